@@ -1,31 +1,243 @@
 # Aplicación FastAPI completamente independiente sin importaciones externas
+# First import: times everything below for the startup report (GET /api/startup)
+from startup import report as startup_report, lazy_import, LazyAttribute, preload
+startup_report.track_imports()
 import os
+import asyncio
+import time
 import uvicorn
 import logging
 import json
 import uuid
+import hashlib
 from datetime import datetime
+from contextlib import asynccontextmanager, nullcontext
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
-from pathlib import Path
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 
 # External AI clients
 try:
-    from perplexity_client import PerplexityClient
+    from perplexity_client import PerplexityClient, CATEGORY_SIZES
 except Exception:
     PerplexityClient = None  # type: ignore
+    CATEGORY_SIZES = {}  # type: ignore
 try:
-    from claude_client import ClaudeClient
+    from claude_client import ClaudeClient, ANTHROPIC_URL
 except Exception:
     ClaudeClient = None  # type: ignore
+try:
+    from improved_alpha_service import ImprovedAlphaVantageClient
+except Exception:
+    ImprovedAlphaVantageClient = None  # type: ignore
+try:
+    from http_transport import close_transport, get_transport
+except Exception:
+    close_transport = None  # type: ignore
+    get_transport = None  # type: ignore
+try:
+    from upstream_policy import deadline, remaining, within_deadline, first_success, policy_stats
+except Exception:
+    deadline = None  # type: ignore
+    first_success = None  # type: ignore
+    policy_stats = None  # type: ignore
+try:
+    from upstream_replay import get_replay_transport, replay_stats, seed_result_cache
+except Exception:
+    get_replay_transport = None  # type: ignore
+    replay_stats = None  # type: ignore
+    seed_result_cache = None  # type: ignore
+try:
+    from result_cache import get_result_cache, make_key
+except Exception:
+    get_result_cache = None  # type: ignore
+try:
+    from singleflight import singleflight_stats
+except Exception:
+    singleflight_stats = None  # type: ignore
+try:
+    from rate_limiter import rate_limiter_stats
+except Exception:
+    rate_limiter_stats = None  # type: ignore
+try:
+    import metrics
+except Exception:
+    metrics = None  # type: ignore
+try:
+    from structured_logging import configure_logging, set_request_id, reset_request_id
+except Exception:
+    configure_logging = None  # type: ignore
+try:
+    from static_assets import StaticSite
+except Exception:
+    StaticSite = None  # type: ignore
+try:
+    from tracing import get_tracer, span
+except Exception:
+    get_tracer = None  # type: ignore
+    span = None  # type: ignore
+try:
+    from portfolio_store import get_portfolio_store, close_portfolio_store
+except Exception:
+    get_portfolio_store = None  # type: ignore
+    close_portfolio_store = None  # type: ignore
+try:
+    from job_queue import get_job_queue, QueueFull
+except Exception:
+    get_job_queue = None  # type: ignore
+# Numerical stack (numpy/scipy): imported on first use, or in the background with STARTUP_PRELOAD
+portfolio_optimizer = lazy_import("portfolio_optimizer")
+price_store = lazy_import("price_store")
+get_price_store = LazyAttribute(price_store, "get_price_store")
+risk_model = lazy_import("risk_model")
+get_covariance_service = LazyAttribute(risk_model, "get_covariance_service")
+backtest = lazy_import("backtest")
+monte_carlo = lazy_import("monte_carlo")
+np = lazy_import("numpy")
+LAZY_MODULES = {
+    "portfolio_optimizer": portfolio_optimizer, "price_store": price_store, "risk_model": risk_model,
+    "backtest": backtest, "monte_carlo": monte_carlo, "numpy": np,
+}
+startup_report.stop_imports()
+
+# Configurar logging: JSON por una cola no bloqueante (LOG_FORMAT=text para desarrollo)
+if configure_logging:
+    configure_logging()
+else:
+    logging.basicConfig(level=logging.INFO)
+http_logger = logging.getLogger("http")
+
+def _span(name: str, detail: str = None):
+    """Tracing span for the current request (no-op when tracing is off or unavailable)."""
+    return span(name, detail) if span else nullcontext()
+
+
+def _deadline(seconds: float = None):
+    """Deadline for the upstream calls made inside (no-op when upstream_policy is unavailable)."""
+    return deadline(seconds) if deadline else nullcontext()
+
+
+def _time_left(default: float = None):
+    """`default` seconds, cut to what is left of the request deadline."""
+    return remaining(default) if deadline else default
+
+
+async def _bounded(awaitable, where: str = "request"):
+    return await within_deadline(awaitable, where) if deadline else await awaitable
+
+
+class TracedJSONResponse(JSONResponse):
+    """JSONResponse whose rendering shows up as the `serialize` span of traced requests."""
+
+    def render(self, content) -> bytes:
+        with _span("serialize"):
+            return super().render(content)
+
+
+# Upstream clients shared by every request of this worker, built once in the lifespan
+_clients: dict = {}
+
+
+def _shared_client(name: str, factory):
+    client = _clients.get(name)
+    if client is None:
+        client = _clients[name] = factory()
+    return client
+
+
+def _build_clients():
+    for name, factory in (("perplexity", _perplexity_client), ("claude", _claude_client), ("alpha_vantage", _get_quote_client)):
+        try:
+            factory()
+        except ApiError as e:
+            logging.warning(f"Cliente {name} no disponible al arrancar: {e.error}")
+
+
+async def _warm_up():
+    """Open TLS connections to the upstream APIs and the local caches/stores before traffic arrives.
+
+    Connections stay in the keep-alive pool for HTTP_KEEPALIVE_EXPIRY seconds.
+    """
+    with startup_report.phase("warmup"):
+        await asyncio.to_thread(lambda: (get_result_cache() if get_result_cache else None, _store()))
+        urls = []
+        if "perplexity" in _clients:
+            urls.append(_clients["perplexity"].api_url)
+        if "claude" in _clients:
+            urls.append(ANTHROPIC_URL)
+        if _quote_client is not None:
+            urls.append(_quote_client.base_url)
+        if get_transport and urls:
+            transport = get_transport()
+            results = await asyncio.gather(*(transport.client.head(url, timeout=5) for url in urls), return_exceptions=True)
+            failed = [url for url, result in zip(urls, results) if isinstance(result, BaseException)]
+            if failed:
+                logging.warning(f"Precalentamiento sin conexión con: {', '.join(failed)}")
+    logging.info("Precalentamiento terminado en %.0f ms", startup_report.phases["warmup"])
+
+
+@asynccontextmanager
+async def lifespan(app):
+    with startup_report.phase("clients"):
+        _build_clients()
+        if get_replay_transport:
+            # UPSTREAM_REPLAY=record|replay: set up before the first call so cached answers are archived too
+            get_replay_transport()
+    seed = [path.strip() for path in os.getenv("RESULT_CACHE_SEED", "").split(",") if path.strip()]
+    if seed and seed_result_cache:
+        with startup_report.phase("cache_seed"):
+            # Archives recorded with UPSTREAM_REPLAY=record, shipped with the deploy
+            try:
+                await asyncio.to_thread(seed_result_cache, seed)
+            except Exception as e:
+                logging.error(f"No se pudo sembrar la cache de resultados: {e}")
+    with startup_report.phase("job_queue"):
+        # Every worker process runs its share of the background job pool
+        if get_job_queue:
+            queue = get_job_queue()
+            for kind, handler in JOB_HANDLERS.items():
+                queue.register(kind, handler)
+            queue.start()
+    with startup_report.phase("static"):
+        if static_site:
+            await asyncio.to_thread(static_site.load)
+    warm_up = asyncio.create_task(_warm_up()) if os.getenv("STARTUP_WARMUP", "0") == "1" else None
+    # e.g. STARTUP_PRELOAD=portfolio_optimizer,numpy: import them after startup instead of on the first request
+    preload([LAZY_MODULES[name.strip()] for name in os.getenv("STARTUP_PRELOAD", "").split(",") if name.strip() in LAZY_MODULES])
+    startup_report.ready()
+    yield
+    # Stop the background work first (running jobs are re-queued for another process), so
+    # nothing reopens the transport or touches the pool and the store while they close
+    if get_job_queue:
+        await get_job_queue().stop()
+    if warm_up is not None:
+        warm_up.cancel()
+        await asyncio.gather(warm_up, return_exceptions=True)
+    # Close pooled keep-alive connections to Perplexity/Claude
+    if close_transport:
+        await close_transport()
+    if monte_carlo.loaded:
+        monte_carlo.shutdown_pool()
+    if close_portfolio_store:
+        close_portfolio_store()
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
 
 # Crear la aplicación FastAPI
-app = FastAPI(title="Value Investing API", description="API para el sistema de Value Investing")
+app = FastAPI(title="Value Investing API", description="API para el sistema de Value Investing",
+              default_response_class=TracedJSONResponse, lifespan=lifespan)
+
+class ApiError(Exception):
+    """Error carrying the HTTP status and message an endpoint answers with.
+    Lets the endpoint logic run outside a request (e.g. in background jobs).
+    """
+
+    def __init__(self, status_code: int, error: str):
+        super().__init__(error)
+        self.status_code = status_code
+        self.error = error
+
+    def response(self) -> JSONResponse:
+        return JSONResponse(status_code=self.status_code, content={"error": self.error})
 
 # Fallback datasets (avoid NameError if not imported elsewhere)
 VALUE_STOCKS: list = []
@@ -44,31 +256,93 @@ app.add_middleware(
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization", "Accept"],
-    expose_headers=["Content-Type"],
+    allow_headers=["Content-Type", "Authorization", "Accept", "X-Trace", "X-Trace-Token", "X-Request-ID", "X-Request-Timeout"],
+    expose_headers=["Content-Type", "Server-Timing", "X-Trace-Id", "X-Request-ID"],
     max_age=600,  # 10 minutos
 )
 
 # --- Static files (React build) ---
-# Serve assets built into backend/public
-# public/index.html must exist (copied from frontend build)
-try:
-    app.mount("/static", StaticFiles(directory="public/static"), name="static")
-except Exception:
-    # Ignore if already mounted
-    pass
+# Assets built into backend/public (public/index.html copied from the frontend build),
+# indexed in memory at startup (lifespan) and served by the SPA catch-all below
+static_site = StaticSite(os.getenv("STATIC_ROOT", "public"), float(os.getenv("STATIC_CHECK_INTERVAL", 2))) if StaticSite else None
 
-# Agregar middleware para loguear todas las solicitudes
+# Una línea por solicitud, con un request id que comparten todos los logs emitidos mientras se atiende
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    logging.info(f"Solicitud recibida: {request.method} {request.url}")
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    token = set_request_id(request_id[:64]) if configure_logging else None
+    start = time.perf_counter()
     try:
         response = await call_next(request)
-        logging.info(f"Respuesta enviada: {response.status_code}")
+        response.headers["X-Request-ID"] = request_id[:64]
+        http_logger.info(
+            "%s %s %s", request.method, request.url.path, response.status_code,
+            extra={"status": response.status_code, "duration_ms": round((time.perf_counter() - start) * 1000, 1)},
+        )
         return response
-    except Exception as e:
-        logging.error(f"Error en solicitud: {str(e)}")
+    except Exception:
+        http_logger.exception("Error en solicitud %s %s", request.method, request.url.path)
         raise
+    finally:
+        if token is not None:
+            reset_request_id(token)
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    # Latency runs until the response starts; streamed bodies are not included
+    if not metrics:
+        return await call_next(request)
+    start = time.perf_counter()
+    status = 500
+    metrics.add("http_requests_in_flight", 1)
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.add("http_requests_in_flight", -1)
+        # Route templates (/api/portfolios/{portfolio_id}) keep label cardinality bounded
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - start, method=request.method, route=route)
+        metrics.inc("http_requests_total", method=request.method, route=route, status=status)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Opt-in (X-Trace header or sample rate); untraced requests only pay for this check.
+    # Spans end when the response starts, so streamed bodies are not part of the trace.
+    trace = get_tracer().start(request.method, request.url.path, request.headers) if get_tracer else None
+    if trace is None:
+        return await call_next(request)
+    with trace:
+        response = await call_next(request)
+    trace.route = getattr(request.scope.get("route"), "path", None)
+    trace.status = response.status_code
+    response.headers["Server-Timing"] = trace.server_timing()
+    response.headers["Timing-Allow-Origin"] = "*"
+    response.headers["X-Trace-Id"] = trace.id
+    await asyncio.to_thread(get_tracer().save, trace)
+    return response
+
+
+# Tiempo total por petición para las llamadas a APIs externas (segundos; 0 lo desactiva).
+# El cliente puede acortarlo con la cabecera X-Request-Timeout
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 60))
+
+
+@app.middleware("http")
+async def apply_deadline(request: Request, call_next):
+    # Upstream calls, rate-limit waits and quote lookups of this request share one budget
+    seconds = REQUEST_DEADLINE or None
+    header = request.headers.get("x-request-timeout")
+    if header:
+        try:
+            seconds = min(seconds or float("inf"), max(0.0, float(header)))
+        except ValueError:
+            pass
+    with _deadline(seconds):
+        return await call_next(request)
 
 
 
@@ -76,37 +350,261 @@ async def log_requests(request: Request, call_next):
 
 
 # Rutas para portfolios
+def _store():
+    """Portfolio store, or None if it cannot be opened (the API keeps working without persistence)."""
+    if not get_portfolio_store:
+        return None
+    try:
+        return get_portfolio_store()
+    except Exception as e:
+        logging.error(f"Almacén de portfolios no disponible: {e}")
+        return None
+
+
+async def _persist(method: str, *args):
+    """Run a store write in a worker thread; failures are logged, never raised to the caller."""
+    store = _store()
+    if store is None:
+        return None
+    try:
+        with _span("store", method):
+            return await asyncio.to_thread(getattr(store, method), *args)
+    except Exception as e:
+        logging.error(f"Error guardando en el almacén de portfolios ({method}): {e}")
+        return None
+
+
+async def _stored_portfolio(portfolio_id) -> dict:
+    """A stored portfolio by id, or None (also when persistence is unavailable)."""
+    if not portfolio_id:
+        return None
+    return await _persist("get_portfolio", portfolio_id)
+
+
 @app.post("/api/portfolio/create")
 async def create_portfolio(request: Request):
+    """Create (and store) a portfolio. Body: { user_id?, name?, target_alloc?, allocation?, amounts? }"""
     try:
         data = await request.json()
         user_id = data.get("user_id", str(uuid.uuid4()))
         name = data.get("name", "Mi Portfolio")
         target_alloc = data.get("target_alloc", {"value": 40, "growth": 40, "bonds": 20})
-        
-        portfolio_id = str(uuid.uuid4())
-        
-        return {
-            "id": portfolio_id,
-            "name": name,
-            "user_id": user_id,
-            "target_alloc": target_alloc,
-            "created_at": datetime.now().isoformat()
-        }
+
+        store = _store()
+        if store is None:
+            return {
+                "id": str(uuid.uuid4()),
+                "name": name,
+                "user_id": user_id,
+                "target_alloc": target_alloc,
+                "created_at": datetime.now().isoformat(),
+                "stored": False,
+            }
+        portfolio = await asyncio.to_thread(store.create_portfolio, user_id, name, target_alloc)
+        if data.get("allocation"):
+            await asyncio.to_thread(store.save_allocation, portfolio["id"], data["allocation"], data.get("amounts"))
+        return dict(portfolio, stored=True)
     except Exception as e:
         logging.error(f"Error en endpoint /api/portfolio/create: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.get("/api/portfolios")
+async def list_portfolios(user_id: str, limit: int = 50, before: str = None):
+    """Saved portfolios of a user, newest first (paginate with before=<created_at>)."""
+    store = _store()
+    if store is None:
+        return JSONResponse(status_code=503, content={"error": "Almacén de portfolios no disponible"})
+    portfolios = await asyncio.to_thread(store.list_portfolios, user_id, max(1, min(limit, 200)), before)
+    return {"portfolios": portfolios}
+
+
+@app.get("/api/portfolios/{portfolio_id}")
+async def get_portfolio(portfolio_id: str):
+    """A saved portfolio with its allocation and latest analysis/decision, without calling any model."""
+    store = _store()
+    if store is None:
+        return JSONResponse(status_code=503, content={"error": "Almacén de portfolios no disponible"})
+    portfolio = await asyncio.to_thread(store.get_portfolio, portfolio_id)
+    if portfolio is None:
+        return JSONResponse(status_code=404, content={"error": "Portfolio no encontrado"})
+    return portfolio
+
+
+@app.put("/api/portfolios/{portfolio_id}/allocation")
+async def save_portfolio_allocation(portfolio_id: str, request: Request):
+    """Replace the stored allocation. Body: { allocation: {category: [...]}, amounts? }"""
+    try:
+        body = await request.json()
+        allocation = body["allocation"]
+    except Exception:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+    store = _store()
+    if store is None:
+        return JSONResponse(status_code=503, content={"error": "Almacén de portfolios no disponible"})
+    try:
+        count = await asyncio.to_thread(store.save_allocation, portfolio_id, allocation, body.get("amounts"))
+    except KeyError as e:
+        return JSONResponse(status_code=404, content={"error": str(e)})
+    return {"id": portfolio_id, "positions": count}
+
+
+def _default_universe() -> list:
+    """Universe used when the request does not send one (legacy behaviour)."""
+    universe = [dict(stock, category="value") for stock in VALUE_STOCKS[:3]]
+    universe += [dict(stock, category="growth") for stock in GROWTH_STOCKS[:3]]
+    universe.append({"ticker": "AGG", "name": "iShares Core U.S. Aggregate Bond ETF", "category": "bonds", "price": 100})
+    return universe
+
+
+def _category_groups(categories: list, target_alloc: dict):
+    """Map each category present in the universe to (asset indices, weight fraction).
+    Returns the groups and the fraction left uninvested because its category has no assets.
+    """
+    present = {}
+    for idx, category in enumerate(categories):
+        present.setdefault(category, []).append(idx)
+    pcts = {}
+    for category, value in target_alloc.items():
+        try:
+            pct = float(value or 0)
+        except (TypeError, ValueError):
+            pct = 0
+        if pct > 0:
+            pcts[category] = pct
+    total = sum(pcts.values())
+    if total <= 0:
+        return None, {}
+    groups = {c: (present[c], pct / total) for c, pct in pcts.items() if c in present}
+    unallocated = {c: round(pct / total, 6) for c, pct in pcts.items() if c not in present}
+    return groups or None, unallocated
+
+
+def _universe_moments(universe: list, data: dict):
+    """Annualized (mu, cov, source) for the universe, or None without estimates.
+    Uses expected_return/volatility when every asset has them, else the local price history.
+    """
+    if all(a.get("expected_return") is not None and a.get("volatility") is not None for a in universe):
+        mu = [float(a["expected_return"]) for a in universe]
+        if data.get("covariance") is not None:
+            return mu, data["covariance"], "universe"
+        cov = portfolio_optimizer.covariance_from_volatility(
+            [float(a["volatility"]) for a in universe],
+            correlation=data.get("correlation"),
+            default_correlation=float(data.get("default_correlation", 0.3)),
+        )
+        return mu, cov, "universe"
+    if not (get_covariance_service and get_price_store):
+        return None
+    tickers = [str(a.get("ticker") or "").upper() for a in universe]
+    store = get_price_store()
+    if not all(t in store.index for t in tickers):
+        return None
+    _check_estimator(data)
+    try:
+        mu, cov = _history_moments(tickers, data)
+    except ValueError:
+        return None
+    return mu, cov, "history"
+
+
+def _check_estimator(data: dict):
+    estimator = data.get("estimator", "ledoit_wolf")
+    if estimator not in risk_model.ESTIMATORS:
+        raise ValueError(f"Estimador desconocido: {estimator}. Usa uno de {', '.join(risk_model.ESTIMATORS)}")
+
+
+def _history_moments(tickers: list, data: dict):
+    """Annualized (mu, cov) from the covariance service: `window` days up to `end`, or from `start`."""
+    return get_covariance_service().moments(
+        tickers,
+        estimator=data.get("estimator", "ledoit_wolf"),
+        window=int(data.get("window", risk_model.TRADING_DAYS)),
+        start=data.get("start"),
+        end=data.get("end"),
+    )
+
+
+def _optimize_universe(universe: list, data: dict, target_alloc: dict, amount: float) -> dict:
+    """Run the mean-variance optimizer over the universe and shape the response allocation."""
+    objective = data.get("objective", "max_sharpe")
+    risk_free = float(data.get("risk_free_rate", 0.0))
+    max_weight = float(data.get("max_weight", 1.0))
+    categories = [a.get("category") or "value" for a in universe]
+    groups, unallocated = _category_groups(categories, target_alloc)
+    warnings = [f"Sin activos para la categoría {c}; su peso queda sin invertir" for c in unallocated]
+
+    moments = _universe_moments(universe, data) if portfolio_optimizer else None
+    if moments is None:
+        # Without return/risk estimates we can only split each category equally
+        stats_missing = [a.get("ticker") for a in universe if a.get("expected_return") is None or a.get("volatility") is None]
+        weights = []
+        for idx, category in enumerate(categories):
+            idx_group, frac = (groups or {}).get(category, ([], 0.0))
+            weights.append(frac / len(idx_group) if idx_group else 0.0)
+        warnings.append("Sin expected_return/volatility ni histórico local para: " + ", ".join(map(str, stats_missing)) + "; pesos iguales por categoría")
+        metrics = {"expected_return": None, "volatility": None, "sharpe_ratio": None}
+        optimizer_info = {"objective": "equal_weight", "success": True}
+    else:
+        mu, cov, source = moments
+        lower = [float(a.get("min_weight", 0.0)) for a in universe]
+        upper = [min(float(a.get("max_weight", max_weight)), max_weight) for a in universe]
+        result = portfolio_optimizer.optimize_weights(
+            mu, cov,
+            objective=objective,
+            risk_free=risk_free,
+            target_return=data.get("target_return"),
+            lower=lower,
+            upper=upper,
+            groups=groups,
+        )
+        weights = result.weights.tolist()
+        metrics = result.metrics()
+        warnings += result.warnings
+        optimizer_info = {
+            "objective": result.objective,
+            "estimates": source,
+            "success": result.success,
+            "message": result.message,
+            "iterations": result.iterations,
+            "elapsed_ms": result.elapsed_ms,
+        }
+
+    allocation = {}
+    for asset, category, weight in zip(universe, categories, weights):
+        if weight <= 0:
+            continue
+        price = asset.get("price")
+        position_amount = round(amount * weight, 2)
+        allocation.setdefault(category, []).append({
+            "ticker": asset.get("ticker"),
+            "name": asset.get("name") or asset.get("ticker"),
+            "weight": round(weight, 6),
+            "amount": position_amount,
+            "shares": round(position_amount / float(price)) if price else None,
+        })
+    return {
+        "allocation": allocation,
+        "unallocated": unallocated,
+        "metrics": metrics,
+        "optimizer": optimizer_info,
+        "warnings": warnings,
+    }
+
+
 @app.post("/api/portfolio/optimize")
 async def optimize_portfolio(request: Request):
+    """Optimize weights with mean-variance (max_sharpe, min_variance or target_return).
+    Body: { amount, target_alloc: {category: %}, universe?: [{ticker, name, category, price,
+            expected_return, volatility, min_weight?, max_weight?}], objective?, risk_free_rate?,
+            target_return?, max_weight?, covariance?: [[...]], correlation?: [[...]],
+            estimator?: sample|ewma|ledoit_wolf, window?: 252, start?, end? }
+    Without expected_return/volatility the estimates come from the local price history.
+    """
     try:
-        logging.info("Iniciando optimización de portfolio")
         # Intentar leer el cuerpo de la solicitud
         try:
-            body = await request.body()
-            logging.info(f"Cuerpo de la solicitud: {body}")
             data = await request.json()
-            logging.info(f"Datos recibidos: {data}")
         except Exception as e:
             logging.error(f"Error al leer el cuerpo de la solicitud: {str(e)}")
             return JSONResponse(
@@ -117,132 +615,120 @@ async def optimize_portfolio(request: Request):
         portfolio_id = data.get("portfolio_id", str(uuid.uuid4()))
         target_alloc = data.get("target_alloc", {"value": 40, "growth": 40, "bonds": 20})
         amount = data.get("amount", 10000)
+        universe = data.get("universe") or _default_universe()
         
-        logging.info(f"Optimizando portfolio {portfolio_id} con asignación {target_alloc} y monto {amount}")
+        logging.info(
+            "Optimizando portfolio %s", portfolio_id,
+            extra={"amount": amount, "target_alloc": target_alloc, "universe_size": len(universe)},
+        )
 
-        # Calcular la asignación de activos
-        value_allocation = target_alloc.get("value", 0) / 100
-        growth_allocation = target_alloc.get("growth", 0) / 100
-        bonds_allocation = target_alloc.get("bonds", 0) / 100
-        
-        # Seleccionar stocks para cada categoría
-        value_stocks = VALUE_STOCKS[:3]  # Tomar los primeros 3 para simplificar
-        growth_stocks = GROWTH_STOCKS[:3]  # Tomar los primeros 3 para simplificar
-        
-        # Calcular pesos y cantidades
-        value_weight_per_stock = value_allocation / len(value_stocks) if value_stocks else 0
-        growth_weight_per_stock = growth_allocation / len(growth_stocks) if growth_stocks else 0
-        
-        # Crear portfolio optimizado
-        optimized = {
-            "id": portfolio_id,
-            "allocation": {
-                "value": [
-                    {
-                        "ticker": stock["ticker"],
-                        "name": stock["name"],
-                        "weight": value_weight_per_stock,
-                        "amount": round(amount * value_weight_per_stock, 2),
-                        "shares": round(amount * value_weight_per_stock / stock["price"])
-                    }
-                    for stock in value_stocks
-                ],
-                "growth": [
-                    {
-                        "ticker": stock["ticker"],
-                        "name": stock["name"],
-                        "weight": growth_weight_per_stock,
-                        "amount": round(amount * growth_weight_per_stock, 2),
-                        "shares": round(amount * growth_weight_per_stock / stock["price"])
-                    }
-                    for stock in growth_stocks
-                ],
-                "bonds": [
-                    {
-                        "ticker": "AGG",
-                        "name": "iShares Core U.S. Aggregate Bond ETF",
-                        "weight": bonds_allocation,
-                        "amount": round(amount * bonds_allocation, 2),
-                        "shares": round(amount * bonds_allocation / 100)  # Precio simulado de AGG
-                    }
-                ]
-            },
-            "metrics": {
-                "expected_return": 0.08,
-                "volatility": 0.12,
-                "sharpe_ratio": 0.67
-            }
-        }
+        try:
+            # CPU-bound: keep it off the event loop
+            optimized = await asyncio.to_thread(_optimize_universe, universe, data, target_alloc, float(amount))
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": "Parámetros de optimización inválidos", "details": str(e)})
+        optimized = {"id": portfolio_id, **optimized}
         
-        logging.info(f"Portfolio optimizado: {optimized}")
+        logging.info("Portfolio optimizado %s", portfolio_id, extra={"categories": list(optimized.get("allocation") or {})})
         return optimized
     except Exception as e:
-        logging.error(f"Error en endpoint /api/portfolio/optimize: {str(e)}")
-        import traceback
-        logging.error(traceback.format_exc())
+        logging.exception("Error en endpoint /api/portfolio/optimize")
         return JSONResponse(
             status_code=500,
             content={"error": "Error al optimizar portfolio", "details": str(e)}
         )
 
 # --- Real-time portfolio from Perplexity ---
-def _compute_allocation(items: list, amount: float):
-    """Convert Perplexity items into allocation list with shares and amounts.
-    Expected fields in item: ticker (or symbol), name, price, weight (0-1 or 0-100).
-    """
-    allocation = []
-    if not items:
-        return allocation
-    for it in items:
-        symbol = it.get("ticker") or it.get("symbol") or it.get("Ticker") or "N/A"
-        name = it.get("name") or it.get("Name") or it.get("nombre") or symbol
-        price = it.get("price") or it.get("Price") or it.get("precio") or 100
-        # weight could be 0-1, 0-100, or missing
-        weight = it.get("weight") or it.get("peso") or it.get("Weight") or 0
-        try:
-            w = float(weight)
-            if w > 1.5:  # interpret as percent
-                w = w / 100.0
-            if w <= 0:
-                w = 1.0 / max(1, len(items))
-        except Exception:
-            w = 1.0 / max(1, len(items))
+# Tiempo máximo para cotizar los tickers de una cartera antes de calcular acciones (segundos)
+PRICE_ENRICH_TIMEOUT = float(os.getenv("PRICE_ENRICH_TIMEOUT", 20))
+_quote_client = None
+# Set when the client could not be built (usually a missing API key): not retried until restart
+_quote_client_error = None
+
+
+def _get_quote_client():
+    """Process-wide Alpha Vantage client, or None when it is not configured."""
+    global _quote_client, _quote_client_error
+    if _quote_client is None and ImprovedAlphaVantageClient and _quote_client_error is None:
         try:
-            px = float(price)
-        except Exception:
-            px = 100.0
-        allocated = amount * w
-        shares = int(max(0, allocated // px))
-        allocation.append({
-            "symbol": symbol,
-            "name": name,
-            "price": px,
-            "shares": shares,
-            "amount": round(shares * px, 2),
-        })
-    return allocation
+            _quote_client = ImprovedAlphaVantageClient()
+        except Exception as e:
+            _quote_client_error = str(e)
+            logging.warning(f"Cotizaciones reales no disponibles: {e}")
+    return _quote_client
 
 
-@app.post("/api/portfolio/claude-analysis")
-async def portfolio_claude_analysis(request: Request):
-    """Generate a qualitative analysis using Claude.
-    Body: { portfolio: { allocation: {category: [...] } } }
-    """
-    try:
-        body = await request.json()
-        portfolio = body.get("portfolio") or {}
-    except Exception:
-        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+def _item_symbol(it: dict) -> str:
+    return it.get("ticker") or it.get("symbol") or it.get("Ticker") or "N/A"
 
-    if not ClaudeClient:
-        return JSONResponse(status_code=500, content={"error": "Claude client not available on server"})
+
+async def _quote_prices(*item_lists, timeout: float = None) -> dict:
+    """Real prices for every ticker in the item lists, fetched in one batch: {TICKER: price}."""
+    client = _get_quote_client()
+    if client is None:
+        return {}
+    tickers = [_item_symbol(it) for items in item_lists for it in items or [] if isinstance(it, dict)]
     try:
-        claude = ClaudeClient()
+        with _span("quotes"):
+            # Never past the request deadline: unquoted tickers keep the price from Perplexity
+            quotes = await client.get_quotes_async(
+                tickers, timeout=max(0.0, _time_left(PRICE_ENRICH_TIMEOUT if timeout is None else timeout)))
     except Exception as e:
-        logging.error(f"Claude init error: {e}")
-        return JSONResponse(status_code=500, content={"error": f"Claude no disponible: {e}"})
+        logging.error(f"Error obteniendo cotizaciones: {e}")
+        return {}
+    return {ticker: quote["price"] for ticker, quote in quotes.items()}
 
-    # Flatten positions for prompt simplicity
+
+def _position(it: dict, amount: float, n_items: int, prices: dict) -> dict:
+    """Allocation entry for one Perplexity item; a missing weight means an equal share of n_items."""
+    symbol = _item_symbol(it)
+    name = it.get("name") or it.get("Name") or it.get("nombre") or symbol
+    # weight could be 0-1, 0-100, or missing
+    weight = it.get("weight") or it.get("peso") or it.get("Weight") or 0
+    try:
+        w = float(weight)
+        if w > 1.5:  # interpret as percent
+            w = w / 100.0
+        if w <= 0:
+            w = 1.0 / max(1, n_items)
+    except Exception:
+        w = 1.0 / max(1, n_items)
+    quoted = prices.get(str(symbol).strip().upper())
+    if quoted:
+        px, source = float(quoted), "alpha_vantage"
+    else:
+        try:
+            px, source = float(it.get("price") or it.get("Price") or it.get("precio")), "perplexity"
+        except (TypeError, ValueError):
+            px, source = None, None
+        if px is not None and px <= 0:
+            px, source = None, None
+    allocated = amount * w
+    shares = int(max(0, allocated // px)) if px else 0
+    return {
+        "symbol": symbol,
+        "name": name,
+        "price": px,
+        "price_source": source,
+        "shares": shares,
+        "amount": round(shares * px, 2) if px else 0.0,
+    }
+
+
+def _compute_allocation(items: list, amount: float, prices: dict = None):
+    """Convert Perplexity items into allocation list with shares and amounts.
+    Expected fields in item: ticker (or symbol), name, price, weight (0-1 or 0-100).
+    Quoted prices ({TICKER: price}) take precedence over the price in the item; positions
+    with no usable price are returned with price None and no shares.
+    """
+    if not items:
+        return []
+    with _span("allocation"):
+        return [_position(it, amount, len(items), prices or {}) for it in items]
+
+
+def _flatten_positions(portfolio: dict) -> list:
+    """Flatten {allocation: {category: [...]}} into a single list of positions for the Claude prompt."""
     flat_positions = []
     try:
         allocation = (portfolio or {}).get("allocation", {})
@@ -262,13 +748,114 @@ async def portfolio_claude_analysis(request: Request):
                     })
     except Exception:
         pass
+    return flat_positions
+
+
+def _claude_client():
+    if not ClaudeClient:
+        raise ApiError(500, "Claude client not available on server")
+    try:
+        return _shared_client("claude", ClaudeClient)
+    except Exception as e:
+        logging.error(f"Claude init error: {e}")
+        raise ApiError(500, f"Claude no disponible: {e}")
+
+
+async def _claude_analysis(body: dict) -> dict:
+    portfolio_id = body.get("portfolio_id")
+    portfolio = body.get("portfolio") or await _stored_portfolio(portfolio_id) or {}
+    claude = _claude_client()
+
+    # Flatten positions for prompt simplicity
+    flat_positions = _flatten_positions(portfolio)
 
     try:
-        analysis = claude.generate_analysis(flat_positions, language="es")
-        return {"analysis": analysis}
+        analysis = await _bounded(claude.generate_analysis_async(flat_positions, language="es"), "claude")
+    except asyncio.TimeoutError:
+        logging.error("Claude analysis timeout")
+        raise ApiError(504, "Tiempo agotado esperando a Claude")
     except Exception as e:
         logging.error(f"Claude analysis error: {e}")
-        return JSONResponse(status_code=500, content={"error": f"Claude error: {e}"})
+        raise ApiError(500, f"Claude error: {e}")
+    analysis_id = claude.analysis_id(flat_positions, language="es")
+    if portfolio_id:
+        await _persist("save_analysis", portfolio_id, "analysis", analysis, analysis_id)
+    return {"analysis": analysis, "analysis_id": analysis_id}
+
+
+@app.post("/api/portfolio/claude-analysis")
+async def portfolio_claude_analysis(request: Request):
+    """Generate a qualitative analysis using Claude.
+    Body: { portfolio?: { allocation: {category: [...] } }, portfolio_id? }
+    With portfolio_id the stored allocation is used when no portfolio is sent, and the analysis is saved.
+    """
+    try:
+        body = await request.json()
+    except Exception:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+    try:
+        return await _claude_analysis(body)
+    except ApiError as e:
+        return e.response()
+
+
+def _sse(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/portfolio/claude-analysis/stream")
+async def portfolio_claude_analysis_stream(request: Request):
+    """Stream the Claude analysis as server-sent events.
+    Events: "meta" {analysis_id}, unnamed {text} deltas, then "done" {analysis_id} or "error" {error}.
+    The final text is cached, so /api/analysis/decision accepts the analysis_id instead of the text.
+    With portfolio_id the stored allocation is used when no portfolio is sent, and the analysis is saved.
+    """
+    try:
+        body = await request.json()
+        portfolio_id = body.get("portfolio_id")
+        portfolio = body.get("portfolio") or await _stored_portfolio(portfolio_id) or {}
+    except Exception:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+
+    try:
+        claude = _claude_client()
+    except ApiError as e:
+        return e.response()
+
+    flat_positions = _flatten_positions(portfolio)
+    analysis_id = claude.analysis_id(flat_positions, language="es")
+
+    async def events():
+        yield _sse({"analysis_id": analysis_id}, event="meta")
+        stream = claude.stream_analysis_async(flat_positions, language="es")
+        parts = []
+        try:
+            async for delta in stream:
+                parts.append(delta)
+                yield _sse({"text": delta})
+            if portfolio_id:
+                await _persist("save_analysis", portfolio_id, "analysis", "".join(parts).strip(), analysis_id)
+            yield _sse({"analysis_id": analysis_id}, event="done")
+        except asyncio.CancelledError:
+            logging.info(f"Cliente desconectado, abortando stream de Claude {analysis_id[:12]}")
+            raise
+        except Exception as e:
+            logging.error(f"Claude stream error: {e}")
+            yield _sse({"error": f"Claude error: {e}"}, event="error")
+        finally:
+            # Closes the upstream HTTP stream if we stopped early
+            await stream.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/api/analysis/claude/stream")
+async def portfolio_claude_analysis_stream_alias(request: Request):
+    return await portfolio_claude_analysis_stream(request)
 
 # Provide an alias path that won't be captured by the category route
 @app.post("/api/analysis/claude")
@@ -276,78 +863,831 @@ async def portfolio_claude_analysis_alias(request: Request):
     return await portfolio_claude_analysis(request)
 
 
-@app.post("/api/portfolio/{category}")
-async def build_portfolio_category(category: str, request: Request):
-    """Build a portfolio slice using Perplexity for a given category.
-    Supported categories: value, growth, bonds, disruptive.
-    Body: { amount: number }
+# --- Backtesting over local price history ---
+def _allocation_positions(allocation) -> list:
+    """Positions of an allocation given as {category: [positions]} or as a plain list."""
+    if not isinstance(allocation, dict):
+        return list(allocation or [])
+    positions = []
+    for entries in allocation.values():
+        if isinstance(entries, dict):
+            entries = list(entries.values())
+        positions.extend(entries or [])
+    return positions
+
+
+def _allocation_weights(allocation) -> dict:
+    """Turn an allocation ({category: [positions]} or a list of positions) into {ticker: weight}.
+    Positions may carry "weight" (as from /api/portfolio/optimize) or "amount" (as from _compute_allocation).
+    """
+    positions = _allocation_positions(allocation)
+    use_amount = all(p.get("amount") not in (None, "") for p in positions)
+    weights = {}
+    for p in positions:
+        ticker = (p.get("ticker") or p.get("symbol") or "").upper()
+        if not ticker:
+            continue
+        try:
+            value = float(p.get("amount") if use_amount else p.get("weight") or 0)
+        except (TypeError, ValueError):
+            continue
+        if value > 0:
+            weights[ticker] = weights.get(ticker, 0.0) + value
+    total = sum(weights.values())
+    return {t: w / total for t, w in weights.items()} if total > 0 else {}
+
+
+def _history_for(weights: dict, start=None, end=None):
+    """Split tickers into those with local history and those without, and load the returns."""
+    store = get_price_store()
+    tickers = [t for t in weights if t in store.index]
+    missing = [t for t in weights if t not in store.index]
+    if not tickers:
+        return None, None, tickers, missing
+    dates, rets = store.returns(tickers, start, end)
+    price_dates = store.dates()
+    # returns[t] is realized on dates[t]; prepend the previous trading day as the start date
+    lo = int(np.searchsorted(price_dates, dates[0])) - 1 if dates.size else 0
+    return price_dates[lo:lo + dates.size + 1], rets, tickers, missing
+
+
+def _run_backtest(body: dict) -> dict:
+    allocation = body.get("allocation") or (body.get("portfolio") or {}).get("allocation")
+    weights = _allocation_weights(allocation)
+    if not weights:
+        raise ValueError("La asignación no contiene posiciones con peso o monto")
+    dates, rets, tickers, missing = _history_for(weights, body.get("start"), body.get("end"))
+    if not tickers or rets.shape[0] < 2:
+        raise ValueError("Sin histórico local suficiente para: " + ", ".join(missing or list(weights)))
+    amount = float(body.get("amount") or 10000)
+    result = backtest.run_backtest(
+        dates,
+        rets,
+        [weights[t] for t in tickers],
+        strategy=body.get("strategy", "buy_and_hold"),
+        frequency=body.get("frequency", "quarterly"),
+        threshold=float(body.get("threshold", 0.05)),
+        cost_bps=float(body.get("cost_bps", 10)),
+        initial=amount,
+        risk_free=float(body.get("risk_free_rate", 0.0)),
+    )
+    used = sum(weights[t] for t in tickers)
+    return {
+        "dates": result.dates.astype(str).tolist(),
+        "values": np.round(result.values, 2).tolist(),
+        "rebalance_dates": result.rebalance_dates.astype(str).tolist(),
+        "metrics": result.metrics(),
+        "weights": {t: round(weights[t] / used, 6) for t in tickers},
+        "warnings": [f"Sin histórico local para {t}; excluido y pesos renormalizados" for t in missing],
+    }
+
+
+@app.post("/api/portfolio/backtest")
+async def backtest_portfolio(request: Request):
+    """Simulate an allocation over local price history.
+    Body: { allocation | portfolio: {allocation}, amount?, start?, end?,
+            strategy?: buy_and_hold|calendar|threshold, frequency?: monthly|quarterly|annual,
+            threshold?: 0.05, cost_bps?: 10, risk_free_rate? }
+    """
+    try:
+        body = await request.json()
+    except Exception:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+    if not (backtest and get_price_store):
+        return JSONResponse(status_code=500, content={"error": "Backtesting not available on server"})
+    try:
+        return await asyncio.to_thread(_run_backtest, body)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        logging.error(f"Backtest error: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+# --- Monte Carlo projection ---
+MONTE_CARLO_MAX_PATHS = int(os.getenv("MONTE_CARLO_MAX_PATHS", 1000000))
+
+
+def _allocation_moments(body: dict, weights: dict):
+    """Annualized (tickers, mu, cov, source, warnings) for the allocation.
+    Uses expected_return/volatility carried by every position, else local price history.
+    """
+    allocation = body.get("allocation") or (body.get("portfolio") or {}).get("allocation")
+    stats = {}
+    for p in _allocation_positions(allocation):
+        ticker = (p.get("ticker") or p.get("symbol") or "").upper()
+        if p.get("expected_return") is not None and p.get("volatility") is not None:
+            stats[ticker] = (float(p["expected_return"]), float(p["volatility"]))
+    tickers = list(weights)
+    if tickers and all(t in stats for t in tickers):
+        cov = portfolio_optimizer.covariance_from_volatility(
+            [stats[t][1] for t in tickers],
+            correlation=body.get("correlation"),
+            default_correlation=float(body.get("default_correlation", 0.3)),
+        )
+        return tickers, np.array([stats[t][0] for t in tickers]), cov, "positions", []
+    store = get_price_store()
+    tickers = [t for t in weights if t in store.index]
+    missing = [t for t in weights if t not in store.index]
+    if not tickers:
+        raise ValueError("Sin expected_return/volatility ni histórico local para: " + ", ".join(missing))
+    _check_estimator(body)
+    mu, cov = _history_moments(tickers, body)
+    warnings = [f"Sin histórico local para {t}; excluido y pesos renormalizados" for t in missing]
+    return tickers, mu, cov, "history", warnings
+
+
+def _run_monte_carlo(body: dict) -> dict:
+    allocation = body.get("allocation") or (body.get("portfolio") or {}).get("allocation")
+    weights = _allocation_weights(allocation)
+    if not weights:
+        raise ValueError("La asignación no contiene posiciones con peso o monto")
+    paths = int(body.get("paths", 10000))
+    if paths > MONTE_CARLO_MAX_PATHS:
+        raise ValueError(f"Máximo {MONTE_CARLO_MAX_PATHS} trayectorias por simulación")
+    tickers, mu, cov, source, warnings = _allocation_moments(body, weights)
+    # Without a seed draw one and return it, so the run can be reproduced
+    seed = body.get("seed")
+    seed = int(seed) if seed is not None else int(np.random.SeedSequence().entropy % (2 ** 63))
+    result = monte_carlo.simulate(
+        [weights[t] for t in tickers],
+        mu,
+        cov,
+        amount=float(body.get("amount") or 10000),
+        years=float(body.get("years", 10)),
+        steps_per_year=int(body.get("steps_per_year", 12)),
+        n_paths=paths,
+        seed=seed,
+        rebalance=bool(body.get("rebalance", True)),
+        percentiles=body.get("percentiles") or monte_carlo.PERCENTILES,
+        histogram_bins=int(body.get("histogram_bins", 40)),
+    )
+    used = sum(weights[t] for t in tickers)
+    return {
+        **result.to_dict(),
+        "seed": seed,
+        "weights": {t: round(weights[t] / used, 6) for t in tickers},
+        "estimates": source,
+        "warnings": warnings,
+    }
+
+
+@app.post("/api/portfolio/montecarlo")
+async def montecarlo_portfolio(request: Request):
+    """Project the value of an allocation with correlated Monte Carlo paths.
+    Body: { allocation | portfolio: {allocation}, amount?, years?: 10, steps_per_year?: 12,
+            paths?: 10000, seed?, rebalance?: true, percentiles?: [5, 50, 95], histogram_bins?: 40,
+            estimator?: sample|ewma|ledoit_wolf, window?: 252, start?, end?,
+            correlation?, default_correlation? }
+    Positions with expected_return/volatility are used as given; otherwise mean and
+    covariance are estimated from the local price history.
     """
     try:
         body = await request.json()
-        amount = float(body.get("amount", 0))
     except Exception:
         return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+    if not (monte_carlo and portfolio_optimizer and get_covariance_service):
+        return JSONResponse(status_code=500, content={"error": "Monte Carlo not available on server"})
+    try:
+        return await asyncio.to_thread(_run_monte_carlo, body)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        logging.error(f"Monte Carlo error: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+# --- Efficient frontier ---
+FRONTIER_MAX_POINTS = 200
+FRONTIER_WORKERS = int(os.getenv("FRONTIER_WORKERS", 1))
+
 
+def _frontier(universe: list, data: dict) -> dict:
+    moments = _universe_moments(universe, data)
+    tickers = [str(a.get("ticker") or "").upper() for a in universe]
+    if moments is None:
+        raise ValueError("Sin expected_return/volatility ni histórico local para todo el universo")
+    mu, cov, source = moments
+    mu, cov = np.asarray(mu, dtype=float), np.asarray(cov, dtype=float)
+    n_points = min(int(data.get("points", 20)), FRONTIER_MAX_POINTS)
+    risk_free = float(data.get("risk_free_rate", 0.0))
+    max_weight = float(data.get("max_weight", 1.0))
+    lower = [float(a.get("min_weight", 0.0)) for a in universe]
+    upper = [min(float(a.get("max_weight", max_weight)), max_weight) for a in universe]
+    groups, unallocated = None, {}
+    if data.get("target_alloc"):
+        groups, unallocated = _category_groups([a.get("category") or "value" for a in universe], data["target_alloc"])
+
+    # The estimates themselves are part of the key, so new prices or new stats miss the cache
+    digest = hashlib.sha256(mu.tobytes() + cov.tobytes()).hexdigest()
+    key = make_key(
+        "frontier", tickers=tickers, moments=digest, points=n_points, risk_free=risk_free,
+        lower=lower, upper=upper, groups={c: [list(idx), pct] for c, (idx, pct) in (groups or {}).items()},
+    )
+    cache = get_result_cache()
+    cached = cache.get(key) if cache else None
+    if cached is not None:
+        return {**cached, "cached": True}
+
+    points = portfolio_optimizer.efficient_frontier(
+        mu, cov, n_points=n_points, risk_free=risk_free, lower=lower, upper=upper,
+        groups=groups, workers=int(data.get("workers", FRONTIER_WORKERS)),
+    )
+    sharpes = [p.sharpe_ratio if p.sharpe_ratio is not None else float("-inf") for p in points]
+    frontier = {
+        "tickers": tickers,
+        "points": [
+            {
+                **p.metrics(),
+                "weights": {t: round(float(w), 6) for t, w in zip(tickers, p.weights) if w > 0},
+            }
+            for p in points
+        ],
+        "min_variance": 0,
+        "max_sharpe": int(np.argmax(sharpes)),
+        "estimates": source,
+        "unallocated": unallocated,
+        "warnings": points[0].warnings,
+        "elapsed_ms": round(sum(p.elapsed_ms for p in points), 2),
+    }
+    if cache:
+        cache.set(key, frontier)
+    return {**frontier, "cached": False}
+
+
+@app.post("/api/portfolio/frontier")
+async def efficient_frontier(request: Request):
+    """Efficient frontier (risk/return/weights per point) for the universe.
+    Body: { universe?: [{ticker, category, expected_return?, volatility?, min_weight?, max_weight?}],
+            points?: 20, target_alloc?: {category: %}, risk_free_rate?, max_weight?,
+            covariance?, correlation?, estimator?, window?, start?, end?, workers? }
+    Without per-asset stats the estimates come from the local price history.
+    """
+    try:
+        data = await request.json()
+    except Exception:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+    if not (portfolio_optimizer and get_result_cache):
+        return JSONResponse(status_code=500, content={"error": "Optimizer not available on server"})
+    universe = data.get("universe") or _default_universe()
+    try:
+        return await asyncio.to_thread(_frontier, universe, data)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        logging.error(f"Frontier error: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+PORTFOLIO_CATEGORIES = ("value", "growth", "bonds", "disruptive")
+# Presupuesto de tiempo por categoría en el endpoint compuesto (segundos)
+CATEGORY_TIMEOUT = float(os.getenv("CATEGORY_TIMEOUT", 55))
+
+
+async def _fetch_category_items(client, category: str, amount: float) -> list:
+    """Ask Perplexity for the instruments of one category."""
+    with _span("perplexity", category):
+        return await _category_items(client, category, amount)
+
+
+async def _category_items(client, category: str, amount: float) -> list:
+    if category == "value":
+        return await client.get_value_portfolio_async(amount)
+    if category == "growth":
+        return await client.get_growth_portfolio_async(amount)
+    if category == "bonds":
+        return await client.get_bond_etfs_async(amount)
+    if category == "disruptive":
+        # ETFs preferred; the broader portfolio starts if they fail, come back empty or run
+        # past their p95, and the first non-empty answer wins (the other call is cancelled)
+        alternatives = (lambda: client.get_disruptive_etfs_async(amount), lambda: client.get_disruptive_portfolio_async(amount))
+        if first_success:
+            return await first_success("disruptive", alternatives)
+        try:
+            items = await alternatives[0]()
+        except Exception as e:
+            logging.warning("ETFs disruptivos no disponibles, se usa la cartera disruptiva: %s", e)
+            items = None
+        return items or await alternatives[1]()
+    raise ValueError(f"Categoría desconocida: {category}")
+
+
+async def _resume(items: list, stream):
+    for item in items:
+        yield item
+    if stream is not None:
+        async for item in stream:
+            yield item
+
+
+async def _category_stream(client, category: str, amount: float):
+    """Open the Perplexity stream of a category: (source, items), `source` naming the request that answers.
+
+    Disruptive follows the rule of _category_items: the ETF stream is preferred, the
+    portfolio stream starts if it fails, ends empty or yields nothing within the hedge
+    delay, and the first stream to yield an instrument is the one streamed.
+    """
+    if category != "disruptive":
+        return category, client.stream_items_async(category, amount)
+    opened = []
+
+    def alternative(source):
+        async def first_item():
+            stream = client.stream_items_async(source, amount)
+            opened.append(stream)
+            try:
+                return source, await stream.__anext__(), stream
+            except StopAsyncIteration:
+                return None
+        return first_item
+
+    alternatives = [alternative("disruptive"), alternative("disruptive_portfolio")]
+    winner = None
+    try:
+        if first_success:
+            winner = await first_success("disruptive_stream", alternatives)
+        else:
+            try:
+                winner = await alternatives[0]()
+            except Exception as e:
+                logging.warning("ETFs disruptivos no disponibles, se usa la cartera disruptiva: %s", e)
+            winner = winner or await alternatives[1]()
+    finally:
+        # Close the losing stream (and the winner's too if nothing came back)
+        for stream in opened:
+            if winner is None or stream is not winner[2]:
+                await stream.aclose()
+    if winner is None:
+        return category, _resume([], None)
+    source, item, stream = winner
+    return source, _resume([item], stream)
+
+
+def _perplexity_client():
     if not PerplexityClient:
-        return JSONResponse(status_code=500, content={"error": "Perplexity client not available on server"})
+        raise ApiError(500, "Perplexity client not available on server")
     try:
-        client = PerplexityClient()
+        return _shared_client("perplexity", PerplexityClient)
     except Exception as e:
         # Most likely missing API key
         logging.error(f"Perplexity init error: {e}")
-        return JSONResponse(status_code=500, content={"error": f"Perplexity no disponible: {e}"})
-
-    try:
-        items: list
-        if category == "value":
-            items = client.get_value_portfolio(amount)
-        elif category == "growth":
-            items = client.get_growth_portfolio(amount)
-        elif category == "bonds":
-            items = client.get_bond_etfs(amount)
-        elif category == "disruptive":
-            # Prefer ETFs for quick results
-            try:
-                items = client.get_disruptive_etfs(amount)
-            except Exception:
-                items = client.get_disruptive_portfolio(amount)
-        else:
-            return JSONResponse(status_code=404, content={"error": f"Categoría desconocida: {category}"})
+        raise ApiError(500, f"Perplexity no disponible: {e}")
+
+
+async def _build_all(body: dict) -> dict:
+    try:
+        amount = float(body.get("amount", 0))
+        target_alloc = body.get("target_alloc") or {"value": 40, "growth": 40, "bonds": 20}
+        timeout = min(float(body.get("timeout", CATEGORY_TIMEOUT)), CATEGORY_TIMEOUT)
+    except Exception:
+        raise ApiError(400, "Invalid JSON body")
+    client = _perplexity_client()
+    left = _time_left()
+    if left is not None:
+        # Leave a fifth of the request deadline for quoting and computing the allocation
+        timeout = max(0.0, min(timeout, left * 0.8))
+
+    amounts = {}
+    for category in PORTFOLIO_CATEGORIES:
+        try:
+            pct = float(target_alloc.get(category, 0) or 0)
+        except (TypeError, ValueError):
+            pct = 0
+        if pct > 0:
+            amounts[category] = round(amount * pct / 100, 2)
+
+    async def run(category):
+        with _deadline(timeout):
+            return await asyncio.wait_for(_fetch_category_items(client, category, amounts[category]), timeout)
+
+    categories = list(amounts)
+    results = await asyncio.gather(*(run(c) for c in categories), return_exceptions=True)
+
+    # One quote round for every ticker of every category before computing shares
+    prices = await _quote_prices(*(r for r in results if not isinstance(r, BaseException)))
+
+    allocation, source_count, errors = {}, {}, {}
+    for category, result in zip(categories, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.TimeoutError):
+                errors[category] = f"timeout tras {timeout:.0f}s"
+            else:
+                errors[category] = str(result) or result.__class__.__name__
+            logging.error(f"Error building portfolio for {category}: {errors[category]}")
+            allocation[category] = []
+            source_count[category] = 0
+            continue
+        allocation[category] = _compute_allocation(result, amounts[category], prices)
+        source_count[category] = len(result)
+
+    result = {
+        "allocation": allocation,
+        "amounts": amounts,
+        "sourceCount": source_count,
+        "errors": errors,
+        "partial": bool(errors),
+    }
+    if body.get("portfolio_id"):
+        result["stored"] = await _persist("save_allocation", body["portfolio_id"], allocation, amounts) is not None
+    return result
 
-        allocation = _compute_allocation(items, amount)
-        return {"allocation": allocation, "sourceCount": len(items)}
+
+@app.post("/api/portfolio/build")
+async def build_portfolio_all(request: Request):
+    """Build every portfolio category concurrently.
+    Body: { amount: number, target_alloc: {value: %, growth: %, bonds: %, disruptive: %}, timeout?: seconds, portfolio_id? }
+    Categories that fail or exceed the timeout are reported in "errors" while the rest are returned.
+    With portfolio_id the resulting allocation is saved to that stored portfolio.
+    """
+    try:
+        body = await request.json()
+    except Exception:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+    try:
+        return await _build_all(body)
+    except ApiError as e:
+        return e.response()
+
+
+@app.post("/api/portfolio/{category}/stream")
+async def build_portfolio_category_stream(category: str, request: Request):
+    """Stream a category's positions as NDJSON while Perplexity is still answering.
+    Body: { amount: number }
+    Lines: {"type": "position", "index", "position"} as instruments are parsed and quoted,
+    then {"type": "done", "sourceCount"} or {"type": "error", "error"}.
+    Quotes are fetched in batches: one quote call in flight at a time, and the instruments
+    parsed meanwhile join the next batch, so the first position is not held back and a
+    category costs a few batched lookups instead of one per instrument.
+    """
+    try:
+        body = await request.json()
+        amount = float(body.get("amount", 0))
+    except Exception:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+    if category not in PORTFOLIO_CATEGORIES:
+        return JSONResponse(status_code=404, content={"error": f"Categoría desconocida: {category}"})
+    try:
+        client = _perplexity_client()
+    except ApiError as e:
+        return e.response()
+
+    def line(data: dict) -> str:
+        return json.dumps(data, ensure_ascii=False) + "\n"
+
+    async def produce(queue: asyncio.Queue):
+        batch = []  # (index, item) parsed but not quoted yet
+        expected = CATEGORY_SIZES.get(category, 1)
+        parsed = asyncio.Event()
+        arrived = asyncio.Event()
+
+        async def quote_batches():
+            while batch or not parsed.is_set():
+                if not batch:
+                    await arrived.wait()
+                    arrived.clear()
+                    continue
+                items = batch[:]
+                del batch[:]
+                prices = await _quote_prices([item for _, item in items])
+                for index, item in items:
+                    queue.put_nowait(line({"type": "position", "index": index, "position": _position(item, amount, expected, prices)}))
+
+        quoter = asyncio.ensure_future(quote_batches())
+        count = 0
+        try:
+            # Disruptive may be answered by the broader portfolio (see _category_stream)
+            source, items = await _category_stream(client, category, amount)
+            expected = CATEGORY_SIZES.get(source, 1)
+            async for item in items:
+                batch.append((count, item))
+                count += 1
+                arrived.set()
+            parsed.set()
+            arrived.set()
+            await quoter
+            queue.put_nowait(count)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            quoter.cancel()
+
+    async def lines():
+        queue: asyncio.Queue = asyncio.Queue()
+        producer = asyncio.ensure_future(produce(queue))
+        try:
+            while True:
+                got = await queue.get()
+                if isinstance(got, str):
+                    yield got
+                elif isinstance(got, int):
+                    yield line({"type": "done", "sourceCount": got})
+                    break
+                else:
+                    logging.error(f"Error streaming portfolio for {category}: {got}")
+                    yield line({"type": "error", "error": str(got)})
+                    break
+        finally:
+            # Client gone or stream finished: stop reading Perplexity and pending quotes
+            producer.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
+
+async def _build_category(category: str, body: dict) -> dict:
+    try:
+        amount = float(body.get("amount", 0))
+    except Exception:
+        raise ApiError(400, "Invalid JSON body")
+    client = _perplexity_client()
+    if category not in PORTFOLIO_CATEGORIES:
+        raise ApiError(404, f"Categoría desconocida: {category}")
+    try:
+        items = await _bounded(_fetch_category_items(client, category, amount), "perplexity")
+        allocation = _compute_allocation(items, amount, await _quote_prices(items))
+    except asyncio.TimeoutError as e:
+        logging.error(f"Timeout building portfolio for {category}: {e}")
+        raise ApiError(504, f"Tiempo agotado consultando {category}")
     except Exception as e:
         logging.error(f"Error building portfolio for {category}: {e}")
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        raise ApiError(500, str(e))
+    return {"allocation": allocation, "sourceCount": len(items)}
+
+
+@app.post("/api/portfolio/{category}")
+async def build_portfolio_category(category: str, request: Request):
+    """Build a portfolio slice using Perplexity for a given category.
+    Supported categories: value, growth, bonds, disruptive.
+    Body: { amount: number }
+    """
+    try:
+        body = await request.json()
+    except Exception:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+    try:
+        return await _build_category(category, body)
+    except ApiError as e:
+        return e.response()
+
+
+async def _decision(body: dict) -> dict:
+    analysis_text = body.get("analysis", "")
+    analysis_id = body.get("analysis_id")
+    portfolio_hint = body.get("portfolio")
+    portfolio_id = body.get("portfolio_id")
+    claude = _claude_client()
+    try:
+        if not analysis_text and analysis_id:
+            analysis_text = await claude.cached_analysis(analysis_id)
+        if not analysis_text and portfolio_id:
+            stored = ((await _stored_portfolio(portfolio_id) or {}).get("analyses") or {}).get("analysis")
+            analysis_text = stored["content"] if stored else None
+        if not analysis_text and (analysis_id or portfolio_id):
+            raise ApiError(404, "Análisis no encontrado o expirado")
+        decision = await _bounded(claude.generate_decision_async(analysis_text, portfolio_hint), "claude")
+    except ApiError:
+        raise
+    except asyncio.TimeoutError:
+        logging.error("Decision timeout")
+        raise ApiError(504, "Tiempo agotado esperando a Claude")
+    except Exception as e:
+        logging.error(f"Decision error: {e}")
+        raise ApiError(500, f"Claude decision error: {e}")
+    if portfolio_id:
+        await _persist("save_analysis", portfolio_id, "decision", decision, analysis_id)
+    return decision
 
 
 @app.post("/api/analysis/decision")
 async def investment_decision(request: Request):
     """Return invest/no-invest decision based on prior Claude analysis text or portfolio.
-    Body: { analysis: str, portfolio?: {...} }
+    Body: { analysis?: str, analysis_id?: str, portfolio?: {...}, portfolio_id? }
+    With portfolio_id the stored analysis is used when the cached one expired, and the decision is saved.
     """
     try:
         body = await request.json()
-        analysis_text = body.get("analysis", "")
-        portfolio_hint = body.get("portfolio")
     except Exception:
         return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+    try:
+        return await _decision(body)
+    except ApiError as e:
+        return e.response()
 
-    if not ClaudeClient:
-        return JSONResponse(status_code=500, content={"error": "Claude client not available on server"})
+# --- Background jobs for slow LLM work ---
+# Same logic as the synchronous endpoints; the payload is the endpoint's JSON body
+JOB_HANDLERS = {
+    "build": _build_all,
+    "category": lambda payload: _build_category(payload.get("category"), payload),
+    "analysis": _claude_analysis,
+    "decision": _decision,
+}
+# Máximo de segundos que GET /api/jobs/{id}?wait= mantiene la petición abierta
+JOB_MAX_WAIT = 30.0
+
+
+def _job_etag(job: dict) -> str:
+    return f'"{job["id"]}-{job["version"]}"'
+
+
+def _job_response(job: dict, status_code: int = 200) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content=job,
+        headers={"ETag": _job_etag(job), "Location": f"/api/jobs/{job['id']}", "Cache-Control": "no-cache"},
+    )
+
+
+@app.post("/api/jobs")
+async def submit_job(request: Request):
+    """Queue slow work and return at once with the job id (202).
+    Body: { kind: "build" | "category" | "analysis" | "decision", payload: {...same body as the endpoint}, priority?: int }
+    """
+    if not get_job_queue:
+        return JSONResponse(status_code=500, content={"error": "Job queue not available on server"})
     try:
-        claude = ClaudeClient()
-        decision = claude.generate_decision(analysis_text, portfolio_hint)
-        return decision
-    except Exception as e:
-        logging.error(f"Decision error: {e}")
-        return JSONResponse(status_code=500, content={"error": f"Claude decision error: {e}"})
+        body = await request.json()
+        kind = body["kind"]
+        payload = body.get("payload") or {}
+        priority = int(body.get("priority", 0))
+    except Exception:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON body"})
+    try:
+        job = await get_job_queue().submit_async(kind, payload, priority)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except QueueFull as e:
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "5"})
+    return _job_response(job, status_code=202)
+
+
+@app.get("/api/jobs/stats")
+async def job_stats():
+    if not get_job_queue:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(get_job_queue().stats)}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, request: Request, wait: float = 0):
+    """Job status and, once finished, its result.
+    With If-None-Match set to the last ETag the call answers 304 while the job is unchanged;
+    wait=N (seconds, max 30) long-polls until it changes.
+    """
+    if not get_job_queue:
+        return JSONResponse(status_code=500, content={"error": "Job queue not available on server"})
+    queue = get_job_queue()
+    job = await queue.get_async(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Trabajo no encontrado o expirado"})
+    etag = request.headers.get("if-none-match")
+    if etag == _job_etag(job) and wait > 0:
+        job = await queue.wait(job_id, job["version"], min(wait, JOB_MAX_WAIT))
+        if job is None:
+            return JSONResponse(status_code=404, content={"error": "Trabajo no encontrado o expirado"})
+    if etag == _job_etag(job):
+        return Response(status_code=304, headers={"ETag": etag})
+    return _job_response(job)
+
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    if not get_job_queue:
+        return JSONResponse(status_code=500, content={"error": "Job queue not available on server"})
+    job = await get_job_queue().cancel_async(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Trabajo no encontrado o expirado"})
+    return _job_response(job)
+
+@app.get("/api/prices/{ticker}")
+def price_history(ticker: str, start: str = None, end: str = None, field: str = "adj_close"):
+    """Daily history for one ticker from the local price store (for charts)."""
+    if not get_price_store:
+        return JSONResponse(status_code=500, content={"error": "Price store not available on server"})
+    store = get_price_store()
+    try:
+        dates, values = store.series(ticker.upper(), field, start, end)
+    except KeyError as e:
+        return JSONResponse(status_code=404, content={"error": str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    values = [None if v != v else round(float(v), 6) for v in values]
+    return {"ticker": ticker.upper(), "field": field, "dates": dates.astype(str).tolist(), "values": values}
 
 # Status endpoint for monitoring
 @app.get("/api/status")
 def api_status():
     return {"status": "ok"}
 
+@app.get("/api/startup")
+def startup_stats():
+    # Import/startup breakdown of this worker, plus modules loaded lazily since
+    return startup_report.to_dict()
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    cache = get_result_cache() if get_result_cache else None
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+@app.get("/api/risk/covariance")
+async def risk_covariance(tickers: str, estimator: str = "ledoit_wolf", window: int = 252,
+                          start: str = None, end: str = None, correlation: bool = False):
+    """Annualized covariance (or correlation) matrix for comma-separated tickers from local history."""
+    if not get_covariance_service:
+        return JSONResponse(status_code=500, content={"error": "Risk model not available on server"})
+    symbols = [t.strip().upper() for t in tickers.split(",") if t.strip()]
+    if not symbols:
+        return JSONResponse(status_code=400, content={"error": "tickers es obligatorio"})
+    try:
+        estimate = await asyncio.to_thread(
+            get_covariance_service().estimate, symbols, estimator, window, start, end,
+        )
+    except KeyError as e:
+        return JSONResponse(status_code=404, content={"error": str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return estimate.to_dict(correlation=correlation)
+
+@app.get("/api/risk/stats")
+def risk_stats():
+    if not get_covariance_service:
+        return {"enabled": False}
+    return {"enabled": True, **get_covariance_service().stats()}
+
+@app.get("/api/upstream/stats")
+def upstream_stats():
+    # Coalesced vs executed upstream calls per provider, and quota queues/waits
+    return {
+        "singleflight": singleflight_stats() if singleflight_stats else {},
+        "rate_limits": rate_limiter_stats() if rate_limiter_stats else {},
+        "replay": replay_stats() if replay_stats else {},
+        # Recent latency per upstream operation (the hedging threshold) and hedges fired
+        "latency": policy_stats() if policy_stats else {},
+    }
+
+def _cache_samples():
+    # Per-process lookup totals of the result and market-data caches, read at each metrics flush
+    caches = {
+        "results": get_result_cache() if get_result_cache else None,
+        "market_data": _quote_client.cache if _quote_client else None,
+    }
+    for name, cache in caches.items():
+        if cache is None:
+            continue
+        counters = dict(cache.stats_counters)
+        yield "cache_lookups_total", {"cache": name, "result": "hit", "tier": "memory"}, counters["memory_hits"]
+        yield "cache_lookups_total", {"cache": name, "result": "hit", "tier": "disk"}, counters["disk_hits"]
+        yield "cache_lookups_total", {"cache": name, "result": "miss", "tier": "disk"}, counters["misses"]
+        yield "cache_lookups_total", {"cache": name, "result": "stale", "tier": "disk"}, counters["stale_hits"]
+
+
+if metrics:
+    metrics.register_collector(_cache_samples)
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus text format, summed over every worker process of this host."""
+    if not metrics:
+        return JSONResponse(status_code=404, content={"error": "Metrics not available on server"})
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def _trace_store(request: Request):
+    if not get_tracer:
+        raise ApiError(404, "Tracing not available on server")
+    tracer = get_tracer()
+    if not tracer.authorized(request.headers):
+        raise ApiError(403, "Token de trazas inválido")
+    if tracer.store is None:
+        raise ApiError(404, "Almacén de trazas desactivado (TRACE_STORE_SIZE=0)")
+    return tracer.store
+
+
+@app.get("/api/admin/traces")
+async def list_traces(request: Request, limit: int = 50, route: str = None, min_ms: float = 0):
+    """Recent traced requests (newest first), optionally by route template or minimum duration."""
+    try:
+        store = _trace_store(request)
+    except ApiError as e:
+        return e.response()
+    return {"traces": await asyncio.to_thread(store.list, max(1, min(limit, 500)), route, min_ms)}
+
+
+@app.get("/api/admin/traces/{trace_id}")
+async def get_trace(trace_id: str, request: Request, format: str = "json"):
+    """One trace with its spans and profile; format=folded returns the profile for flamegraph tools."""
+    try:
+        store = _trace_store(request)
+    except ApiError as e:
+        return e.response()
+    trace = await asyncio.to_thread(store.get, trace_id)
+    if trace is None:
+        return JSONResponse(status_code=404, content={"error": "Traza no encontrada"})
+    if format == "folded":
+        if not trace.get("profile"):
+            return JSONResponse(status_code=404, content={"error": "La traza no tiene perfil"})
+        lines = [f"{stack} {count}" for stack, count in trace["profile"]["stacks"]]
+        return Response("\n".join(lines) + "\n", media_type="text/plain")
+    return trace
+
 # Rutas de prueba
 
 @app.get("/test")
@@ -370,22 +1710,27 @@ def api_test():
     return {"status": "ok", "data": {"value_stocks": value_count, "growth_stocks": growth_count}}
 
 # --- SPA entry and catch-all (must be after API routes) ---
-INDEX_FILE = Path("public") / "index.html"
+def _static_response(full_path: str, request: Request):
+    # In-memory lookup: build files by path, anything else is a client-side route served by index.html
+    if not static_site:
+        raise HTTPException(status_code=404)
+    static_site.refresh()
+    asset = static_site.lookup(full_path)
+    response = static_site.respond(asset, request.headers) if asset else static_site.respond_index(request.headers)
+    if response is None:
+        raise HTTPException(status_code=404)
+    return response
 
 @app.get("/", include_in_schema=False)
-def serve_index():
-    # Serve React index.html at root
-    return FileResponse(INDEX_FILE)
+def serve_index(request: Request):
+    return _static_response("index.html", request)
 
 @app.get("/{full_path:path}", include_in_schema=False)
-def spa_catch_all(full_path: str):
+def spa_catch_all(full_path: str, request: Request):
     # Do not intercept API routes
     if full_path.startswith("api/"):
         raise HTTPException(status_code=404)
-    file_path = Path("public") / full_path
-    if file_path.is_file():
-        return FileResponse(file_path)
-    return FileResponse(INDEX_FILE)
+    return _static_response(full_path, request)
 
 # Ejecutar la aplicación si se llama directamente
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+STRATEGIES = ("buy_and_hold", "calendar", "threshold")
+FREQUENCIES = {"monthly": "M", "quarterly": "Q", "annual": "Y"}
+TRADING_DAYS = 252
+
+
+@dataclass
+class BacktestResult:
+    dates: np.ndarray
+    values: np.ndarray
+    rebalance_dates: np.ndarray
+    turnover: float
+    costs: float
+    risk_free: float = 0.0
+
+    def metrics(self) -> dict:
+        values = self.values
+        daily = values[1:] / values[:-1] - 1.0 if values.size > 1 else np.empty(0)
+        years = max((self.dates[-1] - self.dates[0]).astype(int) / 365.25, 1e-9) if values.size > 1 else 0.0
+        total = float(values[-1] / values[0] - 1.0) if values.size else 0.0
+        cagr = float((values[-1] / values[0]) ** (1.0 / years) - 1.0) if years else None
+        vol = float(daily.std(ddof=1) * np.sqrt(TRADING_DAYS)) if daily.size > 1 else None
+        peaks = np.maximum.accumulate(values) if values.size else values
+        drawdown = float((values / peaks - 1.0).min()) if values.size else 0.0
+        sharpe = (cagr - self.risk_free) / vol if cagr is not None and vol else None
+        return {
+            "total_return": round(total, 6),
+            "cagr": None if cagr is None else round(cagr, 6),
+            "volatility": None if vol is None else round(vol, 6),
+            "sharpe_ratio": None if sharpe is None else round(sharpe, 6),
+            "max_drawdown": round(drawdown, 6),
+            "rebalances": int(self.rebalance_dates.size),
+            "turnover": round(self.turnover, 6),
+            "costs": round(self.costs, 2),
+        }
+
+
+def _calendar_starts(dates: np.ndarray, frequency: str) -> np.ndarray:
+    unit = FREQUENCIES[frequency]
+    if unit == "Q":
+        periods = dates.astype("datetime64[M]").astype(np.int64) // 3
+    else:
+        periods = dates.astype(f"datetime64[{unit}]").astype(np.int64)
+    return np.flatnonzero(np.diff(periods) != 0) + 1
+
+
+def _threshold_starts(growth: np.ndarray, weights: np.ndarray, threshold: float) -> np.ndarray:
+    """Find rebalance rows where any weight drifts more than `threshold` from target.
+    The scan is vectorized over look-ahead windows; the Python loop runs once per rebalance.
+    """
+    n_rows = growth.shape[0]
+    starts = []
+    s = 0
+    window = 64
+    while s < n_rows - 1:
+        stop = min(n_rows, s + 1 + window)
+        rel = growth[s + 1:stop] / growth[s] * weights
+        drift = np.abs(rel / rel.sum(axis=1, keepdims=True) - weights).max(axis=1)
+        hit = np.flatnonzero(drift > threshold)
+        if hit.size:
+            s = s + 1 + int(hit[0])
+            starts.append(s)
+            window = 64
+        elif stop >= n_rows:
+            break
+        else:
+            window *= 2
+    return np.asarray(starts, dtype=np.intp)
+
+
+def run_backtest(
+    dates: np.ndarray,
+    returns: np.ndarray,
+    weights,
+    strategy: str = "buy_and_hold",
+    frequency: str = "quarterly",
+    threshold: float = 0.05,
+    cost_bps: float = 10.0,
+    initial: float = 1.0,
+    risk_free: float = 0.0,
+) -> BacktestResult:
+    """Simulate a fixed-weight portfolio over daily returns.
+
+    dates has T+1 entries (the first is the initial trade date) and returns is
+    (T, N) with returns[t] realized on dates[t + 1]. NaN returns count as 0.
+    Rebalances trade back to the target weights at the close, paying
+    cost_bps on the traded notional; the initial purchase pays it as well.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Estrategia desconocida: {strategy}. Usa una de {', '.join(STRATEGIES)}")
+    if strategy == "calendar" and frequency not in FREQUENCIES:
+        raise ValueError(f"Frecuencia desconocida: {frequency}. Usa una de {', '.join(FREQUENCIES)}")
+    weights = np.asarray(weights, dtype=float)
+    weights = weights / weights.sum()
+    returns = np.nan_to_num(np.asarray(returns, dtype=float), nan=0.0)
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    cost = cost_bps / 10000.0
+
+    # growth[t, i]: value of 1 unit of asset i bought on dates[0]
+    growth = np.vstack([np.ones((1, returns.shape[1])), np.cumprod(1.0 + returns, axis=0)])
+    n_rows = growth.shape[0]
+
+    if strategy == "calendar":
+        rebalances = _calendar_starts(dates, frequency)
+    elif strategy == "threshold":
+        rebalances = _threshold_starts(growth, weights, threshold)
+    else:
+        rebalances = np.empty(0, dtype=np.intp)
+    starts = np.concatenate([[0], rebalances]).astype(np.intp)
+
+    # Every row belongs to the segment opened by the latest rebalance
+    segment = np.searchsorted(starts, np.arange(n_rows), side="right") - 1
+    rel = growth / growth[starts[segment]]
+    seg_growth = rel @ weights
+
+    # Growth of each closing segment up to its rebalance row, the drifted weights
+    # there and the turnover needed to restore the targets
+    ends = rebalances
+    end_rel = growth[ends] / growth[starts[:-1]]
+    end_growth = end_rel @ weights
+    drifted = end_rel * weights / end_growth[:, None]
+    turnover = np.abs(drifted - weights).sum(axis=1)
+    start_values = initial * (1.0 - cost) * np.concatenate([[1.0], np.cumprod(end_growth * (1.0 - cost * turnover))])
+    values = start_values[segment] * seg_growth
+    # Costs: the initial purchase plus the notional traded at each rebalance
+    pre_values = start_values[:-1] * end_growth
+    costs = initial * cost + float((pre_values * cost * turnover).sum())
+    return BacktestResult(
+        dates=dates,
+        values=values,
+        rebalance_dates=dates[rebalances],
+        turnover=float(turnover.sum()),
+        costs=costs,
+        risk_free=risk_free,
+    )
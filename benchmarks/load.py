@@ -0,0 +1,205 @@
+"""Drive the app's endpoints at fixed concurrency levels against the stub upstreams.
+
+The app runs in-process under uvicorn on its own event loop thread; the load
+generator runs on the main thread's loop and the stubs on a third one. All
+three share the GIL, so absolute numbers are lower than on a dedicated host:
+compare runs on the same machine (see run.py baselines).
+"""
+import os
+import time
+import random
+import asyncio
+import tempfile
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+import httpx
+
+from benchmarks.stubs import StubUpstreams, free_port, serve_in_thread, stop_server
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: str
+    body: Optional[Callable[[int], dict]] = None
+    # Status codes that count as success (streams and optimizer answer 200)
+    ok: tuple = (200,)
+
+
+def _universe(n: int = 24) -> list:
+    rng = random.Random(3)
+    categories = ("value", "growth", "bonds")
+    return [
+        {"ticker": f"T{i:03d}", "name": f"Asset {i}", "category": categories[i % 3], "price": round(rng.uniform(10, 300), 2),
+         "expected_return": round(rng.uniform(0.02, 0.14), 4), "volatility": round(rng.uniform(0.05, 0.4), 4)}
+        for i in range(n)
+    ]
+
+
+_PORTFOLIO = {"allocation": {"value": [
+    {"symbol": f"V{i}", "name": f"Value {i}", "price": 50 + i, "shares": 10, "amount": 500 + 10 * i, "weight": 0.1}
+    for i in range(10)
+]}}
+
+# Amounts vary per request so prompts differ and singleflight does not collapse the load
+SCENARIOS = {
+    "status": Scenario("status", "GET", "/api/status"),
+    "static_index": Scenario("static_index", "GET", "/"),
+    "category": Scenario("category", "POST", "/api/portfolio/value", lambda i: {"amount": 10000 + i}),
+    "category_stream": Scenario("category_stream", "POST", "/api/portfolio/growth/stream", lambda i: {"amount": 10000 + i}),
+    "build": Scenario("build", "POST", "/api/portfolio/build",
+                      lambda i: {"amount": 20000 + i, "target_alloc": {"value": 40, "growth": 40, "bonds": 20}}),
+    "claude_analysis": Scenario("claude_analysis", "POST", "/api/portfolio/claude-analysis",
+                                lambda i: {"portfolio": {"allocation": {"value": [dict(p, shares=p["shares"] + i) for p in _PORTFOLIO["allocation"]["value"]]}}}),
+    "decision": Scenario("decision", "POST", "/api/analysis/decision",
+                         lambda i: {"analysis": f"Análisis {i}: cartera diversificada con riesgo moderado."}),
+    "optimize": Scenario("optimize", "POST", "/api/portfolio/optimize",
+                         lambda i: {"amount": 10000 + i, "target_alloc": {"value": 40, "growth": 40, "bonds": 20}, "universe": _universe()}),
+}
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(values: List[float]) -> dict:
+    ordered = sorted(values)
+    return {
+        "p50": _ms(percentile(ordered, 50)),
+        "p95": _ms(percentile(ordered, 95)),
+        "p99": _ms(percentile(ordered, 99)),
+        "max": _ms(ordered[-1]) if ordered else None,
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+async def _probe_loop_lag(samples: List[float], stop: asyncio.Event, interval: float = 0.01):
+    # Runs on the app's loop: how late a 10 ms timer fires is the time the loop was blocked
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - start - interval))
+
+
+def isolated_env(directory: str) -> dict:
+    """Environment that keeps the app's caches, databases and metrics under `directory`."""
+    return {
+        "RESULT_CACHE_TTL": "0",
+        "RESULT_CACHE_PATH": os.path.join(directory, "results.sqlite3"),
+        "ALPHAVANTAGE_CACHE_PATH": os.path.join(directory, "market.sqlite3"),
+        "ALPHAVANTAGE_RATE_PER_MINUTE": "0",
+        "RATE_LIMIT_PATH": os.path.join(directory, "rate_limits.sqlite3"),
+        "PORTFOLIO_DB_PATH": os.path.join(directory, "portfolios.sqlite3"),
+        "JOB_DB_PATH": os.path.join(directory, "jobs.sqlite3"),
+        "METRICS_DIR": os.path.join(directory, "metrics"),
+        "TRACE_DB_PATH": os.path.join(directory, "traces.sqlite3"),
+        "PRICE_STORE_DIR": os.path.join(directory, "prices"),
+        "LOG_LEVEL": "WARNING",
+    }
+
+
+class AppUnderTest:
+    """The real app, imported with its upstreams, data files and logs pointed at throwaway locations."""
+
+    def __init__(self, stubs: StubUpstreams, extra_env: Optional[dict] = None):
+        self.stubs = stubs
+        self.tmp = tempfile.mkdtemp(prefix="bench-")
+        env = {**stubs.env(), **isolated_env(self.tmp)}
+        env.update(extra_env or {})
+        os.environ.update(env)
+        import app as app_module  # after the environment is in place
+        self.module = app_module
+        self.port = free_port()
+        self._server = self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self._server, self._thread = serve_in_thread(self.module.app, self.port)
+        return self
+
+    def stop(self):
+        stop_server(self._server, self._thread)
+
+
+async def _drive(base_url: str, scenario: Scenario, concurrency: int, duration: float, warmup: float, app_loop) -> dict:
+    latencies: List[float] = []
+    statuses: dict = {}
+    counter = {"i": 0}
+    lag: List[float] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        async def request(record: bool):
+            counter["i"] += 1
+            body = scenario.body(counter["i"]) if scenario.body else None
+            start = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, scenario.path, json=body)
+                await response.aread()
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            if record:
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        async def worker(until: float, record: bool):
+            while time.perf_counter() < until:
+                await request(record)
+
+        if warmup > 0:
+            until = time.perf_counter() + warmup
+            await asyncio.gather(*(worker(until, False) for _ in range(concurrency)))
+
+        stop = asyncio.Event()
+        stop_probe = lambda: app_loop.call_soon_threadsafe(stop.set)
+        probe = asyncio.run_coroutine_threadsafe(_probe_loop_lag(lag, stop), app_loop)
+        started = time.perf_counter()
+        until = started + duration
+        await asyncio.gather(*(worker(until, True) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        stop_probe()
+        await asyncio.wrap_future(probe)
+
+    errors = sum(count for status, count in statuses.items() if status not in scenario.ok)
+    return {
+        "scenario": scenario.name,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": {str(k): v for k, v in sorted(statuses.items(), key=str)},
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": summarize(latencies),
+        "loop_lag_ms": summarize(lag),
+    }
+
+
+def run_load(scenarios: List[str], concurrency: List[int], duration: float = 5.0, warmup: float = 1.0,
+             stub_config=None, app_env: Optional[dict] = None, log=print) -> List[dict]:
+    stubs = StubUpstreams(stub_config).start()
+    app = None
+    try:
+        app = AppUnderTest(stubs, app_env).start()
+        results = []
+        for name in scenarios:
+            scenario = SCENARIOS[name]
+            for level in concurrency:
+                result = asyncio.run(_drive(app.base_url, scenario, level, duration, warmup, app._server.loop))
+                log(f"{name:>16} c={level:<4} rps={result['rps']:<9} p50={result['latency_ms']['p50']}ms "
+                    f"p99={result['latency_ms']['p99']}ms lag_p99={result['loop_lag_ms']['p99']}ms errors={result['errors']}")
+                results.append(result)
+        return results
+    finally:
+        if app is not None:
+            app.stop()
+        stubs.stop()
@@ -0,0 +1,77 @@
+"""Micro-benchmarks of the CPU-bound helpers on the request path.
+
+Each case is timed with timeit (best of `repeat` runs) and reported in ns/op,
+so regressions in parsing, prompt building or allocation math show up
+without the noise of a full request.
+"""
+import os
+import json
+import random
+import tempfile
+import timeit
+from typing import Callable, Dict, List
+
+from benchmarks.load import isolated_env
+
+
+def _items(n: int, seed: int = 11) -> List[dict]:
+    rng = random.Random(seed)
+    return [
+        {"ticker": f"TK{i:02d}", "name": f"Company {i}", "sector": "Tech", "price": round(rng.uniform(10, 400), 2),
+         "weight": round(1 / n, 4), "pe_ratio": round(rng.uniform(5, 40), 1)}
+        for i in range(n)
+    ]
+
+
+def _cases() -> Dict[str, Callable[[], object]]:
+    tmp = tempfile.mkdtemp(prefix="bench-micro-")
+    # The repair case logs a warning per call; keep the output to the results
+    os.environ.update({"PERPLEXITY_API_KEY": "stub", "ANTHROPIC_API_KEY": "stub", **isolated_env(tmp), "LOG_LEVEL": "ERROR"})
+    from app import _compute_allocation, _flatten_positions
+    from claude_client import ClaudeClient
+    from perplexity_client import JsonArrayStream, PerplexityClient
+
+    perplexity = PerplexityClient(cache=False, limiter=False)
+    claude = ClaudeClient(cache=False, limiter=False)
+
+    items = _items(10)
+    prices = {item["ticker"]: item["price"] * 1.01 for item in items}
+    clean = "Aquí tienes la selección:\n```json\n" + json.dumps(items, indent=2) + "\n```\nFuentes: [1] [2]"
+    # Single quotes and a trailing comma go through the repair path
+    dirty = "Resultado:\n" + json.dumps(items).replace('"', "'")[:-1] + ",]"
+    large = "Resultado:\n" + json.dumps(_items(200))
+    chunks = [clean[i:i + 40] for i in range(0, len(clean), 40)]
+    positions = _flatten_positions({"allocation": {"value": _compute_allocation(items, 10000, prices),
+                                                   "growth": _compute_allocation(_items(10, 12), 8000)}})
+
+    def stream_feed():
+        parser = JsonArrayStream()
+        for chunk in chunks:
+            parser.feed(chunk)
+
+    return {
+        "compute_allocation_10": lambda: _compute_allocation(items, 10000, prices),
+        "parse_items_clean_10": lambda: perplexity._parse_items(clean),
+        "parse_items_repair_10": lambda: perplexity._parse_items(dirty),
+        "parse_items_clean_200": lambda: perplexity._parse_items(large),
+        "json_array_stream_10": stream_feed,
+        "category_prompts_value": lambda: perplexity._category_request("value", 10000),
+        "claude_analysis_payload": lambda: claude._analysis_payload(positions),
+    }
+
+
+def run_micro(names: List[str] = None, min_time: float = 0.2, repeat: int = 5, log=print) -> List[dict]:
+    cases = _cases()
+    results = []
+    for name, fn in cases.items():
+        if names and name not in names:
+            continue
+        timer = timeit.Timer(fn)
+        number, _ = timer.autorange()
+        # autorange targets ~0.2 s per run; scale to min_time
+        number = max(1, int(number * min_time / 0.2))
+        best = min(timer.repeat(repeat=repeat, number=number)) / number
+        result = {"case": name, "ns_per_op": round(best * 1e9, 1), "loops": number}
+        log(f"{name:>28} {result['ns_per_op']:>14,.1f} ns/op")
+        results.append(result)
+    return results
@@ -0,0 +1,122 @@
+"""Run the benchmark suites and compare them with a stored baseline.
+
+    python -m benchmarks.run                      # load + micro, compare with benchmarks/baselines/default.json
+    python -m benchmarks.run --suite micro --quick
+    python -m benchmarks.run --save-baseline      # record the current numbers as the baseline
+
+Results are written to benchmarks/results/<timestamp>.json. The exit code is 1
+when a metric regressed by more than --threshold against the baseline.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load import SCENARIOS, run_load  # noqa: E402
+from benchmarks.micro import run_micro  # noqa: E402
+from benchmarks.stubs import StubConfig  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, "baselines", "default.json")
+RESULTS_DIR = os.path.join(HERE, "results")
+
+# Lower is better for latencies and ns/op, higher is better for throughput
+_LOWER = ("p50", "p95", "p99")
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """Regressions of current vs baseline beyond threshold (0.15 = 15 %)."""
+    problems = []
+    old_load = {(r["scenario"], r["concurrency"]): r for r in baseline.get("load", [])}
+    for result in current.get("load", []):
+        old = old_load.get((result["scenario"], result["concurrency"]))
+        if old is None:
+            continue
+        label = f"{result['scenario']} c={result['concurrency']}"
+        if old.get("rps") and result.get("rps") is not None and result["rps"] < old["rps"] * (1 - threshold):
+            problems.append(f"{label}: rps {old['rps']} -> {result['rps']}")
+        for key in _LOWER:
+            before, after = old["latency_ms"].get(key), result["latency_ms"].get(key)
+            if before and after is not None and after > before * (1 + threshold):
+                problems.append(f"{label}: {key} {before} ms -> {after} ms")
+        if result["errors"] > old.get("errors", 0):
+            problems.append(f"{label}: errores {old.get('errors', 0)} -> {result['errors']}")
+    old_micro = {r["case"]: r for r in baseline.get("micro", [])}
+    for result in current.get("micro", []):
+        old = old_micro.get(result["case"])
+        if old and result["ns_per_op"] > old["ns_per_op"] * (1 + threshold):
+            problems.append(f"{result['case']}: {old['ns_per_op']} ns/op -> {result['ns_per_op']} ns/op")
+    return problems
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks offline con upstreams simulados")
+    parser.add_argument("--suite", choices=("load", "micro", "all"), default="all")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="escenarios de carga separados por comas")
+    parser.add_argument("--concurrency", default="1,8,32", help="niveles de concurrencia separados por comas")
+    parser.add_argument("--duration", type=float, default=10.0, help="segundos medidos por escenario y nivel")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="latencia de los upstreams simulados")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de llamadas simuladas que fallan")
+    parser.add_argument("--items", type=int, default=10, help="instrumentos por respuesta de Perplexity")
+    parser.add_argument("--analysis-chars", type=int, default=4000, help="longitud de los análisis de Claude")
+    parser.add_argument("--quick", action="store_true", help="duraciones cortas y concurrencia 1,8 (humo en CI)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.15, help="regresión tolerada (0.15 = 15 %%)")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.duration, args.warmup, args.concurrency = 2.0, 0.5, "1,8"
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline")},
+    }
+    if args.suite in ("load", "all"):
+        stub_config = StubConfig(latency_ms=args.latency_ms, error_rate=args.error_rate,
+                                 items=args.items, analysis_chars=args.analysis_chars)
+        report["load"] = run_load(
+            [s.strip() for s in args.scenarios.split(",") if s.strip()],
+            [int(c) for c in args.concurrency.split(",") if c.strip()],
+            duration=args.duration, warmup=args.warmup, stub_config=stub_config,
+        )
+    if args.suite in ("micro", "all"):
+        report["micro"] = run_micro(min_time=0.05 if args.quick else 0.2, repeat=3 if args.quick else 5)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Resultados en {output}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Línea base guardada en {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"Sin línea base en {args.baseline}; usa --save-baseline para crearla")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    problems = compare(report, baseline, args.threshold)
+    for problem in problems:
+        print(f"REGRESIÓN {problem}")
+    if not problems:
+        print(f"Sin regresiones frente a {args.baseline} (umbral {args.threshold:.0%})")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
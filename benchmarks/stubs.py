@@ -0,0 +1,210 @@
+"""Local stand-ins for the Perplexity, Anthropic and Alpha Vantage APIs.
+
+They answer with the same shapes the clients parse (JSON and SSE streams)
+after a configurable latency, fail a configurable fraction of calls and
+produce responses of a configurable size.
+"""
+import json
+import random
+import asyncio
+import threading
+import socket
+import time
+from dataclasses import dataclass
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 200.0      # time to the full answer (streams spread it over their chunks)
+    jitter_ms: float = 50.0        # uniform +/- jitter added to latency
+    error_rate: float = 0.0        # fraction of calls answered with error_status
+    error_status: int = 500
+    items: int = 10                # instruments per Perplexity answer
+    analysis_chars: int = 4000     # length of a Claude analysis
+    stream_chunks: int = 20        # SSE chunks per streamed answer
+    seed: int = 7
+
+
+_WORDS = ("margen", "deuda", "flujo", "caja", "valor", "riesgo", "sector", "crecimiento", "dividendo", "moat")
+
+
+class StubUpstreams:
+    """One Starlette app serving all three upstream APIs, run by uvicorn in its own thread and loop."""
+
+    def __init__(self, config: StubConfig = None):
+        self.config = config or StubConfig()
+        self.random = random.Random(self.config.seed)
+        self.calls = {"perplexity": 0, "anthropic": 0, "alphavantage": 0, "errors": 0}
+        self.port = None
+        self._server = None
+        self._thread = None
+        self.app = Starlette(routes=[
+            Route("/chat/completions", self.perplexity, methods=["POST", "HEAD"]),
+            Route("/v1/messages", self.anthropic, methods=["POST", "HEAD"]),
+            Route("/query", self.alphavantage, methods=["GET", "HEAD"]),
+        ])
+
+    # --- behaviour ---
+    def _latency(self) -> float:
+        c = self.config
+        return max(0.0, c.latency_ms + self.random.uniform(-c.jitter_ms, c.jitter_ms)) / 1000
+
+    def _fail(self):
+        if self.config.error_rate and self.random.random() < self.config.error_rate:
+            self.calls["errors"] += 1
+            return JSONResponse({"error": {"message": "stub failure"}}, status_code=self.config.error_status)
+        return None
+
+    def _items_text(self, seed: str) -> str:
+        rng = random.Random(seed)
+        items = []
+        for i in range(self.config.items):
+            ticker = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(4))
+            items.append({
+                "ticker": ticker, "name": f"{ticker} Corp", "sector": rng.choice(("Tech", "Energy", "Health")),
+                "price": round(rng.uniform(10, 500), 2), "weight": round(1 / self.config.items, 4),
+                "pe_ratio": round(rng.uniform(5, 40), 1), "roe": round(rng.uniform(0.05, 0.35), 3),
+            })
+        return "Aquí tienes la selección solicitada:\n" + json.dumps(items, indent=1)
+
+    def _analysis_text(self) -> str:
+        words, size = [], 0
+        while size < self.config.analysis_chars:
+            word = self.random.choice(_WORDS)
+            words.append(word)
+            size += len(word) + 1
+        return " ".join(words)
+
+    async def _sse(self, pieces, event_of):
+        delay = self._latency() / max(1, len(pieces))
+        for piece in pieces:
+            await asyncio.sleep(delay)
+            event, data = event_of(piece)
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n" if event else f"data: {json.dumps(data)}\n\n"
+
+    def _chunks(self, text: str):
+        n = max(1, self.config.stream_chunks)
+        size = max(1, len(text) // n + 1)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    # --- endpoints ---
+    async def perplexity(self, request: Request):
+        if request.method == "HEAD":
+            return JSONResponse({})
+        self.calls["perplexity"] += 1
+        body = await request.json()
+        failure = self._fail()
+        if failure is not None:
+            await asyncio.sleep(self._latency() / 4)
+            return failure
+        text = self._items_text(json.dumps(body.get("messages"), sort_keys=True))
+        if body.get("stream"):
+            async def stream():
+                async for chunk in self._sse(self._chunks(text), lambda p: (None, {"choices": [{"delta": {"content": p}}]})):
+                    yield chunk
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(stream(), media_type="text/event-stream")
+        await asyncio.sleep(self._latency())
+        return JSONResponse({"choices": [{"message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]})
+
+    async def anthropic(self, request: Request):
+        if request.method == "HEAD":
+            return JSONResponse({})
+        self.calls["anthropic"] += 1
+        body = await request.json()
+        failure = self._fail()
+        if failure is not None:
+            await asyncio.sleep(self._latency() / 4)
+            return failure
+        prompt = json.dumps(body.get("messages"), ensure_ascii=False)
+        if "decision" in prompt and "JSON" in prompt:
+            text = json.dumps({"decision": "invertir", "score": 72, "reasons": ["valoración"], "alerts": []})
+        else:
+            text = self._analysis_text()
+        if body.get("stream"):
+            async def stream():
+                yield 'event: message_start\ndata: {"type": "message_start"}\n\n'
+                delta = lambda p: ("content_block_delta", {"type": "content_block_delta", "delta": {"type": "text_delta", "text": p}})
+                async for chunk in self._sse(self._chunks(text), delta):
+                    yield chunk
+                yield 'event: message_stop\ndata: {"type": "message_stop"}\n\n'
+            return StreamingResponse(stream(), media_type="text/event-stream")
+        await asyncio.sleep(self._latency())
+        return JSONResponse({"content": [{"type": "text", "text": text}], "stop_reason": "end_turn"})
+
+    async def alphavantage(self, request: Request):
+        if request.method == "HEAD":
+            return JSONResponse({})
+        self.calls["alphavantage"] += 1
+        failure = self._fail()
+        await asyncio.sleep(self._latency() / 4)
+        if failure is not None:
+            return failure
+        symbol = request.query_params.get("symbol", "X")
+        price = round(random.Random(symbol).uniform(10, 500), 2)
+        return JSONResponse({"Global Quote": {"01. symbol": symbol, "05. price": f"{price}", "10. change percent": "0.5%"}})
+
+    # --- lifecycle ---
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def env(self) -> dict:
+        """Environment that points the app's clients at these stubs."""
+        return {
+            "PERPLEXITY_API_URL": f"{self.base_url}/chat/completions",
+            "ANTHROPIC_API_URL": f"{self.base_url}/v1/messages",
+            "ALPHAVANTAGE_BASE_URL": f"{self.base_url}/query",
+            "PERPLEXITY_API_KEY": "stub",
+            "ANTHROPIC_API_KEY": "stub",
+            "ALPHAVANTAGE_API_KEY": "stub",
+        }
+
+    def start(self):
+        self.port = free_port()
+        self._server, self._thread = serve_in_thread(self.app, self.port)
+        return self
+
+    def stop(self):
+        stop_server(self._server, self._thread)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app, port: int, timeout: float = 30.0):
+    """Run an ASGI app with uvicorn on its own event loop thread; returns (server, thread) once it listens.
+    server.loop is that event loop (used to probe loop lag).
+    """
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False, lifespan="auto")
+    server = uvicorn.Server(config)
+    server.loop = asyncio.new_event_loop()
+
+    def run():
+        asyncio.set_event_loop(server.loop)
+        server.loop.run_until_complete(server.serve())
+
+    thread = threading.Thread(target=run, name=f"uvicorn-{port}", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError(f"El servidor en el puerto {port} no arrancó")
+        time.sleep(0.02)
+    return server, thread
+
+
+def stop_server(server, thread, timeout: float = 10.0):
+    if server is None:
+        return
+    server.should_exit = True
+    thread.join(timeout)
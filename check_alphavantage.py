@@ -4,7 +4,7 @@ import json
 from datetime import datetime
 
 # Función para verificar la API key de Alpha Vantage
-# Archivo eliminado. Alpha Vantage ha sido removido del backend. No es necesario este script.
+def check_alpha_vantage_key():
     api_key = os.getenv("ALPHAVANTAGE_API_KEY")
     
     if not api_key:
@@ -55,21 +55,11 @@ def check_alpha_vantage_service():
     # Verificar si hay un archivo de caché para Alpha Vantage
     print("\n=== Verificando implementación de caché ===")
     try:
-        import app_railway
-        if hasattr(app_railway, 'alpha_client') and hasattr(app_railway.alpha_client, 'cache'):
-            cache_size = len(app_railway.alpha_client.cache)
-            print(f"Caché implementada. Elementos en caché: {cache_size}")
-            
-            # Mostrar elementos en caché
-            if cache_size > 0:
-                print("\nElementos en caché:")
-                for ticker, data in app_railway.alpha_client.cache.items():
-                    timestamp = data.get("timestamp")
-                    if timestamp:
-                        age = (datetime.now() - timestamp).seconds
-                        print(f"- {ticker}: {age} segundos de antigüedad")
-        else:
-            print("No se pudo verificar la implementación de caché.")
+        from improved_alpha_service import ImprovedAlphaVantageClient
+        client = ImprovedAlphaVantageClient()
+        stats = client.cache.stats()
+        print(f"Caché SQLite en {client.cache.path}. Elementos en caché: {stats.get('disk_entries')}")
+        print(f"Estadísticas: {stats}")
     except Exception as e:
         print(f"Error al verificar la caché: {str(e)}")
 
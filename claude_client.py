@@ -1,11 +1,20 @@
 import os
+import json
 import logging
 import requests
-from typing import Optional
+from typing import AsyncIterator, Optional
+
+from http_transport import iter_sse
+from rate_limiter import get_rate_limiter
+from result_cache import get_result_cache
+from singleflight import get_singleflight, normalize_key
+from upstream_policy import hedged
+from upstream_replay import get_llm_transport
 
 logger = logging.getLogger("claude-client")
 
-ANTHROPIC_URL = "https://api.anthropic.com/v1/messages"
+# Overridable to point at a local stand-in (benchmarks)
+ANTHROPIC_URL = os.getenv("ANTHROPIC_API_URL", "https://api.anthropic.com/v1/messages")
 ANTHROPIC_VERSION = "2023-06-01"
 MODEL_DEFAULT = os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-latest")
 
@@ -15,7 +24,7 @@ class ClaudeClient:
     Accepts ANTHROPIC_API_KEY or CLAUDE_API_KEY.
     """
 
-    def __init__(self, api_key=None, model: str = MODEL_DEFAULT):
+    def __init__(self, api_key=None, model: str = MODEL_DEFAULT, transport=None, cache=None, limiter=None):
         self.api_key = (
             api_key
             or os.getenv("ANTHROPIC_API_KEY")
@@ -24,9 +33,28 @@ class ClaudeClient:
         if not self.api_key:
             raise ValueError("Set ANTHROPIC_API_KEY (or CLAUDE_API_KEY) in environment variables.")
         self.model = model
+        self.transport = transport
+        # Finished analyses are kept so the decision endpoint can reuse them; cache=False disables it
+        self.cache = get_result_cache() if cache is None else (cache or None)
+        # Optional quota shared by every worker (CLAUDE_RATE_PER_MINUTE); limiter=False disables it
+        self.limiter = get_rate_limiter("claude") if limiter is None else (limiter or None)
 
-    def generate_analysis(self, portfolio, strategy_description=None, language="es"):
-        """Generate a detailed qualitative analysis for a portfolio using Claude."""
+    def _throttle_sync(self):
+        if self.limiter is not None:
+            self.limiter.acquire_sync()
+
+    async def _throttle(self):
+        if self.limiter is not None:
+            await self.limiter.acquire()
+
+    def _headers(self):
+        return {
+            "x-api-key": self.api_key,
+            "anthropic-version": ANTHROPIC_VERSION,
+            "content-type": "application/json",
+        }
+
+    def _analysis_payload(self, portfolio, strategy_description=None, language="es"):
         # Build prompt
         header = (
             "Eres un analista financiero experto en inversión cuantitativa y value investing. "
@@ -64,7 +92,7 @@ class ClaudeClient:
         )
         user_content = "\n".join([header] + table + [footer])
 
-        payload = {
+        return {
             "model": self.model,
             "max_tokens": 800,
             "temperature": 0.7,
@@ -72,35 +100,117 @@ class ClaudeClient:
                 {"role": "user", "content": user_content}
             ],
         }
-        headers = {
-            "x-api-key": self.api_key,
-            "anthropic-version": ANTHROPIC_VERSION,
-            "content-type": "application/json",
-        }
+
+    def _analysis_text(self, data):
+        # messages API returns a list of content blocks
+        blocks = data.get("content") or []
+        if not blocks:
+            return "[Sin respuesta de Claude]"
+        parts = []
+        for b in blocks:
+            # text blocks have type "text"
+            if isinstance(b, dict) and b.get("type") == "text":
+                parts.append(b.get("text", ""))
+        return ("\n".join(parts)).strip() or "[Sin contenido]"
+
+    def generate_analysis(self, portfolio, strategy_description=None, language="es"):
+        """Generate a detailed qualitative analysis for a portfolio using Claude."""
+        payload = self._analysis_payload(portfolio, strategy_description, language)
+        self._throttle_sync()
         try:
-            resp = requests.post(ANTHROPIC_URL, headers=headers, json=payload, timeout=60)
+            resp = requests.post(ANTHROPIC_URL, headers=self._headers(), json=payload, timeout=60)
             if resp.status_code != 200:
                 logger.error("Claude API error %s: %s", resp.status_code, resp.text[:500])
                 raise RuntimeError(f"Claude API error {resp.status_code}")
-            data = resp.json()
-            # messages API returns a list of content blocks
-            blocks = data.get("content") or []
-            if not blocks:
-                return "[Sin respuesta de Claude]"
-            parts = []
-            for b in blocks:
-                # text blocks have type "text"
-                if isinstance(b, dict) and b.get("type") == "text":
-                    parts.append(b.get("text", ""))
-            return ("\n".join(parts)).strip() or "[Sin contenido]"
+            return self._analysis_text(resp.json())
         except Exception as e:
             logger.error("Error al llamar a Claude: %s", e)
             raise
 
-    def generate_decision(self, analysis_text: str, portfolio_hint: Optional[dict] = None, language: str = "es"):
-        """Ask Claude to return a strict JSON decision to invest or not.
-        Returns dict with keys: decision (invertir|no_invertir), score (0-100), reasons (list[str]), alerts (list[str]).
+    async def _coalesced(self, payload, name, fn):
+        # Identical concurrent payloads share one upstream request, hedged when it runs past its p95
+        return await get_singleflight("claude").do(normalize_key(ANTHROPIC_URL, payload), lambda: hedged(name, fn))
+
+    def analysis_id(self, portfolio, strategy_description=None, language="es"):
+        """Stable id of the analysis for a portfolio, usable with cached_analysis()."""
+        return normalize_key(ANTHROPIC_URL, self._analysis_payload(portfolio, strategy_description, language))
+
+    def _analysis_cache_key(self, analysis_id):
+        return f"claude:analysis:{analysis_id}"
+
+    async def cached_analysis(self, analysis_id):
+        """Return a previously generated analysis text, or None."""
+        if self.cache is None or not analysis_id:
+            return None
+        return await self.cache.get_async(self._analysis_cache_key(analysis_id))
+
+    async def _store_analysis(self, analysis_id, text):
+        if self.cache is not None and text:
+            await self.cache.set_async(self._analysis_cache_key(analysis_id), text)
+
+    async def generate_analysis_async(self, portfolio, strategy_description=None, language="es"):
+        """Non-blocking variant of generate_analysis using the shared HTTP pool."""
+        payload = self._analysis_payload(portfolio, strategy_description, language)
+        analysis_id = normalize_key(ANTHROPIC_URL, payload)
+        cached = await self.cached_analysis(analysis_id)
+        if cached is not None:
+            return cached
+        text = await self._coalesced(payload, "claude_analysis", lambda: self._request_analysis_async(payload))
+        await self._store_analysis(analysis_id, text)
+        return text
+
+    async def stream_analysis_async(self, portfolio, strategy_description=None, language="es") -> AsyncIterator[str]:
+        """Yield the analysis text incrementally using the Messages API streaming mode.
+        The assembled text is cached under analysis_id() once message_stop arrives; a stream
+        cut short (connection dropped, upstream closed early) is not cached.
+        Closing the generator (e.g. on client disconnect) aborts the upstream stream.
         """
+        payload = self._analysis_payload(portfolio, strategy_description, language)
+        analysis_id = normalize_key(ANTHROPIC_URL, payload)
+        cached = await self.cached_analysis(analysis_id)
+        if cached is not None:
+            yield cached
+            return
+        await self._throttle()
+        transport = self.transport or get_llm_transport()
+        parts, complete = [], False
+        async with transport.stream("POST", ANTHROPIC_URL, headers=self._headers(), json=dict(payload, stream=True), timeout=60) as resp:
+            if resp.status_code != 200:
+                body = (await resp.aread()).decode("utf-8", "replace")
+                logger.error("Claude API error %s: %s", resp.status_code, body[:500])
+                raise RuntimeError(f"Claude API error {resp.status_code}")
+            async for event, data in iter_sse(resp):
+                if event == "content_block_delta":
+                    delta = json.loads(data).get("delta") or {}
+                    if delta.get("type") == "text_delta" and delta.get("text"):
+                        parts.append(delta["text"])
+                        yield delta["text"]
+                elif event == "error":
+                    error = json.loads(data).get("error") or {}
+                    logger.error("Claude stream error: %s", error)
+                    raise RuntimeError(f"Claude stream error: {error.get('message', data)}")
+                elif event == "message_stop":
+                    complete = True
+                    break
+        if not complete:
+            logger.warning("Stream de Claude terminado sin message_stop; el análisis no se guarda en cache")
+            return
+        await self._store_analysis(analysis_id, "".join(parts).strip())
+
+    async def _request_analysis_async(self, payload):
+        await self._throttle()
+        transport = self.transport or get_llm_transport()
+        try:
+            resp = await transport.post(ANTHROPIC_URL, headers=self._headers(), json=payload, timeout=60)
+            if resp.status_code != 200:
+                logger.error("Claude API error %s: %s", resp.status_code, resp.text[:500])
+                raise RuntimeError(f"Claude API error {resp.status_code}")
+            return self._analysis_text(resp.json())
+        except Exception as e:
+            logger.error("Error al llamar a Claude: %s", e)
+            raise
+
+    def _decision_payload(self, analysis_text: str, portfolio_hint: Optional[dict] = None):
         instruction = (
             "Eres un CIO con filosofía de Value Investing (Buffett y Munger). "
             "Con base en el análisis anterior, devuelve SOLO un objeto JSON estricto con: "
@@ -111,45 +221,67 @@ class ClaudeClient:
         user_content = (
             f"{instruction}\n\nANÁLISIS:\n{analysis_text}\n\nPISTAS_PORTAFOLIO(JSON opcional):\n{context}"
         )
-        payload = {
+        return {
             "model": self.model,
             "max_tokens": 400,
             "temperature": 0.2,
             "messages": [{"role": "user", "content": user_content}],
         }
-        headers = {
-            "x-api-key": self.api_key,
-            "anthropic-version": ANTHROPIC_VERSION,
-            "content-type": "application/json",
-        }
+
+    def _parse_decision(self, data):
+        blocks = data.get("content") or []
+        text = "".join([b.get("text", "") for b in blocks if isinstance(b, dict) and b.get("type") == "text"]).strip()
+        import json as _json
+        # Try parse as JSON
+        try:
+            parsed = _json.loads(text)
+        except Exception:
+            # Attempt to extract JSON object substring
+            start = text.find("{")
+            end = text.rfind("}")
+            if start != -1 and end != -1 and end > start:
+                parsed = _json.loads(text[start:end+1])
+            else:
+                raise RuntimeError("Claude did not return JSON")
+        # Normalize
+        decision = (parsed.get("decision") or "").lower()
+        if decision not in ("invertir", "no_invertir"):
+            decision = "no_invertir"
+        score = int(float(parsed.get("score", 0)))
+        reasons = parsed.get("reasons") or parsed.get("razones") or []
+        alerts = parsed.get("alerts") or parsed.get("alertas") or []
+        return {"decision": decision, "score": score, "reasons": reasons, "alerts": alerts}
+
+    def generate_decision(self, analysis_text: str, portfolio_hint: Optional[dict] = None, language: str = "es"):
+        """Ask Claude to return a strict JSON decision to invest or not.
+        Returns dict with keys: decision (invertir|no_invertir), score (0-100), reasons (list[str]), alerts (list[str]).
+        """
+        payload = self._decision_payload(analysis_text, portfolio_hint)
+        self._throttle_sync()
         try:
-            resp = requests.post(ANTHROPIC_URL, headers=headers, json=payload, timeout=45)
+            resp = requests.post(ANTHROPIC_URL, headers=self._headers(), json=payload, timeout=45)
             if resp.status_code != 200:
                 logger.error("Claude decision API error %s: %s", resp.status_code, resp.text[:500])
                 raise RuntimeError(f"Claude API error {resp.status_code}")
-            data = resp.json()
-            blocks = data.get("content") or []
-            text = "".join([b.get("text", "") for b in blocks if isinstance(b, dict) and b.get("type") == "text"]).strip()
-            import json as _json
-            # Try parse as JSON
-            try:
-                parsed = _json.loads(text)
-            except Exception:
-                # Attempt to extract JSON object substring
-                start = text.find("{")
-                end = text.rfind("}")
-                if start != -1 and end != -1 and end > start:
-                    parsed = _json.loads(text[start:end+1])
-                else:
-                    raise RuntimeError("Claude did not return JSON")
-            # Normalize
-            decision = (parsed.get("decision") or "").lower()
-            if decision not in ("invertir", "no_invertir"):
-                decision = "no_invertir"
-            score = int(float(parsed.get("score", 0)))
-            reasons = parsed.get("reasons") or parsed.get("razones") or []
-            alerts = parsed.get("alerts") or parsed.get("alertas") or []
-            return {"decision": decision, "score": score, "reasons": reasons, "alerts": alerts}
+            return self._parse_decision(resp.json())
+        except Exception as e:
+            logger.error("Error al obtener decisión de Claude: %s", e)
+            raise
+
+    async def generate_decision_async(self, analysis_text: str, portfolio_hint: Optional[dict] = None, language: str = "es"):
+        """Non-blocking variant of generate_decision using the shared HTTP pool."""
+        payload = self._decision_payload(analysis_text, portfolio_hint)
+        return await self._coalesced(payload, "claude_decision", lambda: self._request_decision_async(payload))
+
+    async def _request_decision_async(self, payload):
+        await self._throttle()
+        transport = self.transport or get_llm_transport()
+        try:
+            resp = await transport.post(ANTHROPIC_URL, headers=self._headers(), json=payload, timeout=45)
+            if resp.status_code != 200:
+                logger.error("Claude decision API error %s: %s", resp.status_code, resp.text[:500])
+                raise RuntimeError(f"Claude API error {resp.status_code}")
+            return self._parse_decision(resp.json())
         except Exception as e:
             logger.error("Error al obtener decisión de Claude: %s", e)
             raise
@@ -0,0 +1,193 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+from tracing import span
+from upstream_policy import budget, within_deadline
+
+logger = logging.getLogger("http-transport")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class AsyncTransport:
+    """Pooled keep-alive HTTP transport shared by the upstream API clients.
+
+    Wraps a single httpx.AsyncClient and adds a per-host concurrency limit on
+    top of the global pool limits.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        per_host_limit: int = 10,
+        timeout: float = 60.0,
+        connect_timeout: float = 10.0,
+        keepalive_expiry: float = 30.0,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.keepalive_expiry = keepalive_expiry
+        self._client: Optional[httpx.AsyncClient] = None
+        # Semaphores are created lazily so they bind to the running event loop
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+
+    @classmethod
+    def from_env(cls) -> "AsyncTransport":
+        return cls(
+            max_connections=_env_int("HTTP_POOL_MAX_CONNECTIONS", 100),
+            max_keepalive=_env_int("HTTP_POOL_MAX_KEEPALIVE", 20),
+            per_host_limit=_env_int("HTTP_POOL_PER_HOST", 10),
+            timeout=_env_float("HTTP_TIMEOUT", 60.0),
+            connect_timeout=_env_float("HTTP_CONNECT_TIMEOUT", 10.0),
+            keepalive_expiry=_env_float("HTTP_KEEPALIVE_EXPIRY", 30.0),
+        )
+
+    def _timeout(self, timeout: Optional[float]) -> httpx.Timeout:
+        total = self.timeout if timeout is None else timeout
+        return httpx.Timeout(total, connect=min(self.connect_timeout, total))
+
+    def _budget(self, url: str, timeout: Optional[float]) -> float:
+        # The call's own timeout, cut to what is left of the request deadline
+        return budget(self.timeout if timeout is None else timeout, urlsplit(url).netloc)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            )
+            self._client = httpx.AsyncClient(limits=limits, timeout=self._timeout(None))
+            logger.info(
+                "HTTP pool creado (max=%s, keepalive=%s, por host=%s)",
+                self.max_connections, self.max_keepalive, self.per_host_limit,
+            )
+        return self._client
+
+    @staticmethod
+    def _observe(url: str, status, start: float):
+        host = urlsplit(url).netloc
+        metrics.observe("upstream_request_duration_seconds", time.perf_counter() - start, host=host)
+        metrics.inc("upstream_requests_total", host=host, status=status)
+
+    def _slot(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        sem = self._host_slots.get(host)
+        if sem is None:
+            sem = asyncio.Semaphore(self.per_host_limit)
+            self._host_slots[host] = sem
+        return sem
+
+    async def post(self, url: str, *, headers=None, json=None, timeout: Optional[float] = None) -> httpx.Response:
+        """POST through the shared pool, honouring the per-host limit."""
+        async with self._slot(url):
+            timeout = self._budget(url, timeout)
+            start, status = time.perf_counter(), "error"
+            try:
+                with span("upstream", urlsplit(url).netloc):
+                    # httpx timeouts apply per read; the deadline bounds the whole call
+                    response = await within_deadline(
+                        self.client.post(url, headers=headers, json=json, timeout=self._timeout(timeout)), urlsplit(url).netloc)
+                status = response.status_code
+                return response
+            finally:
+                self._observe(url, status, start)
+
+    async def get(self, url: str, *, params=None, headers=None, timeout: Optional[float] = None) -> httpx.Response:
+        """GET through the shared pool, honouring the per-host limit."""
+        async with self._slot(url):
+            timeout = self._budget(url, timeout)
+            start, status = time.perf_counter(), "error"
+            try:
+                with span("upstream", urlsplit(url).netloc):
+                    response = await within_deadline(
+                        self.client.get(url, params=params, headers=headers, timeout=self._timeout(timeout)), urlsplit(url).netloc)
+                status = response.status_code
+                return response
+            finally:
+                self._observe(url, status, start)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, *, headers=None, json=None, timeout: Optional[float] = None):
+        """Open a streaming request; closing the context aborts the upstream response.
+
+        The recorded latency covers the whole stream, until the context closes.
+        Each read is limited to the time left before the request deadline.
+        """
+        async with self._slot(url):
+            timeout = self._budget(url, timeout)
+            start, status = time.perf_counter(), "error"
+            try:
+                with span("upstream", urlsplit(url).netloc):
+                    async with self.client.stream(method, url, headers=headers, json=json, timeout=self._timeout(timeout)) as response:
+                        status = response.status_code
+                        yield response
+            finally:
+                self._observe(url, status, start)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._host_slots.clear()
+
+
+async def iter_sse(response: httpx.Response) -> AsyncIterator[Tuple[str, str]]:
+    """Yield (event, data) pairs from a text/event-stream response."""
+    event, data = "message", []
+    async for line in response.aiter_lines():
+        if not line:
+            if data:
+                yield event, "\n".join(data)
+            event, data = "message", []
+        elif line.startswith(":"):
+            continue
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].lstrip())
+    if data:
+        yield event, "\n".join(data)
+
+
+_transport: Optional[AsyncTransport] = None
+
+
+def get_transport() -> AsyncTransport:
+    """Return the process-wide transport, creating it from env on first use."""
+    global _transport
+    if _transport is None:
+        _transport = AsyncTransport.from_env()
+    return _transport
+
+
+async def close_transport():
+    global _transport
+    if _transport is not None:
+        await _transport.aclose()
+        _transport = None
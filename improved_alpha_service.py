@@ -1,212 +1,316 @@
-# Archivo deshabilitado. Toda la lógica de Alpha Vantage ha sido eliminada. Ahora la API utiliza exclusivamente Perplexity para todos los datos.
-    def __init__(self, api_key=None):
+# Cliente de Alpha Vantage para cotizaciones y datos fundamentales.
+# La cache vive en SQLite (WAL) compartida por todos los workers: escrituras por clave,
+# lecturas bajo demanda, tamaño acotado con expulsión LRU y datos expirados como respaldo ante errores.
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import requests
+
+from http_transport import get_transport
+from rate_limiter import get_rate_limiter
+from result_cache import TieredCache
+
+logger = logging.getLogger("alpha-vantage")
+
+LEGACY_CACHE_FILE = "alpha_vantage_cache.json"
+# REALTIME_BULK_QUOTES accepts up to 100 symbols per call
+BULK_QUOTE_SIZE = 100
+
+
+class ImprovedAlphaVantageClient:
+    def __init__(self, api_key=None, cache: Optional[TieredCache] = None, transport=None, limiter=None):
         self.api_key = api_key or os.getenv("ALPHAVANTAGE_API_KEY")
-        self.cache = {}
+        self.base_url = os.getenv("ALPHAVANTAGE_BASE_URL", "https://www.alphavantage.co/query")
         self.cache_ttl = 60 * 60  # 1 hora para datos de precios
         self.cache_ttl_fundamentals = 24 * 60 * 60  # 24 horas para datos fundamentales
-        self.last_request_time = 0
-        self.min_request_interval = 12  # 12 segundos entre solicitudes (para plan gratuito)
-        
+        self.transport = transport
+        # REALTIME_BULK_QUOTES is premium-only; enable it with ALPHAVANTAGE_BULK_QUOTES=1
+        self.bulk_quotes = os.getenv("ALPHAVANTAGE_BULK_QUOTES", "0").lower() in ("1", "true", "yes")
+        # Quota shared by every worker (ALPHAVANTAGE_RATE_PER_MINUTE / _PER_DAY); limiter=False disables it
+        self.limiter = get_rate_limiter("alphavantage") if limiter is None else (limiter or None)
+
         # Verificar API key
         if not self.api_key:
             error_msg = "ERROR: ALPHAVANTAGE_API_KEY no configurada. Configurar en variables de entorno."
             logger.error(error_msg)
             raise ValueError(error_msg)
-        else:
-            logger.info("Alpha Vantage API key configurada correctamente.")
-            print("ALPHAVANTAGE_API_KEY configurada correctamente.")
-        
-        # Cargar cache si existe
-        self._load_cache()
-    
-    def _load_cache(self):
-        """Cargar cache desde archivo si existe"""
+        logger.info("Alpha Vantage API key configurada correctamente.")
+
+        self.cache = cache if cache is not None else TieredCache(
+            path=os.getenv("ALPHAVANTAGE_CACHE_PATH", os.path.join(".cache", "market_data.sqlite3")),
+            ttl=self.cache_ttl,
+            memory_size=int(os.getenv("ALPHAVANTAGE_CACHE_MEMORY_SIZE", 512)),
+            max_entries=int(os.getenv("ALPHAVANTAGE_CACHE_MAX_ENTRIES", 20000)),
+            # Expired quotes stay available as a fallback when the API fails
+            stale_ttl=float(os.getenv("ALPHAVANTAGE_CACHE_STALE_TTL", 7 * 24 * 60 * 60)),
+        )
+        self._migrate_legacy_cache()
+
+    def _migrate_legacy_cache(self, path: str = LEGACY_CACHE_FILE):
+        """Import the old whole-file JSON cache once, then set the file aside."""
+        if not os.path.exists(path):
+            return
         try:
-            cache_file = "alpha_vantage_cache.json"
-            if os.path.exists(cache_file):
-                with open(cache_file, 'r') as f:
-                    cache_data = json.load(f)
-                    
-                    # Convertir timestamps de string a datetime
-                    for ticker, data in cache_data.items():
-                        if "timestamp" in data:
-                            data["timestamp"] = datetime.fromisoformat(data["timestamp"])
-                    
-                    self.cache = cache_data
-                    logger.info(f"Cache cargada: {len(self.cache)} elementos")
+            with open(path, "r") as f:
+                legacy = json.load(f)
         except Exception as e:
-            logger.error(f"Error cargando cache: {str(e)}")
-    
-    def _save_cache(self):
-        """Guardar cache a archivo"""
+            logger.error(f"Error leyendo cache antigua {path}: {str(e)}")
+            return
+        if not legacy:
+            return
+        now = time.time()
+        for key, entry in legacy.items():
+            try:
+                kind, ticker = key.split("_", 1)
+                stored_at = datetime.fromisoformat(entry["timestamp"]).timestamp()
+            except (KeyError, TypeError, ValueError):
+                continue
+            ttl = self.cache_ttl if kind == "price" else self.cache_ttl_fundamentals
+            self.cache.set(self._cache_key(kind, ticker), entry.get("data"), ttl=stored_at + ttl - now)
         try:
-            # Convertir datetime a string para serializar
-            serializable_cache = {}
-            for ticker, data in self.cache.items():
-                serializable_cache[ticker] = data.copy()
-                if "timestamp" in serializable_cache[ticker]:
-                    serializable_cache[ticker]["timestamp"] = serializable_cache[ticker]["timestamp"].isoformat()
-            
-            with open("alpha_vantage_cache.json", 'w') as f:
-                json.dump(serializable_cache, f)
-            logger.info(f"Cache guardada: {len(self.cache)} elementos")
-        except Exception as e:
-            logger.error(f"Error guardando cache: {str(e)}")
-    
-    def _rate_limit(self):
-        """Implementar rate limiting para evitar exceder lu00edmites de API"""
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
-        
-        if time_since_last_request < self.min_request_interval:
-            sleep_time = self.min_request_interval - time_since_last_request
-            logger.info(f"Rate limiting: Sleeping for {sleep_time:.2f} seconds")
-            time.sleep(sleep_time)
-        
-        self.last_request_time = time.time()
-    
+            os.replace(path, path + ".migrated")
+        except FileNotFoundError:
+            # Another worker starting at the same time migrated it first (the entries are the same)
+            logger.info(f"Cache antigua {path} ya migrada por otro proceso")
+            return
+        except OSError as e:
+            logger.error(f"No se pudo apartar la cache antigua {path}: {str(e)}")
+            return
+        logger.info(f"Cache antigua migrada a SQLite: {len(legacy)} elementos")
+
+    @staticmethod
+    def _cache_key(kind: str, ticker: str) -> str:
+        return f"alpha:{kind}:{ticker.upper()}"
+
+    @staticmethod
+    def normalize_ticker(ticker) -> str:
+        return str(ticker or "").strip().upper()
+
+    def _params(self, function: str, ticker: str) -> dict:
+        logger.info(f"Making request to Alpha Vantage: function={function} symbol={ticker} apikey={self.api_key[:4]}...")
+        return {"function": function, "symbol": ticker, "apikey": self.api_key}
+
+    @staticmethod
+    def _check_limit(data: dict) -> dict:
+        # Alpha Vantage reports throttling as a 200 with a Note/Information message
+        message = data.get("Note") or data.get("Information")
+        if message and ("frequency" in message or "rate limit" in message.lower()):
+            raise RuntimeError(f"Alpha Vantage API limit reached: {message}")
+        return data
+
+    def _query(self, function: str, ticker: str) -> dict:
+        if self.limiter is not None:
+            self.limiter.acquire_sync()
+        response = requests.get(self.base_url, params=self._params(function, ticker), timeout=10)
+        return self._check_limit(response.json())
+
+    async def _query_async(self, function: str, ticker: str) -> dict:
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        transport = self.transport or get_transport()
+        response = await transport.get(self.base_url, params=self._params(function, ticker), timeout=10)
+        return self._check_limit(response.json())
+
+    @staticmethod
+    def _parse_quote(data: dict, ticker: str) -> dict:
+        quote = data.get("Global Quote") or {}
+        if not quote:
+            raise ValueError(f"No se encontraron datos para {ticker}")
+        price = float(quote.get("05. price", 0))
+        if price <= 0:
+            raise ValueError(f"Precio inválido ({price}) obtenido para {ticker}")
+        return {
+            "price": price,
+            "change_percent": quote.get("10. change percent", "0%"),
+            "source": "alpha_vantage",
+        }
+
+    @staticmethod
+    def _parse_overview(data: dict, ticker: str) -> dict:
+        if not data or "Symbol" not in data:
+            raise ValueError(f"No se encontraron datos fundamentales para {ticker}")
+        return data
+
+    def _stale(self, key: str, ticker: str, error: Exception):
+        stale = self.cache.get_stale(key)
+        if stale is None:
+            return None
+        data, age = stale
+        logger.warning(f"Error en API para {ticker} ({error}); usando cache expirada hace {age:.0f}s")
+        return data
+
+    def _price_failed(self, cache_key: str, ticker: str, error: Exception):
+        logger.error(f"Error obteniendo precio real para {ticker}: {str(error)}")
+        stale = self._stale(cache_key, ticker, error)
+        if stale is not None:
+            return stale
+        # No usar datos simulados, lanzar error
+        raise ValueError(f"No se pudo obtener el precio real para {ticker}. No se usarán datos simulados ni predefinidos.")
+
+    def _overview_failed(self, cache_key: str, ticker: str, error: Exception):
+        logger.error(f"Error obteniendo fundamentales para {ticker}: {str(error)}")
+        stale = self._stale(cache_key, ticker, error)
+        if stale is not None:
+            return stale
+        raise ValueError(f"No se pudieron obtener los datos fundamentales de {ticker}.")
+
     def get_real_time_price(self, ticker):
         """Obtener precio en tiempo real con manejo mejorado de cache y errores"""
-        cache_key = f"price_{ticker}"
-        
-        # Verificar cache
-        if cache_key in self.cache:
-            cache_data = self.cache[cache_key]
-            cache_age = (datetime.now() - cache_data["timestamp"]).total_seconds()
-            
-            if cache_age < self.cache_ttl:
-                logger.info(f"Usando precio en cachu00e9 para {ticker} (edad: {cache_age:.0f}s)")
-                return cache_data["data"]
-            else:
-                logger.info(f"Cache expirada para price_{ticker}")
-        
-        # Si no hay API key, usar datos simulados
-        if not self.api_key:
-            simulated_price = self._get_simulated_price(ticker)
-            logger.warning(f"Using simulated price for {ticker}: ${simulated_price}")
-            
-            result = {
-                "price": simulated_price,
-                "change_percent": "0.00%",
-                "source": "simulated"
-            }
-            
-            # Guardar en cache
-            self.cache[cache_key] = {"data": result, "timestamp": datetime.now()}
-            self._save_cache()
-            
-            return result
-        
-        # Si hay API key, intentar obtener datos reales
+        cache_key = self._cache_key("price", ticker)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Usando precio en caché para {ticker}")
+            return cached
         try:
-            # Aplicar rate limiting
-            self._rate_limit()
-            
-            # Hacer solicitud a Alpha Vantage
-            url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={ticker}&apikey={self.api_key}"
-            logger.info(f"Making request to Alpha Vantage: {'function': 'GLOBAL_QUOTE', 'symbol': '{ticker}', 'apikey': '{self.api_key[:4]}...'}")
-            
-            response = requests.get(url, timeout=10)
-            data = response.json()
-            
-            # Verificar si hay mensaje de error por lu00edmite de API
-            if "Note" in data and "API call frequency" in data["Note"]:
-                logger.warning(f"Alpha Vantage API limit reached: {data['Note']}")
-                
-                # Si hay datos en cache (aunque expirados), usarlos
-                if cache_key in self.cache:
-                    logger.info(f"Usando datos expirados de cache para {ticker} debido a lu00edmite de API")
-                    return self.cache[cache_key]["data"]
-                
-                # Si no hay cache, usar datos simulados
-                simulated_price = self._get_simulated_price(ticker)
-                logger.warning(f"Using simulated price for {ticker}: ${simulated_price} (API limit reached)")
-                
-                result = {
-                    "price": simulated_price,
-                    "change_percent": "0.00%",
-                    "source": "simulated"
-                }
-                
-                return result
-            
-            # Procesar datos reales
-            if "Global Quote" in data and data["Global Quote"]:
-                quote = data["Global Quote"]
-                price = float(quote.get("05. price", 0))
-                
-                if price <= 0:
-                    raise ValueError(f"Precio invu00e1lido ({price}) obtenido para {ticker}")
-                
-                change_percent = quote.get("10. change percent", "0%")
-                
-                result = {
+            result = self._parse_quote(self._query("GLOBAL_QUOTE", ticker), ticker)
+        except Exception as e:
+            return self._price_failed(cache_key, ticker, e)
+        self.cache.set(cache_key, result, ttl=self.cache_ttl)
+        return result
+
+    async def get_real_time_price_async(self, ticker):
+        """Non-blocking variant of get_real_time_price; waits for the shared quota on the event loop."""
+        cache_key = self._cache_key("price", ticker)
+        cached = await self.cache.get_async(cache_key)
+        if cached is not None:
+            return cached
+        return await self._fetch_price_async(ticker)
+
+    async def _fetch_price_async(self, ticker):
+        cache_key = self._cache_key("price", ticker)
+        try:
+            result = self._parse_quote(await self._query_async("GLOBAL_QUOTE", ticker), ticker)
+        except Exception as e:
+            return await asyncio.to_thread(self._price_failed, cache_key, ticker, e)
+        await self.cache.set_async(cache_key, result, ttl=self.cache_ttl)
+        return result
+
+    async def _bulk_quotes_async(self, tickers: List[str]) -> Dict[str, dict]:
+        """Quote up to BULK_QUOTE_SIZE tickers with one REALTIME_BULK_QUOTES call."""
+        data = await self._query_async("REALTIME_BULK_QUOTES", ",".join(tickers))
+        rows = data.get("data")
+        if not isinstance(rows, list):
+            raise ValueError(data.get("Information") or data.get("message") or "Respuesta de cotización masiva inválida")
+        quotes = {}
+        for row in rows:
+            symbol = self.normalize_ticker(row.get("symbol"))
+            try:
+                price = float(row.get("close") or 0)
+            except (TypeError, ValueError):
+                continue
+            if symbol in tickers and price > 0:
+                quotes[symbol] = {
                     "price": price,
-                    "change_percent": change_percent,
-                    "source": "alpha_vantage"
-                }
-                
-                # Guardar en cache
-                self.cache[cache_key] = {"data": result, "timestamp": datetime.now()}
-                self._save_cache()
-                
-                return result
-            else:
-                # Si no hay datos, intentar usar cache expirada
-                if cache_key in self.cache:
-                    logger.warning(f"No se encontraron datos para {ticker}, usando cache expirada")
-                    return self.cache[cache_key]["data"]
-                
-                # Si no hay cache, usar datos simulados
-                simulated_price = self._get_simulated_price(ticker)
-                logger.warning(f"Using simulated price for {ticker}: ${simulated_price} (no data found)")
-                
-                result = {
-                    "price": simulated_price,
-                    "change_percent": "0.00%",
-                    "source": "simulated"
+                    "change_percent": f"{row.get('change_percent', '0')}%",
+                    "source": "alpha_vantage",
                 }
-                
-                return result
-                
+        return quotes
+
+    async def get_quotes_async(self, tickers: Iterable[str], timeout: Optional[float] = None) -> Dict[str, dict]:
+        """Quote many tickers in one round.
+
+        Tickers are deduplicated and fresh cache entries served first (one
+        SQLite query for the whole batch). Misses are fetched concurrently
+        under the shared rate limiter, in bulk calls when enabled, falling
+        back to one GLOBAL_QUOTE per ticker. Tickers that fail (and have no
+        stale entry) or are still pending after `timeout` seconds are left
+        out of the result.
+        """
+        symbols = [t for t in dict.fromkeys(self.normalize_ticker(t) for t in tickers) if t]
+        cached = await self.cache.get_many_async(self._cache_key("price", t) for t in symbols)
+        quotes = {t: cached[self._cache_key("price", t)] for t in symbols if self._cache_key("price", t) in cached}
+        missing = [t for t in symbols if t not in quotes]
+        if not missing:
+            return quotes
+
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - loop.time())
+
+        if self.bulk_quotes:
+            for i in range(0, len(missing), BULK_QUOTE_SIZE):
+                try:
+                    fetched = await asyncio.wait_for(self._bulk_quotes_async(missing[i:i + BULK_QUOTE_SIZE]), remaining())
+                except Exception as e:
+                    logger.warning(f"Cotización masiva fallida, se consulta ticker a ticker: {str(e)}")
+                    break
+                for ticker, quote in fetched.items():
+                    await self.cache.set_async(self._cache_key("price", ticker), quote, ttl=self.cache_ttl)
+                quotes.update(fetched)
+            missing = [t for t in missing if t not in quotes]
+
+        tasks = {asyncio.ensure_future(self._fetch_price_async(t)): t for t in missing}
+        if not tasks:
+            return quotes
+        done, pending = await asyncio.wait(tasks, timeout=remaining())
+        for task in pending:
+            task.cancel()
+        for task in done:
+            if task.exception() is None:
+                quotes[tasks[task]] = task.result()
+        if pending:
+            logger.warning(f"Cotizaciones sin respuesta a tiempo: {', '.join(sorted(tasks[t] for t in pending))}")
+        return quotes
+
+    def get_company_overview(self, ticker):
+        """Datos fundamentales (OVERVIEW) con cache de 24 horas"""
+        cache_key = self._cache_key("overview", ticker)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            data = self._parse_overview(self._query("OVERVIEW", ticker), ticker)
+        except Exception as e:
+            return self._overview_failed(cache_key, ticker, e)
+        self.cache.set(cache_key, data, ttl=self.cache_ttl_fundamentals)
+        return data
+
+    async def get_company_overview_async(self, ticker):
+        cache_key = self._cache_key("overview", ticker)
+        cached = await self.cache.get_async(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            data = self._parse_overview(await self._query_async("OVERVIEW", ticker), ticker)
         except Exception as e:
-            logger.error(f"Error obteniendo precio real para {ticker}: {str(e)}")
-            
-            # Si hay error, intentar usar cache expirada
-            if cache_key in self.cache:
-                logger.warning(f"Error en API, usando cache expirada para {ticker}")
-                return self.cache[cache_key]["data"]
-            
-            # No usar datos simulados, lanzar error
-            logger.error(f"No se pudo obtener el precio real para {ticker} desde Alpha Vantage")
-            raise ValueError(f"No se pudo obtener el precio real para {ticker}. No se usarán datos simulados ni predefinidos.")
+            return await asyncio.to_thread(self._overview_failed, cache_key, ticker, e)
+        await self.cache.set_async(cache_key, data, ttl=self.cache_ttl_fundamentals)
+        return data
+
 
 # Función para inicializar y probar el cliente
 def test_client():
     client = ImprovedAlphaVantageClient()
-    
+
     print("\n=== Probando cliente de Alpha Vantage mejorado ===")
-    
-    # Probar obtenciu00f3n de precio
+
+    # Probar obtención de precio
     try:
         price_data = client.get_real_time_price("AAPL")
         print(f"Precio de AAPL: ${price_data['price']} (fuente: {price_data['source']})")
-        
+
         # Probar cache
-        print("\nProbando cache (segunda solicitud deberu00eda ser instantu00e1nea):")
+        print("\nProbando cache (segunda solicitud debería ser instantánea):")
         start_time = time.time()
         client.get_real_time_price("AAPL")
         elapsed = time.time() - start_time
         print(f"Tiempo de respuesta: {elapsed:.4f} segundos")
-        
-        # Mostrar estado de cache
-        print(f"\nElementos en cache: {len(client.cache)}")
-        for key, data in client.cache.items():
-            age = (datetime.now() - data["timestamp"]).total_seconds()
-            print(f"- {key}: {age:.0f} segundos de antigu00fcedad")
-        
+
+        # Mostrar estado de cache y de la cuota
+        print(f"\nEstado de la cache: {client.cache.stats()}")
+        if client.limiter is not None:
+            print(f"Cuota de API: {client.limiter.stats()}")
+
     except Exception as e:
         print(f"Error en prueba: {str(e)}")
 
+
 if __name__ == "__main__":
     test_client()
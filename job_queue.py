@@ -0,0 +1,394 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger("job-queue")
+
+STATUSES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINISHED = ("succeeded", "failed", "cancelled")
+
+_COLUMNS = (
+    "id, kind, status, priority, created_at, started_at, finished_at,"
+    " result, error, error_status, attempts, cancel_requested, version"
+)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Persistent job queue for slow upstream work (LLM calls).
+
+    Jobs live in a SQLite table shared by every worker process: any process
+    can accept a job, any process's workers can run it, and any process can
+    report its state. Each process runs `workers` asyncio tasks that claim
+    the highest-priority queued job (oldest first) under BEGIN IMMEDIATE.
+
+    Every state change bumps the job's version, which callers use as an
+    ETag and to long-poll for changes. Running jobs send heartbeats; jobs
+    whose process died are re-queued after `stale_after` seconds, and
+    finished jobs are deleted after `retention` seconds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        workers: int = 2,
+        retention: float = 24 * 3600,
+        job_timeout: float = 300.0,
+        max_queued: int = 1000,
+        max_attempts: int = 2,
+        poll_interval: float = 0.5,
+        stale_after: float = 120.0,
+    ):
+        self.path = path
+        self.workers = workers
+        self.retention = retention
+        self.job_timeout = job_timeout
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, Callable[[dict], Awaitable[Any]]] = {}
+        self._local = threading.local()
+        self._tasks = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._waiters: Dict[str, asyncio.Event] = {}
+        self._closing = False
+        self.counters = {"submitted": 0, "succeeded": 0, "failed": 0, "cancelled": 0, "requeued": 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, priority INTEGER NOT NULL,"
+            " payload TEXT NOT NULL, result TEXT, error TEXT, error_status INTEGER,"
+            " created_at REAL NOT NULL, started_at REAL, finished_at REAL, heartbeat_at REAL,"
+            " owner TEXT, attempts INTEGER NOT NULL DEFAULT 0, cancel_requested INTEGER NOT NULL DEFAULT 0,"
+            " version INTEGER NOT NULL DEFAULT 1)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(status, priority DESC, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at)")
+
+    @classmethod
+    def from_env(cls) -> "JobQueue":
+        return cls(
+            path=os.getenv("JOB_DB_PATH", os.path.join(".cache", "jobs.sqlite3")),
+            workers=int(os.getenv("JOB_WORKERS", 2)),
+            retention=float(os.getenv("JOB_RETENTION", 24 * 3600)),
+            job_timeout=float(os.getenv("JOB_TIMEOUT", 300)),
+            max_queued=int(os.getenv("JOB_MAX_QUEUED", 1000)),
+        )
+
+    def register(self, kind: str, handler: Callable[[dict], Awaitable[Any]]):
+        self._handlers[kind] = handler
+
+    @property
+    def kinds(self):
+        return tuple(self._handlers)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- storage (blocking; called through asyncio.to_thread) ---
+    @staticmethod
+    def _row(row) -> dict:
+        (job_id, kind, status, priority, created_at, started_at, finished_at,
+         result, error, error_status, attempts, cancel_requested, version) = row
+        return {
+            "id": job_id,
+            "kind": kind,
+            "status": status,
+            "priority": priority,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "error_status": error_status,
+            "attempts": attempts,
+            "cancel_requested": bool(cancel_requested),
+            "version": version,
+        }
+
+    def submit(self, kind: str, payload: dict, priority: int = 0) -> dict:
+        if kind not in self._handlers:
+            raise ValueError(f"Tipo de trabajo desconocido: {kind}. Usa uno de {', '.join(self._handlers)}")
+        job_id = uuid.uuid4().hex
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            (queued,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+            if queued >= self.max_queued:
+                raise QueueFull(f"Cola de trabajos llena ({queued} en espera)")
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, priority, payload, created_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, int(priority), json.dumps(payload, default=str), time.time()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.counters["submitted"] += 1
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """Cancel a queued job at once; ask the process running a job to stop it."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, error = 'Cancelado', version = version + 1"
+                " WHERE id = ? AND status = 'queued'",
+                (now, job_id),
+            )
+            conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, version = version + 1"
+                " WHERE id = ? AND status = 'running' AND cancel_requested = 0",
+                (job_id,),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(job_id)
+
+    def _claim(self) -> Optional[tuple]:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, kind, payload FROM jobs WHERE status = 'queued' ORDER BY priority DESC, created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, started_at = ?, heartbeat_at = ?,"
+                    " attempts = attempts + 1, version = version + 1 WHERE id = ?",
+                    (self.owner, now, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _finish(self, job_id: str, status: str, result=None, error: Optional[str] = None, error_status: Optional[int] = None):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, error_status = ?, finished_at = ?,"
+            " version = version + 1 WHERE id = ? AND owner = ? AND status = 'running'",
+            (status, None if result is None else json.dumps(result, default=str), error, error_status,
+             time.time(), job_id, self.owner),
+        )
+
+    def _requeue(self, job_ids):
+        self._conn().executemany(
+            "UPDATE jobs SET status = 'queued', owner = NULL, version = version + 1"
+            " WHERE id = ? AND owner = ? AND status = 'running'",
+            [(job_id, self.owner) for job_id in job_ids],
+        )
+
+    def _heartbeat(self, job_ids) -> list:
+        """Refresh heartbeats of our running jobs; return those with a cancellation request."""
+        if not job_ids:
+            return []
+        conn = self._conn()
+        marks = ",".join("?" * len(job_ids))
+        conn.execute(f"UPDATE jobs SET heartbeat_at = ? WHERE id IN ({marks})", (time.time(), *job_ids))
+        rows = conn.execute(f"SELECT id FROM jobs WHERE id IN ({marks}) AND cancel_requested = 1", tuple(job_ids))
+        return [row[0] for row in rows]
+
+    def _maintain(self):
+        """Re-queue (or fail) jobs orphaned by a dead process and purge expired results."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            stale = now - self.stale_after
+            failed = conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'El proceso que ejecutaba el trabajo terminó',"
+                " finished_at = ?, version = version + 1"
+                " WHERE status = 'running' AND heartbeat_at < ? AND (attempts >= ? OR cancel_requested = 1)",
+                (now, stale, self.max_attempts),
+            ).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, version = version + 1"
+                " WHERE status = 'running' AND heartbeat_at < ?",
+                (stale,),
+            ).rowcount
+            purged = conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (now - self.retention,)
+            ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if failed or requeued:
+            logger.warning("Trabajos huérfanos: %s reencolados, %s fallidos", requeued, failed)
+            self.counters["requeued"] += requeued
+        if purged:
+            logger.info("Trabajos expirados eliminados: %s", purged)
+
+    def _counts(self) -> dict:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(dict(rows))
+        return counts
+
+    # --- async side ---
+    def _notify(self, job_id: str):
+        event = self._waiters.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def submit_async(self, kind: str, payload: dict, priority: int = 0) -> dict:
+        job = await asyncio.to_thread(self.submit, kind, payload, priority)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get_async(self, job_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.get, job_id)
+
+    async def cancel_async(self, job_id: str) -> Optional[dict]:
+        job = await asyncio.to_thread(self.cancel, job_id)
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        if job is not None:
+            self._notify(job_id)
+        return job
+
+    async def wait(self, job_id: str, version: Optional[int], timeout: float) -> Optional[dict]:
+        """Return the job once its version differs from `version` or it finished, or after `timeout`."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            job = await self.get_async(job_id)
+            remaining = deadline - loop.time()
+            if job is None or job["version"] != version or job["status"] in FINISHED or remaining <= 0:
+                return job
+            # Woken at once by changes made in this process; other processes are polled
+            event = self._waiters.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), min(self.poll_interval, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, job_id: str, kind: str, payload: str):
+        handler = self._handlers.get(kind)
+        task = asyncio.ensure_future(handler(json.loads(payload))) if handler else None
+        if task is None:
+            await asyncio.to_thread(self._finish, job_id, "failed", error=f"Tipo de trabajo desconocido: {kind}")
+            return
+        self._running[job_id] = task
+        status, result, error, error_status = "succeeded", None, None, None
+        try:
+            result = await asyncio.wait_for(task, self.job_timeout)
+        except asyncio.CancelledError:
+            if self._closing:
+                # Shutting down: leave the job for another process
+                await asyncio.to_thread(self._requeue, [job_id])
+                raise
+            status, error = "cancelled", "Cancelado"
+        except asyncio.TimeoutError:
+            status, error = "failed", f"timeout tras {self.job_timeout:.0f}s"
+        except Exception as e:
+            status, error = "failed", str(e) or e.__class__.__name__
+            error_status = getattr(e, "status_code", None)
+            logger.error("Trabajo %s (%s) fallido: %s", job_id[:12], kind, error)
+        finally:
+            self._running.pop(job_id, None)
+        self.counters[status] += 1
+        await asyncio.to_thread(self._finish, job_id, status, result, error, error_status)
+        self._notify(job_id)
+
+    async def _worker(self):
+        while not self._closing:
+            self._wakeup.clear()
+            try:
+                claimed = await asyncio.to_thread(self._claim)
+            except sqlite3.Error as e:
+                logger.error("Error reclamando trabajo: %s", e)
+                claimed = None
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._notify(claimed[0])
+            await self._run(*claimed)
+
+    async def _monitor(self):
+        last_maintenance = 0.0
+        while not self._closing:
+            await asyncio.sleep(max(1.0, self.poll_interval * 2))
+            try:
+                for job_id in await asyncio.to_thread(self._heartbeat, list(self._running)):
+                    task = self._running.get(job_id)
+                    if task is not None:
+                        logger.info("Cancelando trabajo %s a petición", job_id[:12])
+                        task.cancel()
+                if time.monotonic() - last_maintenance > 60:
+                    last_maintenance = time.monotonic()
+                    await asyncio.to_thread(self._maintain)
+            except sqlite3.Error as e:
+                logger.error("Error en el mantenimiento de la cola: %s", e)
+
+    def start(self):
+        """Start this process's workers on the running event loop."""
+        if self._tasks:
+            return
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._monitor()))
+        logger.info("Cola de trabajos iniciada con %s workers (%s)", self.workers, self.owner)
+
+    async def stop(self):
+        self._closing = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running_here": len(self._running),
+            **{f"total_{k}": v for k, v in self.counters.items()},
+            **self._counts(),
+        }
+
+
+_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        _queue = JobQueue.from_env()
+    return _queue
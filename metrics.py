@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: snapshots of exited workers are kept instead of folded
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger("metrics")
+
+# Seconds; tuned for HTTP handlers (ms) up to LLM calls (tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Registry:
+    """Counters, gauges and histograms aggregated across worker processes.
+
+    Updates touch an in-process dict under a lock. A daemon thread writes a
+    snapshot of the process's values to <directory>/<pid>.json every
+    `flush_interval` seconds (atomic rename), and render() sums the
+    snapshots of every process. The counters and histograms of workers that
+    exited are folded into retired.json (their snapshots are removed), so
+    totals never go backwards while the directory holds one file per live
+    worker; their gauges are dropped. Snapshots left by an earlier server
+    (different parent process, dead pid) are removed.
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {}
+        self._values: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._dirty = True
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+
+    # --- definitions ---
+    def counter(self, name: str, help_text: str):
+        self._meta[name] = ("counter", help_text, ())
+
+    def gauge(self, name: str, help_text: str):
+        self._meta[name] = ("gauge", help_text, ())
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self._meta[name] = ("histogram", help_text, tuple(sorted(buckets)))
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """Add a callback returning (name, labels, value) samples read at flush time,
+        e.g. totals a component already counts. Counter samples must be per-process totals.
+        """
+        self._collectors.append(collector)
+
+    # --- updates ---
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+            self._dirty = True
+        self._ensure_flusher()
+
+    def add(self, name: str, delta: float, **labels):
+        """Move a gauge up or down."""
+        self.inc(name, delta, **labels)
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = self._meta[name][2]
+        key = (name, _labels(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                hist = self._histograms[key] = [0.0] * (len(buckets) + 3)
+            hist[bisect_left(buckets, value)] += 1
+            hist[-2] += value
+            hist[-1] += 1
+            self._dirty = True
+        self._ensure_flusher()
+
+    # --- multi-process snapshots ---
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def _retired_path(self) -> str:
+        return os.path.join(self.directory, "retired.json")
+
+    def _snapshot(self) -> dict:
+        with self._lock:
+            values = [[name, list(labels), value] for (name, labels), value in self._values.items()]
+            histograms = [[name, list(labels), list(hist)] for (name, labels), hist in self._histograms.items()]
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    values.append([name, list(_labels(labels)), float(value)])
+            except Exception as e:
+                logger.warning("Error en un colector de métricas: %s", e)
+        return {"pid": os.getpid(), "ppid": os.getppid(), "values": values, "histograms": histograms}
+
+    def flush(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(os.getpid())
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._snapshot(), f)
+        os.replace(tmp, path)
+        self._dirty = False
+
+    def _ensure_flusher(self):
+        # One flusher thread per process (re-created after fork)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                if self._dirty or self._collectors:
+                    self.flush()
+            except OSError as e:
+                logger.warning("No se pudieron escribir las métricas: %s", e)
+
+    @contextmanager
+    def _dir_lock(self):
+        # Serializes aggregation, so two workers rendering at once never fold the same snapshot twice
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def _read(self) -> List[Tuple[str, dict]]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        snapshots = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    snapshots.append((path, json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def _load(self) -> List[dict]:
+        snapshots, dead, retired = [], [], None
+        ppid = os.getppid()
+        for path, snapshot in self._read():
+            pid = snapshot.get("pid")
+            alive = pid is not None and _pid_alive(int(pid))
+            if not alive and snapshot.get("ppid") != ppid:
+                # Left behind by a previous server run
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            snapshot["alive"] = alive
+            if path == self._retired_path():
+                retired = snapshot
+            elif not alive and fcntl is not None:
+                dead.append((path, snapshot))
+            else:
+                snapshots.append(snapshot)
+        if dead:
+            retired = self._retire(([retired] if retired else []) + [snapshot for _, snapshot in dead], ppid)
+            for path, _ in dead:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        if retired is not None:
+            snapshots.append(retired)
+        return snapshots
+
+    def _retire(self, snapshots: List[dict], ppid: int) -> dict:
+        """Write the summed counters and histograms of exited workers to retired.json."""
+        values, histograms = self._sum(snapshots)
+        retired = {
+            "pid": None,
+            "ppid": ppid,
+            "values": [[name, [list(pair) for pair in labels], value] for (name, labels), value in values.items()],
+            "histograms": [[name, [list(pair) for pair in labels], hist] for (name, labels), hist in histograms.items()],
+        }
+        path = self._retired_path()
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(retired, f)
+        os.replace(f"{path}.tmp", path)
+        retired["alive"] = False
+        return retired
+
+    def _sum(self, snapshots: List[dict]):
+        values: Dict[Tuple[str, Labels], float] = {}
+        histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot["values"]:
+                kind = self._meta.get(name, ("gauge",))[0]
+                if kind == "gauge" and not snapshot["alive"]:
+                    continue
+                key = (name, tuple(tuple(pair) for pair in labels))
+                values[key] = values.get(key, 0.0) + value
+            for name, labels, hist in snapshot["histograms"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                total = histograms.get(key)
+                if total is None or len(total) != len(hist):
+                    histograms[key] = list(hist)
+                else:
+                    histograms[key] = [a + b for a, b in zip(total, hist)]
+        return values, histograms
+
+    def render(self) -> str:
+        """Prometheus text exposition (0.0.4) of the values summed over all processes."""
+        self.flush()
+        with self._dir_lock():
+            values, histograms = self._sum(self._load())
+
+        lines = []
+        for name, (kind, help_text, buckets) in sorted(self._meta.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for (hname, labels), hist in sorted(histograms.items()):
+                    if hname != name:
+                        continue
+                    cumulative = 0.0
+                    for bound, count in zip(buckets, hist):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', repr(float(bound))))} {cumulative:g}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {hist[-1]:g}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {hist[-2]:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {hist[-1]:g}")
+            else:
+                for (vname, labels), value in sorted(values.items()):
+                    if vname == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(
+    os.getenv("METRICS_DIR", os.path.join(".cache", "metrics")),
+    flush_interval=float(os.getenv("METRICS_FLUSH_INTERVAL", 1.0)),
+)
+
+registry.counter("http_requests_total", "HTTP requests by route template, method and status")
+registry.histogram("http_request_duration_seconds", "HTTP request latency by route template and method")
+registry.gauge("http_requests_in_flight", "HTTP requests being served")
+registry.counter("upstream_requests_total", "Calls to upstream APIs by host and status (or error)")
+registry.histogram("upstream_request_duration_seconds", "Upstream API latency by host")
+registry.counter("perplexity_parse_failures_total", "Perplexity answers (or streamed objects) that could not be parsed")
+registry.counter("cache_lookups_total", "Cache lookups by cache and result (hit, miss, stale)")
+registry.counter("singleflight_calls_total", "Upstream calls by provider and outcome (executed, coalesced)")
+registry.histogram("rate_limit_wait_seconds", "Time spent queued for an upstream rate-limit token",
+                   (0.0, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 12.0, 30.0, 60.0))
+registry.gauge("rate_limit_queue_depth", "Callers waiting for an upstream rate-limit token")
+registry.counter("rate_limit_rejections_total", "Calls rejected because the wait exceeded their limit")
+registry.counter("upstream_replay_total", "Recorded, replayed and missed upstream calls in record/replay mode")
+
+inc = registry.inc
+add = registry.add
+observe = registry.observe
+register_collector = registry.register_collector
+render = registry.render
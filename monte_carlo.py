@@ -0,0 +1,266 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger("monte-carlo")
+
+PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+# Resolution of the per-step log-value histograms used to aggregate percentiles
+_BINS = 2048
+# Upper bound on normal draws held in memory per chunk (float64, ~32 MB)
+_CHUNK_ELEMENTS = 1 << 22
+# Memory one simulation may hold per process: the per-step histograms plus one chunk of paths
+_MEMORY_BUDGET = int(os.getenv("MONTE_CARLO_MEMORY_MB", 256)) << 20
+# The running total and one chunk's counts: int64 per bin and step
+_HISTOGRAM_BYTES_PER_STEP = 2 * (_BINS + 2) * 8
+# Histograms get at most half the budget; the other half is for the paths
+MAX_STEPS = _MEMORY_BUDGET // (2 * _HISTOGRAM_BYTES_PER_STEP)
+# Below this many paths the process pool costs more than it saves
+_POOL_MIN_PATHS = 20000
+
+
+@dataclass
+class MonteCarloResult:
+    times: np.ndarray
+    percentiles: dict
+    probability_of_loss: float
+    mean_terminal: float
+    histogram_edges: np.ndarray
+    histogram_counts: np.ndarray
+    n_paths: int
+    chunks: int
+    workers: int
+    elapsed_ms: float
+
+    def to_dict(self) -> dict:
+        return {
+            "times": np.round(self.times, 4).tolist(),
+            "percentiles": {str(q): np.round(v, 2).tolist() for q, v in self.percentiles.items()},
+            "probability_of_loss": round(self.probability_of_loss, 6),
+            "mean_terminal": round(self.mean_terminal, 2),
+            "terminal_histogram": {
+                "edges": np.round(self.histogram_edges, 2).tolist(),
+                "counts": self.histogram_counts.tolist(),
+            },
+            "paths": self.n_paths,
+            "chunks": self.chunks,
+            "workers": self.workers,
+            "elapsed_ms": self.elapsed_ms,
+        }
+
+
+def _cholesky(cov: np.ndarray) -> np.ndarray:
+    """Cholesky factor, adding a growing ridge if the matrix is only semi-definite."""
+    jitter = 0.0
+    scale = max(float(np.trace(cov)) / cov.shape[0], 1e-12)
+    for _ in range(8):
+        try:
+            return np.linalg.cholesky(cov + np.eye(cov.shape[0]) * jitter)
+        except np.linalg.LinAlgError:
+            jitter = scale * (1e-10 if jitter == 0.0 else jitter / scale * 100)
+    raise ValueError("La covarianza no es semidefinida positiva")
+
+
+def _simulate_chunk(seed, n_paths, steps, drift, chol, weights, rebalance, lo, width, amount):
+    """Simulate one chunk of paths and reduce it to per-step histogram counts.
+
+    Returns (counts[steps, _BINS + 2], losses, terminal_sum). Column 0 and the
+    last column count values below/above the histogram range.
+    """
+    rng = np.random.default_rng(seed)
+    n_assets = drift.size
+    # One 2-D GEMM over all (path, step) rows; a stacked 3-D matmul is far slower
+    log_ret = (rng.standard_normal((n_paths * steps, n_assets)) @ chol.T).reshape(n_paths, steps, n_assets)
+    log_ret += drift
+    if rebalance:
+        # Constant mix: the portfolio earns the weighted simple return every step
+        growth = np.exp(log_ret, out=log_ret) @ weights
+        log_value = np.cumsum(np.log(growth), axis=1)
+    else:
+        np.cumsum(log_ret, axis=1, out=log_ret)
+        log_value = np.log(np.exp(log_ret, out=log_ret) @ weights)
+    del log_ret
+
+    bins = np.floor((log_value - lo) / width).astype(np.int64) + 1
+    np.clip(bins, 0, _BINS + 1, out=bins)
+    flat = bins + (np.arange(steps, dtype=np.int64) * (_BINS + 2))[None, :]
+    counts = np.bincount(flat.ravel(), minlength=steps * (_BINS + 2)).reshape(steps, _BINS + 2)
+    terminal = amount * np.exp(log_value[:, -1])
+    return counts, int((terminal < amount).sum()), float(terminal.sum())
+
+
+def _histogram_percentiles(counts: np.ndarray, total: int, quantiles: Sequence[float], lo: float, width: float) -> np.ndarray:
+    """Percentiles per row of a histogram (log-value space), interpolating inside the bin."""
+    cdf = np.cumsum(counts, axis=1)
+    out = np.empty((len(quantiles), counts.shape[0]))
+    rows = np.arange(counts.shape[0])
+    for k, q in enumerate(quantiles):
+        target = q / 100.0 * total
+        idx = np.argmax(cdf >= target, axis=1)
+        below = np.where(idx > 0, cdf[rows, np.maximum(idx - 1, 0)], 0)
+        inside = counts[rows, idx]
+        frac = np.where(inside > 0, (target - below) / np.maximum(inside, 1), 0.0)
+        # Bin j (1.._BINS) covers [lo + (j-1)*width, lo + j*width); overflow bins sit on the edges
+        pos = np.clip(idx - 1 + frac, 0.0, float(_BINS))
+        out[k] = lo + pos * width
+    return out
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """The shared pool, (re)created for `workers` processes. Call with _pool_lock held."""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        # spawn: forking the threaded server process can deadlock the children
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _pool_workers = workers
+        logger.info("Pool de Monte Carlo creado con %s procesos", workers)
+    return _pool
+
+
+def _map_chunks(workers: int, args):
+    # map() submits every chunk before returning, so a concurrent resize or
+    # shutdown cannot leave this run holding a pool that no longer accepts work
+    with _pool_lock:
+        return _get_pool(workers).map(_simulate_chunk, *zip(*args))
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def default_workers() -> int:
+    try:
+        return max(1, int(os.getenv("MONTE_CARLO_WORKERS", os.cpu_count() or 1)))
+    except ValueError:
+        return 1
+
+
+def simulate(
+    weights: Sequence[float],
+    mu: Sequence[float],
+    cov,
+    amount: float = 10000.0,
+    years: float = 10.0,
+    steps_per_year: int = 12,
+    n_paths: int = 10000,
+    seed: Optional[int] = None,
+    rebalance: bool = True,
+    percentiles: Sequence[float] = PERCENTILES,
+    histogram_bins: int = 40,
+    workers: Optional[int] = None,
+) -> MonteCarloResult:
+    """Project `amount` invested with `weights` over `years` with correlated log-normal returns.
+
+    mu and cov are annualized (arithmetic) estimates. Paths are simulated in
+    chunks, each with its own child of SeedSequence(seed), and every chunk is
+    reduced to per-step histograms before the next one runs, so memory does
+    not grow with n_paths and the result for a seed does not depend on the
+    number of workers. Large runs are spread over a process pool. Chunks are
+    sized so one run stays within MONTE_CARLO_MEMORY_MB per process; steps
+    (years * steps_per_year) are capped at MAX_STEPS for the same reason.
+    """
+    weights = np.asarray(weights, dtype=float)
+    mu = np.asarray(mu, dtype=float)
+    cov = np.asarray(cov, dtype=float)
+    n_assets = weights.size
+    if mu.shape != (n_assets,) or cov.shape != (n_assets, n_assets):
+        raise ValueError(f"mu y la covarianza deben tener {n_assets} activos")
+    if years <= 0 or steps_per_year <= 0 or n_paths <= 0:
+        raise ValueError("years, steps_per_year y paths deben ser positivos")
+    try:
+        quantiles = [float(q) for q in percentiles]
+    except (TypeError, ValueError):
+        raise ValueError("Los percentiles deben ser números entre 0 y 100")
+    if not 1 <= len(quantiles) <= 101 or not all(0.0 <= q <= 100.0 for q in quantiles):
+        raise ValueError("Indica entre 1 y 101 percentiles, cada uno entre 0 y 100")
+    # Whole percentiles keep integer keys in the response ("5", not "5.0")
+    quantiles = [int(q) if q.is_integer() else q for q in quantiles]
+    steps = max(1, int(round(years * steps_per_year)))
+    if steps > MAX_STEPS:
+        raise ValueError(f"Máximo {MAX_STEPS} pasos por simulación (years * steps_per_year = {steps})")
+    # Normal draws, the log-values and two int64 bin indices per path and step
+    path_bytes = steps * 8 * (n_assets + 3)
+    max_chunk = (_MEMORY_BUDGET - steps * _HISTOGRAM_BYTES_PER_STEP) // path_bytes
+    if max_chunk < 1:
+        raise ValueError(f"Demasiados activos ({n_assets}) y pasos ({steps}) para MONTE_CARLO_MEMORY_MB")
+    weights = weights / weights.sum()
+    dt = years / steps
+    cov = 0.5 * (cov + cov.T)
+    drift = (mu - 0.5 * np.diag(cov)) * dt
+    chol = _cholesky(cov * dt)
+
+    # Histogram range: the portfolio log-value at the horizon +-8 sd of a normal
+    # approximation, widened so every intermediate step fits as well
+    port_mu = float(weights @ drift) * steps
+    port_sd = float(np.sqrt(max(weights @ cov @ weights * years, 1e-12)))
+    lo = min(port_mu, 0.0) - 8.0 * port_sd
+    hi = max(port_mu, 0.0) + 8.0 * port_sd
+    width = (hi - lo) / _BINS
+
+    chunk = int(max(1, min(n_paths, max_chunk, _CHUNK_ELEMENTS // (steps * n_assets))))
+    sizes = [chunk] * (n_paths // chunk) + ([n_paths % chunk] if n_paths % chunk else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(s, size, steps, drift, chol, weights, rebalance, lo, width, amount) for s, size in zip(seeds, sizes)]
+
+    workers = default_workers() if workers is None else max(1, int(workers))
+    workers = min(workers, len(sizes)) if n_paths >= _POOL_MIN_PATHS else 1
+    t0 = time.perf_counter()
+    counts = np.zeros((steps, _BINS + 2), dtype=np.int64)
+    losses, terminal_sum = 0, 0.0
+    if workers > 1:
+        results = _map_chunks(workers, args)
+    else:
+        results = (_simulate_chunk(*a) for a in args)
+    for chunk_counts, chunk_losses, chunk_sum in results:
+        counts += chunk_counts
+        losses += chunk_losses
+        terminal_sum += chunk_sum
+    elapsed = (time.perf_counter() - t0) * 1000
+
+    bands = amount * np.exp(_histogram_percentiles(counts, n_paths, quantiles, lo, width))
+    start = np.full((len(quantiles), 1), float(amount))
+    bands = np.hstack([start, bands])
+
+    # Terminal histogram in value space, re-binned from the fine log histogram;
+    # values outside the range are folded into the first/last bar
+    terminal = counts[-1]
+    occupied = np.flatnonzero(terminal[1:-1])
+    first, last = (int(occupied[0]), int(occupied[-1]) + 1) if occupied.size else (0, _BINS)
+    group = -(-(last - first) // max(1, int(histogram_bins)))
+    starts = np.arange(first, last, group)
+    coarse = np.add.reduceat(terminal[1:-1], starts)
+    coarse[0] += terminal[0]
+    coarse[-1] += terminal[-1]
+    edges = amount * np.exp(lo + np.append(starts, min(starts[-1] + group, _BINS)) * width)
+
+    return MonteCarloResult(
+        times=np.arange(steps + 1) * dt,
+        percentiles={q: bands[k] for k, q in enumerate(quantiles)},
+        probability_of_loss=losses / n_paths,
+        mean_terminal=terminal_sum / n_paths,
+        histogram_edges=edges,
+        histogram_counts=coarse,
+        n_paths=n_paths,
+        chunks=len(sizes),
+        workers=workers,
+        elapsed_ms=round(elapsed, 2),
+    )
+
@@ -1,25 +1,136 @@
 import os
+import re
 import requests
 import logging
 import json
+from typing import AsyncIterator, List
+
+import metrics
+from tracing import span
+from http_transport import iter_sse
+from rate_limiter import get_rate_limiter
+from result_cache import get_result_cache, make_key
+from singleflight import get_singleflight, normalize_key
+from upstream_policy import hedged
+from upstream_replay import get_llm_transport
 
 logger = logging.getLogger("perplexity-client")
 
+# Instruments requested per category by PerplexityClient._category_request
+CATEGORY_SIZES = {"value": 10, "growth": 10, "bonds": 3, "disruptive": 3, "disruptive_portfolio": 5}
+
+# Digit-group separators such as 1_000_000; underscores elsewhere (expense_ratio, tickers) are kept
+_DIGIT_UNDERSCORE = re.compile(r"(?<=\d)_(?=\d)")
+
+
+def _loads_lenient(json_str):
+    """json.loads with the repairs models usually need: 1_000 numbers and single-quoted strings."""
+    json_str_clean = _DIGIT_UNDERSCORE.sub("", json_str)
+    try:
+        return json.loads(json_str_clean)
+    except json.JSONDecodeError:
+        json_str_fixed = re.sub(r"(?<=[:,\[\{])\s*'([^']*)'\s*:", r'"\1":', json_str_clean)  # claves
+        json_str_fixed = re.sub(r":\s*'([^']*)'", r':"\1"', json_str_fixed)                # valores
+        return json.loads(json_str_fixed)
+
+
+class JsonArrayStream:
+    """Incremental parser for the first JSON array of objects in a text stream.
+
+    feed() takes text chunks as they arrive and returns the objects whose
+    closing brace has been seen. Only bracket depth and string state are
+    tracked per character; each object is parsed once, when it closes.
+    Prose before the array (or a markdown fence) is skipped, and a "["
+    not followed by "{" or "]" (e.g. a citation like [1]) is ignored.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._state = "search"  # search -> open -> array -> done
+        self._depth = 0
+        self._start = 0
+        self._quote = None
+        self._escape = False
+        self.errors = 0
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, chunk: str) -> List[dict]:
+        self._buf += chunk
+        items = []
+        buf, i = self._buf, self._pos
+        while i < len(buf) and self._state != "done":
+            ch = buf[i]
+            if self._state == "search":
+                if ch == "[":
+                    self._state = "open"
+            elif self._state == "open":
+                if ch == "{":
+                    self._state = "array"
+                    continue  # handled as the first object below
+                if ch == "]":
+                    self._state = "done"
+                elif not ch.isspace():
+                    self._state = "search"
+                    continue
+            elif self._quote:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == self._quote:
+                    self._quote = None
+            elif ch in "\"'" and self._depth:
+                self._quote = ch
+            elif ch in "{[":
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:
+                    if ch == "]":
+                        self._state = "done"
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        item = self._parse(buf[self._start:i + 1])
+                        if item is not None:
+                            items.append(item)
+            i += 1
+        # Drop consumed text, keeping the object being read
+        keep = self._start if self._depth else i
+        self._buf, self._pos = buf[keep:], i - keep
+        self._start -= keep
+        return items
+
+    def _parse(self, text: str):
+        try:
+            item = _loads_lenient(text)
+        except (json.JSONDecodeError, ValueError) as e:
+            self.errors += 1
+            metrics.inc("perplexity_parse_failures_total", reason="invalid_object")
+            logger.error(f"Objeto JSON inválido en el stream de Perplexity: {str(e)} | {text[:200]}")
+            return None
+        return item if isinstance(item, dict) else None
+
 class PerplexityClient:
-    def __init__(self, api_key=None):
-        import os
+    def __init__(self, api_key=None, transport=None, cache=None, limiter=None):
         self.api_key = api_key or os.getenv("PERPLEXITY_API_KEY")
         if not self.api_key:
             raise ValueError("PERPLEXITY_API_KEY is not set in environment variables.")
-        self.api_url = "https://api.perplexity.ai/chat/completions"
+        # Overridable to point at a local stand-in (benchmarks)
+        self.api_url = os.getenv("PERPLEXITY_API_URL", "https://api.perplexity.ai/chat/completions")
         self.model = "sonar-pro"
+        self.transport = transport
+        # Picks are cached by category + screening params (not amount); pass cache=False to bypass
+        self.cache = get_result_cache() if cache is None else (cache or None)
+        # Optional quota shared by every worker (PERPLEXITY_RATE_PER_MINUTE); limiter=False disables it
+        self.limiter = get_rate_limiter("perplexity") if limiter is None else (limiter or None)
 
-    def _call_perplexity(self, system_prompt, user_prompt):
-        import requests
-        import logging
-        import json
-        import re
-        logger = logging.getLogger("perplexity-client")
+    def _request(self, system_prompt, user_prompt):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -31,6 +142,41 @@ class PerplexityClient:
                 {"role": "user", "content": user_prompt}
             ]
         }
+        return headers, data
+
+    def _parse_items(self, response_text):
+        """Extract the JSON array of instruments from a Perplexity completion."""
+        with span("parse"):
+            return self._parse_array(response_text)
+
+    def _parse_array(self, response_text):
+        start_idx = response_text.find("[")
+        end_idx = response_text.rfind("]")
+        if start_idx != -1 and end_idx != -1:
+            json_str = response_text[start_idx:end_idx+1]
+            try:
+                data = _loads_lenient(json_str)
+                logger.info(f"Respuesta Perplexity con {len(data)} items")
+                return data
+            except Exception as e:
+                # Keep whatever objects are well formed rather than failing the whole answer
+                items = JsonArrayStream().feed(response_text)
+                if items:
+                    metrics.inc("perplexity_parse_failures_total", reason="partial")
+                    logger.warning(f"JSON de Perplexity reparado parcialmente: {len(items)} items ({str(e)})")
+                    return items
+                metrics.inc("perplexity_parse_failures_total", reason="invalid_json")
+                logger.error(f"Error parsing JSON from Perplexity: {str(e)} | JSON: {json_str}")
+                raise
+        else:
+            metrics.inc("perplexity_parse_failures_total", reason="no_array")
+            logger.error("No se encontró un array JSON en la respuesta de Perplexity")
+            raise Exception("No JSON array found in Perplexity response")
+
+    def _call_perplexity(self, system_prompt, user_prompt):
+        headers, data = self._request(system_prompt, user_prompt)
+        if self.limiter is not None:
+            self.limiter.acquire_sync()
         try:
             response = requests.post(self.api_url, headers=headers, json=data, timeout=60)
             if response.status_code != 200:
@@ -38,31 +184,130 @@ class PerplexityClient:
                 raise Exception(f"Perplexity API error: {response.status_code}")
             response_data = response.json()
             response_text = response_data["choices"][0]["message"]["content"]
-            start_idx = response_text.find("[")
-            end_idx = response_text.rfind("]")
-            if start_idx != -1 and end_idx != -1:
-                json_str = response_text[start_idx:end_idx+1]
-                try:
-                    json_str_clean = json_str.replace('_', '')
-                    try:
-                        data = json.loads(json_str_clean)
-                    except json.JSONDecodeError:
-                        json_str_fixed = re.sub(r"(?<=[:,\[\{])\s*'([^']*)'\s*:", r'"\1":', json_str_clean)
-                        json_str_fixed = re.sub(r":\s*'([^']*)'", r':"\1"', json_str_fixed)
-                        data = json.loads(json_str_fixed)
-                    logger.info(f"Respuesta Perplexity con {len(data)} items")
-                    return data
-                except Exception as e:
-                    logger.error(f"Error parsing JSON from Perplexity: {str(e)} | JSON: {json_str}")
-                    raise
-            else:
-                logger.error("No se encontró un array JSON en la respuesta de Perplexity")
-                raise Exception("No JSON array found in Perplexity response")
+            return self._parse_items(response_text)
         except Exception as e:
             logger.error(f"Error al consultar Perplexity API: {str(e)}")
             raise
 
-    def get_growth_portfolio(self, amount, min_marketcap_eur=300_000_000, max_marketcap_eur=2_000_000_000, min_beta=1.2, max_beta=1.4, n_stocks=10, region="EU,US"):
+    async def _call_perplexity_async(self, system_prompt, user_prompt):
+        """Non-blocking variant of _call_perplexity using the shared HTTP pool.
+        Concurrent calls with the same normalized prompt share one upstream request, which
+        gets a backup attempt when it runs past the observed p95 (upstream_policy.hedged).
+        """
+        key = normalize_key(self.api_url, self.model, system_prompt, user_prompt)
+        return await get_singleflight("perplexity").do(
+            key, lambda: hedged("perplexity", lambda: self._request_perplexity_async(system_prompt, user_prompt))
+        )
+
+    async def _request_perplexity_async(self, system_prompt, user_prompt):
+        headers, data = self._request(system_prompt, user_prompt)
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        transport = self.transport or get_llm_transport()
+        try:
+            response = await transport.post(self.api_url, headers=headers, json=data, timeout=60)
+            if response.status_code != 200:
+                logger.error(f"Perplexity API error: {response.status_code} - {response.text}")
+                raise Exception(f"Perplexity API error: {response.status_code}")
+            response_data = response.json()
+            response_text = response_data["choices"][0]["message"]["content"]
+            return self._parse_items(response_text)
+        except Exception as e:
+            logger.error(f"Error al consultar Perplexity API: {str(e)}")
+            raise
+
+    async def _stream_perplexity_async(self, system_prompt, user_prompt, parser=None) -> AsyncIterator[dict]:
+        """Yield instrument objects from a streamed completion as soon as each one closes.
+        Pass a JsonArrayStream as `parser` to check afterwards (parser.done) that the array was closed.
+        """
+        headers, data = self._request(system_prompt, user_prompt)
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        transport = self.transport or get_llm_transport()
+        parser = parser if parser is not None else JsonArrayStream()
+        async with transport.stream("POST", self.api_url, headers=headers, json=dict(data, stream=True), timeout=60) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", "replace")
+                logger.error(f"Perplexity API error: {response.status_code} - {body[:500]}")
+                raise Exception(f"Perplexity API error: {response.status_code}")
+            async for _event, payload in iter_sse(response):
+                if payload.strip() == "[DONE]":
+                    break
+                choices = json.loads(payload).get("choices") or [{}]
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    for item in parser.feed(delta):
+                        yield item
+                if parser.done or choices[0].get("finish_reason"):
+                    break
+        if not parser.done:
+            logger.warning("Stream de Perplexity terminado sin cerrar el array JSON")
+
+    async def stream_items_async(self, category, amount) -> AsyncIterator[dict]:
+        """Stream the instruments of a portfolio category (same defaults as the get_*_async methods).
+        A cached answer is replayed at once; a stream whose array was closed is cached like a
+        regular call (a truncated one, e.g. cut by max tokens or the connection, is not).
+        """
+        key, prompts = self._category_request(category, amount)
+        if self.cache is not None:
+            cached = await self.cache.get_async(key)
+            if cached is not None:
+                logger.info(f"Cache hit {key}")
+                for item in cached:
+                    yield item
+                return
+        items, parser = [], JsonArrayStream()
+        async for item in self._stream_perplexity_async(*prompts, parser=parser):
+            items.append(item)
+            yield item
+        logger.info(f"Respuesta Perplexity (stream) con {len(items)} items")
+        if self.cache is not None and items and parser.done:
+            await self.cache.set_async(key, items)
+
+    def _category_request(self, category, amount):
+        """Cache key and prompts of a category with the default screening parameters."""
+        if category == "value":
+            params = dict(min_marketcap_eur=1_000_000_000, max_marketcap_eur=100_000_000_000, min_roe=12, max_per=18, max_debt=0.6, n_stocks=10, region="EU,US")
+            return self._cache_key("value", **params), self._value_prompts(amount, *params.values())
+        if category == "growth":
+            params = dict(min_marketcap_eur=300_000_000, max_marketcap_eur=2_000_000_000, min_beta=1.2, max_beta=1.4, n_stocks=10, region="EU,US")
+            return self._cache_key("growth", **params), self._growth_prompts(amount, *params.values())
+        if category == "bonds":
+            return self._cache_key("bond_etfs", n_etfs=3, region="Global"), self._bond_etf_prompts(amount, 3, "Global")
+        if category == "disruptive":
+            return self._cache_key("disruptive_etfs", n_etfs=3, region="Global"), self._disruptive_etf_prompts(amount, 3, "Global")
+        if category == "disruptive_portfolio":
+            # Fallback of "disruptive" (same request as get_disruptive_portfolio_async)
+            return self._cache_key("disruptive", n_instruments=5, region="EU,US"), self._disruptive_prompts(amount, 5, "EU,US")
+        raise ValueError(f"Categoría desconocida: {category}")
+
+    def _cache_key(self, category, **params):
+        return make_key(f"perplexity:{category}", model=self.model, **params)
+
+    def _cached_call(self, key, prompts):
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info(f"Cache hit {key}")
+                return cached
+        items = self._call_perplexity(*prompts)
+        if self.cache is not None:
+            self.cache.set(key, items)
+        return items
+
+    async def _cached_call_async(self, key, prompts):
+        if self.cache is not None:
+            cached = await self.cache.get_async(key)
+            if cached is not None:
+                logger.info(f"Cache hit {key}")
+                return cached
+        items = await self._call_perplexity_async(*prompts)
+        if self.cache is not None:
+            await self.cache.set_async(key, items)
+        return items
+
+    # --- Prompts ---
+    def _growth_prompts(self, amount, min_marketcap_eur, max_marketcap_eur, min_beta, max_beta, n_stocks, region):
         system_prompt = (
             "Eres un asistente experto en finanzas cuantitativas. Devuelve únicamente un array JSON de acciones growth (small/micro cap) que cumplan:\n"
             f"- Capitalización entre €{min_marketcap_eur:,} y €{max_marketcap_eur:,}\n"
@@ -74,9 +319,9 @@ class PerplexityClient:
         user_prompt = (
             f"Quiero invertir €{amount:,} en acciones growth europeas y estadounidenses de pequeña capitalización. Dame la lista óptima según los criterios."
         )
-        return self._call_perplexity(system_prompt, user_prompt)
+        return system_prompt, user_prompt
 
-    def get_value_portfolio(self, amount, min_marketcap_eur=1_000_000_000, max_marketcap_eur=100_000_000_000, min_roe=12, max_per=18, max_debt=0.6, n_stocks=10, region="EU,US"):
+    def _value_prompts(self, amount, min_marketcap_eur, max_marketcap_eur, min_roe, max_per, max_debt, n_stocks, region):
         system_prompt = (
             "Eres un asistente experto en value investing y análisis fundamental. Devuelve únicamente un array JSON de acciones value (large/mega cap) que cumplan:\n"
             f"- Capitalización entre €{min_marketcap_eur:,} y €{max_marketcap_eur:,}\n"
@@ -91,11 +336,9 @@ class PerplexityClient:
         user_prompt = (
             f"Quiero invertir €{amount:,} en acciones value europeas y estadounidenses de gran capitalización. Dame la lista óptima según los criterios."
         )
-        return self._call_perplexity(system_prompt, user_prompt)
+        return system_prompt, user_prompt
 
-    def get_disruptive_portfolio(self, amount, n_instruments=5, region="EU,US", n_stocks=None):
-        if n_stocks is not None:
-            n_instruments = n_stocks
+    def _disruptive_prompts(self, amount, n_instruments, region):
         system_prompt = (
             "Eres un asistente experto en inversión disruptiva y tecnología. Devuelve únicamente un array JSON de instrumentos reales y actuales en las siguientes categorías:\n"
             "- Private Equity (fondos de venture capital, private equity, startups de IA, biotecnología, etc)\n"
@@ -107,9 +350,9 @@ class PerplexityClient:
         user_prompt = (
             f"Quiero invertir €{amount:,} en una cartera disruptiva global (private equity, tecnología, IA, biotecnología, etc). Dame la lista óptima según los criterios."
         )
-        return self._call_perplexity(system_prompt, user_prompt)
+        return system_prompt, user_prompt
 
-    def get_disruptive_etfs(self, amount, n_etfs=3, region="Global"):
+    def _disruptive_etf_prompts(self, amount, n_etfs, region):
         system_prompt = (
             "Eres un asistente experto en ETFs de tecnología disruptiva. Devuelve únicamente un array JSON con los "
             f"{n_etfs} principales ETFs que inviertan en innovación, IA, robótica, semiconductores y tecnologías emergentes.\n"
@@ -130,9 +373,9 @@ class PerplexityClient:
             f"Incluye ETFs que inviertan en innovación, IA, robótica y tecnologías emergentes. "
             f"La región objetivo es: {region}."
         )
-        return self._call_perplexity(system_prompt, user_prompt)
+        return system_prompt, user_prompt
 
-    def get_bond_etfs(self, amount, n_etfs=3, region="Global"):
+    def _bond_etf_prompts(self, amount, n_etfs, region):
         system_prompt = (
             "Eres un asistente experto en ETFs de bonos y renta fija. Devuelve únicamente un array JSON con los "
             f"{n_etfs} principales ETFs de bonos (gubernamentales, corporativos, high yield, globales, etc) "
@@ -154,162 +397,24 @@ class PerplexityClient:
             f"Incluye ETFs de bonos gubernamentales, corporativos y globales. "
             f"La región objetivo es: {region}."
         )
-        return self._call_perplexity(system_prompt, user_prompt)
-
-    def __init__(self, api_key=None):
-        self.api_key = api_key or os.getenv("PERPLEXITY_API_KEY")
-        if not self.api_key:
-            raise ValueError("PERPLEXITY_API_KEY is not set in environment variables.")
-        self.api_url = "https://api.perplexity.ai/chat/completions"
-        self.model = "sonar-pro"
+        return system_prompt, user_prompt
 
+    # --- Public API (sync) ---
     def get_growth_portfolio(self, amount, min_marketcap_eur=300_000_000, max_marketcap_eur=2_000_000_000, min_beta=1.2, max_beta=1.4, n_stocks=10, region="EU,US"):
         """
         Llama a Perplexity para obtener una lista óptima de acciones growth (small/micro cap) según los criterios dados.
         Devuelve una lista de acciones con pesos sugeridos y métricas clave.
         """
-        system_prompt = (
-            "Eres un asistente experto en finanzas cuantitativas. Devuelve únicamente un array JSON de acciones growth (small/micro cap) que cumplan:\n"
-            f"- Capitalización entre €{min_marketcap_eur:,} y €{max_marketcap_eur:,}\n"
-            f"- Beta entre {min_beta} y {max_beta}\n"
-            f"- Solo datos reales y actuales\n"
-            "- Incluye: ticker, nombre, sector, país, marketcap, beta, peso (%), métricas clave (ROE, P/E, crecimiento FCF, etc.)\n"
-            f"- Diversifica sectores y países.\n- Devuelve exactamente {n_stocks} acciones.\n- Formato: array JSON, sin texto adicional."
-        )
-        user_prompt = (
-            f"Quiero invertir €{amount:,} en acciones growth europeas y estadounidenses de pequeña capitalización. Dame la lista óptima según los criterios."
-        )
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-        }
-        try:
-            response = requests.post(self.api_url, headers=headers, json=data, timeout=60)
-            if response.status_code != 200:
-                logger.error(f"Perplexity API error: {response.status_code} - {response.text}")
-                raise Exception(f"Perplexity API error: {response.status_code}")
-            response_data = response.json()
-            response_text = response_data["choices"][0]["message"]["content"]
-            # Extraer el array JSON de la respuesta
-            start_idx = response_text.find("[")
-            end_idx = response_text.rfind("]")
-            if start_idx != -1 and end_idx != -1:
-                json_str = response_text[start_idx:end_idx+1]
-                try:
-                    # Sanitizar: eliminar guiones bajos en los números antes de parsear
-                    json_str_clean = json_str.replace('_', '')
-                    stocks_data = json.loads(json_str_clean)
-                    logger.info(f"Portafolio growth obtenido con {len(stocks_data)} acciones")
-                    return stocks_data
-                except Exception as e:
-                    logger.error(f"Error parsing JSON from Perplexity: {str(e)} | JSON: {json_str}")
-                    raise
-            else:
-                logger.error("No se encontró un array JSON en la respuesta de Perplexity")
-                raise Exception("No JSON array found in Perplexity response")
-        except Exception as e:
-            logger.error(f"Error al consultar Perplexity API: {str(e)}")
-            raise
+        key = self._cache_key("growth", min_marketcap_eur=min_marketcap_eur, max_marketcap_eur=max_marketcap_eur, min_beta=min_beta, max_beta=max_beta, n_stocks=n_stocks, region=region)
+        return self._cached_call(key, self._growth_prompts(amount, min_marketcap_eur, max_marketcap_eur, min_beta, max_beta, n_stocks, region))
 
-    def get_disruptive_etfs(self, amount, n_etfs=3, region="Global"):
-        """
-        Obtiene una lista de ETFs de tecnología disruptiva con datos reales de Perplexity.
-        """
-        system_prompt = (
-            "Eres un asistente experto en ETFs de tecnología disruptiva. Devuelve únicamente un array JSON con los "
-            f"{n_etfs} principales ETFs que inviertan en innovación, IA, robótica, semiconductores y tecnologías emergentes.\n"
-            "Cada ETF debe incluir los siguientes campos:\n"
-            "- ticker (ej. 'ARKK')\n"
-            "- name (nombre completo del ETF)\n"
-            "- sector (ej. 'Tecnología Disruptiva', 'Robótica', 'IA')\n"
-            "- country (país de origen o cobertura)\n"
-            "- price (precio actual en USD, debe ser un número real y actualizado)\n"
-            "- weight (peso sugerido en cartera, entre 0.1 y 0.5, la suma debe ser 1.0)\n"
-            "- metrics (objeto con métricas reales como expense_ratio, holdings, ytd_return, etc.)\n"
-            "Usa solo datos reales y actualizados.\n"
-            "Formato: array JSON, sin texto adicional."
-        )
-        
-        user_prompt = (
-            f"Dame una lista de los {n_etfs} mejores ETFs de tecnología disruptiva con sus precios actuales, "
-            f"métricas clave y un peso sugerido para una cartera de ${amount:,.2f}. "
-            f"Incluye ETFs que inviertan en innovación, IA, robótica y tecnologías emergentes. "
-            f"La región objetivo es: {region}."
-        )
-        
-        return self._call_perplexity(system_prompt, user_prompt)
-        
     def get_value_portfolio(self, amount, min_marketcap_eur=1_000_000_000, max_marketcap_eur=100_000_000_000, min_roe=12, max_per=18, max_debt=0.6, n_stocks=10, region="EU,US"):
         """
         Llama a Perplexity para obtener una lista óptima de acciones value (large cap, bajo PER, alto ROE, margen alto, deuda baja, moat cualitativo, etc).
         Devuelve una lista de acciones con pesos sugeridos y métricas clave.
         """
-        system_prompt = (
-            "Eres un asistente experto en value investing y análisis fundamental. Devuelve únicamente un array JSON de acciones value (large/mega cap) que cumplan:\n"
-            f"- Capitalización entre €{min_marketcap_eur:,} y €{max_marketcap_eur:,}\n"
-            f"- ROE mínimo {min_roe}%\n"
-            f"- PER máximo {max_per}\n"
-            f"- Deuda/Equity máxima {max_debt}\n"
-            "- Margen de beneficio alto, moat cualitativo fuerte (ventaja competitiva),\n"
-            "- Solo datos reales y actuales\n"
-            "- Incluye: ticker, nombre, sector, país, marketcap, PER, ROE, deuda, margen, moat, peso (%), métricas clave\n"
-            f"- Diversifica sectores y países.\n- Devuelve exactamente {n_stocks} acciones.\n- Formato: array JSON, sin texto adicional."
-        )
-        user_prompt = (
-            f"Quiero invertir €{amount:,} en acciones value europeas y estadounidenses de gran capitalización. Dame la lista óptima según los criterios."
-        )
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-        }
-        try:
-            response = requests.post(self.api_url, headers=headers, json=data, timeout=60)
-            if response.status_code != 200:
-                logger.error(f"Perplexity API error: {response.status_code} - {response.text}")
-                raise Exception(f"Perplexity API error: {response.status_code}")
-            response_data = response.json()
-            response_text = response_data["choices"][0]["message"]["content"]
-            # Extraer el array JSON de la respuesta
-            start_idx = response_text.find("[")
-            end_idx = response_text.rfind("]")
-            if start_idx != -1 and end_idx != -1:
-                json_str = response_text[start_idx:end_idx+1]
-                try:
-                    # Sanitizar: eliminar guiones bajos en los números antes de parsear
-                    json_str_clean = json_str.replace('_', '')
-                    try:
-                        stocks_data = json.loads(json_str_clean)
-                    except json.JSONDecodeError as e:
-                        import re
-                        # Intenta arreglar claves y valores con comillas simples
-                        json_str_fixed = re.sub(r"(?<=[:,\[\{])\s*'([^']*)'\s*:", r'"\1":', json_str_clean)  # claves
-                        json_str_fixed = re.sub(r":\s*'([^']*)'", r':"\1"', json_str_fixed)                # valores
-                        stocks_data = json.loads(json_str_fixed)
-                    logger.info(f"Portafolio value obtenido con {len(stocks_data)} acciones")
-                    return stocks_data
-                except Exception as e:
-                    logger.error(f"Error parsing JSON from Perplexity: {str(e)} | JSON: {json_str}")
-                    raise
-            else:
-                logger.error("No se encontró un array JSON en la respuesta de Perplexity")
-                raise Exception("No JSON array found in Perplexity response")
-        except Exception as e:
-            logger.error(f"Error al consultar Perplexity API: {str(e)}")
-            raise
+        key = self._cache_key("value", min_marketcap_eur=min_marketcap_eur, max_marketcap_eur=max_marketcap_eur, min_roe=min_roe, max_per=max_per, max_debt=max_debt, n_stocks=n_stocks, region=region)
+        return self._cached_call(key, self._value_prompts(amount, min_marketcap_eur, max_marketcap_eur, min_roe, max_per, max_debt, n_stocks, region))
 
     def get_disruptive_portfolio(self, amount, n_instruments=5, region="EU,US", n_stocks=None):
         """
@@ -318,57 +423,42 @@ class PerplexityClient:
         """
         if n_stocks is not None:
             n_instruments = n_stocks
-        system_prompt = (
-            "Eres un asistente experto en inversión disruptiva y tecnología. Devuelve únicamente un array JSON de instrumentos reales y actuales en las siguientes categorías:\n"
-            "- Private Equity (fondos de venture capital, private equity, startups de IA, biotecnología, etc)\n"
-            "- Tecnología Especializada (ETFs temáticos, acciones disruptivas, fondos de tecnología, robótica, IA, ciberseguridad, semiconductores, etc)\n"
-            "- Solo instrumentos REALES y actuales, nunca inventados ni simulados.\n"
-            "- Incluye: ticker, nombre, categoría (private_equity, etf_temático, acción_disruptiva, fondo_vc, etc), sector, país, peso (%), rentabilidad esperada, métricas clave (CAGR, drawdown, liquidez, etc), comentarios.\n"
-            f"- Diversifica entre private equity y tecnología avanzada. Región: {region}.\n- Devuelve exactamente {n_instruments} instrumentos.\n- Formato: array JSON, sin texto adicional."
-        )
-        user_prompt = (
-            f"Quiero invertir €{amount:,} en una cartera disruptiva global (private equity, tecnología, IA, biotecnología, etc). Dame la lista óptima según los criterios."
-        )
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-        }
-        try:
-            response = requests.post(self.api_url, headers=headers, json=data, timeout=60)
-            if response.status_code != 200:
-                logger.error(f"Perplexity API error: {response.status_code} - {response.text}")
-                raise Exception(f"Perplexity API error: {response.status_code}")
-            response_data = response.json()
-            response_text = response_data["choices"][0]["message"]["content"]
-            # Extraer el array JSON de la respuesta
-            start_idx = response_text.find("[")
-            end_idx = response_text.rfind("]")
-            if start_idx != -1 and end_idx != -1:
-                json_str = response_text[start_idx:end_idx+1]
-                try:
-                    json_str_clean = json_str.replace('_', '')
-                    try:
-                        disruptive_data = json.loads(json_str_clean)
-                    except json.JSONDecodeError:
-                        import re
-                        json_str_fixed = re.sub(r"(?<=[:,\[\{])\s*'([^']*)'\s*:", r'"\1":', json_str_clean)  # claves
-                        json_str_fixed = re.sub(r":\s*'([^']*)'", r':"\1"', json_str_fixed)                # valores
-                        disruptive_data = json.loads(json_str_fixed)
-                    logger.info(f"Portafolio disruptivo obtenido con {len(disruptive_data)} instrumentos")
-                    return disruptive_data
-                except Exception as e:
-                    logger.error(f"Error parsing JSON from Perplexity: {str(e)} | JSON: {json_str}")
-                    raise
-            else:
-                logger.error("No se encontró un array JSON en la respuesta de Perplexity")
-                raise Exception("No JSON array found in Perplexity response")
-        except Exception as e:
-            logger.error(f"Error al consultar Perplexity API: {str(e)}")
-            raise
\ No newline at end of file
+        key = self._cache_key("disruptive", n_instruments=n_instruments, region=region)
+        return self._cached_call(key, self._disruptive_prompts(amount, n_instruments, region))
+
+    def get_disruptive_etfs(self, amount, n_etfs=3, region="Global"):
+        """
+        Obtiene una lista de ETFs de tecnología disruptiva con datos reales de Perplexity.
+        """
+        key = self._cache_key("disruptive_etfs", n_etfs=n_etfs, region=region)
+        return self._cached_call(key, self._disruptive_etf_prompts(amount, n_etfs, region))
+
+    def get_bond_etfs(self, amount, n_etfs=3, region="Global"):
+        """
+        Obtiene una lista de ETFs de bonos con datos reales de Perplexity.
+        """
+        key = self._cache_key("bond_etfs", n_etfs=n_etfs, region=region)
+        return self._cached_call(key, self._bond_etf_prompts(amount, n_etfs, region))
+
+    # --- Public API (async) ---
+    async def get_growth_portfolio_async(self, amount, min_marketcap_eur=300_000_000, max_marketcap_eur=2_000_000_000, min_beta=1.2, max_beta=1.4, n_stocks=10, region="EU,US"):
+        key = self._cache_key("growth", min_marketcap_eur=min_marketcap_eur, max_marketcap_eur=max_marketcap_eur, min_beta=min_beta, max_beta=max_beta, n_stocks=n_stocks, region=region)
+        return await self._cached_call_async(key, self._growth_prompts(amount, min_marketcap_eur, max_marketcap_eur, min_beta, max_beta, n_stocks, region))
+
+    async def get_value_portfolio_async(self, amount, min_marketcap_eur=1_000_000_000, max_marketcap_eur=100_000_000_000, min_roe=12, max_per=18, max_debt=0.6, n_stocks=10, region="EU,US"):
+        key = self._cache_key("value", min_marketcap_eur=min_marketcap_eur, max_marketcap_eur=max_marketcap_eur, min_roe=min_roe, max_per=max_per, max_debt=max_debt, n_stocks=n_stocks, region=region)
+        return await self._cached_call_async(key, self._value_prompts(amount, min_marketcap_eur, max_marketcap_eur, min_roe, max_per, max_debt, n_stocks, region))
+
+    async def get_disruptive_portfolio_async(self, amount, n_instruments=5, region="EU,US", n_stocks=None):
+        if n_stocks is not None:
+            n_instruments = n_stocks
+        key = self._cache_key("disruptive", n_instruments=n_instruments, region=region)
+        return await self._cached_call_async(key, self._disruptive_prompts(amount, n_instruments, region))
+
+    async def get_disruptive_etfs_async(self, amount, n_etfs=3, region="Global"):
+        key = self._cache_key("disruptive_etfs", n_etfs=n_etfs, region=region)
+        return await self._cached_call_async(key, self._disruptive_etf_prompts(amount, n_etfs, region))
+
+    async def get_bond_etfs_async(self, amount, n_etfs=3, region="Global"):
+        key = self._cache_key("bond_etfs", n_etfs=n_etfs, region=region)
+        return await self._cached_call_async(key, self._bond_etf_prompts(amount, n_etfs, region))
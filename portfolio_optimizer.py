@@ -0,0 +1,518 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.linalg
+from scipy.optimize import linprog, minimize
+
+logger = logging.getLogger("portfolio-optimizer")
+
+OBJECTIVES = ("max_sharpe", "min_variance", "target_return")
+
+
+@dataclass
+class OptimizationResult:
+    weights: np.ndarray
+    expected_return: float
+    volatility: float
+    sharpe_ratio: Optional[float]
+    success: bool
+    message: str
+    iterations: int
+    elapsed_ms: float
+    objective: str
+    warnings: List[str] = field(default_factory=list)
+
+    def metrics(self) -> dict:
+        return {
+            "expected_return": round(self.expected_return, 6),
+            "volatility": round(self.volatility, 6),
+            "sharpe_ratio": None if self.sharpe_ratio is None else round(self.sharpe_ratio, 6),
+        }
+
+
+def covariance_from_volatility(volatility: Sequence[float], correlation=None, default_correlation: float = 0.3) -> np.ndarray:
+    """Build a covariance matrix from volatilities and an optional correlation matrix.
+    Without a correlation matrix a constant pairwise correlation is assumed.
+    """
+    vol = np.asarray(volatility, dtype=float)
+    if correlation is None:
+        corr = np.full((vol.size, vol.size), float(default_correlation))
+        np.fill_diagonal(corr, 1.0)
+    else:
+        corr = np.asarray(correlation, dtype=float)
+    return corr * np.outer(vol, vol)
+
+
+def portfolio_metrics(weights: np.ndarray, mu: np.ndarray, cov: np.ndarray, risk_free: float = 0.0) -> Tuple[float, float, Optional[float]]:
+    ret = float(weights @ mu)
+    vol = float(np.sqrt(max(weights @ cov @ weights, 0.0)))
+    sharpe = (ret - risk_free) / vol if vol > 1e-12 else None
+    return ret, vol, sharpe
+
+
+def _group_matrix(n: int, groups: Dict[str, Tuple[Sequence[int], float]]):
+    names = list(groups)
+    A = np.zeros((len(names), n))
+    b = np.zeros(len(names))
+    for row, name in enumerate(names):
+        idx, target = groups[name]
+        A[row, list(idx)] = 1.0
+        b[row] = target
+    return A, b
+
+
+def _initial_weights(n, lower, upper, A, b):
+    # Spread each group's target evenly over its members, then clip into the bounds
+    if A is None:
+        x0 = np.full(n, 1.0 / n)
+    else:
+        counts = A.sum(axis=1)
+        x0 = (A * (b / np.maximum(counts, 1))[:, None]).sum(axis=0)
+    return np.clip(x0, lower, upper)
+
+
+class _ActiveSetQP:
+    """Active-set solver for min 1/2 w'Qw - c'w s.t. Aw = b, lower <= w <= upper.
+
+    Each solve starts with primal-dual iterations: one KKT system restricted
+    to the free variables per iteration, moving every bound violation /
+    wrong-signed multiplier at once, so it usually converges in a handful of
+    dense solves. Near degenerate vertices (the max-return end of the
+    frontier) those simultaneous moves can cycle; the solve then continues
+    with a primal active-set method from a feasible point that changes one
+    bound per iteration and breaks ties by the lowest index (Bland's rule),
+    which cannot cycle. The active sets of the last solution are kept to
+    warm-start the next call with a nearby c.
+    """
+
+    def __init__(self, Q, A, b, lower, upper, max_iter=60):
+        self.Q = Q
+        self.A = A
+        self.b = b
+        self.lower = lower
+        self.upper = upper
+        self.max_iter = max_iter
+        self.at_lower = np.zeros(Q.shape[0], dtype=bool)
+        self.at_upper = np.zeros(Q.shape[0], dtype=bool)
+        self.iterations = 0
+        # Last solution: a feasible start for the primal phase while b is unchanged
+        self.last: Optional[np.ndarray] = None
+        # Once the primal-dual phase has failed the next nearby c usually fails too
+        self.primal_only = False
+
+    def solve(self, c) -> Optional[np.ndarray]:
+        """Minimizer for this c, or None when it cannot be found (the caller falls back to SLSQP).
+        Raises ValueError when the constraints have no feasible point.
+        """
+        w = None if self.primal_only else self._primal_dual(c)
+        if w is None:
+            self.primal_only = True
+            w = self._primal(c)
+        if w is not None:
+            self.last = w.copy()
+        return w
+
+    def _kkt(self, free, rhs_top, rhs_bottom):
+        F = np.flatnonzero(free)
+        k, m = F.size, self.A.shape[0]
+        K = np.zeros((k + m, k + m))
+        K[:k, :k] = self.Q[np.ix_(F, F)]
+        K[:k, k:] = self.A[:, F].T
+        K[k:, :k] = self.A[:, F]
+        rhs = np.concatenate([rhs_top, rhs_bottom])
+        try:
+            sol = scipy.linalg.solve(K, rhs, assume_a="sym", check_finite=False)
+        except (np.linalg.LinAlgError, ValueError):
+            sol, *_ = np.linalg.lstsq(K, rhs, rcond=None)
+        return F, sol[:k], sol[k:]
+
+    def _primal_dual(self, c) -> Optional[np.ndarray]:
+        Q, A, b, lower, upper = self.Q, self.A, self.b, self.lower, self.upper
+        lo, hi = self.at_lower.copy(), self.at_upper.copy()
+        seen = set()
+        for _ in range(self.max_iter):
+            free = ~(lo | hi)
+            w = np.where(lo, lower, np.where(hi, upper, 0.0))
+            fixed = ~free
+            F, w_free, lam = self._kkt(
+                free,
+                c[free] - Q[np.ix_(free, fixed)] @ w[fixed],
+                b - A[:, fixed] @ w[fixed],
+            )
+            w[F] = w_free
+            z = Q @ w - c + A.T @ lam
+            z[free] = 0.0
+            new_lo = (lo & (z > 0)) | (free & (w < lower))
+            new_hi = (hi & (z < 0)) | (free & (w > upper))
+            self.iterations += 1
+            if np.array_equal(new_lo, lo) and np.array_equal(new_hi, hi):
+                if np.abs(A @ w - b).max(initial=0.0) > 1e-6:
+                    return None
+                self.at_lower, self.at_upper = lo, hi
+                return w
+            state = (new_lo.tobytes(), new_hi.tobytes())
+            if state in seen:
+                return None  # cycling
+            seen.add(state)
+            lo, hi = new_lo, new_hi
+        return None
+
+    def _feasible_start(self):
+        """A feasible point and a working set of bounds whose complement keeps A full row rank."""
+        A, b, lower, upper = self.A, self.b, self.lower, self.upper
+        n, m = A.shape[1], A.shape[0]
+        w = self.last
+        if w is None or np.abs(A @ w - b).max(initial=0.0) > 1e-9:
+            res = linprog(np.zeros(n), A_eq=A, b_eq=b, bounds=np.column_stack([lower, upper]), method="highs")
+            if not res.success:
+                raise ValueError("Las restricciones no tienen solución factible")
+            w = res.x
+        w = np.clip(w, lower, upper)
+        lo = w <= lower + 1e-12
+        hi = ~lo & (w >= upper - 1e-12)
+        # A degenerate vertex has basic variables sitting on a bound; release
+        # some of them so the equality constraints keep free variables to act on
+        bound = lo | hi
+        rank = np.linalg.matrix_rank(A[:, ~bound]) if (~bound).any() else 0
+        for i in np.flatnonzero(bound):
+            if rank >= m:
+                break
+            trial = ~bound
+            trial[i] = True
+            trial_rank = np.linalg.matrix_rank(A[:, trial])
+            if trial_rank > rank:
+                bound[i] = lo[i] = hi[i] = False
+                rank = trial_rank
+        return w, lo, hi
+
+    def _primal(self, c) -> Optional[np.ndarray]:
+        Q, A, b, lower, upper = self.Q, self.A, self.b, self.lower, self.upper
+        n, m = A.shape[1], A.shape[0]
+        w, lo, hi = self._feasible_start()
+        # After a full step w minimizes over the current face; with a singular Q
+        # (duplicated assets) the solve can keep returning a tiny step that never
+        # lands, so the multipliers are checked instead of stepping again
+        on_minimizer = False
+        for _ in range(5 * n + 50):
+            free = ~(lo | hi)
+            g = Q @ w - c
+            # Step to the minimizer over the free variables, staying on Aw = b
+            F, p, lam = self._kkt(free, -g[free], np.zeros(m))
+            self.iterations += 1
+            if on_minimizer or np.abs(p).max(initial=0.0) <= 1e-12:
+                z = g + A.T @ lam
+                tol = 1e-10 * max(1.0, np.abs(g).max(initial=0.0))
+                wrong = np.flatnonzero((lo & (z < -tol)) | (hi & (z > tol)))
+                if wrong.size == 0:
+                    if np.abs(A @ w - b).max(initial=0.0) > 1e-6:
+                        return None
+                    self.at_lower, self.at_upper = lo, hi
+                    return w
+                # Bland's rule: release the lowest-index bound with a wrong-signed multiplier
+                lo[wrong[0]] = hi[wrong[0]] = False
+                on_minimizer = False
+                continue
+            ratios = np.full(F.size, np.inf)
+            down, up = p < -1e-15, p > 1e-15
+            ratios[down] = (lower[F][down] - w[F][down]) / p[down]
+            ratios[up] = (upper[F][up] - w[F][up]) / p[up]
+            ratios = np.maximum(ratios, 0.0)
+            alpha = min(1.0, float(ratios.min(initial=np.inf)))
+            w[F] += alpha * p
+            on_minimizer = alpha >= 1.0
+            if alpha < 1.0:
+                # Bland's rule again: the lowest-index blocking bound joins the working set
+                j = int(np.flatnonzero(ratios <= alpha + 1e-14)[0])
+                i = F[j]
+                if p[j] < 0:
+                    lo[i], w[i] = True, lower[i]
+                else:
+                    hi[i], w[i] = True, upper[i]
+        return None
+
+
+def _solve_slsqp(fun, start, lower, upper, constraints, max_iter):
+    res = minimize(
+        fun,
+        np.clip(start, lower, upper),
+        jac=True,
+        method="SLSQP",
+        bounds=np.column_stack([lower, upper]),
+        constraints=constraints,
+        options={"maxiter": max_iter, "ftol": 1e-10},
+    )
+    return res.x, bool(res.success), str(res.message), int(res.get("nit", 0))
+
+
+def _max_sharpe_active_set(qp: _ActiveSetQP, excess: np.ndarray, cov: np.ndarray, tol: float = 1e-4):
+    """Maximize the Sharpe ratio along the parametric frontier w(lam) = argmin 1/2 w'Cw - lam e'w.
+    The Sharpe ratio is unimodal in lam, so a golden-section search over log(lam) suffices.
+    """
+    def sharpe(log_lam):
+        w = qp.solve(np.exp(log_lam) * excess)
+        if w is None:
+            return None, -np.inf
+        vol = np.sqrt(max(w @ cov @ w, 1e-16))
+        return w, float(w @ excess) / vol
+
+    scale = np.log(np.trace(cov) / cov.shape[0] / max(np.abs(excess).mean(), 1e-12))
+    lo, hi = scale - 12.0, scale + 6.0
+    ratio = (np.sqrt(5.0) - 1.0) / 2.0
+    x1, x2 = hi - ratio * (hi - lo), lo + ratio * (hi - lo)
+    w1, f1 = sharpe(x1)
+    w2, f2 = sharpe(x2)
+    while hi - lo > tol:
+        if f1 is None or f2 is None:
+            return None
+        if f1 >= f2:
+            hi, x2, w2, f2 = x2, x1, w1, f1
+            x1 = hi - ratio * (hi - lo)
+            w1, f1 = sharpe(x1)
+        else:
+            lo, x1, w1, f1 = x1, x2, w2, f2
+            x2 = lo + ratio * (hi - lo)
+            w2, f2 = sharpe(x2)
+        if w1 is None or w2 is None:
+            return None
+    return w1 if f1 >= f2 else w2
+
+
+def _problem(mu, cov, lower, upper, groups):
+    """Validate the inputs and build the QP data shared by every objective.
+    Returns (mu, cov, Q, A, b, lower, upper, warnings).
+    """
+    mu = np.asarray(mu, dtype=float)
+    cov = np.asarray(cov, dtype=float)
+    n = mu.size
+    if cov.shape != (n, n):
+        raise ValueError(f"La covarianza debe ser {n}x{n}, recibida {cov.shape}")
+    cov = 0.5 * (cov + cov.T)
+    # Tiny ridge keeps the KKT systems non-singular for rank-deficient sample covariances
+    Q = cov + np.eye(n) * (1e-10 * max(np.trace(cov) / n, 1e-12))
+    lower = np.broadcast_to(np.asarray(lower, dtype=float), (n,)).copy()
+    upper = np.broadcast_to(np.asarray(upper, dtype=float), (n,)).copy()
+    warnings: List[str] = []
+
+    rows, targets = [], []
+    if groups:
+        A_groups, b_groups = _group_matrix(n, groups)
+        rows.extend(A_groups)
+        targets.extend(b_groups)
+        if np.any(A_groups @ lower > b_groups + 1e-9) or np.any(A_groups @ upper < b_groups - 1e-9):
+            raise ValueError("Límites por activo incompatibles con la asignación por categoría")
+        covered = bool(np.all(A_groups.sum(axis=0) > 0))
+    else:
+        covered = False
+    if not covered:
+        rows.append(np.ones(n))
+        targets.append(1.0)
+    return mu, cov, Q, np.vstack(rows), np.asarray(targets, dtype=float), lower, upper, warnings
+
+
+def optimize_weights(
+    mu: Sequence[float],
+    cov,
+    objective: str = "max_sharpe",
+    risk_free: float = 0.0,
+    target_return: Optional[float] = None,
+    lower=0.0,
+    upper=1.0,
+    groups: Optional[Dict[str, Tuple[Sequence[int], float]]] = None,
+    x0: Optional[np.ndarray] = None,
+    max_iter: int = 200,
+) -> OptimizationResult:
+    """Long-only mean-variance optimization.
+
+    mu and cov are annualized. lower/upper are scalars or per-asset arrays.
+    groups maps a category name to (asset indices, total weight); when the
+    groups cover every asset they replace the budget constraint, so their
+    targets may sum to less than 1 (the rest stays uninvested).
+
+    The QP is solved with a vectorized active-set method (dense KKT solves);
+    SLSQP is used as a fallback, warm-started with x0 when given. Raises
+    ValueError when the constraints or target_return cannot be met.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Objetivo desconocido: {objective}. Usa uno de {', '.join(OBJECTIVES)}")
+    if objective == "target_return" and target_return is None:
+        raise ValueError("target_return es obligatorio para el objetivo target_return")
+    mu, cov, Q, A, b, lower, upper, warnings = _problem(mu, cov, lower, upper, groups)
+    n = mu.size
+    if objective == "target_return":
+        # An unreachable target would only run both solvers out of iterations
+        w_max = _max_return(mu, A, b, lower, upper)
+        if w_max is None:
+            raise ValueError("Las restricciones no tienen solución factible")
+        if target_return > float(w_max @ mu) + 1e-9:
+            raise ValueError(
+                f"target_return {target_return:.4f} no es alcanzable: el máximo con estas restricciones es {float(w_max @ mu):.4f}"
+            )
+
+    excess = mu - risk_free
+    t0 = time.perf_counter()
+    qp = _ActiveSetQP(Q, A, b, lower, upper)
+    weights = None
+    if objective == "min_variance":
+        weights = qp.solve(np.zeros(n))
+    elif objective == "target_return":
+        weights = qp.solve(np.zeros(n))
+        if weights is not None and weights @ mu < target_return - 1e-12:
+            # The return constraint binds: solve again with it as an equality
+            qp_target = _ActiveSetQP(Q, np.vstack([A, mu]), np.append(b, target_return), lower, upper)
+            qp_target.at_lower, qp_target.at_upper = qp.at_lower, qp.at_upper
+            weights = qp_target.solve(np.zeros(n))
+            qp.iterations += qp_target.iterations
+    else:
+        weights = _max_sharpe_active_set(qp, excess, cov)
+    iterations = qp.iterations
+    success, message = weights is not None, "Active-set QP converged"
+
+    if weights is None:
+        logger.info("Active-set no convergió para %s, usando SLSQP", objective)
+        constraints = [{"type": "eq", "fun": lambda w: A @ w - b, "jac": lambda w: A}]
+        if objective == "target_return":
+            constraints.append({"type": "ineq", "fun": lambda w: w @ mu - target_return, "jac": lambda w: mu})
+        if objective == "max_sharpe":
+            def fun(w):
+                var = w @ cov @ w
+                vol = np.sqrt(max(var, 1e-16))
+                ret = w @ excess
+                grad = -(excess * vol - ret * (cov @ w) / vol) / var
+                return -ret / vol, grad
+        else:
+            def fun(w):
+                cw = cov @ w
+                return w @ cw, 2.0 * cw
+        start = x0 if x0 is not None and np.shape(x0) == (n,) else _initial_weights(n, lower, upper, A if groups else None, b)
+        weights, success, message, nit = _solve_slsqp(fun, start, lower, upper, constraints, max_iter)
+        iterations += nit
+    elapsed = (time.perf_counter() - t0) * 1000
+
+    weights = np.clip(weights, lower, upper)
+    weights[np.abs(weights) < 1e-8] = 0.0
+    if not success:
+        logger.warning("Optimización %s no convergió: %s", objective, message)
+    ret, vol, sharpe = portfolio_metrics(weights, mu, cov, risk_free)
+    return OptimizationResult(
+        weights=weights,
+        expected_return=ret,
+        volatility=vol,
+        sharpe_ratio=sharpe,
+        success=success,
+        message=message,
+        iterations=iterations,
+        elapsed_ms=round(elapsed, 2),
+        objective=objective,
+        warnings=warnings,
+    )
+
+
+def _max_return(mu, A, b, lower, upper) -> Optional[np.ndarray]:
+    """Weights with the highest achievable return under the constraints (an LP)."""
+    res = linprog(-mu, A_eq=A, b_eq=b, bounds=np.column_stack([lower, upper]), method="highs")
+    return res.x if res.success else None
+
+
+def _frontier_block(Q, A, b, lower, upper, mu, targets, at_lower, at_upper):
+    """Solve consecutive target-return points, each warm-started from the previous active set."""
+    qp = _ActiveSetQP(Q, np.vstack([A, mu]), np.append(b, 0.0), lower, upper)
+    qp.at_lower, qp.at_upper = at_lower.copy(), at_upper.copy()
+    c = np.zeros(mu.size)
+    solved = []
+    for target in targets:
+        qp.b[-1] = target
+        t0 = time.perf_counter()
+        before = qp.iterations
+        w = qp.solve(c)
+        solved.append((w, qp.iterations - before, (time.perf_counter() - t0) * 1000))
+    return solved
+
+
+def efficient_frontier(
+    mu: Sequence[float],
+    cov,
+    n_points: int = 20,
+    risk_free: float = 0.0,
+    lower=0.0,
+    upper=1.0,
+    groups: Optional[Dict[str, Tuple[Sequence[int], float]]] = None,
+    workers: int = 1,
+) -> List[OptimizationResult]:
+    """Efficient frontier from the minimum-variance portfolio up to the maximum return.
+
+    Returns n_points results with evenly spaced target returns. Points are
+    solved in order so each active-set solve starts from its neighbour's
+    active set (usually one or two KKT solves per point). With workers > 1
+    the targets are split into contiguous blocks solved on threads; LAPACK
+    releases the GIL. Points the active-set method cannot solve fall back to
+    SLSQP.
+    """
+    if n_points < 2:
+        raise ValueError("n_points debe ser al menos 2")
+    mu, cov, Q, A, b, lower, upper, warnings = _problem(mu, cov, lower, upper, groups)
+    n = mu.size
+
+    t0 = time.perf_counter()
+    qp = _ActiveSetQP(Q, A, b, lower, upper)
+    w_min = qp.solve(np.zeros(n))
+    min_iterations = qp.iterations
+    if w_min is None:
+        fallback = optimize_weights(mu, cov, objective="min_variance", lower=lower, upper=upper, groups=groups)
+        w_min, min_iterations = fallback.weights, fallback.iterations
+    min_elapsed = (time.perf_counter() - t0) * 1000
+    ret_min = float(w_min @ mu)
+    w_max = _max_return(mu, A, b, lower, upper)
+    if w_max is None:
+        raise ValueError("Las restricciones no tienen solución factible")
+    ret_max = float(w_max @ mu)
+
+    solved = [(w_min, min_iterations, min_elapsed)]
+    if ret_max - ret_min > 1e-9 * max(1.0, abs(ret_max)):
+        targets = np.linspace(ret_min, ret_max, n_points)[1:]
+        blocks = [blk for blk in np.array_split(targets, max(1, min(int(workers), targets.size))) if blk.size]
+        args = [(Q, A, b, lower, upper, mu, blk, qp.at_lower, qp.at_upper) for blk in blocks]
+        if len(blocks) > 1:
+            with ThreadPoolExecutor(max_workers=len(blocks)) as pool:
+                parts = list(pool.map(lambda a: _frontier_block(*a), args))
+        else:
+            parts = [_frontier_block(*args[0])]
+        solved += [point for part in parts for point in part]
+    else:
+        targets = np.empty(0)
+        warnings.append("Todos los activos tienen el mismo retorno esperado; la frontera es un único punto")
+
+    points = []
+    for k, (w, iterations, elapsed) in enumerate(solved):
+        success, message = w is not None, "Active-set QP converged"
+        if w is None and k == len(solved) - 1:
+            # The top of the frontier is usually a vertex where the equality QP degenerates
+            w, success, message = w_max, True, "Máximo retorno (LP)"
+        elif w is None:
+            target = float(targets[k - 1])
+            logger.info("Active-set no convergió en el punto %s de la frontera, usando SLSQP", k)
+            fallback = optimize_weights(
+                mu, cov, objective="target_return", target_return=target,
+                lower=lower, upper=upper, groups=groups, x0=points[-1].weights,
+            )
+            w, success, message = fallback.weights, fallback.success, fallback.message
+            iterations, elapsed = iterations + fallback.iterations, elapsed + fallback.elapsed_ms
+        w = np.clip(w, lower, upper)
+        w[np.abs(w) < 1e-8] = 0.0
+        ret, vol, sharpe = portfolio_metrics(w, mu, cov, risk_free)
+        points.append(OptimizationResult(
+            weights=w,
+            expected_return=ret,
+            volatility=vol,
+            sharpe_ratio=sharpe,
+            success=success,
+            message=message,
+            iterations=iterations,
+            elapsed_ms=round(elapsed, 2),
+            objective="frontier",
+            warnings=warnings,
+        ))
+    return points
@@ -0,0 +1,346 @@
+import os
+import json
+import uuid
+import sqlite3
+import logging
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+try:
+    import psycopg2
+    from psycopg2.pool import ThreadedConnectionPool
+    from psycopg2.extras import execute_values
+except Exception:
+    psycopg2 = None  # type: ignore
+
+logger = logging.getLogger("portfolio-store")
+
+# Schema shared by both backends; TEXT holds JSON so SQLite and Postgres read the same rows
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS portfolios ("
+    " id TEXT PRIMARY KEY, user_id TEXT NOT NULL, name TEXT NOT NULL,"
+    " target_alloc TEXT NOT NULL, amounts TEXT, created_at TEXT NOT NULL, updated_at TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_portfolios_user_created ON portfolios(user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_portfolios_created ON portfolios(created_at)",
+    "CREATE TABLE IF NOT EXISTS positions ("
+    " portfolio_id TEXT NOT NULL, category TEXT NOT NULL, idx INTEGER NOT NULL,"
+    " symbol TEXT, name TEXT, price DOUBLE PRECISION, shares DOUBLE PRECISION, amount DOUBLE PRECISION,"
+    " data TEXT NOT NULL, PRIMARY KEY (portfolio_id, category, idx))",
+    "CREATE TABLE IF NOT EXISTS analyses ("
+    " id TEXT PRIMARY KEY, portfolio_id TEXT NOT NULL, kind TEXT NOT NULL,"
+    " analysis_id TEXT, content TEXT NOT NULL, created_at TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_analyses_portfolio ON analyses(portfolio_id, kind, created_at)",
+)
+
+_POSITION_COLUMNS = ("symbol", "name", "price", "shares", "amount")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _number(value) -> Optional[float]:
+    try:
+        return None if value is None else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class PortfolioStore(ABC):
+    """Portfolios, their allocations and the analyses generated for them.
+
+    SQL is written once with "?" placeholders; backends translate it and
+    provide connections. A saved portfolio is read back with three indexed
+    queries, without calling any upstream model again.
+    """
+
+    backend = "base"
+
+    # --- backend hooks ---
+    @abstractmethod
+    def _transaction(self):
+        """Context manager yielding a cursor; commits on success and rolls back on error."""
+
+    def _execute(self, cur, sql: str, params=()):
+        cur.execute(sql, params)
+
+    def _insert_many(self, cur, table: str, columns, rows):
+        marks = ", ".join("?" * len(columns))
+        cur.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({marks})", rows)
+
+    def close(self):
+        pass
+
+    # --- public API ---
+    def create_portfolio(self, user_id: str, name: str, target_alloc: dict, portfolio_id: Optional[str] = None) -> dict:
+        now = _now()
+        row = {
+            "id": portfolio_id or str(uuid.uuid4()),
+            "user_id": user_id,
+            "name": name,
+            "target_alloc": target_alloc,
+            "created_at": now,
+        }
+        with self._transaction() as cur:
+            self._execute(
+                cur,
+                "INSERT INTO portfolios (id, user_id, name, target_alloc, amounts, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, NULL, ?, ?)",
+                (row["id"], user_id, name, json.dumps(target_alloc), now, now),
+            )
+        return row
+
+    def save_allocation(self, portfolio_id: str, allocation: Dict[str, list], amounts: Optional[dict] = None) -> int:
+        """Replace the stored positions of a portfolio with one bulk insert. Returns the position count."""
+        rows = []
+        for category, positions in (allocation or {}).items():
+            if isinstance(positions, dict):
+                positions = list(positions.values())
+            for idx, position in enumerate(positions or []):
+                if not isinstance(position, dict):
+                    continue
+                rows.append((
+                    portfolio_id, category, idx,
+                    position.get("symbol") or position.get("ticker"), position.get("name"),
+                    _number(position.get("price")), _number(position.get("shares")), _number(position.get("amount")),
+                    json.dumps(position, ensure_ascii=False, default=str),
+                ))
+        with self._transaction() as cur:
+            self._execute(
+                cur,
+                "UPDATE portfolios SET amounts = COALESCE(?, amounts), updated_at = ? WHERE id = ?",
+                (json.dumps(amounts) if amounts is not None else None, _now(), portfolio_id),
+            )
+            if cur.rowcount == 0:
+                raise KeyError(f"Portfolio no encontrado: {portfolio_id}")
+            self._execute(cur, "DELETE FROM positions WHERE portfolio_id = ?", (portfolio_id,))
+            if rows:
+                self._insert_many(cur, "positions", ("portfolio_id", "category", "idx") + _POSITION_COLUMNS + ("data",), rows)
+        return len(rows)
+
+    def save_analysis(self, portfolio_id: str, kind: str, content, analysis_id: Optional[str] = None) -> dict:
+        """Store a generated analysis ("analysis" text or "decision" dict) for a portfolio."""
+        row = {"id": str(uuid.uuid4()), "kind": kind, "analysis_id": analysis_id, "content": content, "created_at": _now()}
+        with self._transaction() as cur:
+            self._execute(
+                cur,
+                "INSERT INTO analyses (id, portfolio_id, kind, analysis_id, content, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (row["id"], portfolio_id, kind, analysis_id, json.dumps(content, ensure_ascii=False), row["created_at"]),
+            )
+        return row
+
+    def get_portfolio(self, portfolio_id: str) -> Optional[dict]:
+        """The portfolio with its allocation and the latest analysis of each kind, or None."""
+        with self._transaction() as cur:
+            self._execute(
+                cur,
+                "SELECT id, user_id, name, target_alloc, amounts, created_at, updated_at FROM portfolios WHERE id = ?",
+                (portfolio_id,),
+            )
+            head = cur.fetchone()
+            if head is None:
+                return None
+            self._execute(
+                cur, "SELECT category, data FROM positions WHERE portfolio_id = ? ORDER BY category, idx", (portfolio_id,)
+            )
+            positions = cur.fetchall()
+            self._execute(
+                cur,
+                "SELECT kind, analysis_id, content, created_at FROM analyses WHERE portfolio_id = ? ORDER BY created_at",
+                (portfolio_id,),
+            )
+            analyses = cur.fetchall()
+        allocation: Dict[str, list] = {}
+        for category, data in positions:
+            allocation.setdefault(category, []).append(json.loads(data))
+        latest = {}
+        for kind, analysis_id, content, created_at in analyses:
+            latest[kind] = {"analysis_id": analysis_id, "content": json.loads(content), "created_at": created_at}
+        portfolio = self._head(head)
+        portfolio.update(allocation=allocation, analyses=latest)
+        return portfolio
+
+    def list_portfolios(self, user_id: str, limit: int = 50, before: Optional[str] = None) -> List[dict]:
+        """Most recent portfolios of a user (without positions); page with before=<created_at>."""
+        sql = "SELECT id, user_id, name, target_alloc, amounts, created_at, updated_at FROM portfolios WHERE user_id = ?"
+        params = [user_id]
+        if before:
+            sql += " AND created_at < ?"
+            params.append(before)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(int(limit))
+        with self._transaction() as cur:
+            self._execute(cur, sql, tuple(params))
+            return [self._head(row) for row in cur.fetchall()]
+
+    @staticmethod
+    def _head(row) -> dict:
+        pid, user_id, name, target_alloc, amounts, created_at, updated_at = row
+        return {
+            "id": pid,
+            "user_id": user_id,
+            "name": name,
+            "target_alloc": json.loads(target_alloc),
+            "amounts": json.loads(amounts) if amounts else None,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+
+class SQLitePortfolioStore(PortfolioStore):
+    """Local backend: one WAL database file, a connection per thread.
+    sqlite3 keeps its own per-connection cache of prepared statements.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._transaction() as cur:
+            for statement in SCHEMA:
+                cur.execute(statement)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        cur = conn.cursor()
+        cur.execute("BEGIN")
+        try:
+            yield cur
+            cur.execute("COMMIT")
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+        finally:
+            cur.close()
+
+
+class PostgresPortfolioStore(PortfolioStore):
+    """Postgres backend over a thread-safe psycopg2 connection pool.
+
+    The read path runs as server-side prepared statements (PREPARE once per
+    pooled connection, then EXECUTE); positions are written with a single
+    multi-row INSERT (execute_values).
+    """
+
+    backend = "postgres"
+    _PREPARED = {
+        "SELECT id, user_id, name, target_alloc, amounts, created_at, updated_at FROM portfolios WHERE id = ?":
+            ("pf_get_portfolio", "text"),
+        "SELECT category, data FROM positions WHERE portfolio_id = ? ORDER BY category, idx":
+            ("pf_get_positions", "text"),
+        "SELECT kind, analysis_id, content, created_at FROM analyses WHERE portfolio_id = ? ORDER BY created_at":
+            ("pf_get_analyses", "text"),
+    }
+
+    def __init__(self, dsn: str, min_connections: int = 1, max_connections: int = 10):
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 no está instalado; no se puede usar DATABASE_URL")
+        self.pool = ThreadedConnectionPool(min_connections, max_connections, dsn)
+        # Keyed by the connection object itself: an id() can be reused once a
+        # dropped connection is freed, and the entries go away with the connections
+        self._prepared_conns = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._ready = False
+        with self._transaction() as cur:
+            for statement in SCHEMA:
+                cur.execute(statement)
+        self._ready = True
+
+    @staticmethod
+    def _sql(sql: str) -> str:
+        return sql.replace("?", "%s")
+
+    def _prepare(self, conn, cur):
+        if not self._ready:
+            return
+        with self._lock:
+            if conn in self._prepared_conns:
+                return
+        # The pool hands a connection to one thread at a time, so nobody else prepares it meanwhile
+        for sql, (name, arg_type) in self._PREPARED.items():
+            cur.execute(f"PREPARE {name} ({arg_type}) AS {sql.replace('?', '$1')}")
+        # Commit so a later rollback of the caller's transaction cannot undo the PREPAREs
+        conn.commit()
+        with self._lock:
+            self._prepared_conns.add(conn)
+
+    @contextmanager
+    def _transaction(self):
+        conn = self.pool.getconn()
+        try:
+            with conn:  # commits on success, rolls back on error
+                with conn.cursor() as cur:
+                    self._prepare(conn, cur)
+                    yield cur
+        except (psycopg2.InterfaceError, psycopg2.OperationalError):
+            # Broken connection: drop it from the pool instead of handing it out again
+            with self._lock:
+                self._prepared_conns.discard(conn)
+            self.pool.putconn(conn, close=True)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self.pool.putconn(conn)
+
+    def _execute(self, cur, sql: str, params=()):
+        prepared = self._PREPARED.get(sql)
+        if prepared is not None:
+            cur.execute(f"EXECUTE {prepared[0]} (%s)", params)
+        else:
+            cur.execute(self._sql(sql), params)
+
+    def _insert_many(self, cur, table: str, columns, rows):
+        execute_values(cur, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s", rows, page_size=500)
+
+    def close(self):
+        self.pool.closeall()
+
+
+_store: Optional[PortfolioStore] = None
+_store_lock = threading.Lock()
+
+
+def get_portfolio_store() -> PortfolioStore:
+    """Process-wide store: Postgres when DATABASE_URL is set, otherwise a local SQLite file."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            dsn = os.getenv("DATABASE_URL")
+            if dsn:
+                _store = PostgresPortfolioStore(
+                    dsn,
+                    min_connections=int(os.getenv("DATABASE_POOL_MIN", 1)),
+                    max_connections=int(os.getenv("DATABASE_POOL_MAX", 10)),
+                )
+            else:
+                _store = SQLitePortfolioStore(os.getenv("PORTFOLIO_DB_PATH", os.path.join("data", "portfolios.sqlite3")))
+            logger.info("Almacén de portfolios: %s", _store.backend)
+        return _store
+
+
+def close_portfolio_store():
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
@@ -0,0 +1,339 @@
+import os
+import csv
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-writer assumption
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger("price-store")
+
+FIELDS = ("open", "high", "low", "close", "adj_close", "volume")
+_DTYPE = np.float64
+_COLUMN_BLOCK = 64
+
+
+def _to_days(values) -> np.ndarray:
+    """Convert dates (ISO strings, datetime64, date objects) to int64 days since epoch."""
+    return np.asarray(values, dtype="datetime64[D]").astype(np.int64)
+
+
+class PriceStore:
+    """Daily OHLCV history as dense date x ticker matrices in memory-mapped files.
+
+    Layout in `path`:
+      meta.json        tickers (column order), row count, column capacity, version,
+                       rewrite_version (last version that changed stored rows),
+                       generation (which set of matrix files is current)
+      dates.i8         int64 days since epoch, one per row (sorted, append-only)
+      <field>.f8       float64 matrix of shape (rows, capacity), row-major;
+                       <field>.<generation>.f8 once the columns have been widened
+
+    Rows are trading days, so appending a day only appends bytes to each file.
+    Readers map the files read-only; every worker shares the same page cache.
+    Missing values are NaN. Columns are reserved in blocks so new tickers rarely
+    force a rewrite; a rewrite goes to a new generation of files that only
+    becomes current when meta.json is replaced.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._meta_mtime = None
+        self._maps: Dict[str, np.ndarray] = {}
+        self._dates = np.empty(0, dtype=np.int64)
+        self.tickers: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.n_rows = 0
+        self.capacity = 0
+        self.version = 0
+        self.rewrite_version = 0
+        self.generation = 0
+        self.refresh()
+
+    # --- Metadata / mapping ---
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _data_file(self, field: str, generation: int) -> str:
+        return self._file(f"{field}.f8" if not generation else f"{field}.{generation}.f8")
+
+    def _read_meta(self) -> dict:
+        try:
+            with open(self._file("meta.json"), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"tickers": [], "n_rows": 0, "capacity": 0, "version": 0, "rewrite_version": 0, "generation": 0}
+
+    def _write_meta(self, tickers, n_rows, capacity, version, rewrite_version, generation):
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w") as f:
+            meta = {
+                "tickers": tickers, "n_rows": n_rows, "capacity": capacity,
+                "version": version, "rewrite_version": rewrite_version, "generation": generation,
+            }
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._file("meta.json"))
+
+    def refresh(self, force: bool = False) -> bool:
+        """Re-map the files if another process committed new rows. Returns True if reloaded."""
+        try:
+            mtime = os.stat(self._file("meta.json")).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if not force and mtime == self._meta_mtime:
+            return False
+        with self._lock:
+            meta = self._read_meta()
+            n_rows, capacity = int(meta["n_rows"]), int(meta["capacity"])
+            generation = int(meta.get("generation", 0))
+            maps = {}
+            if n_rows and capacity:
+                dates = np.memmap(self._file("dates.i8"), dtype=np.int64, mode="r", shape=(n_rows,))
+                for field in FIELDS:
+                    maps[field] = np.memmap(self._data_file(field, generation), dtype=_DTYPE, mode="r", shape=(n_rows, capacity))
+            else:
+                dates = np.empty(0, dtype=np.int64)
+            self.tickers = list(meta["tickers"])
+            self.index = {t: i for i, t in enumerate(self.tickers)}
+            self.n_rows, self.capacity, self.version = n_rows, capacity, int(meta.get("version", 0))
+            self.rewrite_version = int(meta.get("rewrite_version", self.version))
+            self.generation = generation
+            self._dates, self._maps = dates, maps
+            self._meta_mtime = mtime
+        return True
+
+    # --- Reads ---
+    def dates(self) -> np.ndarray:
+        self.refresh()
+        return self._dates.view("datetime64[D]")
+
+    def _row_range(self, start=None, end=None) -> Tuple[int, int]:
+        lo = 0 if start is None else int(np.searchsorted(self._dates, _to_days(start), side="left"))
+        hi = self.n_rows if end is None else int(np.searchsorted(self._dates, _to_days(end), side="right"))
+        return lo, hi
+
+    def columns(self, tickers: Optional[Sequence[str]] = None) -> np.ndarray:
+        if tickers is None:
+            return np.arange(len(self.tickers))
+        missing = [t for t in tickers if t not in self.index]
+        if missing:
+            raise KeyError(f"Tickers sin histórico: {', '.join(missing)}")
+        return np.array([self.index[t] for t in tickers], dtype=np.intp)
+
+    def slice(self, field: str = "adj_close", tickers: Optional[Sequence[str]] = None, start=None, end=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (dates, values[rows, tickers]) for a date range.
+        Without tickers the result is a zero-copy view of the mapped file.
+        """
+        if field not in FIELDS:
+            raise ValueError(f"Campo desconocido: {field}")
+        self.refresh()
+        lo, hi = self._row_range(start, end)
+        dates = self._dates[lo:hi].view("datetime64[D]")
+        if not self._maps:
+            return dates, np.empty((0, 0 if tickers is None else len(tickers)), dtype=_DTYPE)
+        data = self._maps[field]
+        if tickers is None:
+            return dates, data[lo:hi, :len(self.tickers)]
+        return dates, data[lo:hi, self.columns(tickers)]
+
+    def series(self, ticker: str, field: str = "adj_close", start=None, end=None) -> Tuple[np.ndarray, np.ndarray]:
+        dates, values = self.slice(field, [ticker], start, end)
+        return dates, values[:, 0]
+
+    def returns(self, tickers: Optional[Sequence[str]] = None, start=None, end=None, field: str = "adj_close") -> Tuple[np.ndarray, np.ndarray]:
+        """Simple daily returns; missing prices yield NaN returns."""
+        dates, prices = self.slice(field, tickers, start, end)
+        if prices.shape[0] < 2:
+            return dates[1:], np.empty((0, prices.shape[1]), dtype=_DTYPE)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rets = prices[1:] / prices[:-1] - 1.0
+        return dates[1:], rets
+
+    # --- Writes ---
+    @contextmanager
+    def _write_lock(self):
+        with open(self._file("write.lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                self.refresh(force=True)
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def _widen(self, capacity: int, generation: int):
+        """Copy every matrix into `generation` files with `capacity` columns.
+        Nothing reads them until meta.json names that generation, so a failed
+        or interrupted write leaves the current files untouched.
+        """
+        for field in FIELDS:
+            widened = np.full((self.n_rows, capacity), np.nan, dtype=_DTYPE)
+            if self.n_rows and self.capacity:
+                widened[:, :self.capacity] = self._maps[field]
+            widened.tofile(self._data_file(field, generation))
+        logger.info("Capacidad de columnas ampliada a %s", capacity)
+
+    def _truncate(self, path: str, size: int):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+    def write(self, dates: Iterable, tickers: Sequence[str], data: Dict[str, np.ndarray]):
+        """Upsert a block of values.
+
+        dates: (rows,) ; tickers: (cols,) ; data: {field: array (rows, cols)}.
+        Dates after the last stored day are appended; dates already stored are
+        updated in place, only for the fields given and never with NaN (NaN
+        means "no value" and keeps what is stored). Inserting before the last
+        stored day is not supported. Everything is validated before any file
+        is touched.
+        """
+        days = _to_days(list(dates))
+        order = np.argsort(days, kind="stable")
+        days = days[order]
+        unknown = [f for f in data if f not in FIELDS]
+        if unknown:
+            raise ValueError(f"Campos desconocidos: {', '.join(unknown)}")
+        data = {f: np.asarray(v, dtype=_DTYPE) for f, v in data.items()}
+        for field, values in data.items():
+            if values.shape != (days.size, len(tickers)):
+                raise ValueError(f"{field}: se esperaba forma {(days.size, len(tickers))}, recibida {values.shape}")
+        data = {f: v[order] for f, v in data.items()}
+        with self._write_lock():
+            existing = np.isin(days, self._dates)
+            new_days = np.unique(days[~existing])
+            last = self._dates[-1] if self.n_rows else None
+            if last is not None and new_days.size and new_days[0] <= last:
+                raise ValueError("Solo se pueden añadir fechas posteriores al último día almacenado")
+
+            tickers_all = list(self.tickers)
+            index = dict(self.index)
+            for t in tickers:
+                if t not in index:
+                    index[t] = len(tickers_all)
+                    tickers_all.append(t)
+            cols = np.array([index[t] for t in tickers], dtype=np.intp)
+            capacity = max(self.capacity, _COLUMN_BLOCK, -(-len(tickers_all) // _COLUMN_BLOCK) * _COLUMN_BLOCK)
+            generation = self.generation
+            if capacity > self.capacity and self.n_rows:
+                # Rare path: widen into a new generation. Readers keep their old mapping until they refresh.
+                generation += 1
+                self._widen(capacity, generation)
+
+            if existing.any():
+                rows = np.searchsorted(self._dates, days[existing])
+                for field, values in data.items():
+                    mm = np.memmap(self._data_file(field, generation), dtype=_DTYPE, mode="r+", shape=(self.n_rows, capacity))
+                    block = values[existing]
+                    current = mm[rows[:, None], cols[None, :]]
+                    mm[rows[:, None], cols[None, :]] = np.where(np.isnan(block), current, block)
+                    mm.flush()
+                    del mm
+
+            if new_days.size:
+                # Drop bytes of any append that crashed before meta.json was committed
+                for field in FIELDS:
+                    self._truncate(self._data_file(field, generation), self.n_rows * capacity * _DTYPE().itemsize)
+                self._truncate(self._file("dates.i8"), self.n_rows * 8)
+                rows = np.searchsorted(new_days, days[~existing])
+                for field in FIELDS:
+                    block = np.full((new_days.size, capacity), np.nan, dtype=_DTYPE)
+                    if field in data:
+                        block[rows[:, None], cols[None, :]] = data[field][~existing]
+                    with open(self._data_file(field, generation), "ab") as f:
+                        f.write(block.tobytes())
+                with open(self._file("dates.i8"), "ab") as f:
+                    f.write(new_days.astype(np.int64).tobytes())
+
+            # Readers only see the new rows (and a new generation) once meta.json is
+            # replaced. Caches built on earlier versions stay valid for appends but
+            # not for rewritten rows.
+            version = self.version + 1
+            rewrite_version = version if existing.any() else self.rewrite_version
+            self._write_meta(tickers_all, self.n_rows + int(new_days.size), capacity, version, rewrite_version, generation)
+            if generation != self.generation:
+                for field in FIELDS:
+                    try:
+                        os.remove(self._data_file(field, self.generation))
+                    except OSError:  # never written, or still mapped on Windows
+                        pass
+        self.refresh(force=True)
+
+    def append_day(self, date, values: Dict[str, Dict[str, float]]):
+        """Append (or update) one trading day: values = {ticker: {field: value}}.
+        Fields a ticker leaves out keep their stored value.
+        """
+        tickers = list(values)
+        data = {
+            field: np.array([[values[t].get(field, np.nan) for t in tickers]], dtype=_DTYPE)
+            for field in FIELDS
+            if any(field in values[t] for t in tickers)
+        }
+        self.write([date], tickers, data)
+
+    def load_csv(self, path: str) -> int:
+        """Load a long-format CSV: date,ticker,open,high,low,close,adj_close,volume.
+        Missing adj_close falls back to close. Returns the number of rows read.
+        """
+        with open(path, newline="") as f:
+            reader = csv.DictReader(f)
+            cols = {c.lower().strip(): c for c in reader.fieldnames or []}
+            if "date" not in cols or ("ticker" not in cols and "symbol" not in cols):
+                raise ValueError("El CSV necesita columnas date y ticker")
+            ticker_col = cols.get("ticker") or cols.get("symbol")
+            records = list(reader)
+        if not records:
+            return 0
+        dates = sorted({r[cols["date"]].strip()[:10] for r in records})
+        tickers = sorted({r[ticker_col].strip().upper() for r in records})
+        d_idx = {d: i for i, d in enumerate(dates)}
+        t_idx = {t: i for i, t in enumerate(tickers)}
+        data = {f: np.full((len(dates), len(tickers)), np.nan, dtype=_DTYPE) for f in FIELDS}
+        for r in records:
+            i, j = d_idx[r[cols["date"]].strip()[:10]], t_idx[r[ticker_col].strip().upper()]
+            for field in FIELDS:
+                raw = r.get(cols.get(field, field)) if field in cols else None
+                if field == "adj_close" and not raw and "close" in cols:
+                    raw = r.get(cols["close"])
+                if raw not in (None, ""):
+                    try:
+                        data[field][i, j] = float(raw)
+                    except ValueError:
+                        pass
+        self.write(dates, tickers, data)
+        logger.info("Cargadas %s filas (%s días, %s tickers) desde %s", len(records), len(dates), len(tickers), path)
+        return len(records)
+
+
+_store: Optional[PriceStore] = None
+
+
+def get_price_store() -> PriceStore:
+    """Return the process-wide store at PRICE_STORE_DIR (default data/prices)."""
+    global _store
+    if _store is None:
+        _store = PriceStore(os.getenv("PRICE_STORE_DIR", os.path.join("data", "prices")))
+    return _store
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) >= 3 and sys.argv[1] == "load":
+        store = get_price_store()
+        for csv_path in sys.argv[2:]:
+            store.load_csv(csv_path)
+        print(f"{len(store.tickers)} tickers, {store.n_rows} días en {store.path}")
+    else:
+        print("Uso: python price_store.py load archivo.csv [...]")
@@ -0,0 +1,252 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+import metrics
+from tracing import span
+from upstream_policy import budget, remaining
+
+logger = logging.getLogger("rate-limiter")
+
+
+class RateLimitExceeded(Exception):
+    """The call would have to wait longer than the caller allows."""
+
+    def __init__(self, name: str, wait: float):
+        super().__init__(f"Límite de peticiones de {name} alcanzado; siguiente hueco en {wait:.0f}s")
+        self.name = name
+        self.wait = wait
+
+
+def _day(now: float) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(now))
+
+
+def _seconds_to_midnight(now: float) -> float:
+    return 86400.0 - (now % 86400.0)
+
+
+class RateLimiter:
+    """Token bucket with a per-minute rate and an optional daily quota.
+
+    The bucket lives in a SQLite row shared by every worker process on the
+    host, so the quota holds for the whole deployment rather than per process.
+    Within a process callers queue in arrival order behind an asyncio.Lock;
+    only the head of the queue polls the shared bucket and it sleeps on the
+    event loop (never the thread) until the next token is due. Daily quotas
+    reset at midnight UTC.
+    """
+
+    def __init__(self, name: str, per_minute: float, per_day: int = 0, burst: Optional[float] = None,
+                 path: Optional[str] = None, max_wait: float = 60.0):
+        if per_minute <= 0:
+            raise ValueError("per_minute debe ser positivo")
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst if burst is not None else per_minute)
+        self.per_day = int(per_day)
+        self.max_wait = max_wait
+        self.path = path or os.getenv("RATE_LIMIT_PATH", os.path.join(".cache", "rate_limits.sqlite3"))
+        self._local = threading.local()
+        self._lock: Optional[asyncio.Lock] = None
+        self._thread_lock = threading.Lock()
+        self._waiting = 0
+        self._waits = deque(maxlen=1024)
+        self.counters = {"acquired": 0, "waited": 0, "rejected": 0, "max_queue": 0, "wait_seconds": 0.0}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL,"
+            " day TEXT NOT NULL, day_count INTEGER NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _take(self) -> float:
+        """Take one token if available; otherwise return the seconds until one is due."""
+        now = time.time()
+        today = _day(now)
+        conn = self._conn()
+        # IMMEDIATE takes the write lock up front so two workers cannot read the same tokens
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at, day, day_count FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            if row is None:
+                tokens, day_count = self.capacity, 0
+            else:
+                tokens = min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+                day_count = row[3] if row[2] == today else 0
+            if self.per_day and day_count >= self.per_day:
+                wait = _seconds_to_midnight(now)
+            elif tokens >= 1.0:
+                tokens -= 1.0
+                day_count += 1
+                wait = 0.0
+            else:
+                wait = (1.0 - tokens) / self.rate
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated_at, day, day_count) VALUES (?, ?, ?, ?, ?)",
+                (self.name, tokens, now, today, day_count),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def _enter(self):
+        with self._thread_lock:
+            self._waiting += 1
+            self.counters["max_queue"] = max(self.counters["max_queue"], self._waiting)
+        metrics.add("rate_limit_queue_depth", 1, limiter=self.name)
+
+    def _leave(self):
+        with self._thread_lock:
+            self._waiting -= 1
+        metrics.add("rate_limit_queue_depth", -1, limiter=self.name)
+
+    def _record(self, waited: float):
+        with self._thread_lock:
+            self.counters["acquired"] += 1
+            self.counters["wait_seconds"] += waited
+            if waited > 0.01:
+                self.counters["waited"] += 1
+            self._waits.append(waited)
+        metrics.observe("rate_limit_wait_seconds", waited, limiter=self.name)
+
+    def _reject(self, wait: float):
+        with self._thread_lock:
+            self.counters["rejected"] += 1
+        metrics.inc("rate_limit_rejections_total", limiter=self.name)
+        logger.warning("%s: petición rechazada, siguiente hueco en %.1fs", self.name, wait)
+        raise RateLimitExceeded(self.name, wait)
+
+    async def acquire(self, max_wait: Optional[float] = None):
+        """Wait for a token in FIFO order, without blocking the event loop.
+
+        Raises RateLimitExceeded when the next token is further away than
+        max_wait (for instance when the daily quota is spent) or than the
+        time left before the request deadline, and DeadlineExceeded without
+        taking a token when that deadline has already passed.
+        """
+        budget(None, f"rate_limit:{self.name}")
+        limit = remaining(self.max_wait if max_wait is None else max_wait)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        start = time.monotonic()
+        self._enter()
+        try:
+            # asyncio.Lock hands over to waiters in arrival order
+            with span("rate_limit", self.name):
+                async with self._lock:
+                    while True:
+                        # The deadline may have passed while queued behind other callers
+                        budget(None, f"rate_limit:{self.name}")
+                        wait = await asyncio.to_thread(self._take)
+                        if wait <= 0:
+                            break
+                        if time.monotonic() - start + wait > limit:
+                            self._reject(wait)
+                        await asyncio.sleep(wait)
+        finally:
+            self._leave()
+        self._record(time.monotonic() - start)
+
+    def acquire_sync(self, max_wait: Optional[float] = None):
+        """Blocking acquire for synchronous callers (scripts, worker threads)."""
+        limit = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+        self._enter()
+        try:
+            while True:
+                wait = self._take()
+                if wait <= 0:
+                    break
+                if time.monotonic() - start + wait > limit:
+                    self._reject(wait)
+                time.sleep(wait)
+        finally:
+            self._leave()
+        self._record(time.monotonic() - start)
+
+    def state(self) -> dict:
+        """Shared bucket state as seen by every worker."""
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT tokens, updated_at, day, day_count FROM buckets WHERE name = ?", (self.name,)
+        ).fetchone()
+        if row is None:
+            return {"tokens": self.capacity, "day_count": 0}
+        return {
+            "tokens": round(min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate), 3),
+            "day_count": row[3] if row[2] == _day(now) else 0,
+        }
+
+    def stats(self) -> dict:
+        with self._thread_lock:
+            counters = dict(self.counters)
+            waits = sorted(self._waits)
+        stats = {
+            "per_minute": round(self.rate * 60, 3),
+            "per_day": self.per_day or None,
+            "queue_depth": self._waiting,
+            **counters,
+            "wait_seconds": round(counters["wait_seconds"], 3),
+        }
+        if waits:
+            stats["wait_p50"] = round(waits[len(waits) // 2], 3)
+            stats["wait_p95"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3)
+            stats["wait_max"] = round(waits[-1], 3)
+        try:
+            stats.update(self.state())
+        except sqlite3.Error as e:
+            logger.warning("No se pudo leer el estado de %s: %s", self.name, e)
+        return stats
+
+
+# Default quotas per provider; 0 per minute disables the limiter.
+# Alpha Vantage free plan: 5 calls per minute and 25 per day.
+_DEFAULTS = {
+    "alphavantage": (5, 25),
+    "perplexity": (0, 0),
+    "claude": (0, 0),
+}
+
+_limiters: Dict[str, Optional[RateLimiter]] = {}
+
+
+def get_rate_limiter(name: str) -> Optional[RateLimiter]:
+    """Return the process-wide limiter for a provider, or None if it has no quota.
+
+    Quotas come from <NAME>_RATE_PER_MINUTE / <NAME>_RATE_PER_DAY.
+    """
+    if name not in _limiters:
+        per_minute, per_day = _DEFAULTS.get(name, (0, 0))
+        prefix = name.upper()
+        try:
+            per_minute = float(os.getenv(f"{prefix}_RATE_PER_MINUTE", per_minute))
+            per_day = int(os.getenv(f"{prefix}_RATE_PER_DAY", per_day))
+        except ValueError:
+            logger.error("Cuota inválida para %s; se usa la predeterminada", name)
+        _limiters[name] = RateLimiter(name, per_minute, per_day) if per_minute > 0 else None
+    return _limiters[name]
+
+
+def rate_limiter_stats() -> dict:
+    return {name: limiter.stats() for name, limiter in _limiters.items() if limiter is not None}
@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("result-cache")
+
+# Writes between eviction passes; the table may overshoot max_entries by this much per worker
+_EVICT_EVERY = 64
+
+
+def make_key(namespace: str, **params) -> str:
+    """Build a stable cache key from a namespace and its parameters."""
+    return f"{namespace}:{json.dumps(params, sort_keys=True, default=str)}"
+
+
+class TieredCache:
+    """Two-tier TTL cache for upstream results.
+
+    Tier 1 is an in-process LRU dict. Tier 2 is a SQLite database in WAL mode
+    shared by every worker process on the host. Values must be JSON
+    serializable; they are stored serialized so callers always get a fresh copy.
+
+    With stale_ttl > 0 expired rows are kept that much longer so callers can
+    fall back to them (get_stale) when the upstream fails.
+    """
+
+    def __init__(self, path: str, ttl: float = 3600, memory_size: int = 256, max_entries: int = 5000, stale_ttl: float = 0):
+        self.path = path
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats_counters = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0, "stale_hits": 0, "sets": 0, "evictions": 0, "errors": 0,
+        }
+        # Called as listener(key, value) after every set (e.g. to record upstream results)
+        self.listeners: List[Callable[[str, Any], None]] = []
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed_at)")
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache(expires_at)")
+        self._writes = 0
+
+    @classmethod
+    def from_env(cls) -> "TieredCache":
+        return cls(
+            path=os.getenv("RESULT_CACHE_PATH", os.path.join(".cache", "results.sqlite3")),
+            ttl=float(os.getenv("RESULT_CACHE_TTL", 3600)),
+            memory_size=int(os.getenv("RESULT_CACHE_MEMORY_SIZE", 256)),
+            max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 5000)),
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats_counters[name] += 1
+
+    def _memory_get(self, key: str, now: float) -> Optional[str]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, raw = entry
+            if expires_at <= now:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return raw
+
+    def _memory_set(self, key: str, raw: str, expires_at: float):
+        with self._lock:
+            self._memory[key] = (expires_at, raw)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        raw = self._memory_get(key, now)
+        if raw is not None:
+            self._count("memory_hits")
+            return json.loads(raw)
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            logger.warning("Cache read error for %s: %s", key, e)
+            self._count("errors")
+            return None
+        raw, expires_at = row
+        self._memory_set(key, raw, expires_at)
+        self._count("disk_hits")
+        return json.loads(raw)
+
+    def get_many(self, keys) -> Dict[str, Any]:
+        """Look up several keys at once; the disk tier is read with a single query."""
+        now = time.time()
+        found, missing = {}, []
+        for key in dict.fromkeys(keys):
+            raw = self._memory_get(key, now)
+            if raw is not None:
+                self._count("memory_hits")
+                found[key] = json.loads(raw)
+            else:
+                missing.append(key)
+        if not missing:
+            return found
+        try:
+            conn = self._conn()
+            rows = []
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(missing), 500):
+                part = missing[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows += conn.execute(
+                    f"SELECT key, value, expires_at FROM cache WHERE key IN ({marks}) AND expires_at > ?", (*part, now)
+                ).fetchall()
+            if rows:
+                conn.executemany("UPDATE cache SET accessed_at = ? WHERE key = ?", [(now, row[0]) for row in rows])
+        except sqlite3.Error as e:
+            logger.warning("Cache read error for %s keys: %s", len(missing), e)
+            self._count("errors")
+            return found
+        for key, raw, expires_at in rows:
+            self._memory_set(key, raw, expires_at)
+            found[key] = json.loads(raw)
+        with self._lock:
+            self.stats_counters["disk_hits"] += len(rows)
+            self.stats_counters["misses"] += len(missing) - len(rows)
+        return found
+
+    def get_stale(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Return (value, seconds since it expired) even if expired, or None if not retained."""
+        try:
+            row = self._conn().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Cache read error for %s: %s", key, e)
+            self._count("errors")
+            return None
+        if row is None:
+            return None
+        age = time.time() - row[1]
+        if age > 0:
+            self._count("stale_hits")
+        return json.loads(row[0]), max(0.0, age)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        raw = json.dumps(value, default=str)
+        self._memory_set(key, raw, expires_at)
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, raw, expires_at, now),
+            )
+            self._count("sets")
+            with self._lock:
+                self._writes += 1
+                due = self._writes % _EVICT_EVERY == 1
+            if due:
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            logger.warning("Cache write error for %s: %s", key, e)
+            self._count("errors")
+        for listener in self.listeners:
+            try:
+                listener(key, value)
+            except Exception as e:
+                logger.warning("Cache listener error for %s: %s", key, e)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        deleted = conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now - self.stale_ttl,)).rowcount
+        (count,) = conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            deleted += conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)", (overflow,)
+            ).rowcount
+        if deleted > 0:
+            with self._lock:
+                self.stats_counters["evictions"] += deleted
+
+    def delete(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logger.warning("Cache delete error for %s: %s", key, e)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        self._conn().execute("DELETE FROM cache")
+
+    async def get_async(self, key: str) -> Optional[Any]:
+        # Memory hits are answered inline; only the disk tier goes to a thread
+        raw = self._memory_get(key, time.time())
+        if raw is not None:
+            self._count("memory_hits")
+            return json.loads(raw)
+        return await asyncio.to_thread(self.get, key)
+
+    async def get_many_async(self, keys) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get_many, list(keys))
+
+    async def set_async(self, key: str, value: Any, ttl: Optional[float] = None):
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.stats_counters)
+            memory_entries = len(self._memory)
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        try:
+            (disk_entries,) = self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()
+        except sqlite3.Error:
+            disk_entries = None
+        counters.update({
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            "memory_entries": memory_entries,
+            "disk_entries": disk_entries,
+            "ttl": self.ttl,
+        })
+        return counters
+
+
+_cache: Optional[TieredCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[TieredCache]:
+    """Return the process-wide result cache, or None when disabled (RESULT_CACHE_TTL=0)."""
+    global _cache
+    if float(os.getenv("RESULT_CACHE_TTL", 3600)) <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = TieredCache.from_env()
+            except Exception as e:
+                logger.error("No se pudo inicializar la cache de resultados: %s", e)
+                return None
+        return _cache
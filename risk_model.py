@@ -0,0 +1,297 @@
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from price_store import PriceStore, get_price_store
+
+logger = logging.getLogger("risk-model")
+
+TRADING_DAYS = 252
+ESTIMATORS = ("sample", "ewma", "ledoit_wolf")
+# RiskMetrics daily decay
+EWMA_DECAY = 0.94
+
+
+def annualized_moments(returns: np.ndarray, periods_per_year: int = TRADING_DAYS) -> Tuple[np.ndarray, np.ndarray]:
+    """Annualized mean and covariance of daily simple returns, ignoring rows with gaps."""
+    returns = np.asarray(returns, dtype=float)
+    complete = returns[~np.isnan(returns).any(axis=1)]
+    if complete.shape[0] < 2:
+        raise ValueError("Histórico insuficiente para estimar la covarianza")
+    n = returns.shape[1]
+    mu = complete.mean(axis=0) * periods_per_year
+    cov = np.cov(complete, rowvar=False, ddof=1).reshape(n, n) * periods_per_year
+    return mu, cov
+
+
+@dataclass
+class RiskEstimate:
+    tickers: Tuple[str, ...]
+    mu: np.ndarray
+    cov: np.ndarray
+    estimator: str
+    start: Optional[str]
+    end: Optional[str]
+    observations: int
+    shrinkage: Optional[float] = None
+
+    def correlation(self) -> np.ndarray:
+        vol = np.sqrt(np.clip(np.diag(self.cov), 0.0, None))
+        scale = np.where(vol > 0, vol, 1.0)
+        corr = self.cov / np.outer(scale, scale)
+        np.fill_diagonal(corr, 1.0)
+        return corr
+
+    def to_dict(self, correlation: bool = False) -> dict:
+        matrix = self.correlation() if correlation else self.cov
+        return {
+            "tickers": list(self.tickers),
+            "estimator": self.estimator,
+            "start": self.start,
+            "end": self.end,
+            "observations": self.observations,
+            "shrinkage": None if self.shrinkage is None else round(self.shrinkage, 6),
+            "expected_returns": np.round(self.mu, 8).tolist(),
+            "volatility": np.round(np.sqrt(np.clip(np.diag(self.cov), 0.0, None)), 8).tolist(),
+            "correlation" if correlation else "covariance": np.round(matrix, 10).tolist(),
+        }
+
+
+class _WindowStats:
+    """Running sums over the complete rows of a window of daily returns.
+
+    Holds sum(r), sum(r r'), and the fourth-moment sums the Ledoit-Wolf
+    shrinkage intensity needs, so rows can be added when a day arrives and
+    removed when it leaves the window in O(N^2), instead of O(T N^2) for a
+    full recomputation. The EWMA covariance is updated recursively.
+    """
+
+    def __init__(self, n: int, decay: float):
+        self.n = n
+        self.decay = decay
+        self.count = 0
+        self.s1 = np.zeros(n)
+        self.s2 = np.zeros((n, n))
+        self.sa = 0.0           # sum of r'r
+        self.sa2 = 0.0          # sum of (r'r)^2
+        self.sar = np.zeros(n)  # sum of (r'r) r
+        self.ewma = np.zeros((n, n))
+        self.updates = 0
+
+    @staticmethod
+    def _complete(rows: np.ndarray) -> np.ndarray:
+        return rows[~np.isnan(rows).any(axis=1)]
+
+    def _accumulate(self, rows: np.ndarray, sign: float):
+        a = np.einsum("ij,ij->i", rows, rows)
+        self.count += int(sign) * rows.shape[0]
+        self.s1 += sign * rows.sum(axis=0)
+        self.s2 += sign * (rows.T @ rows)
+        self.sa += sign * float(a.sum())
+        self.sa2 += sign * float(a @ a)
+        self.sar += sign * (a @ rows)
+
+    def build(self, rows: np.ndarray):
+        rows = self._complete(rows)
+        self._accumulate(rows, 1.0)
+        if rows.shape[0]:
+            # Normalized exponential weights, newest row heaviest
+            weights = (1.0 - self.decay) * self.decay ** np.arange(rows.shape[0] - 1, -1, -1)
+            weights /= weights.sum()
+            self.ewma = (rows * weights[:, None]).T @ rows
+
+    def add(self, rows: np.ndarray):
+        rows = self._complete(rows)
+        self._accumulate(rows, 1.0)
+        for r in rows:
+            self.ewma *= self.decay
+            self.ewma += (1.0 - self.decay) * np.outer(r, r)
+        self.updates += rows.shape[0]
+
+    def remove(self, rows: np.ndarray):
+        # The EWMA weight of a row leaving the window is decay**window, negligible
+        rows = self._complete(rows)
+        self._accumulate(rows, -1.0)
+        self.updates += rows.shape[0]
+
+    def estimate(self, estimator: str) -> Tuple[np.ndarray, np.ndarray, Optional[float]]:
+        """Daily (mean, covariance, shrinkage) for the estimator."""
+        t = self.count
+        if t < 2:
+            raise ValueError("Histórico insuficiente para estimar la covarianza")
+        mean = self.s1 / t
+        if estimator == "ewma":
+            return mean, self.ewma.copy(), None
+        scatter = self.s2 - t * np.outer(mean, mean)  # sum of centered x x'
+        if estimator == "sample":
+            return mean, scatter / (t - 1), None
+
+        # Ledoit-Wolf (2004) shrinkage towards a scaled identity
+        s = scatter / t
+        n = self.n
+        m = np.trace(s) / n
+        s_norm2 = float(np.sum(s * s))
+        d2 = s_norm2 - n * m * m
+        # sum_t (x_t'x_t)^2 with x_t = r_t - mean, expanded over the running sums
+        c = float(mean @ mean)
+        fourth = (
+            self.sa2
+            + 4.0 * float(mean @ self.s2 @ mean)
+            + t * c * c
+            - 4.0 * float(self.sar @ mean)
+            + 2.0 * c * self.sa
+            - 4.0 * c * float(self.s1 @ mean)
+        )
+        b2 = min(max((fourth - t * s_norm2) / (t * t), 0.0), d2)
+        shrinkage = b2 / d2 if d2 > 0 else 1.0
+        cov = shrinkage * m * np.eye(n) + (1.0 - shrinkage) * s
+        return mean, cov, float(shrinkage)
+
+
+class _Entry:
+    def __init__(self, stats: _WindowStats, lo: int, hi: int, version: int):
+        self.stats = stats
+        self.lo = lo
+        self.hi = hi
+        self.version = version
+        self.estimates = {}
+        self.lock = threading.Lock()
+
+
+class CovarianceService:
+    """Covariance/correlation estimates over the local price history.
+
+    Entries are keyed by (universe, window, end date). When the store only
+    appended days since an entry was built, its window is slid forward by
+    adding the new return rows and removing the ones that fell out;
+    rewritten rows force a rebuild. Entries are rebuilt from scratch after
+    `window` incremental updates to shed accumulated rounding error.
+    """
+
+    def __init__(self, store: Optional[PriceStore] = None, max_entries: int = 64, decay: float = EWMA_DECAY):
+        self._store = store
+        self.max_entries = max_entries
+        self.decay = decay
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "incremental": 0, "rebuilds": 0}
+
+    @property
+    def store(self) -> PriceStore:
+        return self._store if self._store is not None else get_price_store()
+
+    def _returns(self, tickers, lo: int, hi: int) -> np.ndarray:
+        """Return rows [lo, hi): row i is the return from price row i-1 to i."""
+        if hi <= lo:
+            return np.empty((0, len(tickers)))
+        dates = self.store.dates()
+        _, prices = self.store.slice("adj_close", list(tickers), dates[lo - 1], dates[hi - 1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return prices[1:] / prices[:-1] - 1.0
+
+    def _rows(self, start, end, window: Optional[int]) -> Tuple[int, int]:
+        dates = self.store.dates().astype(np.int64)
+        hi = len(dates) if end is None else int(np.searchsorted(dates, np.datetime64(end, "D").astype(np.int64), side="right"))
+        if start is not None:
+            lo = int(np.searchsorted(dates, np.datetime64(start, "D").astype(np.int64), side="left")) + 1
+        else:
+            lo = hi - int(window or TRADING_DAYS)
+        return max(lo, 1), hi
+
+    def _build(self, tickers, lo, hi) -> _WindowStats:
+        stats = _WindowStats(len(tickers), self.decay)
+        stats.build(self._returns(tickers, lo, hi))
+        self.counters["rebuilds"] += 1
+        return stats
+
+    def estimate(
+        self,
+        tickers: Sequence[str],
+        estimator: str = "ledoit_wolf",
+        window: Optional[int] = TRADING_DAYS,
+        start=None,
+        end=None,
+    ) -> RiskEstimate:
+        """Annualized estimate for the tickers.
+
+        The sample uses the `window` trading days up to `end` (default: the
+        latest day), or every day from `start` when start is given.
+        """
+        if estimator not in ESTIMATORS:
+            raise ValueError(f"Estimador desconocido: {estimator}. Usa uno de {', '.join(ESTIMATORS)}")
+        store = self.store
+        store.refresh()
+        self.store.columns(tickers)  # KeyError for tickers without history
+        tickers = tuple(tickers)
+        lo, hi = self._rows(start, end, window)
+        key = (tickers, None if start is not None else int(window or TRADING_DAYS), str(start), str(end))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(None, lo, hi, -1)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        with entry.lock:
+            moved = max(0, hi - max(entry.hi, lo)) + max(0, min(lo, entry.hi) - entry.lo)
+            rebuild = (
+                entry.stats is None
+                or entry.version < store.rewrite_version  # stored rows changed under the entry
+                or lo < entry.lo or hi < entry.hi
+                or moved >= hi - lo                        # cheaper to start over
+                or entry.stats.updates + moved > hi - lo   # shed accumulated rounding error
+            )
+            if rebuild:
+                entry.stats = self._build(tickers, lo, hi)
+            elif (lo, hi) != (entry.lo, entry.hi):
+                # Only days were appended: slide the window
+                entry.stats.add(self._returns(tickers, max(entry.hi, lo), hi))
+                entry.stats.remove(self._returns(tickers, entry.lo, min(lo, entry.hi)))
+                self.counters["incremental"] += 1
+            elif estimator in entry.estimates:
+                entry.version = store.version
+                self.counters["hits"] += 1
+                return entry.estimates[estimator]
+            if rebuild or (lo, hi) != (entry.lo, entry.hi):
+                entry.estimates = {}
+            entry.lo, entry.hi, entry.version = lo, hi, store.version
+
+            mean, cov, shrinkage = entry.stats.estimate(estimator)
+            dates = store.dates()
+            result = RiskEstimate(
+                tickers=tickers,
+                mu=mean * TRADING_DAYS,
+                cov=cov * TRADING_DAYS,
+                estimator=estimator,
+                start=str(dates[lo]) if lo < hi else None,
+                end=str(dates[hi - 1]) if lo < hi else None,
+                observations=entry.stats.count,
+                shrinkage=shrinkage,
+            )
+            result.mu.flags.writeable = False
+            result.cov.flags.writeable = False
+            entry.estimates[estimator] = result
+            return result
+
+    def moments(self, tickers: Sequence[str], estimator: str = "ledoit_wolf", window: Optional[int] = TRADING_DAYS, start=None, end=None) -> Tuple[np.ndarray, np.ndarray]:
+        estimate = self.estimate(tickers, estimator, window, start, end)
+        return estimate.mu, estimate.cov
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), **self.counters}
+
+
+_service: Optional[CovarianceService] = None
+
+
+def get_covariance_service() -> CovarianceService:
+    global _service
+    if _service is None:
+        _service = CovarianceService()
+    return _service
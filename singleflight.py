@@ -0,0 +1,98 @@
+import re
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+import metrics
+from upstream_policy import SharedDeadline, shared_deadline, within_deadline
+
+logger = logging.getLogger("singleflight")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_key(*parts: Any) -> str:
+    """Hash the parts of an upstream request, ignoring whitespace differences."""
+    text = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(_WHITESPACE.sub(" ", text).strip().encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Coalesce concurrent identical async calls into one upstream request.
+
+    The first caller for a key starts the call as a task; callers arriving
+    while it is running await the same task and receive its result or its
+    exception. The task is shielded so one caller disconnecting does not
+    cancel the call for everyone else; it is cancelled once no caller is
+    waiting for it. The task runs under the latest deadline among its
+    waiters, while each caller's own deadline bounds only its wait.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self._deadlines: Dict[str, SharedDeadline] = {}
+        self.counters = {"calls": 0, "executions": 0, "coalesced": 0, "errors": 0, "abandoned": 0, "max_waiters": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.counters["calls"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self.counters["executions"] += 1
+            metrics.inc("singleflight_calls_total", provider=self.name, outcome="executed")
+            shared = self._deadlines[key] = SharedDeadline()
+            at = shared.join()
+            with shared_deadline(shared):
+                task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self._waiters[key] = 1
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        else:
+            self.counters["coalesced"] += 1
+            metrics.inc("singleflight_calls_total", provider=self.name, outcome="coalesced")
+            shared = self._deadlines[key]
+            at = shared.join()
+            self._waiters[key] += 1
+            self.counters["max_waiters"] = max(self.counters["max_waiters"], self._waiters[key])
+            logger.info("%s: reutilizando llamada en curso (%s esperando)", self.name, self._waiters[key])
+        try:
+            return await within_deadline(asyncio.shield(task), self.name)
+        finally:
+            shared.leave(at)
+            if not task.done() and self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+                if not self._waiters[key]:
+                    logger.info("%s: nadie espera ya la llamada en curso; se cancela", self.name)
+                    self.counters["abandoned"] += 1
+                    task.cancel()
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._waiters.pop(key, None)
+            self._deadlines.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.counters["errors"] += 1
+
+    def stats(self) -> dict:
+        counters = dict(self.counters)
+        counters["in_flight"] = len(self._inflight)
+        return counters
+
+
+_groups: Dict[str, SingleFlight] = {}
+
+
+def get_singleflight(name: str) -> SingleFlight:
+    """Return the process-wide coalescing group for an upstream provider."""
+    group = _groups.get(name)
+    if group is None:
+        group = _groups[name] = SingleFlight(name)
+    return group
+
+
+def singleflight_stats() -> dict:
+    return {name: group.stats() for name, group in _groups.items()}
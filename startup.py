@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import builtins
+import logging
+import threading
+import importlib
+import importlib.util
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("startup")
+
+
+class StartupReport:
+    """Import-time and startup-time breakdown of one worker process.
+
+    Top-level imports made between track_imports() and stop_imports() are
+    timed individually (cumulative, like `python -X importtime`), lifespan
+    phases are timed with phase(), and modules loaded lazily later are added
+    as they happen. `STARTUP_BUDGET_MS` turns an over-budget startup into a
+    warning (and a failing exit code for `python startup.py`).
+    """
+
+    def __init__(self, budget_ms: Optional[float] = None):
+        self.created = time.perf_counter()
+        self.budget_ms = budget_ms if budget_ms is not None else float(os.getenv("STARTUP_BUDGET_MS", 0))
+        self.imports: Dict[str, float] = {}
+        self.phases: Dict[str, float] = {}
+        self.lazy_imports: Dict[str, float] = {}
+        self.ready_ms: Optional[float] = None
+        self._original_import = None
+        self._depth = threading.local()
+
+    # --- imports ---
+    def track_imports(self):
+        if self._original_import is not None:
+            return
+        original = self._original_import = builtins.__import__
+        owner = threading.get_ident()
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            # Only the outermost import of the tracking thread is recorded
+            if threading.get_ident() != owner or getattr(self._depth, "value", 0) or name in sys.modules:
+                return original(name, globals, locals, fromlist, level)
+            self._depth.value = 1
+            start = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                self._depth.value = 0
+                self.imports[name] = self.imports.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+        builtins.__import__ = timed_import
+
+    def stop_imports(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+        self.phases["imports"] = sum(self.imports.values())
+
+    # --- lifespan ---
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def ready(self):
+        """Mark the app ready to serve; logs the breakdown and checks the budget."""
+        self.ready_ms = (time.perf_counter() - self.created) * 1000
+        report = self.to_dict()
+        logger.info("Arranque completado en %.0f ms", self.ready_ms, extra={"startup": report})
+        if self.over_budget():
+            logger.warning("Arranque por encima del presupuesto: %.0f ms > %.0f ms", self.ready_ms, self.budget_ms)
+
+    def over_budget(self) -> bool:
+        return bool(self.budget_ms) and self.ready_ms is not None and self.ready_ms > self.budget_ms
+
+    def to_dict(self) -> dict:
+        def rounded(values: Dict[str, float]) -> Dict[str, float]:
+            return {k: round(v, 1) for k, v in sorted(values.items(), key=lambda kv: -kv[1])}
+
+        return {
+            "ready_ms": round(self.ready_ms, 1) if self.ready_ms is not None else None,
+            "budget_ms": self.budget_ms or None,
+            "phases": rounded(self.phases),
+            "imports": rounded(self.imports),
+            "lazy_imports": rounded(self.lazy_imports),
+        }
+
+
+report = StartupReport()
+
+
+class LazyModule:
+    """Module proxy imported on first attribute access.
+
+    Truthiness says whether the module can be imported without importing it
+    (it turns False if the import fails), so `if not lazy_module:` guards keep
+    working.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._available: Optional[bool] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self):
+        if self._module is not None:
+            return self._module
+        with self._lock:
+            if self._module is None:
+                start = time.perf_counter()
+                try:
+                    module = importlib.import_module(self._name)
+                except Exception as e:
+                    self._available = False
+                    logger.error("No se pudo importar %s: %s", self._name, e)
+                    raise ImportError(f"Módulo {self._name} no disponible: {e}") from e
+                report.lazy_imports[self._name] = (time.perf_counter() - start) * 1000
+                logger.info("Módulo %s cargado bajo demanda en %.0f ms", self._name, report.lazy_imports[self._name])
+                self._module = module
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+    def __bool__(self) -> bool:
+        if self._module is not None:
+            return True
+        if self._available is None:
+            self._available = importlib.util.find_spec(self._name) is not None
+        return self._available
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+class LazyAttribute:
+    """A function (or other callable) of a LazyModule, resolved on first call."""
+
+    def __init__(self, module: LazyModule, name: str):
+        self._module = module
+        self._name = name
+
+    def __call__(self, *args, **kwargs):
+        return getattr(self._module, self._name)(*args, **kwargs)
+
+    def __bool__(self) -> bool:
+        return bool(self._module)
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def preload(modules: List[LazyModule]):
+    """Import lazy modules in a background thread, off the startup path (STARTUP_PRELOAD)."""
+
+    def run():
+        for module in modules:
+            try:
+                module.load()
+            except ImportError:
+                pass
+
+    if modules:
+        threading.Thread(target=run, name="lazy-preload", daemon=True).start()
+
+
+if __name__ == "__main__":
+    # Startup check for CI/deploys: import the app, run its lifespan, print the breakdown
+    import asyncio
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    target = sys.argv[1] if len(sys.argv) > 1 else "app"
+    # The app records its own import breakdown (track_imports/stop_imports around its imports)
+    app_module = importlib.import_module(target)
+    # Running as __main__: the app filled the report of the imported `startup` module
+    report = importlib.import_module("startup").report
+
+    async def start_and_stop():
+        async with app_module.app.router.lifespan_context(app_module.app):
+            pass
+
+    asyncio.run(start_and_stop())
+    print(json.dumps(report.to_dict(), indent=2))
+    sys.exit(1 if report.over_budget() else 0)
@@ -0,0 +1,242 @@
+import os
+import re
+import sys
+import gzip
+import time
+import hashlib
+import logging
+import mimetypes
+import threading
+from email.utils import formatdate
+from typing import Dict, Optional
+
+from starlette.responses import FileResponse, Response
+
+try:
+    import brotli
+except ImportError:  # optional: only needed to prebuild .br variants
+    brotli = None
+
+logger = logging.getLogger("static-assets")
+
+# Build output with a content hash in the name (main.b4b14190.js) never changes under the same URL
+_FINGERPRINT = re.compile(r"\.[0-9a-f]{8,}\.")
+_COMPRESSIBLE = {".js", ".css", ".html", ".json", ".map", ".svg", ".txt", ".ico", ".xml", ".webmanifest"}
+_MIN_COMPRESS_SIZE = 1024
+_MAX_MEMORY_GZIP = 5 * 1024 * 1024
+_VARIANTS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+class Asset:
+    """One file of the build, with its strong ETag and precompressed variants."""
+
+    __slots__ = ("path", "stat", "etag", "media_type", "immutable", "variants", "_gzip")
+
+    def __init__(self, path: str, digest: str, stat: os.stat_result, immutable: bool):
+        self.path = path
+        self.stat = stat
+        self.etag = f'"{digest}"'
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.immutable = immutable
+        # encoding -> (path, stat) of a prebuilt sibling (app.js.br, app.js.gz)
+        self.variants: Dict[str, tuple] = {}
+        self._gzip: Optional[bytes] = None
+
+    @property
+    def compressible(self) -> bool:
+        return (os.path.splitext(self.path)[1] in _COMPRESSIBLE
+                and _MIN_COMPRESS_SIZE <= self.stat.st_size <= _MAX_MEMORY_GZIP)
+
+    def gzip_bytes(self) -> bytes:
+        """gzip body compressed on first use, for builds shipped without .gz files."""
+        if self._gzip is None:
+            with open(self.path, "rb") as f:
+                self._gzip = gzip.compress(f.read(), compresslevel=6, mtime=0)
+        return self._gzip
+
+
+def _accepted(header: str) -> Dict[str, float]:
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+class StaticSite:
+    """Serves a single-page-app build directory from an in-memory index.
+
+    The directory is walked once; URL lookups are dict hits, so unknown URLs
+    (client-side routes) fall back to index.html without touching the disk.
+    index.html is kept in memory (plain and gzip). Fingerprinted files get
+    `Cache-Control: immutable`, everything else is revalidated through strong
+    content-hash ETags (304 on If-None-Match). Prebuilt .br/.gz siblings are
+    chosen by Accept-Encoding; compressible files without one are gzipped in
+    memory on first request. A new build is picked up by checking, at most every
+    `check_interval` seconds, the mtimes of the directory, index.html and
+    asset-manifest.json.
+    """
+
+    def __init__(self, root: str = "public", check_interval: float = 2.0):
+        self.root = root
+        self.check_interval = check_interval
+        self.assets: Dict[str, Asset] = {}
+        self.index: Optional[Asset] = None
+        self._index_body = b""
+        self._index_gzip = b""
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _build_signature(self):
+        signature = []
+        for name in ("", "index.html", "asset-manifest.json", "static"):
+            try:
+                signature.append(os.stat(os.path.join(self.root, name)).st_mtime_ns)
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def load(self):
+        """(Re)build the index from disk."""
+        started = time.perf_counter()
+        assets: Dict[str, Asset] = {}
+        for directory, _dirs, files in os.walk(self.root):
+            names = set(files)
+            for name in files:
+                if name.endswith((".br", ".gz")) and name[:-3] in names:
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                    with open(path, "rb") as f:
+                        digest = hashlib.sha256(f.read()).hexdigest()[:32]
+                except OSError as e:
+                    logger.warning("No se pudo indexar %s: %s", path, e)
+                    continue
+                url = os.path.relpath(path, self.root).replace(os.sep, "/")
+                asset = Asset(path, digest, stat, immutable=bool(_FINGERPRINT.search(name)))
+                for encoding, suffix in _VARIANTS:
+                    if name + suffix in names:
+                        variant = os.stat(path + suffix)
+                        # A variant older than its source belongs to a previous build
+                        if variant.st_mtime >= stat.st_mtime:
+                            asset.variants[encoding] = (path + suffix, variant)
+                assets[url] = asset
+
+        index = assets.get("index.html")
+        body = b""
+        if index is not None:
+            with open(index.path, "rb") as f:
+                body = f.read()
+        with self._lock:
+            self.assets = assets
+            self.index = index
+            self._index_body = body
+            self._index_gzip = gzip.compress(body, compresslevel=9, mtime=0) if body else b""
+            self._signature = self._build_signature()
+            self._checked_at = time.monotonic()
+        logger.info("Build estático indexado: %s ficheros en %.0f ms", len(assets), (time.perf_counter() - started) * 1000)
+
+    def refresh(self):
+        """Reload if the build changed since the last check (stat calls at most every check_interval)."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        if self._build_signature() != self._signature:
+            logger.info("Cambio detectado en %s; reindexando", self.root)
+            self.load()
+
+    def lookup(self, url_path: str) -> Optional[Asset]:
+        return self.assets.get(url_path.lstrip("/"))
+
+    def respond(self, asset: Asset, headers) -> Response:
+        """Response for one asset honouring If-None-Match and Accept-Encoding."""
+        is_index = asset is self.index
+        if is_index:
+            available = {"gzip"} if self._index_gzip else set()
+        else:
+            available = set(asset.variants) | ({"gzip"} if asset.compressible else set())
+        accepted = _accepted(headers.get("accept-encoding", "")) if available else {}
+        encoding = None
+        for candidate, _suffix in _VARIANTS:
+            if candidate in available and accepted.get(candidate, 0) > 0:
+                encoding = candidate
+                break
+        etag = asset.etag if encoding is None else f'{asset.etag[:-1]}-{encoding}"'
+        response_headers = {
+            "etag": etag,
+            "cache-control": IMMUTABLE if asset.immutable else REVALIDATE,
+            "last-modified": formatdate(asset.stat.st_mtime, usegmt=True),
+        }
+        if available:
+            response_headers["vary"] = "Accept-Encoding"
+        if _etag_matches(headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=response_headers)
+        if encoding is not None:
+            response_headers["content-encoding"] = encoding
+        if is_index:
+            body = self._index_gzip if encoding == "gzip" else self._index_body
+            return Response(body, media_type="text/html", headers=response_headers)
+        if encoding == "gzip" and encoding not in asset.variants:
+            return Response(asset.gzip_bytes(), media_type=asset.media_type, headers=response_headers)
+        path, stat = asset.variants[encoding] if encoding else (asset.path, asset.stat)
+        # Only fingerprinted files are known not to change before the next refresh; others are stat'ed again
+        return FileResponse(path, media_type=asset.media_type, headers=response_headers,
+                            stat_result=stat if asset.immutable else None)
+
+    def respond_index(self, headers) -> Optional[Response]:
+        return self.respond(self.index, headers) if self.index is not None else None
+
+
+def precompress(root: str = "public") -> int:
+    """Write .gz (and .br when the brotli package is installed) next to every compressible file.
+
+    Meant for the build/deploy step so workers never compress at request time.
+    """
+    written = 0
+    for directory, _dirs, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            if name.endswith((".br", ".gz")) or os.path.splitext(name)[1] not in _COMPRESSIBLE:
+                continue
+            if os.path.getsize(path) < _MIN_COMPRESS_SIZE:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            outputs = [(".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                outputs.append((".br", lambda d: brotli.compress(d, quality=11)))
+            for suffix, compress in outputs:
+                with open(path + suffix, "wb") as f:
+                    f.write(compress(data))
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    target = sys.argv[1] if len(sys.argv) > 1 else "public"
+    count = precompress(target)
+    logger.info("%s variantes comprimidas escritas en %s%s", count, target,
+                "" if brotli is not None else " (sin brotli: pip install brotli para .br)")
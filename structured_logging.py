@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import metrics
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# LogRecord attributes; anything else on a record came in through extra={...}
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id", "color_message"}
+
+metrics.registry.counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+
+def set_request_id(value: Optional[str]):
+    """Bind a request id to the current context (task); returns a token for reset."""
+    return _request_id.set(value)
+
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def _truncate(text: str, limit: int) -> str:
+    if limit and len(text) > limit:
+        return f"{text[:limit]}…[+{len(text) - limit} chars]"
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, request_id and any extra fields.
+
+    Extra values that are not JSON scalars are serialized and, like the
+    message, cut to max_chars so a stray payload cannot flood the log.
+    """
+
+    def __init__(self, max_chars: int = 2000):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": _truncate(record.getMessage(), self.max_chars),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key in _RESERVED or key.startswith("_"):
+                continue
+            if isinstance(value, str):
+                value = _truncate(value, self.max_chars)
+            elif not isinstance(value, (int, float, bool, type(None))):
+                text = json.dumps(value, default=str, ensure_ascii=False)
+                # Small structures stay nested; large ones become a truncated string
+                if len(text) > self.max_chars:
+                    value = _truncate(text, self.max_chars)
+            entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = _truncate(record.exc_text, self.max_chars * 4)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local development, with the request id and capped message."""
+
+    def __init__(self, max_chars: int = 2000):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+        self.max_chars = max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.request_id = getattr(record, "request_id", None) or "-"
+        return _truncate(super().format(record), self.max_chars)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of DEBUG/INFO records per logger prefix; warnings and errors always pass.
+
+    Rates come as {"uvicorn.access": 0.1, "http": 0.05}; the longest matching prefix wins.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = dict(sorted(rates.items(), key=lambda kv: -len(kv[0])))
+        self._cache: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            for prefix, value in self.rates.items():
+                if name == prefix or name.startswith(prefix + "."):
+                    rate = value
+                    break
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks or formats on the caller's thread.
+
+    The record is enqueued as is (message formatting happens in the listener
+    thread), with the request id captured first. When the queue is full the
+    record is dropped and counted instead of stalling the event loop.
+    Arguments are therefore rendered slightly later: pass values, not objects
+    that are mutated right after the call.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = _request_id.get()
+        if record.exc_info:
+            # Tracebacks reference frames that will not survive until the listener runs
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total")
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # At exit the queue may be full; wait for the writer thread to make room
+        try:
+            self.queue.put(self._sentinel, timeout=5)
+        except queue.Full:
+            pass
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def _parse_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for part in spec.split(","):
+        name, sep, value = part.partition("=")
+        if not sep:
+            continue
+        try:
+            rates[name.strip()] = max(0.0, min(1.0, float(value)))
+        except ValueError:
+            continue
+    return rates
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging():
+    """Route every logger (including uvicorn's) through a bounded queue to one stdout writer thread.
+
+    LOG_FORMAT=json|text, LOG_LEVEL, LOG_SAMPLING ("logger=rate,..."),
+    LOG_FIELD_MAX_CHARS and LOG_QUEUE_SIZE come from the environment.
+    Calling it again is a no-op.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    max_chars = int(os.getenv("LOG_FIELD_MAX_CHARS", 2000))
+    formatter = TextFormatter(max_chars) if os.getenv("LOG_FORMAT", "json").lower() == "text" else JsonFormatter(max_chars)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(formatter)
+
+    handler = NonBlockingQueueHandler(queue.Queue(int(os.getenv("LOG_QUEUE_SIZE", 10000))))
+    rates = _parse_rates(os.getenv("LOG_SAMPLING", ""))
+    if rates:
+        handler.addFilter(SamplingFilter(rates))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        # Uvicorn installs its own stream handlers; send its records through the queue too
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+    _listener = _Listener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
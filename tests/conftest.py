@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# The app modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """The app, imported with its caches, databases and metrics under a temporary directory."""
+    from benchmarks.load import isolated_env
+
+    os.environ.update(isolated_env(str(tmp_path_factory.mktemp("app"))))
+    import app
+
+    return app
@@ -0,0 +1,193 @@
+import json
+import time
+import asyncio
+from datetime import datetime
+
+import httpx
+import pytest
+
+import improved_alpha_service
+from http_transport import AsyncTransport
+from improved_alpha_service import ImprovedAlphaVantageClient
+from result_cache import TieredCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TieredCache(str(tmp_path / "market.sqlite3"), ttl=3600, stale_ttl=3600)
+
+
+@pytest.fixture
+def make_client(cache, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the legacy cache file is looked up in the working directory
+    return lambda **kwargs: ImprovedAlphaVantageClient(api_key="test", cache=cache, limiter=False, **kwargs)
+
+
+def quote_api(prices, calls, delay=0.0, bulk=None):
+    """Mock Alpha Vantage answering GLOBAL_QUOTE from `prices` (a missing ticker is a server error).
+    REALTIME_BULK_QUOTES answers with the `bulk` prices, or an error message when bulk is None.
+    """
+
+    async def answer(request):
+        function, symbol = request.url.params["function"], request.url.params["symbol"]
+        calls.append((function, symbol))
+        await asyncio.sleep(delay)
+        if function == "REALTIME_BULK_QUOTES":
+            if bulk is None:
+                return httpx.Response(200, json={"Information": "premium endpoint"})
+            rows = [{"symbol": t, "close": str(bulk[t]), "change_percent": "2"} for t in symbol.split(",") if t in bulk]
+            return httpx.Response(200, json={"data": rows})
+        if symbol not in prices:
+            return httpx.Response(500, text="error")
+        return httpx.Response(200, json={"Global Quote": {"05. price": str(prices[symbol]), "10. change percent": "1%"}})
+
+    transport = AsyncTransport()
+    transport._client = httpx.AsyncClient(transport=httpx.MockTransport(answer))
+    return transport
+
+
+def write_legacy(path):
+    entry = {"timestamp": datetime.now().isoformat(), "data": {"price": 60.5}}
+    path.write_text(json.dumps({"price_KO": entry}))
+
+
+def test_legacy_cache_is_migrated_and_set_aside(make_client, tmp_path):
+    write_legacy(tmp_path / improved_alpha_service.LEGACY_CACHE_FILE)
+    client = make_client()
+    assert client.cache.get("alpha:price:KO") == {"price": 60.5}
+    assert not (tmp_path / improved_alpha_service.LEGACY_CACHE_FILE).exists()
+    assert (tmp_path / f"{improved_alpha_service.LEGACY_CACHE_FILE}.migrated").exists()
+
+
+def test_legacy_cache_moved_by_another_worker_is_not_an_error(make_client, tmp_path, monkeypatch):
+    write_legacy(tmp_path / improved_alpha_service.LEGACY_CACHE_FILE)
+
+    def already_moved(src, dst):
+        raise FileNotFoundError(src)
+
+    monkeypatch.setattr(improved_alpha_service.os, "replace", already_moved)
+    client = make_client()
+    assert client.cache.get("alpha:price:KO") == {"price": 60.5}
+
+
+def test_fresh_quote_is_served_without_a_request(make_client, cache):
+    calls = []
+
+    async def main():
+        client = make_client(transport=quote_api({"KO": 60.5}, calls))
+        first = await client.get_real_time_price_async("KO")
+        second = await client.get_real_time_price_async("ko")
+        await client.transport.aclose()
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == second == {"price": 60.5, "change_percent": "1%", "source": "alpha_vantage"}
+    assert calls == [("GLOBAL_QUOTE", "KO")]
+    # Stored per key, so another client (worker) on the same database reads it without a request
+    other = ImprovedAlphaVantageClient(api_key="test", cache=TieredCache(cache.path), limiter=False)
+    assert other.get_real_time_price("KO")["price"] == 60.5
+
+
+def test_expired_quote_is_refetched_and_stale_one_used_on_error(make_client, cache):
+    cache.set("alpha:price:KO", {"price": 58.0, "source": "alpha_vantage"}, ttl=-1)
+    cache.set("alpha:price:PEP", {"price": 170.0, "source": "alpha_vantage"}, ttl=-1)
+    calls = []
+
+    async def main():
+        client = make_client(transport=quote_api({"KO": 60.5}, calls))
+        ko = await client.get_real_time_price_async("KO")
+        pep = await client.get_real_time_price_async("PEP")
+        await client.transport.aclose()
+        return ko, pep
+
+    ko, pep = asyncio.run(main())
+    assert ko["price"] == 60.5 and cache.get("alpha:price:KO")["price"] == 60.5
+    assert pep["price"] == 170.0
+    assert calls == [("GLOBAL_QUOTE", "KO"), ("GLOBAL_QUOTE", "PEP")]
+
+
+def test_failed_quote_without_stale_entry_raises(make_client):
+    async def main():
+        client = make_client(transport=quote_api({}, []))
+        try:
+            return await client.get_real_time_price_async("KO")
+        finally:
+            await client.transport.aclose()
+
+    with pytest.raises(ValueError, match="precio real para KO"):
+        asyncio.run(main())
+
+
+def test_fundamentals_use_their_own_ttl(make_client, cache, monkeypatch):
+    client = make_client()
+    overview = {"Symbol": "KO", "PERatio": "24"}
+    monkeypatch.setattr(client, "_query", lambda function, ticker: overview)
+    assert client.get_company_overview("KO") == overview
+
+    with cache._lock:
+        expires_at, _ = cache._memory["alpha:overview:KO"]
+    assert expires_at - datetime.now().timestamp() == pytest.approx(client.cache_ttl_fundamentals, abs=60)
+
+
+def get_quotes(client, tickers, timeout=None):
+    async def main():
+        try:
+            return await client.get_quotes_async(tickers, timeout=timeout)
+        finally:
+            await client.transport.aclose()
+
+    return asyncio.run(main())
+
+
+def test_batch_dedupes_serves_cache_and_fetches_misses_concurrently(make_client, cache):
+    cache.set("alpha:price:KO", {"price": 60.5, "source": "alpha_vantage"})
+    calls = []
+    client = make_client(transport=quote_api({"PEP": 170.0, "MSFT": 410.0}, calls, delay=0.2))
+
+    start = time.monotonic()
+    quotes = get_quotes(client, ["ko", "KO", "PEP", " pep ", "MSFT", ""])
+    elapsed = time.monotonic() - start
+
+    assert {t: q["price"] for t, q in quotes.items()} == {"KO": 60.5, "PEP": 170.0, "MSFT": 410.0}
+    assert sorted(calls) == [("GLOBAL_QUOTE", "MSFT"), ("GLOBAL_QUOTE", "PEP")]
+    assert elapsed < 0.35  # two 0.2 s quotes at once
+    assert cache.get("alpha:price:MSFT")["price"] == 410.0
+
+
+def test_batch_uses_bulk_quotes_and_fetches_the_rest_one_by_one(make_client, cache):
+    calls = []
+    client = make_client(transport=quote_api({"PEP": 170.0}, calls, bulk={"KO": 61.0, "MSFT": 411.0}))
+    client.bulk_quotes = True
+
+    quotes = get_quotes(client, ["KO", "MSFT", "PEP"])
+
+    assert {t: q["price"] for t, q in quotes.items()} == {"KO": 61.0, "MSFT": 411.0, "PEP": 170.0}
+    assert quotes["KO"]["change_percent"] == "2%"
+    assert calls == [("REALTIME_BULK_QUOTES", "KO,MSFT,PEP"), ("GLOBAL_QUOTE", "PEP")]
+    assert cache.get("alpha:price:KO")["price"] == 61.0
+
+
+def test_unavailable_bulk_quotes_fall_back_to_single_quotes(make_client):
+    calls = []
+    client = make_client(transport=quote_api({"KO": 60.5, "PEP": 170.0}, calls))
+    client.bulk_quotes = True
+
+    quotes = get_quotes(client, ["KO", "PEP"])
+
+    assert sorted(quotes) == ["KO", "PEP"]
+    assert calls[0] == ("REALTIME_BULK_QUOTES", "KO,PEP")
+    assert sorted(calls[1:]) == [("GLOBAL_QUOTE", "KO"), ("GLOBAL_QUOTE", "PEP")]
+
+
+def test_batch_leaves_out_failed_and_late_tickers(make_client, cache):
+    cache.set("alpha:price:KO", {"price": 58.0, "source": "alpha_vantage"}, ttl=-1)
+    client = make_client(transport=quote_api({"MSFT": 410.0}, [], delay=0.3))
+
+    start = time.monotonic()
+    quotes = get_quotes(client, ["KO", "PEP", "MSFT"], timeout=0.1)
+
+    assert time.monotonic() - start < 0.3
+    assert quotes == {}
+    client = make_client(transport=quote_api({"MSFT": 410.0}, []))
+    # Without a deadline the failed KO falls back to its stale entry; PEP has none and is left out
+    assert {t: q["price"] for t, q in get_quotes(client, ["KO", "PEP", "MSFT"]).items()} == {"KO": 58.0, "MSFT": 410.0}
@@ -0,0 +1,179 @@
+import asyncio
+
+import httpx
+import numpy as np
+import pytest
+
+import backtest
+from price_store import PriceStore
+
+
+def _market(n_days=300, n_assets=3, seed=0):
+    rng = np.random.default_rng(seed)
+    days = np.arange(np.datetime64("2023-01-02"), np.datetime64("2025-01-01"))
+    dates = days[np.is_busday(days)][:n_days + 1]
+    returns = rng.normal(0.0004, 0.015, size=(n_days, n_assets))
+    return dates, returns
+
+
+def _reference(dates, returns, weights, rebalance, initial, cost):
+    """Day-by-day simulation; rebalance(row, holdings) says whether to trade back to the targets."""
+    weights = np.asarray(weights, dtype=float) / np.sum(weights)
+    holdings = initial * (1.0 - cost) * weights
+    values, rebalances, turnover, costs = [holdings.sum()], [], 0.0, initial * cost
+    for row, daily in enumerate(returns, start=1):
+        holdings = holdings * (1.0 + daily)
+        value = holdings.sum()
+        if rebalance(row, holdings):
+            traded = np.abs(holdings - value * weights).sum()
+            turnover += traded / value
+            costs += traded * cost
+            value -= traded * cost
+            holdings = value * weights
+            rebalances.append(dates[row])
+        values.append(value)
+    return np.array(values), np.array(rebalances, dtype="datetime64[D]"), turnover, costs
+
+
+WEIGHTS = [0.5, 0.3, 0.2]
+
+
+def test_buy_and_hold_matches_reference():
+    dates, returns = _market()
+    result = backtest.run_backtest(dates, returns, WEIGHTS, cost_bps=10, initial=10000)
+    values, rebalances, _, costs = _reference(dates, returns, WEIGHTS, lambda row, h: False, 10000, 0.001)
+
+    np.testing.assert_allclose(result.values, values, rtol=1e-10)
+    assert result.rebalance_dates.size == 0 and rebalances.size == 0
+    assert result.turnover == 0.0
+    assert result.costs == pytest.approx(costs)
+
+
+@pytest.mark.parametrize("frequency, count", [("monthly", 13), ("quarterly", 4), ("annual", 1)])
+def test_calendar_rebalances_on_first_trading_day_of_each_period(frequency, count):
+    dates, returns = _market()
+    result = backtest.run_backtest(dates, returns, WEIGHTS, strategy="calendar", frequency=frequency, initial=10000)
+    unit = {"monthly": "M", "quarterly": "M", "annual": "Y"}[frequency]
+    periods = dates.astype(f"datetime64[{unit}]").astype(np.int64)
+    if frequency == "quarterly":
+        periods //= 3
+    starts = set(np.flatnonzero(np.diff(periods) != 0) + 1)
+    values, rebalances, turnover, costs = _reference(
+        dates, returns, WEIGHTS, lambda row, h: row in starts, 10000, 0.001)
+
+    assert result.rebalance_dates.size == count
+    np.testing.assert_array_equal(result.rebalance_dates, rebalances)
+    np.testing.assert_allclose(result.values, values, rtol=1e-10)
+    assert result.turnover == pytest.approx(turnover)
+    assert result.costs == pytest.approx(costs)
+
+
+@pytest.mark.parametrize("threshold", [0.01, 0.03, 0.2])
+def test_threshold_rebalances_when_drift_exceeds_it(threshold):
+    dates, returns = _market(n_days=500)
+    weights = np.asarray(WEIGHTS)
+
+    def drifted(row, holdings):
+        return np.abs(holdings / holdings.sum() - weights).max() > threshold
+
+    result = backtest.run_backtest(dates, returns, WEIGHTS, strategy="threshold", threshold=threshold, initial=10000)
+    values, rebalances, turnover, costs = _reference(dates, returns, WEIGHTS, drifted, 10000, 0.001)
+
+    np.testing.assert_array_equal(result.rebalance_dates, rebalances)
+    np.testing.assert_allclose(result.values, values, rtol=1e-10)
+    assert result.turnover == pytest.approx(turnover)
+    assert result.costs == pytest.approx(costs)
+
+
+def test_costs_scale_with_turnover():
+    dates, returns = _market()
+    free = backtest.run_backtest(dates, returns, WEIGHTS, strategy="calendar", frequency="monthly", cost_bps=0)
+    paid = backtest.run_backtest(dates, returns, WEIGHTS, strategy="calendar", frequency="monthly", cost_bps=50)
+
+    assert free.costs == 0.0
+    assert paid.turnover == pytest.approx(free.turnover, rel=1e-3)
+    assert paid.values[-1] < free.values[-1]
+
+
+def test_nan_returns_count_as_flat():
+    dates, returns = _market(n_days=20)
+    gappy = returns.copy()
+    gappy[5, 1] = np.nan
+    filled = returns.copy()
+    filled[5, 1] = 0.0
+
+    np.testing.assert_array_equal(
+        backtest.run_backtest(dates, gappy, WEIGHTS).values, backtest.run_backtest(dates, filled, WEIGHTS).values)
+
+
+def test_metrics():
+    dates = np.array(["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"], dtype="datetime64[D]")
+    result = backtest.BacktestResult(
+        dates=dates, values=np.array([100.0, 110.0, 99.0, 121.0]),
+        rebalance_dates=dates[2:3], turnover=0.25, costs=1.234)
+    metrics = result.metrics()
+
+    assert metrics["total_return"] == pytest.approx(0.21)
+    assert metrics["max_drawdown"] == pytest.approx(-0.1)
+    assert metrics["rebalances"] == 1
+    assert metrics["turnover"] == 0.25 and metrics["costs"] == 1.23
+    assert metrics["volatility"] > 0 and metrics["sharpe_ratio"] > 0
+
+
+def test_unknown_strategy_or_frequency_raises():
+    dates, returns = _market(n_days=10)
+    with pytest.raises(ValueError, match="Estrategia desconocida"):
+        backtest.run_backtest(dates, returns, WEIGHTS, strategy="momentum")
+    with pytest.raises(ValueError, match="Frecuencia desconocida"):
+        backtest.run_backtest(dates, returns, WEIGHTS, strategy="calendar", frequency="weekly")
+
+
+@pytest.fixture
+def prices(app_module, monkeypatch, tmp_path):
+    dates, returns = _market(n_days=120, n_assets=2, seed=4)
+    close = 100.0 * np.vstack([np.ones((1, 2)), np.cumprod(1.0 + returns, axis=0)])
+    store = PriceStore(str(tmp_path / "prices"))
+    store.write(dates.astype(str).tolist(), ["AAA", "BBB"], {"adj_close": close})
+    monkeypatch.setattr(app_module, "get_price_store", lambda: store)
+    return dates, returns
+
+
+def _post(app_module, body):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as client:
+            return await client.post("/api/portfolio/backtest", json=body)
+
+    return asyncio.run(run())
+
+
+def test_endpoint_runs_allocation_over_local_history(app_module, prices):
+    dates, returns = prices
+    allocation = {
+        "conservative": [{"ticker": "AAA", "amount": 6000}, {"ticker": "ZZZ", "amount": 2000}],
+        "growth": [{"ticker": "bbb", "amount": 2000}],
+    }
+    response = _post(app_module, {"allocation": allocation, "amount": 10000, "strategy": "calendar",
+                                  "frequency": "monthly", "cost_bps": 0})
+    body = response.json()
+    expected = backtest.run_backtest(dates, returns, [0.75, 0.25], strategy="calendar", frequency="monthly",
+                                     cost_bps=0, initial=10000)
+
+    assert response.status_code == 200
+    assert body["weights"] == {"AAA": 0.75, "BBB": 0.25}
+    assert body["dates"][0] == str(dates[0]) and len(body["dates"]) == dates.size
+    np.testing.assert_allclose(body["values"], expected.values, atol=0.01)
+    assert body["rebalance_dates"] == expected.rebalance_dates.astype(str).tolist()
+    assert body["metrics"]["rebalances"] == expected.rebalance_dates.size
+    assert len(body["warnings"]) == 1 and "ZZZ" in body["warnings"][0]
+
+
+@pytest.mark.parametrize("body, message", [
+    ({"allocation": []}, "no contiene posiciones"),
+    ({"allocation": [{"ticker": "ZZZ", "weight": 1}]}, "Sin histórico local"),
+    ({"allocation": [{"ticker": "AAA", "weight": 1}], "strategy": "momentum"}, "Estrategia desconocida"),
+])
+def test_endpoint_rejects_bad_requests(app_module, prices, body, message):
+    response = _post(app_module, body)
+
+    assert response.status_code == 400
+    assert message in response.json()["error"]
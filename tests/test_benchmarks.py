@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import subprocess
+
+import httpx
+import pytest
+
+from benchmarks.load import percentile, summarize
+from benchmarks.micro import run_micro
+from benchmarks.run import compare
+from benchmarks.stubs import StubConfig, StubUpstreams
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _load(rps, p95, errors=0):
+    return {"scenario": "build", "concurrency": 8, "rps": rps, "errors": errors,
+            "latency_ms": {"p50": p95 / 2, "p95": p95, "p99": p95 * 1.2}}
+
+
+def test_compare_flags_only_regressions_past_the_threshold():
+    baseline = {"load": [_load(100, 200)], "micro": [{"case": "allocation", "ns_per_op": 1000.0}]}
+
+    assert compare({"load": [_load(90, 220)], "micro": [{"case": "allocation", "ns_per_op": 1100.0}]}, baseline, 0.15) == []
+    problems = compare({"load": [_load(80, 240, errors=2)], "micro": [{"case": "allocation", "ns_per_op": 1200.0}]},
+                       baseline, 0.15)
+    assert problems == [
+        "build c=8: rps 100 -> 80",
+        "build c=8: p50 100.0 ms -> 120.0 ms",
+        "build c=8: p95 200 ms -> 240 ms",
+        "build c=8: p99 240.0 ms -> 288.0 ms",
+        "build c=8: errores 0 -> 2",
+        "allocation: 1000.0 ns/op -> 1200.0 ns/op",
+    ]
+    # Scenarios or cases missing from the baseline are not compared
+    assert compare({"load": [dict(_load(1, 9999), scenario="new")]}, baseline, 0.15) == []
+
+
+def test_percentiles_use_nearest_rank():
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.05 and percentile(values, 100) == 0.1 and percentile(values, 0) == 0.001
+    assert percentile([], 50) is None
+    assert summarize([0.3, 0.1, 0.2]) == {"p50": 200.0, "p95": 300.0, "p99": 300.0, "max": 300.0}
+
+
+def test_micro_cases_run():
+    results = run_micro(min_time=0.01, repeat=1, log=lambda line: None)
+
+    assert results and all(r["ns_per_op"] > 0 and r["loops"] >= 1 for r in results)
+    assert len({r["case"] for r in results}) == len(results)
+
+
+@pytest.fixture
+def stubs():
+    stubs = StubUpstreams(StubConfig(latency_ms=5, jitter_ms=0, items=3)).start()
+    yield stubs
+    stubs.stop()
+
+
+def test_stubs_answer_like_the_upstreams(stubs):
+    perplexity = httpx.post(stubs.env()["PERPLEXITY_API_URL"], json={"messages": [{"role": "user", "content": "x"}]})
+    quote = httpx.get(stubs.env()["ALPHAVANTAGE_BASE_URL"], params={"function": "GLOBAL_QUOTE", "symbol": "KO"})
+
+    content = perplexity.json()["choices"][0]["message"]["content"]
+    assert len(json.loads(content[content.index("["):])) == 3
+    assert float(quote.json()["Global Quote"]["05. price"]) > 0
+    stubs.config.error_rate = 1.0
+    assert httpx.post(stubs.env()["ANTHROPIC_API_URL"], json={"messages": []}).status_code == 500
+    assert stubs.calls == {"perplexity": 1, "anthropic": 1, "alphavantage": 1, "errors": 1}
+
+
+def test_load_run_against_the_stubs():
+    # A separate process: the load suite imports the app with the stubs' environment
+    script = (
+        "import json\n"
+        "from benchmarks.load import run_load\n"
+        "from benchmarks.stubs import StubConfig\n"
+        "results = run_load(['status', 'category'], [2], duration=0.5, warmup=0.1,\n"
+        "                   stub_config=StubConfig(latency_ms=5, jitter_ms=0), log=lambda line: None)\n"
+        "print(json.dumps(results))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    results = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert [r["scenario"] for r in results] == ["status", "category"]
+    for r in results:
+        assert r["requests"] > 0 and r["errors"] == 0, r["statuses"]
+        assert r["latency_ms"]["p50"] is not None and r["loop_lag_ms"]["p99"] is not None
@@ -0,0 +1,131 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from claude_client import ClaudeClient
+from http_transport import AsyncTransport
+from result_cache import TieredCache
+
+PORTFOLIO = [{"ticker": "KO", "peso": 100}]
+
+
+def sse(*texts, stop=True):
+    events = [("message_start", {"type": "message_start"})]
+    events += [("content_block_delta", {"delta": {"type": "text_delta", "text": text}}) for text in texts]
+    if stop:
+        events.append(("message_stop", {"type": "message_stop"}))
+    return "".join(f"event: {event}\ndata: {json.dumps(data)}\n\n" for event, data in events)
+
+
+@pytest.fixture
+def claude(tmp_path):
+    calls = []
+
+    def make(body):
+        def answer(request):
+            calls.append(request)
+            return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+        transport = AsyncTransport()
+        transport._client = httpx.AsyncClient(transport=httpx.MockTransport(answer))
+        cache = TieredCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+        return ClaudeClient(api_key="test", transport=transport, cache=cache, limiter=False)
+
+    make.calls = calls
+    return make
+
+
+def stream(client):
+    async def main():
+        return [part async for part in client.stream_analysis_async(PORTFOLIO)]
+    return asyncio.run(main())
+
+
+def test_completed_stream_is_cached_and_replayed(claude):
+    client = claude(sse("Cartera ", "sólida."))
+    assert stream(client) == ["Cartera ", "sólida."]
+    assert stream(client) == ["Cartera sólida."]
+    assert len(claude.calls) == 1
+
+
+def test_stream_without_message_stop_is_not_cached(claude):
+    client = claude(sse("Cartera ", "sól", stop=False))
+    assert stream(client) == ["Cartera ", "sól"]
+    assert stream(client) == ["Cartera ", "sól"]
+    assert len(claude.calls) == 2
+
+
+def test_stream_error_event_raises(claude):
+    body = sse("Cartera ", stop=False) + 'event: error\ndata: {"error": {"message": "overloaded"}}\n\n'
+    with pytest.raises(RuntimeError, match="overloaded"):
+        stream(claude(body))
+
+
+def test_identical_concurrent_analyses_share_one_request():
+    requests = []
+
+    async def answer(request):
+        requests.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"content": [{"type": "text", "text": "Cartera sólida."}]})
+
+    transport = AsyncTransport()
+    transport._client = httpx.AsyncClient(transport=httpx.MockTransport(answer))
+    client = ClaudeClient(api_key="test", transport=transport, cache=False, limiter=False)
+
+    async def main():
+        return await asyncio.gather(*(client.generate_analysis_async(PORTFOLIO) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["Cartera sólida."] * 5
+    assert len(requests) == 1
+
+
+def sse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        event, data = "message", None
+        for line in block.splitlines():
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[5:])
+        events.append((event, data))
+    return events
+
+
+@pytest.mark.parametrize("stop", [True, False])
+def test_analysis_endpoint_streams_server_sent_events(app_module, claude, monkeypatch, stop):
+    client = claude(sse("Cartera ", "sólida.", stop=stop))
+    monkeypatch.setattr(app_module, "_claude_client", lambda: client)
+
+    async def main():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            response = await http.post("/api/portfolio/claude-analysis/stream", json={"portfolio": PORTFOLIO})
+        analysis_id = sse_events(response.text)[0][1]["analysis_id"]
+        return response, analysis_id, await client.cached_analysis(analysis_id)
+
+    response, analysis_id, cached = asyncio.run(main())
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert sse_events(response.text) == [
+        ("meta", {"analysis_id": analysis_id}),
+        ("message", {"text": "Cartera "}),
+        ("message", {"text": "sólida."}),
+        ("done", {"analysis_id": analysis_id}),
+    ]
+    assert cached == ("Cartera sólida." if stop else None)
+
+
+def test_analysis_endpoint_reports_upstream_errors_as_an_event(app_module, claude, monkeypatch):
+    client = claude('event: error\ndata: {"error": {"message": "overloaded"}}\n\n')
+    monkeypatch.setattr(app_module, "_claude_client", lambda: client)
+
+    async def main():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await http.post("/api/portfolio/claude-analysis/stream", json={"portfolio": PORTFOLIO})
+
+    events = sse_events(asyncio.run(main()).text)
+    assert [event for event, _ in events] == ["meta", "error"]
+    assert "overloaded" in events[1][1]["error"]
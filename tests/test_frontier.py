@@ -0,0 +1,119 @@
+import asyncio
+
+import httpx
+import numpy as np
+import pytest
+
+import portfolio_optimizer
+from price_store import PriceStore
+from result_cache import TieredCache
+from risk_model import CovarianceService
+
+TICKERS = ["AAA", "BBB", "CCC", "DDD", "EEE"]
+
+
+def _market(n, seed=0):
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(size=(750, n)) * 0.01 + rng.normal(size=(750, 1)) * 0.01
+    return rng.normal(0.08, 0.05, n), np.cov(returns, rowvar=False) * 252
+
+
+@pytest.mark.parametrize("workers", [2, 4])
+def test_parallel_blocks_match_sequential_frontier(workers):
+    mu, cov = _market(40, seed=9)
+    sequential = portfolio_optimizer.efficient_frontier(mu, cov, n_points=25, upper=0.15)
+    parallel = portfolio_optimizer.efficient_frontier(mu, cov, n_points=25, upper=0.15, workers=workers)
+
+    assert len(parallel) == len(sequential) == 25
+    for a, b in zip(sequential, parallel):
+        assert a.expected_return == pytest.approx(b.expected_return, abs=1e-9)
+        assert a.volatility == pytest.approx(b.volatility, rel=1e-6)
+
+
+def test_frontier_points_are_efficient():
+    mu, cov = _market(20, seed=2)
+    points = portfolio_optimizer.efficient_frontier(mu, cov, n_points=10, upper=0.3)
+    min_var = portfolio_optimizer.optimize_weights(mu, cov, objective="min_variance", upper=0.3)
+
+    assert points[0].volatility == pytest.approx(min_var.volatility, rel=1e-6)
+    # The top of the frontier fills the best three assets to the cap and puts the rest in the fourth
+    best = np.sort(mu)[::-1]
+    assert points[-1].expected_return == pytest.approx(0.3 * best[:3].sum() + 0.1 * best[3])
+    vols = [p.volatility for p in points]
+    assert vols == sorted(vols)
+
+
+def test_equal_returns_collapse_to_one_point():
+    _, cov = _market(6)
+    points = portfolio_optimizer.efficient_frontier(np.full(6, 0.07), cov, n_points=5)
+
+    assert len(points) == 1
+    assert "único punto" in points[0].warnings[-1]
+
+
+@pytest.fixture
+def frontier(app_module, monkeypatch, tmp_path):
+    """POST /api/portfolio/frontier against a fresh result cache and price history."""
+    rng = np.random.default_rng(3)
+    days = np.arange(np.datetime64("2023-01-02"), np.datetime64("2024-06-01"))
+    dates = days[np.is_busday(days)][:300]
+    close = 100.0 * np.cumprod(1.0 + rng.normal(0.0004, 0.01, size=(dates.size, len(TICKERS))), axis=0)
+    store = PriceStore(str(tmp_path / "prices"))
+    store.write(dates.astype(str).tolist(), TICKERS, {"adj_close": close})
+    service = CovarianceService(store)
+    cache = TieredCache(str(tmp_path / "results.sqlite3"))
+    monkeypatch.setattr(app_module, "get_price_store", lambda: store)
+    monkeypatch.setattr(app_module, "get_covariance_service", lambda: service)
+    monkeypatch.setattr(app_module, "get_result_cache", lambda: cache)
+
+    def post(body):
+        async def run():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as client:
+                return await client.post("/api/portfolio/frontier", json=body)
+
+        response = asyncio.run(run())
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    post.store, post.service, post.next_day = store, service, dates[-1] + 3
+    return post
+
+
+UNIVERSE = [{"ticker": t, "category": "value"} for t in TICKERS]
+
+
+def test_endpoint_serves_repeated_frontier_from_cache(frontier):
+    first = frontier({"universe": UNIVERSE, "points": 8, "max_weight": 0.5})
+    second = frontier({"universe": UNIVERSE, "points": 8, "max_weight": 0.5})
+
+    assert first["estimates"] == "history"
+    assert len(first["points"]) == 8 and first["min_variance"] == 0
+    assert not first["cached"] and second["cached"]
+    assert second["points"] == first["points"]
+    # Different constraints are a different frontier; every call reuses the covariance estimate
+    third = frontier({"universe": UNIVERSE, "points": 8, "max_weight": 0.4})
+    assert not third["cached"]
+    assert frontier.service.stats()["rebuilds"] == 1
+    assert frontier.service.stats()["hits"] == 2
+
+
+def test_new_prices_invalidate_the_cached_frontier(frontier):
+    first = frontier({"universe": UNIVERSE, "points": 6})
+    frontier.store.append_day(str(frontier.next_day), {t: {"adj_close": 120.0} for t in TICKERS})
+    second = frontier({"universe": UNIVERSE, "points": 6})
+
+    assert not first["cached"] and not second["cached"]
+    assert second["points"] != first["points"]
+    # The window slid forward by one day instead of being rebuilt
+    assert frontier.service.stats()["incremental"] == 1
+
+
+def test_endpoint_uses_universe_estimates_when_given(frontier):
+    mu, cov = _market(3, seed=1)
+    universe = [{"ticker": t, "category": "value", "expected_return": m, "volatility": 0.2}
+                for t, m in zip(["X", "Y", "Z"], mu)]
+    body = frontier({"universe": universe, "points": 5, "default_correlation": 0.2})
+
+    assert body["estimates"] == "universe"
+    assert body["tickers"] == ["X", "Y", "Z"]
+    assert sum(body["points"][-1]["weights"].values()) == pytest.approx(1.0, abs=1e-5)
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from http_transport import AsyncTransport, iter_sse
+from upstream_policy import DeadlineExceeded, deadline
+
+
+def transport_with(handler, **kwargs):
+    transport = AsyncTransport(**kwargs)
+    transport._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return transport
+
+
+def test_per_host_limit_queues_only_that_host():
+    active, peak = {}, {}
+
+    async def handler(request):
+        host = request.url.host
+        active[host] = active.get(host, 0) + 1
+        peak[host] = max(peak.get(host, 0), active[host])
+        await asyncio.sleep(0.05)
+        active[host] -= 1
+        return httpx.Response(200, json={"host": host})
+
+    async def main():
+        transport = transport_with(handler, per_host_limit=2)
+        calls = [transport.post("https://llm.test/v1", json={}) for _ in range(6)]
+        calls += [transport.get("https://quotes.test/q") for _ in range(2)]
+        responses = await asyncio.gather(*calls)
+        await transport.aclose()
+        return responses
+
+    responses = asyncio.run(main())
+    assert [r.status_code for r in responses] == [200] * 8
+    assert peak == {"llm.test": 2, "quotes.test": 2}
+
+
+def test_deadline_cuts_a_slow_call():
+    async def handler(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    async def main():
+        transport = transport_with(handler)
+        start = time.monotonic()
+        with deadline(0.05), pytest.raises(DeadlineExceeded):
+            await transport.post("https://llm.test/v1", json={})
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) < 0.5
+
+
+def test_no_request_is_sent_without_time_left():
+    sent = []
+
+    async def main():
+        transport = transport_with(lambda request: sent.append(request) or httpx.Response(200))
+        with deadline(0), pytest.raises(DeadlineExceeded):
+            await transport.get("https://quotes.test/q")
+
+    asyncio.run(main())
+    assert sent == []
+
+
+def test_pooled_client_is_reused_and_recreated_after_close():
+    async def main():
+        transport = AsyncTransport()
+        first = transport.client
+        assert transport.client is first
+        await transport.aclose()
+        second = transport.client
+        await transport.aclose()
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first is not second and first.is_closed
+
+
+def test_iter_sse_parses_events():
+    body = (
+        ": keep-alive\n\n"
+        "event: content_block_delta\ndata: {\"a\": 1}\n\n"
+        "data: line one\ndata: line two\n\n"
+        "event: message_stop\ndata: {}"
+    )
+
+    async def main():
+        transport = transport_with(lambda request: httpx.Response(200, text=body))
+        async with transport.stream("POST", "https://llm.test/v1", json={}) as response:
+            return [event async for event in iter_sse(response)]
+
+    assert asyncio.run(main()) == [
+        ("content_block_delta", '{"a": 1}'),
+        ("message", "line one\nline two"),
+        ("message_stop", "{}"),
+    ]
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+
+import httpx
+
+from job_queue import JobQueue
+
+
+async def noop(payload):
+    return payload
+
+
+def make_queue(path, **kwargs):
+    queue = JobQueue(str(path), **kwargs)
+    queue.register("noop", noop)
+    return queue
+
+
+def test_each_job_is_claimed_by_one_process_only(tmp_path):
+    first, second = make_queue(tmp_path / "jobs.sqlite3"), make_queue(tmp_path / "jobs.sqlite3")
+    submitted = {first.submit("noop", {"i": i})["id"] for i in range(40)}
+    claimed = {first.owner: [], second.owner: []}
+
+    def drain(queue):
+        while True:
+            row = queue._claim()
+            if row is None:
+                return
+            claimed[queue.owner].append(row[0])
+
+    threads = [threading.Thread(target=drain, args=(queue,)) for queue in (first, second, first, second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    every = claimed[first.owner] + claimed[second.owner]
+    assert sorted(every) == sorted(submitted)
+    for owner, ids in claimed.items():
+        for job_id in ids:
+            row = first._conn().execute("SELECT status, owner, attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            assert row == ("running", owner, 1)
+
+
+def test_job_with_a_stale_heartbeat_is_requeued_then_failed(tmp_path):
+    dead, alive = make_queue(tmp_path / "jobs.sqlite3", stale_after=60), make_queue(tmp_path / "jobs.sqlite3", stale_after=60)
+    job_id = dead.submit("noop", {})["id"]
+
+    def orphan():
+        assert dead._claim()[0] == job_id
+        dead._conn().execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time() - 120, job_id))
+
+    orphan()
+    version = alive.get(job_id)["version"]
+    alive._maintain()
+    job = alive.get(job_id)
+    assert job["status"] == "queued" and job["version"] == version + 1
+    assert alive.counters["requeued"] == 1
+
+    # Out of attempts (max_attempts=2): the second orphaning fails it
+    orphan()
+    alive._maintain()
+    job = alive.get(job_id)
+    assert job["status"] == "failed" and job["attempts"] == 2
+
+
+def test_fresh_heartbeat_keeps_the_job(tmp_path):
+    queue = make_queue(tmp_path / "jobs.sqlite3", stale_after=60)
+    job_id = queue.submit("noop", {})["id"]
+    queue._claim()
+    queue._maintain()
+    assert queue.get(job_id)["status"] == "running"
+
+
+def test_cancel_request_from_another_process_stops_the_running_job(tmp_path):
+    runner = make_queue(tmp_path / "jobs.sqlite3", poll_interval=0.05)
+    other = make_queue(tmp_path / "jobs.sqlite3")
+    started = {}
+
+    async def slow(payload):
+        started["at"] = time.monotonic()
+        await asyncio.sleep(30)
+
+    runner.register("slow", slow)
+    other.register("slow", slow)
+
+    async def main():
+        runner.start()
+        try:
+            job_id = (await other.submit_async("slow", {}))["id"]
+            while "at" not in started:
+                await asyncio.sleep(0.02)
+            requested = other.cancel(job_id)
+            assert requested["status"] == "running" and requested["cancel_requested"]
+            # The runner's monitor sees the request with its next heartbeat
+            job = await other.wait(job_id, requested["version"], 5)
+            return job, time.monotonic() - started["at"]
+        finally:
+            await runner.stop()
+
+    job, elapsed = asyncio.run(main())
+    assert job["status"] == "cancelled"
+    assert elapsed < 5
+
+
+def test_cancelling_a_queued_job_finishes_it_at_once(tmp_path):
+    queue = make_queue(tmp_path / "jobs.sqlite3")
+    job = queue.submit("noop", {})
+    cancelled = queue.cancel(job["id"])
+    assert cancelled["status"] == "cancelled" and not cancelled["cancel_requested"]
+    assert cancelled["version"] == job["version"] + 1
+    assert queue._claim() is None
+
+
+def test_job_etag_answers_304_until_the_version_changes(app_module):
+    queue = app_module.get_job_queue()
+    queue.register("noop", noop)
+
+    async def main():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            job = await queue.submit_async("noop", {"x": 1})
+            first = await client.get(f"/api/jobs/{job['id']}")
+            unchanged = await client.get(f"/api/jobs/{job['id']}", headers={"If-None-Match": first.headers["ETag"]})
+            queue.cancel(job["id"])
+            changed = await client.get(f"/api/jobs/{job['id']}", headers={"If-None-Match": first.headers["ETag"]})
+            return first, unchanged, changed
+
+    first, unchanged, changed = asyncio.run(main())
+    assert first.status_code == 200 and first.json()["status"] == "queued"
+    assert unchanged.status_code == 304 and unchanged.headers["ETag"] == first.headers["ETag"]
+    assert changed.status_code == 200 and changed.json()["status"] == "cancelled"
+    assert changed.headers["ETag"] != first.headers["ETag"]
+
+
+def test_long_poll_returns_when_the_job_changes(tmp_path):
+    queue = make_queue(tmp_path / "jobs.sqlite3", poll_interval=0.05)
+
+    async def main():
+        job = await queue.submit_async("noop", {})
+        start = time.monotonic()
+        asyncio.get_running_loop().call_later(0.1, queue.cancel, job["id"])
+        changed = await queue.wait(job["id"], job["version"], 5)
+        return job, changed, time.monotonic() - start
+
+    job, changed, elapsed = asyncio.run(main())
+    assert changed["version"] > job["version"]
+    assert 0.1 <= elapsed < 2
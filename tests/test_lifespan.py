@@ -0,0 +1,32 @@
+import asyncio
+
+import http_transport
+
+
+def test_shutdown_stops_jobs_before_closing_the_transport(app_module):
+    queue = app_module.get_job_queue()
+    seen = {}
+
+    async def slow(payload):
+        client = http_transport.get_transport().client
+        seen["started"] = True
+        try:
+            await asyncio.sleep(10)
+        finally:
+            seen["closed_when_cancelled"] = client.is_closed
+
+    async def main():
+        async with app_module.lifespan(app_module.app):
+            queue.register("test_slow", slow)
+            job = await queue.submit_async("test_slow", {})
+            for _ in range(100):
+                if seen.get("started"):
+                    break
+                await asyncio.sleep(0.02)
+        return job
+
+    job = asyncio.run(main())
+    assert seen == {"started": True, "closed_when_cancelled": False}
+    assert http_transport._transport is None
+    # Left for another process rather than lost
+    assert queue.get(job["id"])["status"] == "queued"
@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import asyncio
+import subprocess
+
+import httpx
+import pytest
+
+from metrics import Registry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = Registry(str(tmp_path / "metrics"))
+    registry.counter("jobs_total", "Jobs")
+    registry.gauge("in_flight", "In flight")
+    registry.histogram("latency_seconds", "Latency", (0.1, 1.0))
+    return registry
+
+
+@pytest.fixture
+def worker():
+    """A live process standing in for a sibling worker."""
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    yield process
+    process.kill()
+    process.wait()
+
+
+def write_snapshot(registry, pid, values=(), histograms=(), ppid=None):
+    os.makedirs(registry.directory, exist_ok=True)
+    with open(os.path.join(registry.directory, f"{pid}.json"), "w") as f:
+        json.dump({"pid": pid, "ppid": os.getppid() if ppid is None else ppid,
+                   "values": list(values), "histograms": list(histograms)}, f)
+
+
+def samples(text):
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+
+
+def test_histogram_renders_cumulative_buckets(registry):
+    for value in (0.05, 0.1, 0.5, 3.0):
+        registry.observe("latency_seconds", value, route="/x")
+    rendered = samples(registry.render())
+    assert rendered['latency_seconds_bucket{route="/x",le="0.1"}'] == "2"
+    assert rendered['latency_seconds_bucket{route="/x",le="1.0"}'] == "3"
+    assert rendered['latency_seconds_bucket{route="/x",le="+Inf"}'] == "4"
+    assert float(rendered['latency_seconds_sum{route="/x"}']) == pytest.approx(3.65)
+    assert rendered['latency_seconds_count{route="/x"}'] == "4"
+
+
+def test_two_workers_are_summed(registry, worker):
+    registry.inc("jobs_total", 2, kind="build")
+    registry.add("in_flight", 1)
+    registry.observe("latency_seconds", 0.5)
+    write_snapshot(registry, worker.pid,
+                   values=[["jobs_total", [["kind", "build"]], 3.0], ["in_flight", [], 2.0]],
+                   histograms=[["latency_seconds", [], [1.0, 0.0, 0.0, 0.05, 1.0]]])
+    rendered = samples(registry.render())
+    assert rendered['jobs_total{kind="build"}'] == "5"
+    assert rendered["in_flight"] == "3"
+    assert rendered['latency_seconds_bucket{le="0.1"}'] == "1"
+    assert rendered['latency_seconds_bucket{le="1.0"}'] == "2"
+    assert rendered["latency_seconds_count"] == "2"
+
+
+def test_exited_worker_is_folded_into_retired_totals(registry, worker):
+    registry.inc("jobs_total", 1)
+    write_snapshot(registry, worker.pid, values=[["jobs_total", [], 4.0], ["in_flight", [], 2.0]],
+                   histograms=[["latency_seconds", [], [0.0, 1.0, 0.0, 0.5, 1.0]]])
+    assert samples(registry.render())["jobs_total"] == "5"
+    worker.kill()
+    worker.wait()
+
+    for _ in range(2):  # folded once, never counted twice
+        rendered = samples(registry.render())
+        assert rendered["jobs_total"] == "5"
+        assert rendered["latency_seconds_count"] == "1"
+        assert "in_flight" not in rendered
+    assert sorted(name for name in os.listdir(registry.directory) if name.endswith(".json")) == \
+        sorted([f"{os.getpid()}.json", "retired.json"])
+
+
+def test_snapshots_of_a_previous_server_are_removed(registry):
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    write_snapshot(registry, dead.pid, values=[["jobs_total", [], 7.0]], ppid=1)
+    registry.inc("jobs_total", 1)
+    assert samples(registry.render())["jobs_total"] == "1"
+    assert not os.path.exists(os.path.join(registry.directory, f"{dead.pid}.json"))
+
+
+def test_middleware_counts_requests_by_route_template(app_module):
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as client:
+            before = (await client.get("/metrics")).text
+            for job_id in ("a1", "b2", "c3"):
+                await client.get(f"/api/jobs/{job_id}")
+            after = await client.get("/metrics")
+            return samples(before), after
+
+    before, response = asyncio.run(main())
+    after = samples(response.text)
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    total = 'http_requests_total{method="GET",route="/api/jobs/{job_id}",status="404"}'
+    count = 'http_request_duration_seconds_count{method="GET",route="/api/jobs/{job_id}"}'
+    assert float(after[total]) - float(before.get(total, 0)) == 3
+    assert float(after[count]) - float(before.get(count, 0)) == 3
+    # One label set per route, however many ids were requested
+    assert not any("a1" in name or "b2" in name for name in after)
+    # Only the /metrics request itself is being served
+    assert after["http_requests_in_flight"] == "1"
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import monte_carlo
+
+MU = [0.07, 0.04]
+COV = np.diag([0.04, 0.01])
+
+
+def test_same_seed_same_result():
+    first = monte_carlo.simulate([0.6, 0.4], MU, COV, n_paths=3000, seed=7, percentiles=[5, 50, 95])
+    second = monte_carlo.simulate([0.6, 0.4], MU, COV, n_paths=3000, seed=7, percentiles=[5, 50, 95])
+
+    assert list(first.to_dict()["percentiles"]) == ["5", "50", "95"]
+    for q in (5, 50, 95):
+        np.testing.assert_array_equal(first.percentiles[q], second.percentiles[q])
+    assert first.percentiles[5][-1] < first.percentiles[50][-1] < first.percentiles[95][-1]
+
+
+@pytest.mark.parametrize("percentiles", [[-1], [50, 101], ["x"], [], list(range(102))])
+def test_rejects_bad_percentiles(percentiles):
+    with pytest.raises(ValueError, match="percentiles"):
+        monte_carlo.simulate([1.0], [0.05], [[0.04]], n_paths=10, percentiles=percentiles)
+
+
+def test_caps_steps():
+    with pytest.raises(ValueError, match="pasos"):
+        monte_carlo.simulate([1.0], [0.05], [[0.04]], n_paths=10, years=100, steps_per_year=365)
+
+
+def test_chunks_fit_the_memory_budget(monkeypatch):
+    monkeypatch.setattr(monte_carlo, "_MEMORY_BUDGET", 8 << 20)
+    result = monte_carlo.simulate([0.5, 0.5], MU, COV, n_paths=2000, years=10, steps_per_year=12)
+
+    steps = 120
+    path_bytes = steps * 8 * (2 + 3)
+    chunk = -(-2000 // result.chunks)
+    assert chunk * path_bytes + steps * monte_carlo._HISTOGRAM_BYTES_PER_STEP <= 8 << 20
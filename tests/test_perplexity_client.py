@@ -0,0 +1,137 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from http_transport import AsyncTransport
+from perplexity_client import JsonArrayStream, PerplexityClient
+from result_cache import TieredCache
+
+
+def sse(*deltas, finish_reason=None):
+    events = [{"choices": [{"delta": {"content": delta}}]} for delta in deltas]
+    events.append({"choices": [{"delta": {}, "finish_reason": finish_reason or "stop"}]})
+    return "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+
+
+@pytest.fixture
+def client(tmp_path):
+    def make(body):
+        transport = AsyncTransport()
+        transport._client = httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})))
+        cache = TieredCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+        return PerplexityClient(api_key="test", transport=transport, cache=cache, limiter=False)
+    return make
+
+
+def stream(client, category="bonds"):
+    async def main():
+        return [item async for item in client.stream_items_async(category, 10000)]
+    return asyncio.run(main())
+
+
+def test_closed_stream_is_cached(client):
+    perplexity = client(sse('[{"ticker": "AGG"}', ', {"ticker": "BND"}]'))
+    assert stream(perplexity) == [{"ticker": "AGG"}, {"ticker": "BND"}]
+    key, _ = perplexity._category_request("bonds", 10000)
+    assert perplexity.cache.get(key) == [{"ticker": "AGG"}, {"ticker": "BND"}]
+
+
+def test_truncated_stream_is_not_cached(client):
+    # finish_reason=length: the model ran out of tokens before closing the array
+    perplexity = client(sse('[{"ticker": "AGG"}', ', {"ticker": "BN', finish_reason="length"))
+    assert stream(perplexity) == [{"ticker": "AGG"}]
+    key, _ = perplexity._category_request("bonds", 10000)
+    assert perplexity.cache.get(key) is None
+
+
+ARRAYS = [
+    # (name, payload, objects, array closed)
+    ("plain", '[{"ticker": "AGG"}, {"ticker": "BND"}]', [{"ticker": "AGG"}, {"ticker": "BND"}], True),
+    ("prose and fence", 'Aquí tienes [1]:\n```json\n[\n  {"ticker": "AGG"}\n]\n```', [{"ticker": "AGG"}], True),
+    ("brackets in strings", '[{"name": "a ] b } c [ {", "note": "say \\"hi\\" }"}]',
+     [{"name": "a ] b } c [ {", "note": 'say "hi" }'}], True),
+    ("nested", '[{"t": "X", "metrics": {"roe": 12, "tags": ["a", "]"]}}, {"t": "Y"}]',
+     [{"t": "X", "metrics": {"roe": 12, "tags": ["a", "]"]}}, {"t": "Y"}], True),
+    ("lenient", "[{'ticker': 'KO', 'marketcap': 250_000_000_000}]", [{"ticker": "KO", "marketcap": 250000000000}], True),
+    ("empty", "Sin resultados: []", [], True),
+    ("never closes", '[{"ticker": "AGG"}, {"ticker": "BND"}, {"ticker": "TL', [{"ticker": "AGG"}, {"ticker": "BND"}], False),
+]
+
+
+def splits(payload):
+    yield [payload]
+    for size in (1, 2, 3, 7):
+        yield [payload[i:i + size] for i in range(0, len(payload), size)]
+    for cut in range(1, len(payload)):
+        yield [payload[:cut], payload[cut:]]
+
+
+@pytest.mark.parametrize("name, payload, objects, closed", ARRAYS, ids=[case[0] for case in ARRAYS])
+def test_json_array_stream_is_independent_of_chunking(name, payload, objects, closed):
+    for chunks in splits(payload):
+        parser = JsonArrayStream()
+        items = [item for chunk in chunks for item in parser.feed(chunk)]
+        assert items == objects, chunks
+        assert parser.done is closed and parser.errors == 0
+
+
+def test_json_array_stream_yields_each_object_when_it_closes():
+    parser = JsonArrayStream()
+    assert parser.feed('[{"ticker": "AGG", "name": "iShares') == []
+    assert parser.feed(' Core"}, {"tic') == [{"ticker": "AGG", "name": "iShares Core"}]
+    assert parser.feed('ker": "BND"}] trailing [{"x": 1}]') == [{"ticker": "BND"}]
+    assert parser.done
+    assert parser.feed('{"ignored": true}') == []
+
+
+def test_category_picks_are_cached_independently_of_the_amount(tmp_path):
+    requests = []
+
+    def answer(request):
+        requests.append(request)
+        return httpx.Response(200, json={"choices": [{"message": {"content": '[{"ticker": "AGG"}]'}}]})
+
+    transport = AsyncTransport()
+    transport._client = httpx.AsyncClient(transport=httpx.MockTransport(answer))
+    cache = TieredCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+    first = PerplexityClient(api_key="test", transport=transport, cache=cache, limiter=False)
+    # Another worker: same shared cache file, its own client
+    second = PerplexityClient(api_key="test", transport=transport,
+                              cache=TieredCache(str(tmp_path / "cache.sqlite3"), ttl=60), limiter=False)
+
+    async def main():
+        return [
+            await first.get_bond_etfs_async(10000),
+            await first.get_bond_etfs_async(25000),
+            await second.get_bond_etfs_async(10000),
+        ]
+
+    assert asyncio.run(main()) == [[{"ticker": "AGG"}]] * 3
+    assert len(requests) == 1
+
+
+def test_identical_concurrent_calls_share_one_request():
+    requests = []
+
+    async def answer(request):
+        requests.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"choices": [{"message": {"content": '[{"ticker": "KO"}]'}}]})
+
+    transport = AsyncTransport()
+    transport._client = httpx.AsyncClient(transport=httpx.MockTransport(answer))
+    client = PerplexityClient(api_key="test", transport=transport, cache=False, limiter=False)
+
+    async def main():
+        same = [client._call_perplexity_async("sistema", "dame  value") for _ in range(4)]
+        # Whitespace differences normalize to the same request
+        same.append(client._call_perplexity_async("sistema", "dame value"))
+        other = client._call_perplexity_async("sistema", "dame growth")
+        return await asyncio.gather(*same, other)
+
+    results = asyncio.run(main())
+    assert results == [[{"ticker": "KO"}]] * 6
+    assert len(requests) == 2
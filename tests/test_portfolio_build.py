@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+
+class FakePerplexity:
+    """get_*_async stand-ins answering after `delay` seconds (or raising `error`)."""
+
+    def __init__(self, delay=0.2, errors=None):
+        self.delay = delay
+        self.errors = errors or {}
+
+    async def _answer(self, category, tickers):
+        await asyncio.sleep(self.delay)
+        if category in self.errors:
+            raise self.errors[category]
+        return [{"ticker": t, "price": 10, "weight": 1 / len(tickers)} for t in tickers]
+
+    async def get_value_portfolio_async(self, amount):
+        return await self._answer("value", ["KO", "JNJ"])
+
+    async def get_growth_portfolio_async(self, amount):
+        return await self._answer("growth", ["ETSY"])
+
+    async def get_bond_etfs_async(self, amount):
+        return await self._answer("bonds", ["AGG", "BND"])
+
+    async def get_disruptive_etfs_async(self, amount):
+        return await self._answer("disruptive", ["ARKK"])
+
+
+@pytest.fixture
+def build(app_module, monkeypatch):
+    quotes = []
+
+    async def quote_prices(*lists, timeout=None):
+        quotes.append(sorted(item["ticker"] for items in lists for item in items))
+        return {"KO": 50.0}
+
+    monkeypatch.setattr(app_module, "_quote_prices", quote_prices)
+
+    def run(perplexity, body):
+        monkeypatch.setattr(app_module, "_perplexity_client", lambda: perplexity)
+
+        async def main():
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                start = time.monotonic()
+                response = await client.post("/api/portfolio/build", json=body)
+                return response, time.monotonic() - start
+
+        return asyncio.run(main())
+
+    run.quotes = quotes
+    return run
+
+
+def test_categories_are_fetched_concurrently(build):
+    body = {"amount": 10000, "target_alloc": {"value": 40, "growth": 30, "bonds": 20, "disruptive": 10}}
+    response, elapsed = build(FakePerplexity(delay=0.2), body)
+    data = response.json()
+
+    assert response.status_code == 200
+    assert elapsed < 0.6  # four 0.2 s calls, not 0.8 s in a row
+    assert data["amounts"] == {"value": 4000, "growth": 3000, "bonds": 2000, "disruptive": 1000}
+    assert data["sourceCount"] == {"value": 2, "growth": 1, "bonds": 2, "disruptive": 1}
+    assert data["partial"] is False and data["errors"] == {}
+    # Quoted price wins over the one in the item
+    ko = data["allocation"]["value"][0]
+    assert ko["symbol"] == "KO" and ko["price"] == 50.0 and ko["shares"] == 40
+
+
+def test_a_failing_category_does_not_sink_the_others(build):
+    perplexity = FakePerplexity(delay=0.05, errors={"growth": RuntimeError("Perplexity API error: 500")})
+    response, _ = build(perplexity, {"amount": 1000})
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["partial"] is True
+    assert data["errors"] == {"growth": "Perplexity API error: 500"}
+    assert data["allocation"]["growth"] == [] and len(data["allocation"]["value"]) == 2
+
+
+def test_slow_category_times_out_alone(build):
+    class Slow(FakePerplexity):
+        async def get_bond_etfs_async(self, amount):
+            await asyncio.sleep(5)
+
+    response, elapsed = build(Slow(delay=0.01), {"amount": 1000, "timeout": 0.2})
+    data = response.json()
+
+    assert elapsed < 1
+    assert data["errors"] == {"bonds": "timeout tras 0s"}
+    assert data["sourceCount"]["value"] == 2
+
+
+def test_every_category_is_quoted_in_one_batch(build):
+    body = {"amount": 10000, "target_alloc": {"value": 40, "growth": 30, "bonds": 20, "disruptive": 10}}
+    response, _ = build(FakePerplexity(delay=0.01), body)
+    data = response.json()
+
+    assert build.quotes == [["AGG", "ARKK", "BND", "ETSY", "JNJ", "KO"]]
+    by_symbol = {p["symbol"]: p for positions in data["allocation"].values() for p in positions}
+    assert by_symbol["KO"]["price_source"] == "alpha_vantage"
+    assert by_symbol["JNJ"]["price_source"] == "perplexity" and by_symbol["JNJ"]["price"] == 10
+
+
+def test_quote_prices_asks_the_client_once_for_all_tickers(app_module, monkeypatch):
+    class Client:
+        calls = []
+
+        async def get_quotes_async(self, tickers, timeout=None):
+            self.calls.append((list(tickers), timeout))
+            return {"KO": {"price": 61.0}, "AGG": {"price": 98.5}}
+
+    monkeypatch.setattr(app_module, "_get_quote_client", Client)
+    value = [{"ticker": "KO"}, {"symbol": "JNJ"}, "not an item"]
+    bonds = [{"ticker": "AGG"}]
+
+    prices = asyncio.run(app_module._quote_prices(value, None, bonds, timeout=3))
+
+    assert prices == {"KO": 61.0, "AGG": 98.5}
+    assert Client.calls == [(["KO", "JNJ", "AGG"], 3)]
+
+
+def test_positions_without_a_usable_price_get_no_shares(app_module):
+    items = [{"ticker": "KO", "weight": 50}, {"ticker": "JNJ", "weight": 0.5, "price": "n/a"},
+             {"ticker": "PEP", "weight": 0.5, "price": 0}]
+    allocation = app_module._compute_allocation(items, 1000, {"KO": 60.0})
+
+    assert allocation[0]["shares"] == 8 and allocation[0]["amount"] == 480.0
+    assert [p["price"] for p in allocation[1:]] == [None, None]
+    assert [p["shares"] for p in allocation[1:]] == [0, 0]
@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+
+import portfolio_optimizer
+
+ACTIVE_SET = "Active-set QP converged"
+
+
+def _market(n, seed=0):
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(size=(750, n)) * 0.01 + rng.normal(size=(750, 1)) * 0.01
+    return rng.normal(0.08, 0.05, n), np.cov(returns, rowvar=False) * 252
+
+
+def _slsqp(monkeypatch, *args, **kwargs):
+    with monkeypatch.context() as m:
+        m.setattr(portfolio_optimizer._ActiveSetQP, "solve", lambda self, c: None)
+        result = portfolio_optimizer.optimize_weights(*args, **kwargs)
+    assert result.message != ACTIVE_SET
+    return result
+
+
+@pytest.mark.parametrize("n, upper", [(20, 1.0), (20, 0.1), (120, 0.05)])
+def test_max_sharpe_uses_active_set_and_matches_slsqp(monkeypatch, n, upper):
+    # n=20 with upper=1 ends on a degenerate vertex where the primal-dual steps used to cycle
+    mu, cov = _market(n)
+    result = portfolio_optimizer.optimize_weights(mu, cov, upper=upper)
+    reference = _slsqp(monkeypatch, mu, cov, upper=upper)
+
+    assert result.success and result.message == ACTIVE_SET
+    assert result.weights.sum() == pytest.approx(1.0, abs=1e-8)
+    assert result.weights.max() <= upper + 1e-12
+    assert result.sharpe_ratio == pytest.approx(reference.sharpe_ratio, rel=1e-5)
+    np.testing.assert_allclose(result.weights, reference.weights, atol=1e-3)
+
+
+@pytest.mark.parametrize("objective, target", [("min_variance", None), ("target_return", 0.1)])
+def test_other_objectives_match_slsqp(monkeypatch, objective, target):
+    mu, cov = _market(40, seed=3)
+    result = portfolio_optimizer.optimize_weights(mu, cov, objective=objective, target_return=target, upper=0.2)
+    reference = _slsqp(monkeypatch, mu, cov, objective=objective, target_return=target, upper=0.2)
+
+    assert result.message == ACTIVE_SET
+    assert result.volatility == pytest.approx(reference.volatility, rel=1e-4)
+    if target is not None:
+        assert result.expected_return >= target - 1e-9
+
+
+def test_groups_are_respected():
+    mu, cov = _market(12, seed=5)
+    groups = {"value": (range(0, 6), 0.6), "growth": (range(6, 12), 0.4)}
+    result = portfolio_optimizer.optimize_weights(mu, cov, upper=0.3, groups=groups)
+
+    assert result.message == ACTIVE_SET
+    assert result.weights[:6].sum() == pytest.approx(0.6, abs=1e-8)
+    assert result.weights[6:].sum() == pytest.approx(0.4, abs=1e-8)
+
+
+def test_unreachable_target_return_raises():
+    mu, cov = _market(10)
+    with pytest.raises(ValueError, match="no es alcanzable"):
+        portfolio_optimizer.optimize_weights(mu, cov, objective="target_return", target_return=5.0)
+
+
+def test_infeasible_bounds_raise():
+    mu, cov = _market(4)
+    with pytest.raises(ValueError, match="solución factible"):
+        portfolio_optimizer.optimize_weights(mu, cov, upper=0.1)
+    with pytest.raises(ValueError, match="incompatibles"):
+        portfolio_optimizer.optimize_weights(mu, cov, upper=0.2, groups={"value": ([0, 1], 0.6), "growth": ([2, 3], 0.4)})
+
+
+def test_frontier_stays_on_active_set():
+    mu, cov = _market(30, seed=7)
+    points = portfolio_optimizer.efficient_frontier(mu, cov, n_points=15, upper=0.25)
+
+    assert all(point.message in (ACTIVE_SET, "Máximo retorno (LP)") for point in points)
+    returns = [point.expected_return for point in points]
+    assert returns == sorted(returns)
+
+
+def _duplicated(n, copies, seed=0):
+    # Each asset listed `copies` times: singular covariance, ties in every return
+    mu, cov = _market(n, seed)
+    index = np.repeat(np.arange(n), copies)
+    return mu[index], cov[np.ix_(index, index)]
+
+
+@pytest.mark.parametrize("objective", ["max_sharpe", "min_variance"])
+def test_tied_returns_match_slsqp(monkeypatch, objective):
+    _, cov = _market(25, seed=11)
+    mu = np.full(25, 0.08)
+    result = portfolio_optimizer.optimize_weights(mu, cov, objective=objective, upper=0.15)
+    reference = _slsqp(monkeypatch, mu, cov, objective=objective, upper=0.15)
+
+    assert result.message == ACTIVE_SET
+    assert result.volatility == pytest.approx(reference.volatility, rel=1e-5)
+    if objective == "max_sharpe":
+        # With equal returns the best Sharpe portfolio is the minimum variance one
+        min_var = portfolio_optimizer.optimize_weights(mu, cov, objective="min_variance", upper=0.15)
+        np.testing.assert_allclose(result.weights, min_var.weights, atol=1e-6)
+
+
+@pytest.mark.parametrize("objective", ["max_sharpe", "min_variance"])
+def test_singular_covariance_matches_slsqp(monkeypatch, objective):
+    mu, cov = _duplicated(10, 3)
+    result = portfolio_optimizer.optimize_weights(mu, cov, objective=objective, upper=0.2)
+    reference = _slsqp(monkeypatch, mu, cov, objective=objective, upper=0.2)
+
+    assert result.message == ACTIVE_SET
+    assert result.weights.sum() == pytest.approx(1.0, abs=1e-8)
+    assert result.weights.max() <= 0.2 + 1e-12
+    # Weights split between duplicated assets are not unique, the optimal risk is
+    assert result.volatility == pytest.approx(reference.volatility, rel=1e-4)
+    if objective == "max_sharpe":
+        assert result.sharpe_ratio >= reference.sharpe_ratio * (1 - 1e-5)
+
+
+def test_single_feasible_point_is_found():
+    # upper = 1/n leaves equal weights as the only feasible portfolio
+    mu, cov = _market(8, seed=2)
+    result = portfolio_optimizer.optimize_weights(mu, cov, upper=0.125)
+    np.testing.assert_allclose(result.weights, np.full(8, 0.125), atol=1e-8)
+
+
+def test_fixed_weights_match_slsqp(monkeypatch):
+    # lower == upper pins some assets; the rest share what is left
+    mu, cov = _market(15, seed=4)
+    lower, upper = np.zeros(15), np.full(15, 0.3)
+    lower[:3] = upper[:3] = 0.1
+    result = portfolio_optimizer.optimize_weights(mu, cov, lower=lower, upper=upper)
+    reference = _slsqp(monkeypatch, mu, cov, lower=lower, upper=upper)
+
+    assert result.message == ACTIVE_SET
+    np.testing.assert_allclose(result.weights[:3], 0.1, atol=1e-10)
+    assert result.sharpe_ratio == pytest.approx(reference.sharpe_ratio, rel=1e-5)
@@ -0,0 +1,86 @@
+import os
+import time
+import uuid
+
+import pytest
+
+from portfolio_store import PostgresPortfolioStore, SQLitePortfolioStore, psycopg2
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        store = SQLitePortfolioStore(str(tmp_path / "portfolios.sqlite3"))
+    else:
+        dsn = os.getenv("TEST_DATABASE_URL")
+        if not dsn or psycopg2 is None:
+            pytest.skip("TEST_DATABASE_URL no definido (o psycopg2 no instalado)")
+        store = PostgresPortfolioStore(dsn, max_connections=2)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def user():
+    # Unique per test so a shared Postgres database needs no cleanup
+    return f"user-{uuid.uuid4().hex[:8]}"
+
+
+ALLOCATION = {
+    "value": [{"symbol": "KO", "name": "Coca-Cola", "price": 60.5, "shares": 10, "amount": 605.0}],
+    "bonds": [{"ticker": "AGG", "price": "98.1", "shares": 2, "amount": 196.2}, {"symbol": "BND", "price": None}],
+}
+
+
+def test_create_get_and_list_by_user(store, user):
+    created = store.create_portfolio(user, "Mi cartera", {"value": 0.6, "bonds": 0.4})
+    store.create_portfolio(f"{user}-other", "Otra", {"value": 1})
+
+    portfolio = store.get_portfolio(created["id"])
+    assert portfolio["user_id"] == user and portfolio["name"] == "Mi cartera"
+    assert portfolio["target_alloc"] == {"value": 0.6, "bonds": 0.4}
+    assert portfolio["allocation"] == {} and portfolio["analyses"] == {} and portfolio["amounts"] is None
+    assert [p["id"] for p in store.list_portfolios(user)] == [created["id"]]
+    assert store.get_portfolio(str(uuid.uuid4())) is None
+
+
+def test_list_is_newest_first_and_pages_with_before(store, user):
+    ids = []
+    for i in range(3):
+        ids.append(store.create_portfolio(user, f"p{i}", {})["id"])
+        time.sleep(0.002)
+    page = store.list_portfolios(user, limit=2)
+    assert [p["id"] for p in page] == ids[::-1][:2]
+    assert [p["id"] for p in store.list_portfolios(user, before=page[-1]["created_at"])] == ids[:1]
+
+
+def test_saving_an_allocation_replaces_the_previous_one(store, user):
+    pid = store.create_portfolio(user, "p", {})["id"]
+    assert store.save_allocation(pid, ALLOCATION, amounts={"value": 605, "bonds": 196.2}) == 3
+    portfolio = store.get_portfolio(pid)
+    assert portfolio["allocation"] == ALLOCATION
+    assert portfolio["amounts"] == {"value": 605, "bonds": 196.2}
+
+    assert store.save_allocation(pid, {"growth": [{"symbol": "ETSY", "shares": 1}]}) == 1
+    portfolio = store.get_portfolio(pid)
+    assert portfolio["allocation"] == {"growth": [{"symbol": "ETSY", "shares": 1}]}
+    # amounts=None keeps the stored amounts
+    assert portfolio["amounts"] == {"value": 605, "bonds": 196.2}
+
+
+def test_saving_an_allocation_for_an_unknown_portfolio_fails(store):
+    with pytest.raises(KeyError):
+        store.save_allocation(str(uuid.uuid4()), ALLOCATION)
+
+
+def test_latest_analysis_of_each_kind_is_returned(store, user):
+    pid = store.create_portfolio(user, "p", {})["id"]
+    store.save_analysis(pid, "analysis", "primer análisis", analysis_id="a1")
+    time.sleep(0.002)
+    store.save_analysis(pid, "analysis", "segundo análisis", analysis_id="a2")
+    store.save_analysis(pid, "decision", {"action": "hold", "confidence": 0.7})
+
+    analyses = store.get_portfolio(pid)["analyses"]
+    assert analyses["analysis"]["content"] == "segundo análisis"
+    assert analyses["analysis"]["analysis_id"] == "a2"
+    assert analyses["decision"]["content"] == {"action": "hold", "confidence": 0.7}
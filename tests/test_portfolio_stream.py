@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+
+class FakePerplexity:
+    """stream_items_async stand-in: per category, (delay before each item, items)."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.closed = []
+
+    async def stream_items_async(self, category, amount):
+        delay, items = self.answers[category]
+        try:
+            for item in items:
+                await asyncio.sleep(delay)
+                yield item
+        finally:
+            self.closed.append(category)
+
+
+@pytest.fixture
+def stream(app_module, monkeypatch):
+    monkeypatch.setenv("FALLBACK_HEDGE_DELAY", "0.1")
+
+    async def no_quotes(*lists, timeout=None):
+        return {}
+
+    monkeypatch.setattr(app_module, "_quote_prices", no_quotes)
+
+    def run(category, answers):
+        perplexity = FakePerplexity(answers)
+        monkeypatch.setattr(app_module, "_perplexity_client", lambda: perplexity)
+
+        async def main():
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.post(f"/api/portfolio/{category}/stream", json={"amount": 1000})
+            return [json.loads(line) for line in response.text.splitlines()]
+
+        return asyncio.run(main()), perplexity
+
+    return run
+
+
+def item(ticker):
+    return {"ticker": ticker, "price": 10}
+
+
+def test_disruptive_streams_the_etfs_when_they_answer(stream):
+    lines, perplexity = stream("disruptive", {
+        "disruptive": (0.01, [item("ARKK"), item("BOTZ"), item("SMH")]),
+        "disruptive_portfolio": (0.01, [item("PE")]),
+    })
+    assert [line["position"]["symbol"] for line in lines[:-1]] == ["ARKK", "BOTZ", "SMH"]
+    assert lines[-1] == {"type": "done", "sourceCount": 3}
+    assert "disruptive_portfolio" not in perplexity.closed
+
+
+def test_disruptive_falls_back_to_the_portfolio_when_the_etfs_are_empty(stream):
+    lines, _ = stream("disruptive", {
+        "disruptive": (0.01, []),
+        "disruptive_portfolio": (0.01, [item(t) for t in ("A", "B", "C", "D", "E")]),
+    })
+    positions = [line["position"] for line in lines[:-1]]
+    assert [p["symbol"] for p in positions] == ["A", "B", "C", "D", "E"]
+    # Weighted as the five instruments the portfolio request asks for
+    assert positions[0]["shares"] == 20
+    assert lines[-1]["sourceCount"] == 5
+
+
+def test_disruptive_hedges_slow_etfs_and_closes_the_loser(stream):
+    lines, perplexity = stream("disruptive", {
+        "disruptive": (1.0, [item("ARKK")]),
+        "disruptive_portfolio": (0.01, [item("PE")]),
+    })
+    assert [line["position"]["symbol"] for line in lines[:-1]] == ["PE"]
+    assert perplexity.closed == ["disruptive", "disruptive_portfolio"]
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+
+import price_store
+from price_store import PriceStore
+
+
+def _block(rows, cols, start=1.0):
+    return start + np.arange(rows * cols, dtype=float).reshape(rows, cols)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PriceStore(str(tmp_path / "prices"))
+    store.write(["2024-01-02", "2024-01-03"], ["AAA", "BBB"], {"close": _block(2, 2), "volume": _block(2, 2, 100.0)})
+    return store
+
+
+def test_append_and_read(store):
+    store.write(["2024-01-04"], ["BBB", "CCC"], {"close": [[10.0, 20.0]]})
+
+    dates, close = store.slice("close")
+    assert [str(d) for d in dates] == ["2024-01-02", "2024-01-03", "2024-01-04"]
+    np.testing.assert_array_equal(close[:2, :2], _block(2, 2))
+    assert close[2, 1] == 10.0 and close[2, 2] == 20.0 and np.isnan(close[2, 0])
+    assert np.isnan(close[:2, 2]).all()
+
+
+def test_partial_update_keeps_other_fields(store):
+    store.append_day("2024-01-03", {"AAA": {"close": 99.0}, "BBB": {"volume": 7.0}})
+
+    _, close = store.slice("close", ["AAA", "BBB"])
+    _, volume = store.slice("volume", ["AAA", "BBB"])
+    np.testing.assert_array_equal(close[1], [99.0, 4.0])
+    np.testing.assert_array_equal(volume[1], [102.0, 7.0])
+    assert store.rewrite_version == store.version
+
+
+def test_rejected_write_leaves_store_untouched(store):
+    before = {name: open(os.path.join(store.path, name), "rb").read() for name in sorted(os.listdir(store.path))}
+    many = [f"T{i:03d}" for i in range(price_store._COLUMN_BLOCK + 1)]
+    # Would widen the matrices and is also before the last stored day
+    with pytest.raises(ValueError, match="posteriores"):
+        store.write(["2024-01-01"], many, {"close": np.ones((1, len(many)))})
+    with pytest.raises(ValueError, match="forma"):
+        store.write(["2024-01-05"], ["AAA"], {"close": np.ones((2, 1))})
+    with pytest.raises(ValueError, match="desconocidos"):
+        store.write(["2024-01-05"], ["AAA"], {"price": [[1.0]]})
+
+    after = {name: open(os.path.join(store.path, name), "rb").read() for name in sorted(os.listdir(store.path))}
+    assert after == before
+    reopened = PriceStore(store.path)
+    np.testing.assert_array_equal(reopened.slice("close")[1], _block(2, 2))
+
+
+def test_widening_switches_generation_atomically(store):
+    reader = PriceStore(store.path)
+    many = [f"T{i:03d}" for i in range(price_store._COLUMN_BLOCK + 1)]
+    store.write(["2024-01-03", "2024-01-04"], many, {"close": np.full((2, len(many)), 5.0)})
+
+    assert store.capacity == 2 * price_store._COLUMN_BLOCK and store.generation == 1
+    assert not os.path.exists(os.path.join(store.path, "close.f8"))
+    # A reader mapped before the widening still sees consistent data until it refreshes
+    np.testing.assert_array_equal(reader._maps["close"][:, :2], _block(2, 2))
+    assert reader.refresh()
+    _, close = reader.slice("close", ["AAA", "BBB", "T000"])
+    np.testing.assert_array_equal(close[:2, :2], _block(2, 2))
+    np.testing.assert_array_equal(close[1:, 2], [5.0, 5.0])
+    assert np.isnan(close[0, 2])
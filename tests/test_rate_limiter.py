@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import pytest
+
+from rate_limiter import RateLimiter, RateLimitExceeded
+from upstream_policy import DeadlineExceeded, deadline
+
+
+def _limiter(tmp_path, **kwargs):
+    kwargs.setdefault("per_minute", 600)
+    return RateLimiter("test", path=str(tmp_path / "limits.sqlite3"), **kwargs)
+
+
+def test_waiters_are_served_in_arrival_order(tmp_path):
+    limiter = _limiter(tmp_path, burst=1)  # one token every 0.1 s
+    order = []
+
+    async def call(i):
+        await asyncio.sleep(0.005 * i)
+        await limiter.acquire()
+        order.append((i, time.monotonic()))
+
+    async def main():
+        start = time.monotonic()
+        await asyncio.gather(*(call(i) for i in reversed(range(5))))
+        return start
+
+    start = asyncio.run(main())
+    assert [i for i, _ in order] == list(range(5))
+    # The first token is free, then one per 0.1 s
+    assert order[-1][1] - start == pytest.approx(0.4, abs=0.15)
+    assert limiter.counters["acquired"] == 5 and limiter.counters["waited"] == 4
+
+
+def test_rejects_when_the_wait_exceeds_max_wait(tmp_path):
+    limiter = _limiter(tmp_path, per_minute=60, burst=1)
+
+    async def main():
+        await limiter.acquire()
+        started = time.monotonic()
+        with pytest.raises(RateLimitExceeded) as info:
+            await limiter.acquire(max_wait=0.2)
+        return time.monotonic() - started, info.value
+
+    elapsed, error = asyncio.run(main())
+    assert elapsed < 0.1  # rejected up front, not after sleeping
+    assert error.wait == pytest.approx(1.0, abs=0.1)
+    assert limiter.counters["rejected"] == 1 and limiter.counters["acquired"] == 1
+
+
+def test_rejects_when_the_request_deadline_is_closer(tmp_path):
+    limiter = _limiter(tmp_path, per_minute=60, burst=1)
+
+    async def main():
+        await limiter.acquire()
+        with deadline(0.3):
+            await limiter.acquire(max_wait=30)
+
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(main())
+
+
+def test_expired_deadline_takes_no_token(tmp_path):
+    limiter = _limiter(tmp_path, per_minute=60, burst=1)
+
+    async def main():
+        with deadline(0):
+            await limiter.acquire(max_wait=30)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(main())
+    assert limiter.state()["tokens"] == pytest.approx(1.0, abs=0.01)
+    assert limiter.counters["acquired"] == 0
+
+
+def test_deadline_passing_while_queued_takes_no_token(tmp_path):
+    limiter = _limiter(tmp_path, per_minute=120, burst=1)  # one token every 0.5 s
+
+    async def hurried():
+        await asyncio.sleep(0.01)
+        with deadline(0.2):
+            await limiter.acquire(max_wait=30)
+
+    async def main():
+        await limiter.acquire()
+        # The second call holds the queue for 0.5 s waiting for the next token
+        return await asyncio.gather(limiter.acquire(), hurried(), return_exceptions=True)
+
+    first, second = asyncio.run(main())
+    assert first is None and isinstance(second, DeadlineExceeded)
+    assert limiter.counters["acquired"] == 2
+
+
+def test_daily_quota_is_shared_between_instances(tmp_path):
+    first = _limiter(tmp_path, per_day=2)
+    second = _limiter(tmp_path, per_day=2)
+
+    first.acquire_sync()
+    second.acquire_sync()
+    with pytest.raises(RateLimitExceeded) as info:
+        first.acquire_sync(max_wait=5)
+    assert info.value.wait > 5
+    assert first.state()["day_count"] == 2
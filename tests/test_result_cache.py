@@ -0,0 +1,72 @@
+from result_cache import TieredCache, make_key
+
+
+def test_get_stale_counts_only_expired_entries(tmp_path):
+    cache = TieredCache(str(tmp_path / "cache.sqlite3"), ttl=60, stale_ttl=3600)
+    cache.set("fresh", {"v": 1})
+    cache.set("old", {"v": 2}, ttl=-5)
+
+    value, age = cache.get_stale("fresh")
+    assert value == {"v": 1} and age == 0.0
+    assert cache.stats_counters["stale_hits"] == 0
+
+    value, age = cache.get_stale("old")
+    assert value == {"v": 2} and age >= 5
+    assert cache.stats_counters["stale_hits"] == 1
+
+    assert cache.get_stale("missing") is None
+    assert cache.get("old") is None
+    assert cache.stats_counters["stale_hits"] == 1
+
+
+
+def test_make_key_ignores_parameter_order():
+    assert make_key("perplexity:value", region="EU", n=10) == make_key("perplexity:value", n=10, region="EU")
+    assert make_key("perplexity:value", n=10) != make_key("perplexity:growth", n=10)
+
+
+def test_workers_share_the_disk_tier(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    writer, reader = TieredCache(path), TieredCache(path)
+    writer.set("k", [{"ticker": "KO"}])
+
+    first = reader.get("k")
+    first[0]["ticker"] = "changed"  # callers get their own copy
+    assert reader.get("k") == [{"ticker": "KO"}]
+    assert reader.stats_counters["disk_hits"] == 1 and reader.stats_counters["memory_hits"] == 1
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = TieredCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+    cache.set("old", 1, ttl=-1)
+    assert cache.get("old") is None
+    assert cache.stats_counters["misses"] == 1
+
+
+def test_memory_tier_is_a_bounded_lru(tmp_path):
+    cache = TieredCache(str(tmp_path / "cache.sqlite3"), memory_size=2)
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+    cache.get("b")
+    cache.set("d", "d")
+    assert list(cache._memory) == ["b", "d"]
+    assert cache.get("a") == "a"  # still on disk
+    assert cache.stats_counters["disk_hits"] == 1
+
+
+def test_disk_tier_evicts_least_recently_used_beyond_max_entries(tmp_path):
+    cache = TieredCache(str(tmp_path / "cache.sqlite3"), memory_size=1, max_entries=10)
+    for i in range(65):  # the 65th write runs an eviction pass
+        cache.set(f"k{i}", i)
+    stats = cache.stats()
+    assert stats["disk_entries"] == 10 and stats["evictions"] == 55
+    assert cache.get("k0") is None and cache.get("k64") == 64
+
+
+def test_get_many_reads_both_tiers(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    TieredCache(path).set("disk", 1)
+    cache = TieredCache(path)
+    cache.set("memory", 2)
+    assert cache.get_many(["memory", "disk", "missing", "disk"]) == {"memory": 2, "disk": 1}
+    assert cache.stats_counters["misses"] == 1
@@ -0,0 +1,165 @@
+import asyncio
+
+import httpx
+import numpy as np
+import pytest
+
+import risk_model
+from price_store import PriceStore
+from risk_model import CovarianceService, TRADING_DAYS
+
+TICKERS = ["AAA", "BBB", "CCC", "DDD"]
+
+
+def _prices(n_days, seed=0, gaps=False):
+    rng = np.random.default_rng(seed)
+    days = np.arange(np.datetime64("2022-01-03"), np.datetime64("2026-01-01"))
+    dates = days[np.is_busday(days)][:n_days]
+    common = rng.normal(0, 0.01, size=(n_days, 1))
+    close = 100.0 * np.cumprod(1.0 + common + rng.normal(0.0003, 0.01, size=(n_days, len(TICKERS))), axis=0)
+    if gaps:
+        close[[10, 40], [1, 3]] = np.nan
+    return dates, close
+
+
+def _ledoit_wolf(returns):
+    """Ledoit-Wolf (2004) shrinkage towards a scaled identity, straight from the paper."""
+    t, n = returns.shape
+    x = returns - returns.mean(axis=0)
+    s = x.T @ x / t
+    m = np.trace(s) / n
+    d2 = np.sum((s - m * np.eye(n)) ** 2)
+    b_bar2 = sum(np.sum((np.outer(row, row) - s) ** 2) for row in x) / t ** 2
+    b2 = min(b_bar2, d2)
+    return (b2 / d2) * m * np.eye(n) + (1 - b2 / d2) * s, b2 / d2
+
+
+def _ewma(returns, decay):
+    weights = (1 - decay) * decay ** np.arange(returns.shape[0] - 1, -1, -1)
+    weights /= weights.sum()
+    return (returns * weights[:, None]).T @ returns
+
+
+@pytest.fixture
+def history(tmp_path):
+    dates, close = _prices(400, gaps=True)
+    store = PriceStore(str(tmp_path / "prices"))
+    store.write(dates[:300].astype(str).tolist(), TICKERS, {"adj_close": close[:300]})
+    store.rest = (dates[300:], close[300:])
+    return store
+
+
+def _window_returns(store, window):
+    _, prices = store.slice("adj_close", TICKERS)
+    returns = prices[1:] / prices[:-1] - 1.0
+    returns = returns[-window:]
+    return returns[~np.isnan(returns).any(axis=1)]
+
+
+@pytest.mark.parametrize("estimator", risk_model.ESTIMATORS)
+def test_estimators_match_direct_formulas(history, estimator):
+    # The window covers the gaps: rows with a missing price are left out
+    estimate = CovarianceService(history).estimate(TICKERS, estimator, window=280)
+    returns = _window_returns(history, 280)
+
+    assert estimate.observations == returns.shape[0] == 278
+    np.testing.assert_allclose(estimate.mu, returns.mean(axis=0) * TRADING_DAYS, rtol=1e-10)
+    if estimator == "sample":
+        expected = np.cov(returns, rowvar=False)
+    elif estimator == "ewma":
+        expected = _ewma(returns, risk_model.EWMA_DECAY)
+    else:
+        expected, shrinkage = _ledoit_wolf(returns)
+        assert estimate.shrinkage == pytest.approx(shrinkage, rel=1e-8)
+    np.testing.assert_allclose(estimate.cov, expected * TRADING_DAYS, rtol=1e-8)
+
+
+def test_shrinkage_makes_a_short_window_well_conditioned(tmp_path):
+    # More assets than days: the sample covariance is singular, the shrunk one is not
+    rng = np.random.default_rng(1)
+    tickers = [f"T{i:02d}" for i in range(30)]
+    days = np.arange(np.datetime64("2024-01-01"), np.datetime64("2024-03-01"))
+    dates = days[np.is_busday(days)][:21]
+    store = PriceStore(str(tmp_path / "prices"))
+    store.write(dates.astype(str).tolist(), tickers,
+                {"adj_close": 100 * np.cumprod(1 + rng.normal(0, 0.01, (21, 30)), axis=0)})
+    service = CovarianceService(store)
+
+    assert np.linalg.matrix_rank(service.estimate(tickers, "sample", window=20).cov) < 30
+    shrunk = service.estimate(tickers, "ledoit_wolf", window=20)
+    assert 0 < shrunk.shrinkage <= 1
+    assert np.linalg.eigvalsh(shrunk.cov).min() > 0
+
+
+def test_new_days_slide_the_window_incrementally(history):
+    service = CovarianceService(history)
+    service.estimate(TICKERS, "ledoit_wolf", window=120)
+    dates, close = history.rest
+    for day in range(5):
+        history.append_day(str(dates[day]), {t: {"adj_close": close[day, j]} for j, t in enumerate(TICKERS)})
+        slid = service.estimate(TICKERS, "ledoit_wolf", window=120)
+
+    fresh = CovarianceService(history).estimate(TICKERS, "ledoit_wolf", window=120)
+    assert service.stats() == {"entries": 1, "hits": 0, "incremental": 5, "rebuilds": 1}
+    assert slid.end == str(dates[4]) and slid.observations == fresh.observations
+    np.testing.assert_allclose(slid.cov, fresh.cov, rtol=1e-9)
+    np.testing.assert_allclose(slid.mu, fresh.mu, rtol=1e-9)
+
+
+def test_repeated_estimates_are_cached_and_read_only(history):
+    service = CovarianceService(history)
+    first = service.estimate(TICKERS, "sample", window=60)
+    again = service.estimate(TICKERS, "sample", window=60)
+    service.estimate(TICKERS, "ewma", window=60)
+
+    assert again is first
+    assert service.stats() == {"entries": 1, "hits": 1, "incremental": 0, "rebuilds": 1}
+    with pytest.raises(ValueError):
+        first.cov[0, 0] = 1.0
+
+
+def test_rewritten_history_forces_a_rebuild(history):
+    service = CovarianceService(history)
+    before = service.estimate(TICKERS, "sample", window=60)
+    dates, _ = history.slice("adj_close", TICKERS)
+    history.append_day(str(dates[-10]), {"AAA": {"adj_close": 1.0}})
+    after = service.estimate(TICKERS, "sample", window=60)
+
+    assert service.stats()["rebuilds"] == 2
+    assert after.cov[0, 0] > before.cov[0, 0]
+
+
+def test_entries_are_bounded(history):
+    service = CovarianceService(history, max_entries=2)
+    for window in (30, 60, 90):
+        service.estimate(TICKERS, "sample", window=window)
+    assert service.stats()["entries"] == 2
+
+
+def test_unknown_estimator_or_ticker(history):
+    service = CovarianceService(history)
+    with pytest.raises(ValueError, match="Estimador desconocido"):
+        service.estimate(TICKERS, "shrunk")
+    with pytest.raises(KeyError):
+        service.estimate(["AAA", "ZZZ"])
+
+
+def test_covariance_endpoint(app_module, history, monkeypatch):
+    service = CovarianceService(history)
+    monkeypatch.setattr(app_module, "get_covariance_service", lambda: service)
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as client:
+            return [await client.get("/api/risk/covariance", params=params) for params in (
+                {"tickers": "aaa, bbb", "window": 60, "correlation": "true"},
+                {"tickers": "AAA,ZZZ"},
+                {"tickers": "AAA", "estimator": "shrunk"},
+            )]
+
+    ok, unknown_ticker, bad_estimator = asyncio.run(main())
+    body = ok.json()
+
+    assert body["tickers"] == ["AAA", "BBB"] and body["estimator"] == "ledoit_wolf"
+    assert np.diag(body["correlation"]).tolist() == [1.0, 1.0]
+    assert unknown_ticker.status_code == 404
+    assert bad_estimator.status_code == 400
@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+from upstream_policy import DeadlineExceeded, deadline, remaining, within_deadline
+
+
+def test_shared_call_outlives_the_first_callers_deadline():
+    group = SingleFlight("test")
+    seen = {}
+
+    async def upstream():
+        seen["remaining"] = remaining()
+        # Bounded by the shared deadline, which the second caller extends
+        await within_deadline(asyncio.sleep(0.2), "upstream")
+        return "ok"
+
+    async def hurried():
+        with deadline(0.05):
+            return await group.do("key", upstream)
+
+    async def patient():
+        await asyncio.sleep(0.01)
+        with deadline(5):
+            return await group.do("key", upstream)
+
+    async def main():
+        start = time.monotonic()
+        first, second = await asyncio.gather(hurried(), patient(), return_exceptions=True)
+        return first, second, time.monotonic() - start
+
+    first, second, elapsed = asyncio.run(main())
+    assert isinstance(first, DeadlineExceeded)
+    assert second == "ok"
+    assert 0 < seen["remaining"] <= 0.05
+    assert group.counters["executions"] == 1 and group.counters["coalesced"] == 1
+    assert elapsed < 0.5
+
+
+def test_shared_call_runs_under_the_latest_waiter_deadline():
+    group = SingleFlight("test")
+    seen = []
+
+    async def upstream():
+        await asyncio.sleep(0.05)
+        seen.append(remaining())
+        return "ok"
+
+    async def call(seconds, delay):
+        await asyncio.sleep(delay)
+        with deadline(seconds):
+            return await group.do("key", upstream)
+
+    async def main():
+        return await asyncio.gather(call(1, 0), call(3, 0.01), call(2, 0.02))
+
+    assert asyncio.run(main()) == ["ok"] * 3
+    assert 2.5 < seen[0] <= 3
+
+
+def test_call_is_cancelled_when_every_waiter_leaves():
+    group = SingleFlight("test")
+    seen = {}
+
+    async def upstream():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            seen["cancelled"] = True
+            raise
+        return "ok"
+
+    async def call(seconds):
+        with deadline(seconds):
+            return await group.do("key", upstream)
+
+    async def main():
+        results = await asyncio.gather(call(0.05), call(0.1), return_exceptions=True)
+        await asyncio.sleep(0.01)
+        return results
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, DeadlineExceeded) for r in results)
+    assert seen == {"cancelled": True}
+    assert group.counters["abandoned"] == 1
+    assert group.stats()["in_flight"] == 0
+
+
+def test_each_caller_keeps_its_own_deadline():
+    group = SingleFlight("test")
+
+    async def upstream():
+        await asyncio.sleep(0.3)
+        return "ok"
+
+    async def call(seconds, delay):
+        await asyncio.sleep(delay)
+        start = time.monotonic()
+        with deadline(seconds):
+            try:
+                return await group.do("key", upstream)
+            except DeadlineExceeded:
+                return round(time.monotonic() - start, 1)
+
+    async def main():
+        return await asyncio.gather(call(None, 0), call(0.1, 0.01), call(5, 0.02))
+
+    assert asyncio.run(main()) == ["ok", 0.1, "ok"]
+
+
+def test_failures_reach_every_waiter():
+    group = SingleFlight("test")
+
+    async def upstream():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("boom")
+
+    async def main():
+        return await asyncio.gather(*(group.do("key", upstream) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert group.counters["errors"] == 1
+    with pytest.raises(KeyError):
+        group._waiters["key"]
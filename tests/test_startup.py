@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import builtins
+import logging
+import subprocess
+
+import httpx
+import pytest
+
+import startup
+from benchmarks.load import isolated_env
+from startup import LazyAttribute, StartupReport, lazy_import, preload
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def fresh_module(tmp_path, monkeypatch):
+    """Name of a module that is importable but not imported yet."""
+    (tmp_path / "startup_probe.py").write_text("import time\ntime.sleep(0.02)\nVALUE = 42\n\ndef answer():\n    return VALUE\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield "startup_probe"
+    sys.modules.pop("startup_probe", None)
+
+
+@pytest.fixture
+def report(monkeypatch):
+    report = StartupReport(budget_ms=0)
+    monkeypatch.setattr(startup, "report", report)
+    return report
+
+
+def test_top_level_imports_are_timed_until_stopped(report, fresh_module):
+    original = builtins.__import__
+    report.track_imports()
+    try:
+        __import__(fresh_module)
+        __import__("os")  # already loaded: not recorded
+    finally:
+        report.stop_imports()
+
+    assert builtins.__import__ is original
+    assert set(report.imports) == {fresh_module}
+    assert report.imports[fresh_module] >= 20
+    assert report.phases["imports"] == report.imports[fresh_module]
+
+
+def test_phases_accumulate_and_budget_is_checked(caplog):
+    report = StartupReport(budget_ms=1)
+    with report.phase("static"):
+        time.sleep(0.005)
+    with report.phase("static"):
+        pass
+    with caplog.at_level(logging.INFO, logger="startup"):
+        report.ready()
+
+    assert report.phases["static"] >= 5
+    assert report.over_budget()
+    assert "presupuesto" in caplog.records[-1].getMessage()
+    assert report.to_dict()["budget_ms"] == 1
+    assert not StartupReport(budget_ms=0).over_budget()
+
+
+def test_lazy_module_imports_on_first_use(report, fresh_module):
+    module = lazy_import(fresh_module)
+    answer = LazyAttribute(module, "answer")
+
+    assert module and answer and not module.loaded
+    assert fresh_module not in sys.modules
+    assert answer() == 42 and module.VALUE == 42
+    assert module.loaded and report.lazy_imports[fresh_module] >= 20
+
+
+def test_missing_lazy_module_is_falsy_and_raises_on_use(report):
+    module = lazy_import("no_such_module_here")
+
+    assert not module and not LazyAttribute(module, "anything")
+    with pytest.raises(ImportError):
+        module.load()
+
+
+def test_broken_lazy_module_turns_falsy(report, tmp_path, monkeypatch):
+    (tmp_path / "startup_broken.py").write_text("raise RuntimeError('boom')\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = lazy_import("startup_broken")
+
+    assert module
+    with pytest.raises(ImportError, match="boom"):
+        module.VALUE
+    assert not module
+
+
+def test_preload_imports_in_the_background(report, fresh_module):
+    module = lazy_import(fresh_module)
+    preload([module, lazy_import("no_such_module_here")])
+
+    deadline = time.monotonic() + 5
+    while not module.loaded and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert module.loaded
+
+
+def run_startup_check(tmp_path, **env):
+    environ = {**os.environ, **isolated_env(str(tmp_path)), "STATIC_ROOT": str(tmp_path / "public"), **env}
+    return subprocess.run([sys.executable, "startup.py"], cwd=ROOT, env=environ, capture_output=True, text=True, timeout=120)
+
+
+def test_app_starts_without_the_numerical_stack(tmp_path):
+    environ = {**os.environ, **isolated_env(str(tmp_path)), "STATIC_ROOT": str(tmp_path / "public")}
+    probe = "import sys, app; print(sorted(m for m in ('numpy', 'scipy', 'portfolio_optimizer') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, env=environ, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+
+
+def test_startup_check_prints_the_breakdown(tmp_path):
+    result = run_startup_check(tmp_path)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout[result.stdout.index("{\n"):])
+
+    assert report["ready_ms"] > 0
+    assert {"imports", "clients", "job_queue", "static"} <= set(report["phases"])
+    assert "fastapi" in report["imports"]
+
+    over = run_startup_check(tmp_path, STARTUP_BUDGET_MS="1")
+    assert over.returncode == 1
+
+
+def test_startup_endpoint_reports_lazy_imports(app_module):
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as client:
+            return await client.get("/api/startup")
+
+    app_module.backtest.load()
+    body = asyncio.run(main()).json()
+
+    assert set(body) == {"ready_ms", "budget_ms", "phases", "imports", "lazy_imports"}
+    assert "backtest" in body["lazy_imports"]
@@ -0,0 +1,143 @@
+import os
+import gzip
+import asyncio
+
+import httpx
+import pytest
+
+import static_assets
+from static_assets import IMMUTABLE, REVALIDATE, StaticSite
+
+INDEX = b"<!doctype html><div id=root></div>" + b"<!-- padding -->" * 100
+BUNDLE = b"console.log('app');\n" * 200
+STYLES = b"body { margin: 0 }\n" * 100
+
+
+@pytest.fixture
+def build(tmp_path):
+    root = tmp_path / "public"
+    (root / "static" / "js").mkdir(parents=True)
+    (root / "static" / "css").mkdir()
+    (root / "index.html").write_bytes(INDEX)
+    bundle = root / "static" / "js" / "main.1a2b3c4d.js"
+    bundle.write_bytes(BUNDLE)
+    (root / "static" / "js" / "main.1a2b3c4d.js.gz").write_bytes(gzip.compress(BUNDLE))
+    (root / "static" / "js" / "main.1a2b3c4d.js.br").write_bytes(b"brotli bytes")
+    (root / "static" / "css" / "app.css").write_bytes(STYLES)
+    (root / "favicon.ico").write_bytes(b"\x00" * 10)
+    return root
+
+
+@pytest.fixture
+def site(build):
+    site = StaticSite(str(build), check_interval=0)
+    site.load()
+    return site
+
+
+@pytest.fixture
+def get(app_module, site, monkeypatch):
+    """GET through the app's SPA routes; returns the response and its raw (still encoded) body."""
+    monkeypatch.setattr(app_module, "static_site", site)
+
+    def request(path, **headers):
+        async def main():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as client:
+                async with client.stream("GET", path, headers={"accept-encoding": "identity", **headers}) as response:
+                    return response, b"".join([chunk async for chunk in response.aiter_raw()])
+
+        return asyncio.run(main())
+
+    return request
+
+
+def test_index_skips_variants_and_marks_fingerprinted_files(site):
+    assert sorted(site.assets) == ["favicon.ico", "index.html", "static/css/app.css", "static/js/main.1a2b3c4d.js"]
+    assert site.lookup("/static/js/main.1a2b3c4d.js").immutable
+    assert not site.lookup("static/css/app.css").immutable
+    assert sorted(site.lookup("static/js/main.1a2b3c4d.js").variants) == ["br", "gzip"]
+
+
+def test_fingerprinted_asset_prefers_brotli_and_is_immutable(get):
+    response, body = get("/static/js/main.1a2b3c4d.js", **{"accept-encoding": "gzip, br"})
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "br" and body == b"brotli bytes"
+    assert response.headers["cache-control"] == IMMUTABLE
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.headers["etag"].endswith('-br"')
+
+
+def test_encoding_follows_accept_encoding(get):
+    gzipped, body = get("/static/js/main.1a2b3c4d.js", **{"accept-encoding": "br;q=0, gzip"})
+    plain, raw = get("/static/js/main.1a2b3c4d.js")
+
+    assert gzipped.headers["content-encoding"] == "gzip" and gzip.decompress(body) == BUNDLE
+    assert "content-encoding" not in plain.headers and raw == BUNDLE
+    assert len({gzipped.headers["etag"], plain.headers["etag"]}) == 2
+
+
+def test_compressible_file_without_variant_is_gzipped_in_memory(get):
+    response, body = get("/static/css/app.css", **{"accept-encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(body) == STYLES
+    assert response.headers["cache-control"] == REVALIDATE
+    small, _ = get("/favicon.ico", **{"accept-encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    assert "Accept-Encoding" not in small.headers.get("vary", "")
+
+
+def test_matching_etag_answers_304(get):
+    first, _ = get("/static/css/app.css")
+    etag = first.headers["etag"]
+
+    for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        response, body = get("/static/css/app.css", **{"if-none-match": header})
+        assert response.status_code == 304 and body == b""
+        assert response.headers["etag"] == etag
+    assert get("/static/css/app.css", **{"if-none-match": '"other"'})[0].status_code == 200
+
+
+def test_client_routes_fall_back_to_index(get):
+    response, body = get("/portfolio/123/edit")
+    compressed, gz_body = get("/portfolio/123/edit", **{"accept-encoding": "gzip"})
+
+    assert response.status_code == 200 and body == INDEX
+    assert response.headers["content-type"].startswith("text/html")
+    assert response.headers["cache-control"] == REVALIDATE
+    assert compressed.headers["content-encoding"] == "gzip" and gzip.decompress(gz_body) == INDEX
+    assert get("/")[1] == INDEX
+
+
+def test_api_paths_are_not_served_the_index(get):
+    assert get("/api/no-such-endpoint")[0].status_code == 404
+
+
+def test_variant_older_than_its_source_is_ignored(build):
+    source = build / "static" / "js" / "main.1a2b3c4d.js"
+    stat = source.stat()
+    os.utime(str(source) + ".br", ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**9))
+    site = StaticSite(str(build))
+    site.load()
+
+    assert sorted(site.lookup("static/js/main.1a2b3c4d.js").variants) == ["gzip"]
+
+
+def test_new_build_is_picked_up_on_refresh(site, build):
+    (build / "index.html").write_bytes(b"<!doctype html>new build")
+    os.utime(build / "index.html", ns=(0, (build / "index.html").stat().st_mtime_ns + 10**9))
+    site.refresh()
+
+    assert site.respond_index({}).body == b"<!doctype html>new build"
+
+
+def test_precompress_writes_variants_for_large_text_files(build):
+    for name in ("main.1a2b3c4d.js.gz", "main.1a2b3c4d.js.br"):
+        os.remove(build / "static" / "js" / name)
+    written = static_assets.precompress(str(build))
+
+    per_file = 1 if static_assets.brotli is None else 2
+    assert written == 3 * per_file  # index.html, the bundle and the stylesheet; not the icon
+    assert gzip.decompress((build / "static" / "css" / "app.css.gz").read_bytes()) == STYLES
+    assert not (build / "favicon.ico.gz").exists()
@@ -0,0 +1,130 @@
+import sys
+import json
+import queue
+import asyncio
+import logging
+
+import httpx
+import pytest
+
+import metrics
+import structured_logging
+from structured_logging import JsonFormatter, NonBlockingQueueHandler, SamplingFilter, TextFormatter
+
+
+def make_record(msg="hola %s", args=("mundo",), level=logging.INFO, name="http", **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_writes_one_object_with_extras():
+    record = make_record(status=200, duration_ms=12.5, items=["KO", "PEP"], request_id="abc")
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["level"] == "INFO" and entry["logger"] == "http" and entry["msg"] == "hola mundo"
+    assert entry["request_id"] == "abc"
+    assert entry["status"] == 200 and entry["duration_ms"] == 12.5 and entry["items"] == ["KO", "PEP"]
+    assert entry["ts"].endswith("+00:00")
+
+
+def test_json_formatter_truncates_long_values():
+    record = make_record("x" * 50, (), payload={"text": "y" * 100}, note="z" * 50)
+    entry = json.loads(JsonFormatter(max_chars=20).format(record))
+
+    assert entry["msg"] == "x" * 20 + "…[+30 chars]"
+    assert entry["note"].startswith("z" * 20) and entry["note"].endswith("[+30 chars]")
+    assert isinstance(entry["payload"], str) and entry["payload"].startswith('{"text": "yyy')
+
+
+def test_json_formatter_includes_the_traceback():
+    try:
+        raise ValueError("fallo")
+    except ValueError:
+        record = logging.LogRecord("app", logging.ERROR, __file__, 1, "error", (), sys.exc_info())
+    entry = json.loads(JsonFormatter().format(record))
+    assert "ValueError: fallo" in entry["exc"]
+
+
+def test_text_formatter_marks_records_without_request_id():
+    line = TextFormatter().format(make_record())
+    assert " INFO http [-] hola mundo" in line
+
+
+def test_sampling_uses_longest_prefix_and_keeps_warnings(monkeypatch):
+    monkeypatch.setattr(structured_logging.random, "random", lambda: 0.5)
+    sampler = SamplingFilter({"uvicorn": 0.9, "uvicorn.access": 0.1})
+
+    assert sampler.filter(make_record(name="uvicorn.error"))
+    assert not sampler.filter(make_record(name="uvicorn.access"))
+    assert sampler.filter(make_record(name="uvicorn.access", level=logging.WARNING))
+    assert sampler.filter(make_record(name="uvicornish"))
+
+
+def test_parse_rates_skips_bad_entries():
+    assert structured_logging._parse_rates("http=0.05, uvicorn.access=2,bad,x=y") == {"http": 0.05, "uvicorn.access": 1.0}
+
+
+def test_queue_handler_captures_request_id_and_drops_when_full():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    token = structured_logging.set_request_id("req-1")
+    try:
+        handler.handle(make_record())
+    finally:
+        structured_logging.reset_request_id(token)
+    dropped = metrics.registry._values.get(("log_records_dropped_total", ()), 0.0)
+    handler.handle(make_record())
+
+    record = handler.queue.get_nowait()
+    assert record.request_id == "req-1"
+    assert record.getMessage() == "hola mundo"  # formatted later, by the listener thread
+    assert metrics.registry._values[("log_records_dropped_total", ())] == dropped + 1
+
+
+@pytest.fixture
+def captured(app_module):
+    """Records reaching the root logger at INFO, as the queue handler prepares them."""
+    handler = NonBlockingQueueHandler(queue.Queue())
+    root = logging.getLogger()
+    level = root.level
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    yield handler.queue
+    root.removeHandler(handler)
+    root.setLevel(level)
+
+
+def get(app_module, path, headers=None):
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as client:
+            return await client.get(path, headers=headers or {})
+
+    return asyncio.run(main())
+
+
+def drain(records):
+    items = []
+    while not records.empty():
+        items.append(records.get_nowait())
+    return items
+
+
+def test_request_id_is_echoed_and_shared_by_the_request_logs(app_module, captured):
+    response = get(app_module, "/test", {"X-Request-ID": "abc-123"})
+
+    assert response.headers["X-Request-ID"] == "abc-123"
+    records = drain(captured)
+    route = [r for r in records if r.getMessage() == "Ruta de prueba accedida"]
+    access = [r for r in records if r.name == "http"]
+    assert route and route[0].request_id == "abc-123"
+    assert access[0].request_id == "abc-123" and access[0].getMessage() == "GET /test 200"
+    assert access[0].status == 200 and access[0].duration_ms >= 0
+
+
+def test_request_id_is_generated_or_capped(app_module, captured):
+    generated = get(app_module, "/test").headers["X-Request-ID"]
+    capped = get(app_module, "/test", {"X-Request-ID": "r" * 100}).headers["X-Request-ID"]
+
+    assert len(generated) == 16 and int(generated, 16) >= 0
+    assert capped == "r" * 64
+    assert {r.request_id for r in drain(captured) if r.name == "http"} == {generated, capped}
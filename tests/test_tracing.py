@@ -0,0 +1,129 @@
+import time
+import asyncio
+
+import httpx
+import pytest
+
+from tracing import Trace, Tracer, TraceStore, span
+
+
+def test_untraced_requests_get_no_trace():
+    tracer = Tracer()
+    assert tracer.start("GET", "/x", {}) is None
+    # Spans outside a trace are the shared no-op
+    assert span("store") is span("quotes")
+
+
+def test_header_starts_a_trace_and_token_guards_it():
+    assert Tracer().start("GET", "/x", {"x-trace": "1"})._sampler is None
+    guarded = Tracer(token="s3cret")
+    assert guarded.start("GET", "/x", {"x-trace": "1"}) is None
+    trace = guarded.start("GET", "/x", {"x-trace": "profile", "x-trace-token": "s3cret"})
+    assert trace is not None and trace._sampler is not None
+    assert Tracer(sample_rate=1.0).start("GET", "/x", {}) is not None
+
+
+def test_spans_nest_and_add_up_in_server_timing():
+    with Trace("POST", "/api/portfolio/build") as trace:
+        with span("perplexity", "value"):
+            with span("cache"):
+                time.sleep(0.01)
+        with span("perplexity", "value"):
+            pass
+        with span("quotes/batch", 'a "b"'):
+            pass
+
+    spans = trace.to_dict()["spans"]
+    assert [(s["name"], s["parent"]) for s in spans] == [("perplexity", None), ("cache", 0), ("perplexity", None), ("quotes/batch", None)]
+    breakdown = trace.breakdown()
+    assert [(name, detail) for name, detail, _ in breakdown] == [("perplexity", "value"), ("cache", None), ("quotes/batch", 'a "b"')]
+    assert breakdown[0][2] >= 0.01
+
+    header = trace.server_timing().split(", ")
+    assert header[0].startswith("perplexity;dur=") and header[0].endswith(';desc="value"')
+    assert header[2].startswith("quotes_batch;dur=") and header[2].endswith(";desc=\"a 'b'\"")
+    assert header[-1].startswith("total;dur=")
+
+
+def test_profile_records_busy_stacks():
+    def busy_loop():
+        end = time.perf_counter() + 0.1
+        while time.perf_counter() < end:
+            pass
+
+    with Trace("GET", "/x", profile=True, profile_interval=0.002) as trace:
+        busy_loop()
+
+    assert trace.profile["samples"] > 0
+    assert any("busy_loop" in stack for stack, _ in trace.profile["stacks"])
+
+
+def test_store_keeps_the_most_recent_traces(tmp_path):
+    store = TraceStore(str(tmp_path / "traces.sqlite3"), max_traces=5)
+    traces = []
+    for i in range(33):  # the 33rd write prunes the table
+        with Trace("GET", f"/t/{i}") as trace:
+            pass
+        trace.route, trace.status = "/t/{i}", 200
+        trace.started_at = 1000.0 + i
+        store.save(trace)
+        traces.append(trace)
+
+    listed = store.list(limit=50)
+    assert [t["path"] for t in listed] == [f"/t/{i}" for i in range(32, 27, -1)]
+    assert store.get(traces[-1].id)["route"] == "/t/{i}"
+    assert store.get(traces[0].id) is None
+    assert store.list(route="/other") == []
+
+
+@pytest.fixture
+def client(app_module, monkeypatch):
+    tracer = app_module.get_tracer()
+    monkeypatch.setattr(tracer, "token", None)
+    monkeypatch.setattr(tracer, "sample_rate", 0.0)
+    monkeypatch.setattr(tracer, "profile_rate", 0.0)
+
+    def request(*calls):
+        async def main():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as http:
+                return [await http.request(method, url, headers=headers) for method, url, headers in calls]
+
+        return asyncio.run(main())
+
+    request.tracer = tracer
+    return request
+
+
+def test_traced_request_is_stored_with_its_route(client):
+    plain, traced = client(("GET", "/api/jobs/missing", {}), ("GET", "/api/jobs/missing", {"X-Trace": "1"}))
+
+    assert "Server-Timing" not in plain.headers and "X-Trace-Id" not in plain.headers
+    assert traced.headers["Server-Timing"].split(", ")[-1].startswith("total;dur=")
+    trace_id = traced.headers["X-Trace-Id"]
+
+    stored, listed = client(("GET", f"/api/admin/traces/{trace_id}", {}),
+                            ("GET", "/api/admin/traces?route=/api/jobs/{job_id}", {}))
+    assert stored.json()["route"] == "/api/jobs/{job_id}" and stored.json()["status"] == 404
+    assert trace_id in [t["id"] for t in listed.json()["traces"]]
+
+
+def test_admin_endpoints_need_the_token(client, monkeypatch):
+    monkeypatch.setattr(client.tracer, "token", "s3cret")
+    denied, allowed, untraced = client(
+        ("GET", "/api/admin/traces", {}),
+        ("GET", "/api/admin/traces", {"X-Trace-Token": "s3cret"}),
+        ("GET", "/api/jobs/missing", {"X-Trace": "1"}),
+    )
+
+    assert denied.status_code == 403
+    assert allowed.status_code == 200
+    assert "X-Trace-Id" not in untraced.headers
+
+
+def test_folded_profile_needs_a_profiled_trace(client):
+    (traced,) = client(("GET", "/api/jobs/missing", {"X-Trace": "1"}))
+    (folded,) = client(("GET", f"/api/admin/traces/{traced.headers['X-Trace-Id']}?format=folded", {}))
+    (missing,) = client(("GET", "/api/admin/traces/nope", {}))
+
+    assert folded.status_code == 404 and "perfil" in folded.json()["error"]
+    assert missing.status_code == 404
@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from upstream_policy import first_success, remaining
+
+
+def _alternative(calls, name, delay, result=None, error=None):
+    async def run():
+        calls.append(name)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            calls.append(f"{name} cancelled")
+            raise
+        if error:
+            raise error
+        return result
+    return run
+
+
+@pytest.fixture(autouse=True)
+def short_hedge(monkeypatch):
+    monkeypatch.setenv("FALLBACK_HEDGE_DELAY", "0.1")
+
+
+def test_fast_answer_never_starts_the_fallback():
+    calls = []
+    result = asyncio.run(first_success("t-fast", [
+        _alternative(calls, "etfs", 0.01, ["A"]), _alternative(calls, "portfolio", 0.01, ["B"]),
+    ]))
+    assert result == ["A"] and calls == ["etfs"]
+
+
+def test_empty_answer_starts_the_fallback_at_once():
+    calls = []
+
+    async def main():
+        start = time.monotonic()
+        result = await first_success("t-empty", [
+            _alternative(calls, "etfs", 0.01, []), _alternative(calls, "portfolio", 0.01, ["B"]),
+        ])
+        return result, time.monotonic() - start
+
+    result, elapsed = asyncio.run(main())
+    assert result == ["B"] and calls == ["etfs", "portfolio"]
+    assert elapsed < 0.08
+
+
+def test_slow_answer_is_hedged_and_the_loser_cancelled():
+    calls = []
+
+    async def main():
+        start = time.monotonic()
+        result = await first_success("t-slow", [
+            _alternative(calls, "etfs", 1.0, ["A"]), _alternative(calls, "portfolio", 0.05, ["B"]),
+        ])
+        return result, time.monotonic() - start
+
+    result, elapsed = asyncio.run(main())
+    assert result == ["B"]
+    assert calls == ["etfs", "portfolio", "etfs cancelled"]
+    assert 0.1 <= elapsed < 0.5
+
+
+def test_first_error_is_raised_when_nothing_succeeds():
+    calls = []
+    with pytest.raises(RuntimeError, match="etfs"):
+        asyncio.run(first_success("t-error", [
+            _alternative(calls, "etfs", 0.01, error=RuntimeError("etfs")),
+            _alternative(calls, "portfolio", 0.01, error=ValueError("portfolio")),
+        ]))
+    assert calls == ["etfs", "portfolio"]
+    assert asyncio.run(first_success("t-rejected", [
+        _alternative([], "etfs", 0.01, []), _alternative([], "portfolio", 0.01, []),
+    ])) == []
+
+
+class SlowPerplexity:
+    """Value portfolio answering after `delay` seconds; records the deadline budget it saw."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.budgets = []
+
+    async def get_value_portfolio_async(self, amount):
+        self.budgets.append(remaining())
+        await asyncio.sleep(self.delay)
+        return [{"ticker": "KO", "price": 60, "weight": 1}]
+
+
+@pytest.fixture
+def post_value(app_module, monkeypatch):
+    async def no_quotes(*lists, timeout=None):
+        return {}
+
+    monkeypatch.setattr(app_module, "_quote_prices", no_quotes)
+
+    def post(perplexity, headers=None):
+        monkeypatch.setattr(app_module, "_perplexity_client", lambda: perplexity)
+
+        async def main():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://test") as client:
+                start = time.monotonic()
+                response = await client.post("/api/portfolio/value", json={"amount": 1000}, headers=headers or {})
+                return response, time.monotonic() - start
+
+        return asyncio.run(main())
+
+    return post
+
+
+def test_request_timeout_header_cuts_the_upstream_call(post_value):
+    perplexity = SlowPerplexity(delay=5)
+    response, elapsed = post_value(perplexity, {"X-Request-Timeout": "0.2"})
+
+    assert response.status_code == 504
+    assert "Tiempo agotado" in response.json()["error"]
+    assert elapsed < 1
+    assert 0 < perplexity.budgets[0] <= 0.2
+
+
+def test_header_cannot_extend_the_server_deadline(app_module, post_value, monkeypatch):
+    monkeypatch.setattr(app_module, "REQUEST_DEADLINE", 0.2)
+    response, elapsed = post_value(SlowPerplexity(delay=5), {"X-Request-Timeout": "30"})
+
+    assert response.status_code == 504 and elapsed < 1
+
+
+def test_bad_header_keeps_the_server_deadline(app_module, post_value, monkeypatch):
+    monkeypatch.setattr(app_module, "REQUEST_DEADLINE", 0)
+    perplexity = SlowPerplexity(delay=0.05)
+    response, _ = post_value(perplexity, {"X-Request-Timeout": "soon"})
+
+    assert response.status_code == 200
+    assert response.json()["sourceCount"] == 1
+    assert perplexity.budgets == [None]  # REQUEST_DEADLINE=0 and no usable header: unbounded
@@ -0,0 +1,35 @@
+import threading
+
+from upstream_replay import Archive
+
+
+def test_compact_keeps_latest_entry_per_fingerprint(tmp_path):
+    archive = Archive(str(tmp_path / "upstream.jsonl.gz"))
+    for version in range(3):
+        archive.append({"type": "response", "fp": "a", "status": 200, "body": version})
+    archive.append({"type": "response", "fp": "b", "status": 200, "body": "b"})
+    archive.append({"type": "cache", "key": "perplexity:x", "value": [1]})
+
+    assert archive.lookup("a")["body"] == 2
+    assert archive.compact() == 3
+    assert len(list(archive.entries())) == 3
+    assert archive.lookup("a")["body"] == 2
+
+
+def test_compact_loses_no_concurrent_appends(tmp_path):
+    archive = Archive(str(tmp_path / "upstream.jsonl.gz"))
+    total = 300
+    done = threading.Event()
+
+    def record():
+        for i in range(total):
+            Archive(archive.path).append({"type": "response", "fp": f"fp{i}", "status": 200, "body": i})
+        done.set()
+
+    writer = threading.Thread(target=record)
+    writer.start()
+    while not done.is_set():
+        archive.compact()
+    writer.join()
+
+    assert {entry["fp"] for entry in archive.entries()} == {f"fp{i}" for i in range(total)}
@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import List, Optional
+
+logger = logging.getLogger("tracing")
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_parent: ContextVar[Optional[int]] = ContextVar("trace_parent", default=None)
+# Returned by span() when the request is not traced: entering it costs one contextvar read
+_NOOP = nullcontext()
+
+# Leaf frames of threads that are only waiting (event loop selector, idle executor workers, sleepers)
+_IDLE_FILES = ("selectors.py", "threading.py", "queue.py")
+_IDLE_LEAVES = {("thread.py", "_worker"), ("metrics.py", "_flush_loop")}
+
+
+class _Span:
+    __slots__ = ("trace", "name", "detail", "index", "start", "_token")
+
+    def __init__(self, trace: "Trace", name: str, detail: Optional[str]):
+        self.trace = trace
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.index = len(self.trace.spans)
+        self.trace.spans.append([self.name, self.detail, self.start - self.trace.start, None, _parent.get()])
+        self._token = _parent.set(self.index)
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.spans[self.index][3] = time.perf_counter() - self.start
+        _parent.reset(self._token)
+        return False
+
+
+class StackSampler:
+    """Sampling profiler: a thread records the Python stack of every busy thread each interval.
+
+    Stacks are kept in folded form ("module:function;module:function") so they can
+    be fed to flamegraph tools. Samples are process-wide, so requests running
+    concurrently on the same worker show up in each other's profiles.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return {
+            "interval_ms": round(self.interval * 1000, 3),
+            "samples": self.samples,
+            "stacks": self.stacks.most_common(100),
+        }
+
+    def _fold(self, frame) -> Optional[str]:
+        leaf = frame.f_code
+        if leaf.co_filename.endswith(_IDLE_FILES) or (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_LEAVES:
+            return None
+        parts = []
+        while frame is not None and len(parts) < self.max_depth:
+            code = frame.f_code
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            parts.append(f"{module}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(parts))
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = self._fold(frame)
+                if stack:
+                    self.stacks[stack] += 1
+
+
+class Trace:
+    """Spans recorded while serving one request (and the optional profile)."""
+
+    def __init__(self, method: str, path: str, profile: bool = False, profile_interval: float = 0.005):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.route = None
+        self.status = None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        # [name, detail, start offset, duration, parent index]
+        self.spans: List[list] = []
+        self.profile = None
+        self._sampler = StackSampler(profile_interval) if profile else None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        if self._sampler is not None:
+            self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.duration = time.perf_counter() - self.start
+        if self._sampler is not None:
+            self.profile = self._sampler.stop()
+        _current.reset(self._token)
+        return False
+
+    def breakdown(self) -> List[tuple]:
+        """Total time per (name, detail) over finished spans, in first-seen order."""
+        totals = {}
+        for name, detail, _start, duration, _parent_index in self.spans:
+            if duration is not None:
+                totals[(name, detail)] = totals.get((name, detail), 0.0) + duration
+        return [(name, detail, duration) for (name, detail), duration in totals.items()]
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: one entry per span name plus the total."""
+        entries = []
+        for name, detail, duration in self.breakdown():
+            entry = f"{_token(name)};dur={duration * 1000:.1f}"
+            if detail:
+                entry += ';desc="' + str(detail).replace('"', "'") + '"'
+            entries.append(entry)
+        total = self.duration if self.duration is not None else time.perf_counter() - self.start
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "breakdown": [
+                {"name": name, "detail": detail, "duration_ms": round(duration * 1000, 3)}
+                for name, detail, duration in self.breakdown()
+            ],
+            "spans": [
+                {
+                    "name": name,
+                    "detail": detail,
+                    "start_ms": round(start * 1000, 3),
+                    "duration_ms": round(duration * 1000, 3) if duration is not None else None,
+                    "parent": parent,
+                }
+                for name, detail, start, duration, parent in self.spans
+            ],
+            "profile": self.profile,
+        }
+
+
+def _token(name: str) -> str:
+    # Server-Timing metric names must be HTTP tokens
+    return "".join(c if c.isalnum() or c in "-_.!#$%&'*+^`|~" else "_" for c in name) or "span"
+
+
+def span(name: str, detail: Optional[str] = None):
+    """Time a block as part of the current request trace; a no-op when the request is not traced."""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name, detail)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+class TraceStore:
+    """Recent traces in a SQLite file shared by every worker, newest first."""
+
+    def __init__(self, path: str, max_traces: int = 500):
+        self.path = path
+        self.max_traces = max_traces
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS traces ("
+            " id TEXT PRIMARY KEY, started_at REAL NOT NULL, method TEXT, path TEXT, route TEXT,"
+            " status INTEGER, duration_ms REAL, data TEXT NOT NULL)"
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_traces_started ON traces(started_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, trace: Trace):
+        data = trace.to_dict()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO traces (id, started_at, method, path, route, status, duration_ms, data)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (trace.id, trace.started_at, trace.method, trace.path, trace.route, trace.status,
+             data["duration_ms"], json.dumps(data)),
+        )
+        self._writes += 1
+        if self._writes % 32 == 1:
+            conn.execute(
+                "DELETE FROM traces WHERE id NOT IN (SELECT id FROM traces ORDER BY started_at DESC LIMIT ?)",
+                (self.max_traces,),
+            )
+
+    def list(self, limit: int = 50, route: Optional[str] = None, min_ms: float = 0) -> List[dict]:
+        query = "SELECT id, started_at, method, path, route, status, duration_ms FROM traces WHERE duration_ms >= ?"
+        params: list = [min_ms]
+        if route:
+            query += " AND route = ?"
+            params.append(route)
+        query += " ORDER BY started_at DESC LIMIT ?"
+        params.append(limit)
+        columns = ("id", "started_at", "method", "path", "route", "status", "duration_ms")
+        return [dict(zip(columns, row)) for row in self._conn().execute(query, params)]
+
+    def get(self, trace_id: str) -> Optional[dict]:
+        row = self._conn().execute("SELECT data FROM traces WHERE id = ?", (trace_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+class Tracer:
+    """Decides which requests are traced or profiled and keeps their traces.
+
+    A request is traced when it sends `X-Trace: 1` (or `X-Trace: profile` to
+    also run the sampling profiler) or when it falls in TRACE_SAMPLE_RATE /
+    PROFILE_SAMPLE_RATE. If TRACE_TOKEN is set, the header must also carry
+    `X-Trace-Token: <token>`.
+    """
+
+    def __init__(self, sample_rate: float = 0.0, profile_rate: float = 0.0, token: Optional[str] = None,
+                 profile_interval: float = 0.005, store: Optional[TraceStore] = None):
+        self.sample_rate = sample_rate
+        self.profile_rate = profile_rate
+        self.token = token
+        self.profile_interval = profile_interval
+        self.store = store
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        store = None
+        size = int(os.getenv("TRACE_STORE_SIZE", 500))
+        if size > 0:
+            try:
+                store = TraceStore(os.getenv("TRACE_DB_PATH", os.path.join(".cache", "traces.sqlite3")), size)
+            except sqlite3.Error as e:
+                logger.error("No se pudo abrir el almacén de trazas: %s", e)
+        return cls(
+            sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", 0)),
+            profile_rate=float(os.getenv("PROFILE_SAMPLE_RATE", 0)),
+            token=os.getenv("TRACE_TOKEN") or None,
+            profile_interval=float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000,
+            store=store,
+        )
+
+    def authorized(self, headers) -> bool:
+        return self.token is None or headers.get("x-trace-token") == self.token
+
+    def start(self, method: str, path: str, headers) -> Optional[Trace]:
+        """A trace for this request, or None (the common, zero-cost case)."""
+        requested = headers.get("x-trace")
+        if requested and self.authorized(headers):
+            profile = requested.lower() == "profile"
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            profile = False
+        elif self.profile_rate > 0 and random.random() < self.profile_rate:
+            profile = True
+        else:
+            return None
+        return Trace(method, path, profile=profile, profile_interval=self.profile_interval)
+
+    def save(self, trace: Trace):
+        if self.store is None:
+            return
+        try:
+            self.store.save(trace)
+        except sqlite3.Error as e:
+            logger.warning("No se pudo guardar la traza %s: %s", trace.id, e)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    """Return the process-wide tracer, configured from env on first use."""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer.from_env()
+    return _tracer
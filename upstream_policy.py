@@ -0,0 +1,316 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+import metrics
+
+logger = logging.getLogger("upstream-policy")
+
+# Absolute time.monotonic() by which the current request must be answered,
+# or the SharedDeadline of work done on behalf of several requests
+_deadline: ContextVar[Any] = ContextVar("deadline", default=None)
+
+metrics.registry.counter("upstream_hedges_total", "Backup attempts fired for slow upstream calls, and how many won")
+metrics.registry.counter("deadline_exceeded_total", "Upstream calls not started or cut short by the request deadline")
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """The request deadline ran out before (or while) calling an upstream."""
+
+
+class SharedDeadline:
+    """Deadline of a call shared by several requests: the latest among those still waiting.
+
+    Unbounded while any waiter has no deadline. It moves as waiters join and
+    leave, so a request with little time left cannot cut the call short for
+    the others.
+    """
+
+    def __init__(self):
+        self._waiters: list = []
+
+    def join(self) -> Optional[float]:
+        """Add the current request's deadline; pass the returned value to leave()."""
+        at = _current()
+        self._waiters.append(at)
+        return at
+
+    def leave(self, at: Optional[float]):
+        self._waiters.remove(at)
+
+    @property
+    def at(self) -> Optional[float]:
+        if not self._waiters or None in self._waiters:
+            return None
+        return max(self._waiters)
+
+
+def _current() -> Optional[float]:
+    at = _deadline.get()
+    return at.at if isinstance(at, SharedDeadline) else at
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    """Bound everything awaited inside to `seconds` from now (never extends an outer deadline)."""
+    if seconds is None:
+        yield
+        return
+    at = time.monotonic() + max(0.0, seconds)
+    outer = _current()
+    token = _deadline.set(at if outer is None else min(outer, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def shared_deadline(shared: SharedDeadline):
+    """Run the body (e.g. start a coalesced task) under `shared` instead of the caller's deadline."""
+    token = _deadline.set(shared)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left before the deadline, capped at `default`; `default` when there is no deadline."""
+    at = _current()
+    if at is None:
+        return default
+    left = at - time.monotonic()
+    return left if default is None else min(default, left)
+
+
+def budget(timeout: Optional[float], where: str = "upstream") -> Optional[float]:
+    """Timeout for one upstream call: `timeout` cut to the time left. Raises DeadlineExceeded if none is left."""
+    left = remaining(timeout)
+    if left is not None and left <= 0:
+        metrics.inc("deadline_exceeded_total", where=where)
+        raise DeadlineExceeded(f"Sin tiempo restante para {where}")
+    return left
+
+
+async def within_deadline(awaitable: Awaitable[Any], where: str = "request") -> Any:
+    """Await `awaitable`, cancelling it when the deadline passes (DeadlineExceeded).
+
+    The deadline is re-read when it is reached, so a shared deadline that was
+    extended in the meantime keeps the call going.
+    """
+    left = remaining()
+    if left is None:
+        return await awaitable
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=max(0.0, left))
+            if done:
+                return task.result()
+            left = remaining()
+            if left is None:
+                return await task
+            if left <= 0:
+                metrics.inc("deadline_exceeded_total", where=where)
+                raise DeadlineExceeded(f"Plazo de la petición agotado esperando a {where}")
+    finally:
+        if not task.done():
+            await _cancel([task])
+
+
+class LatencyWindow:
+    """Latencies of the last `size` successful calls of one upstream operation."""
+
+    def __init__(self, size: int = 200):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._values.append(seconds)
+
+    def percentile(self, pct: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            values = sorted(self._values)
+        if len(values) < max(1, min_samples):
+            return None
+        return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+    def stats(self) -> dict:
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "samples": len(self._values),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+_windows: Dict[str, LatencyWindow] = {}
+_windows_lock = threading.Lock()
+
+
+def latency_window(name: str) -> LatencyWindow:
+    window = _windows.get(name)
+    if window is None:
+        with _windows_lock:
+            window = _windows.setdefault(name, LatencyWindow())
+    return window
+
+
+def _fallback_delay() -> float:
+    try:
+        return max(0.0, float(os.getenv("FALLBACK_HEDGE_DELAY", 2.0)))
+    except ValueError:
+        return 2.0
+
+
+def _hedge_settings():
+    enabled = os.getenv("UPSTREAM_HEDGE", "1").lower() in ("1", "true", "yes")
+    try:
+        pct = float(os.getenv("HEDGE_PERCENTILE", 95))
+        min_samples = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+    except ValueError:
+        pct, min_samples = 95.0, 20
+    return enabled, pct, min_samples
+
+
+async def _cancel(tasks):
+    for task in tasks:
+        task.cancel()
+    # Let cancelled attempts close their connections before returning
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def hedged(name: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    """Run `call`; if it is still pending after the observed p95 of `name`, start a second attempt.
+
+    The first attempt to succeed wins and the other is cancelled; a failure
+    only counts once every attempt has failed. Until HEDGE_MIN_SAMPLES calls
+    have been observed (or with UPSTREAM_HEDGE=0) this is a plain call. No
+    backup is fired when the deadline would not leave it time to finish.
+    """
+    window = latency_window(name)
+    enabled, pct, min_samples = _hedge_settings()
+    delay = window.percentile(pct, min_samples) if enabled else None
+
+    async def attempt():
+        start = time.perf_counter()
+        result = await call()
+        window.observe(time.perf_counter() - start)
+        return result
+
+    if delay is None:
+        return await attempt()
+    primary = asyncio.ensure_future(attempt())
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        left = remaining()
+        if done or (left is not None and left < delay):
+            return await primary
+        window.hedges += 1
+        metrics.inc("upstream_hedges_total", upstream=name, result="fired")
+        logger.info("%s: sin respuesta tras p%.0f (%.0f ms); se lanza un intento de respaldo", name, pct, delay * 1000)
+        backup = asyncio.ensure_future(attempt())
+        tasks.append(backup)
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is backup:
+                        window.hedge_wins += 1
+                        metrics.inc("upstream_hedges_total", upstream=name, result="backup_won")
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        await _cancel([task for task in tasks if not task.done()])
+
+
+async def first_success(name: str, alternatives: Sequence[Callable[[], Awaitable[Any]]],
+                        accept: Callable[[Any], bool] = bool) -> Any:
+    """Return the first result of `alternatives` that passes `accept`, earlier ones preferred.
+
+    Alternatives are started in order: the next one as soon as every running
+    one has failed or returned a rejected result, or as a hedge once the
+    current one has been pending for the observed p95 of the first
+    alternative (FALLBACK_HEDGE_DELAY until HEDGE_MIN_SAMPLES are known).
+    A fast, good first answer therefore never starts (or bills) the others.
+    Once a result is accepted the remaining attempts are cancelled. When
+    none is accepted the first error (in alternative order) is raised, or
+    the last rejected result is returned.
+    """
+    window = latency_window(name)
+    enabled, pct, min_samples = _hedge_settings()
+    delay = window.percentile(pct, min_samples) if enabled else None
+    if delay is None:
+        delay = _fallback_delay()
+
+    async def primary():
+        start = time.perf_counter()
+        result = await alternatives[0]()
+        window.observe(time.perf_counter() - start)
+        return result
+
+    tasks: list = []
+    pending: set = set()
+    errors: Dict[int, BaseException] = {}
+    rejected = None
+    next_start = 0.0
+
+    def launch():
+        nonlocal next_start
+        factory = primary if not tasks else alternatives[len(tasks)]
+        task = asyncio.ensure_future(factory())
+        tasks.append(task)
+        pending.add(task)
+        next_start = time.monotonic() + delay
+
+    try:
+        launch()
+        while pending:
+            more = len(tasks) < len(alternatives)
+            done, _ = await asyncio.wait(
+                pending, timeout=max(0.0, next_start - time.monotonic()) if more else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                window.hedges += 1
+                metrics.inc("upstream_hedges_total", upstream=name, result="fired")
+                logger.info("%s: sin respuesta tras %.0f ms; se lanza la alternativa %s", name, delay * 1000, len(tasks))
+                launch()
+                continue
+            pending.difference_update(done)
+            for task in sorted(done, key=tasks.index):
+                if task.exception() is not None:
+                    errors[tasks.index(task)] = task.exception()
+                elif accept(task.result()):
+                    if tasks.index(task):
+                        window.hedge_wins += 1
+                        metrics.inc("upstream_hedges_total", upstream=name, result="backup_won")
+                    return task.result()
+                else:
+                    rejected = task.result()
+            if not pending and len(tasks) < len(alternatives):
+                launch()
+        if errors and rejected is None:
+            raise errors[min(errors)]
+        return rejected
+    finally:
+        await _cancel([task for task in tasks if not task.done()])
+
+
+def policy_stats() -> dict:
+    return {name: window.stats() for name, window in sorted(_windows.items())}
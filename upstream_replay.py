@@ -0,0 +1,396 @@
+import os
+import sys
+import json
+import gzip
+import time
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    import fcntl
+except ImportError:  # Windows: compact only while nothing is recording
+    fcntl = None  # type: ignore
+
+import metrics
+from http_transport import get_transport
+from singleflight import normalize_key
+
+logger = logging.getLogger("upstream-replay")
+
+PASSTHROUGH, RECORD, REPLAY = "passthrough", "record", "replay"
+# Result cache entries worth archiving: LLM answers, not locally computed results
+_CACHE_PREFIXES = ("perplexity:", "claude:")
+# Transient failures are not worth replaying
+_NOT_RECORDED = {429, 500, 502, 503, 504, 529}
+
+
+class ReplayMiss(LookupError):
+    """Replay mode found no recorded response for a request."""
+
+
+def fingerprint(method: str, url: str, body) -> str:
+    """Stable id of an upstream request: method, URL path and JSON body (host and headers ignored,
+    so an archive recorded against the real API replays behind a URL override)."""
+    return normalize_key(method.upper(), urlsplit(url).path, body)
+
+
+def _summary(body) -> str:
+    # A readable hint of the request, enough to recognise an entry without the full prompt
+    try:
+        messages = body.get("messages") or []
+        return f"{body.get('model', '-')}: {str(messages[-1].get('content', ''))[:160]}"
+    except Exception:
+        return ""
+
+
+class Archive:
+    """Append-only gzip JSON-lines file of recorded upstream responses and result-cache entries.
+
+    Each line is written as its own gzip member in one O_APPEND write, so
+    several workers can record into the same file; readers see the
+    concatenation as a single stream. Later entries win over earlier ones.
+    Appends hold a shared flock on <path>.lock and compaction an exclusive
+    one, so compacting while workers record loses no lines (without fcntl,
+    compact only while nothing is recording).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._responses: Optional[Dict[str, dict]] = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def append(self, entry: dict):
+        data = gzip.compress((json.dumps(entry, ensure_ascii=False, default=str) + "\n").encode("utf-8"), mtime=0)
+        # Shared: appends from several workers interleave, but never with a compaction
+        with self._file_lock(exclusive=False):
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        with self._lock:
+            if self._responses is not None and entry.get("type") == "response":
+                self._responses[entry["fp"]] = entry
+
+    def entries(self) -> Iterator[dict]:
+        if not os.path.exists(self.path):
+            return
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            except (EOFError, OSError, ValueError) as e:
+                # A worker killed mid-write leaves a truncated last member
+                logger.warning("Archivo %s truncado o dañado: %s", self.path, e)
+
+    def responses(self) -> Dict[str, dict]:
+        with self._lock:
+            if self._responses is None:
+                self._responses = {e["fp"]: e for e in self.entries() if e.get("type") == "response"}
+                logger.info("Archivo de respuestas cargado: %s entradas de %s", len(self._responses), self.path)
+            return self._responses
+
+    def lookup(self, fp: str) -> Optional[dict]:
+        return self.responses().get(fp)
+
+    def compact(self) -> int:
+        """Rewrite the file keeping only the latest entry per fingerprint / cache key.
+        Appends wait for the rewrite, so none lands in the file being replaced.
+        """
+        latest: Dict[str, dict] = {}
+        with self._file_lock(exclusive=True):
+            for entry in self.entries():
+                latest[entry.get("fp") or f"cache:{entry.get('key')}"] = entry
+            tmp = f"{self.path}.tmp"
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                for entry in latest.values():
+                    f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+            os.replace(tmp, self.path)
+        with self._lock:
+            self._responses = None
+        return len(latest)
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    """Recorded body served in its original SSE events, optionally spread over a delay."""
+
+    def __init__(self, body: bytes, delay: float):
+        self.parts = [part + b"\n\n" for part in body.split(b"\n\n") if part] or [body]
+        self.delay = delay / len(self.parts)
+
+    async def __aiter__(self):
+        for part in self.parts:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield part
+
+
+class _TeeStream(httpx.AsyncByteStream):
+    """Pass a live response body through while keeping a copy for the archive."""
+
+    def __init__(self, inner, sink: List[bytes]):
+        self.inner = inner
+        self.sink = sink
+
+    async def __aiter__(self):
+        async for chunk in self.inner:
+            self.sink.append(chunk)
+            yield chunk
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+class ReplayTransport:
+    """Record/replay layer with the AsyncTransport interface, used by the LLM clients.
+
+    record: calls go upstream and their responses (never the request headers)
+    are appended to the archive, as are the LLM answers the result cache
+    stores, which later seed a production cache (seed_result_cache).
+    replay: responses are served from the archive with no network access,
+    after UPSTREAM_REPLAY_LATENCY ("0", a fixed number of ms, or "recorded").
+    Misses raise ReplayMiss unless UPSTREAM_REPLAY_MISS=live.
+    """
+
+    def __init__(self, mode: str, archive: Archive, latency: str = "0", miss: str = "error"):
+        self.mode = mode
+        self.archive = archive
+        self.latency = latency
+        self.miss = miss
+        self.counters = {"recorded": 0, "replayed": 0, "missed": 0}
+
+    @classmethod
+    def from_env(cls, mode: str) -> "ReplayTransport":
+        return cls(
+            mode,
+            Archive(os.getenv("UPSTREAM_ARCHIVE_PATH", os.path.join(".cache", "upstream_archive.jsonl.gz"))),
+            latency=os.getenv("UPSTREAM_REPLAY_LATENCY", "0").strip().lower(),
+            miss=os.getenv("UPSTREAM_REPLAY_MISS", "error").strip().lower(),
+        )
+
+    @property
+    def inner(self):
+        return get_transport()
+
+    def _count(self, result: str):
+        self.counters[result] += 1
+        metrics.inc("upstream_replay_total", result=result)
+
+    def _delay(self, entry: dict) -> float:
+        if self.latency == "recorded":
+            return entry.get("elapsed_ms", 0) / 1000
+        try:
+            return max(0.0, float(self.latency)) / 1000
+        except ValueError:
+            return 0.0
+
+    # --- recording ---
+    async def _record(self, method: str, url: str, body, response: httpx.Response, content: bytes, elapsed: float):
+        if response.status_code in _NOT_RECORDED:
+            return
+        entry = {
+            "type": "response",
+            "fp": fingerprint(method, url, body),
+            "method": method.upper(),
+            "path": urlsplit(url).path,
+            "summary": _summary(body),
+            "stream": bool(isinstance(body, dict) and body.get("stream")),
+            "status": response.status_code,
+            "content_type": response.headers.get("content-type", "application/json"),
+            "body": content.decode("utf-8", "replace"),
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "recorded_at": time.time(),
+        }
+        try:
+            await asyncio.to_thread(self.archive.append, entry)
+            self._count("recorded")
+        except OSError as e:
+            logger.error("No se pudo grabar la respuesta en %s: %s", self.archive.path, e)
+
+    def record_cache_entry(self, key: str, value):
+        """Result-cache listener: archive the LLM answers the clients cache."""
+        if not key.startswith(_CACHE_PREFIXES):
+            return
+        try:
+            self.archive.append({"type": "cache", "key": key, "value": value, "recorded_at": time.time()})
+        except OSError as e:
+            logger.error("No se pudo grabar la entrada de cache en %s: %s", self.archive.path, e)
+
+    @staticmethod
+    def _headers(headers) -> dict:
+        # Recorded bodies must be plain text: ask upstream not to compress them
+        return {**(headers or {}), "accept-encoding": "identity"}
+
+    # --- replay ---
+    def _lookup(self, method: str, url: str, body) -> Optional[dict]:
+        entry = self.archive.lookup(fingerprint(method, url, body))
+        if entry is None:
+            self._count("missed")
+            logger.warning("Sin respuesta grabada para %s %s (%s)", method, urlsplit(url).path, _summary(body))
+            if self.miss != "live":
+                raise ReplayMiss(f"No recorded response for {method} {urlsplit(url).path}")
+            return None
+        self._count("replayed")
+        return entry
+
+    @staticmethod
+    def _response(method: str, url: str, entry: dict, stream=None) -> httpx.Response:
+        headers = {"content-type": entry["content_type"]}
+        request = httpx.Request(method, url)
+        if stream is not None:
+            return httpx.Response(entry["status"], headers=headers, stream=stream, request=request)
+        return httpx.Response(entry["status"], headers=headers, content=entry["body"].encode("utf-8"), request=request)
+
+    # --- AsyncTransport interface ---
+    async def post(self, url: str, *, headers=None, json=None, timeout: Optional[float] = None) -> httpx.Response:
+        if self.mode == REPLAY:
+            entry = self._lookup("POST", url, json)
+            if entry is not None:
+                delay = self._delay(entry)
+                if delay:
+                    await asyncio.sleep(delay)
+                return self._response("POST", url, entry)
+            return await self.inner.post(url, headers=headers, json=json, timeout=timeout)
+        start = time.perf_counter()
+        response = await self.inner.post(url, headers=self._headers(headers), json=json, timeout=timeout)
+        await self._record("POST", url, json, response, response.content, time.perf_counter() - start)
+        return response
+
+    async def get(self, url: str, *, params=None, headers=None, timeout: Optional[float] = None) -> httpx.Response:
+        # Only POST calls (the LLM APIs) are recorded
+        return await self.inner.get(url, params=params, headers=headers, timeout=timeout)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, *, headers=None, json=None, timeout: Optional[float] = None):
+        if self.mode == REPLAY:
+            entry = self._lookup(method, url, json)
+            if entry is not None:
+                yield self._response(method, url, entry, _ReplayStream(entry["body"].encode("utf-8"), self._delay(entry)))
+                return
+            async with self.inner.stream(method, url, headers=headers, json=json, timeout=timeout) as response:
+                yield response
+            return
+        start, chunks = time.perf_counter(), []
+        async with self.inner.stream(method, url, headers=self._headers(headers), json=json, timeout=timeout) as response:
+            response.stream = _TeeStream(response.stream, chunks)
+            yield response
+        # Only what the client read is kept, which is all it needs to replay the same way
+        if chunks:
+            await self._record(method, url, json, response, b"".join(chunks), time.perf_counter() - start)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "archive": self.archive.path, **self.counters}
+
+
+_replay: Optional[ReplayTransport] = None
+_replay_lock = threading.Lock()
+
+
+def _mode() -> str:
+    mode = os.getenv("UPSTREAM_REPLAY", PASSTHROUGH).strip().lower()
+    if mode in ("", "off", "none"):
+        return PASSTHROUGH
+    if mode not in (PASSTHROUGH, RECORD, REPLAY):
+        logger.error("UPSTREAM_REPLAY=%s no reconocido; se usa passthrough", mode)
+        return PASSTHROUGH
+    return mode
+
+
+def get_replay_transport() -> Optional[ReplayTransport]:
+    """The process-wide record/replay layer, or None in passthrough mode (UPSTREAM_REPLAY)."""
+    global _replay
+    mode = _mode()
+    if mode == PASSTHROUGH:
+        return None
+    with _replay_lock:
+        if _replay is None:
+            _replay = ReplayTransport.from_env(mode)
+            logger.info("Llamadas a los LLM en modo %s (%s)", mode, _replay.archive.path)
+            if mode == RECORD:
+                from result_cache import get_result_cache
+
+                cache = get_result_cache()
+                if cache is not None:
+                    cache.listeners.append(_replay.record_cache_entry)
+        return _replay
+
+
+def get_llm_transport():
+    """Transport for the Perplexity and Claude clients: the shared pool, behind record/replay when enabled."""
+    return get_replay_transport() or get_transport()
+
+
+def replay_stats() -> dict:
+    return _replay.stats() if _replay is not None else {"mode": _mode()}
+
+
+def seed_result_cache(paths: List[str], cache=None, overwrite: bool = False) -> int:
+    """Load the archived LLM answers of one or more archives into the result cache.
+
+    Meant for deploys (RESULT_CACHE_SEED): fresh entries already in the cache
+    are kept unless overwrite is set. Returns the number of entries written.
+    """
+    if cache is None:
+        from result_cache import get_result_cache
+
+        cache = get_result_cache()
+    if cache is None:
+        logger.warning("Cache de resultados desactivada; no se siembra nada")
+        return 0
+    written = 0
+    for path in paths:
+        entries = {e["key"]: e["value"] for e in Archive(path).entries() if e.get("type") == "cache"}
+        existing = {} if overwrite else cache.get_many(list(entries))
+        for key, value in entries.items():
+            if key not in existing:
+                cache.set(key, value)
+                written += 1
+        logger.info("Cache sembrada desde %s: %s de %s entradas", path, written, len(entries))
+    return written
+
+
+if __name__ == "__main__":
+    # python upstream_replay.py seed|compact|list [archive ...]
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    archives = sys.argv[2:] or [os.getenv("UPSTREAM_ARCHIVE_PATH", os.path.join(".cache", "upstream_archive.jsonl.gz"))]
+    if command == "seed":
+        seed_result_cache(archives)
+    elif command == "compact":
+        for path in archives:
+            logger.info("%s compactado: %s entradas", path, Archive(path).compact())
+    elif command == "list":
+        for path in archives:
+            for entry in Archive(path).entries():
+                if entry.get("type") == "response":
+                    print(f"{entry['fp'][:12]} {entry['status']} {'stream' if entry['stream'] else 'json':<6} "
+                          f"{entry['elapsed_ms']:>8.0f} ms  {entry['summary'][:100]!r}")
+                else:
+                    print(f"{'cache':<12} {entry['key'][:120]}")
+    else:
+        sys.exit(f"Comando desconocido: {command} (seed, compact, list)")